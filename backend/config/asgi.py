@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Режим ASGI: чтение карточки пациента - асинхронными представлениями (core/async_views.py).
+# Запуск: uvicorn config.asgi:application --host 0.0.0.0 --port 8000 --workers 4
+os.environ.setdefault('ASYNC_PATIENT_VIEWS', 'True')
 
 application = get_asgi_application()
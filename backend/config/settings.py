@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.instrumentation.PerformanceMiddleware', # Первым: замеры всего запроса (только при PERF_INSTRUMENTATION)
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware', # Выше CommonMiddleware
@@ -60,6 +61,16 @@ ROOT_URLCONF = 'config.urls'
 TEMPLATES = [ { 'BACKEND': 'django.template.backends.django.DjangoTemplates', 'DIRS': [], 'APP_DIRS': True, 'OPTIONS': { 'context_processors': [ 'django.template.context_processors.debug', 'django.template.context_processors.request', 'django.contrib.auth.context_processors.auth', 'django.contrib.messages.context_processors.messages', ], }, }, ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
+ASGI_APPLICATION = 'config.asgi.application'
+
+# --- РЕЖИМ ASGI (core/async_views.py) ---
+# Чтение карточки пациента (/patients/<id>/, dynamics, tests, episodes) асинхронными представлениями.
+# config/asgi.py включает по умолчанию; под WSGI асинхронные представления только добавили бы переходов между потоками
+ASYNC_PATIENT_VIEWS = os.environ.get('ASYNC_PATIENT_VIEWS', 'False') == 'True'
+# Сколько асинхронных представлений выполняется одновременно в процессе (у каждого - свое соединение с БД);
+# остальные ждут. Воркеры uvicorn x это число не должно превышать max_connections PostgreSQL
+ASYNC_VIEW_CONCURRENCY = int(os.environ.get('ASYNC_VIEW_CONCURRENCY', 16))
+# -------------------------------------------------------------
 
 
 # Database
@@ -101,6 +112,106 @@ MEDIA_ROOT = BASE_DIR / 'mediafiles'
 # -------------------------------------------------------------
 
 
+# --- ИССЛЕДОВАТЕЛЬСКИЕ ВЫГРУЗКИ ---
+# Размер порции, которую server-side курсор читает из БД за раз при потоковой выгрузке
+RESEARCH_EXPORT_CHUNK_SIZE = int(os.environ.get('RESEARCH_EXPORT_CHUNK_SIZE', 2000))
+# Колоночные выгрузки (?format=parquet / arrow, нужен pyarrow): строк в row group / record batch и сжатие Parquet
+RESEARCH_COLUMNAR_ROWS_PER_GROUP = int(os.environ.get('RESEARCH_COLUMNAR_ROWS_PER_GROUP', 65536))
+RESEARCH_PARQUET_COMPRESSION = os.environ.get('RESEARCH_PARQUET_COMPRESSION', 'zstd')
+# Сжатие буферов Arrow IPC ('zstd', 'lz4_frame' или '' - без сжатия, для старых читателей)
+RESEARCH_ARROW_COMPRESSION = os.environ.get('RESEARCH_ARROW_COMPRESSION', 'zstd')
+# Матрица когорты (/api/research/matrix/, core/matrix.py): предел пациенты x показатели x интервалы
+RESEARCH_MATRIX_MAX_CELLS = int(os.environ.get('RESEARCH_MATRIX_MAX_CELLS', 5_000_000))
+# Фоновые выгрузки (/api/research/jobs/, core/jobs.py): потоков на процесс
+# (0 - выполнять сразу после коммита в самом запросе, удобно для тестов),
+# сколько хранить готовый файл и через сколько считать running-задание зависшим (секунды)
+RESEARCH_JOB_WORKERS = int(os.environ.get('RESEARCH_JOB_WORKERS', 2))
+RESEARCH_JOB_RESULT_TTL = int(os.environ.get('RESEARCH_JOB_RESULT_TTL', 24 * 60 * 60))
+RESEARCH_JOB_STALE_TIMEOUT = int(os.environ.get('RESEARCH_JOB_STALE_TIMEOUT', 60 * 60))
+# -------------------------------------------------------------
+
+
+# --- ПАКЕТНАЯ ЗАГРУЗКА НАБЛЮДЕНИЙ (/api/observations/bulk/) ---
+# Размер пакета bulk_create по умолчанию и верхняя граница для ?batch_size=
+OBSERVATION_BULK_BATCH_SIZE = int(os.environ.get('OBSERVATION_BULK_BATCH_SIZE', 1000))
+OBSERVATION_BULK_MAX_BATCH_SIZE = 10000
+# -------------------------------------------------------------
+
+
+# --- ЗАМЕРЫ ПРОИЗВОДИТЕЛЬНОСТИ (core/instrumentation.py) ---
+# Server-Timing на каждом ответе, гистограммы по представлениям на /metrics и лог медленных запросов
+PERF_INSTRUMENTATION = os.environ.get('PERF_INSTRUMENTATION', 'False') == 'True'
+# Запросы к БД не короче порога (мс) пишутся в лог core.performance
+PERF_SLOW_QUERY_MS = float(os.environ.get('PERF_SLOW_QUERY_MS', 500))
+# Если задан - /metrics требует заголовок Authorization: Bearer <токен>
+PERF_METRICS_TOKEN = os.environ.get('PERF_METRICS_TOKEN', '')
+# -------------------------------------------------------------
+
+
+# --- ДОКАЧИВАЕМЫЕ ЗАГРУЗКИ ФАЙЛОВ ТЕСТОВ (core/uploads.py) ---
+# Максимальный размер файла и одной части (байты), срок жизни брошенной загрузки (секунды)
+MEDICAL_TEST_UPLOAD_MAX_SIZE = int(os.environ.get('MEDICAL_TEST_UPLOAD_MAX_SIZE', 4 * 1024 ** 3))
+MEDICAL_TEST_UPLOAD_MAX_CHUNK = int(os.environ.get('MEDICAL_TEST_UPLOAD_MAX_CHUNK', 64 * 1024 ** 2))
+MEDICAL_TEST_UPLOAD_TTL = int(os.environ.get('MEDICAL_TEST_UPLOAD_TTL', 24 * 60 * 60))
+# -------------------------------------------------------------
+
+
+# --- РАЗБОР ФАЙЛОВ ТЕСТОВ: ОТВЕТЫ И ИТОГ (core/extraction.py) ---
+# Потоков разбора в процессе (0 - разбор сразу после коммита в самом запросе),
+# ответов в одной пакетной вставке, через сколько секунд running-задание считать зависшим
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', 2))
+EXTRACTION_BATCH_SIZE = int(os.environ.get('EXTRACTION_BATCH_SIZE', 1000))
+EXTRACTION_STALE_TIMEOUT = int(os.environ.get('EXTRACTION_STALE_TIMEOUT', 60 * 60))
+# Без ijson JSON читается целиком - только файлы не больше этого размера (байты)
+EXTRACTION_JSON_MAX_IN_MEMORY = int(os.environ.get('EXTRACTION_JSON_MAX_IN_MEMORY', 32 * 1024 ** 2))
+# -------------------------------------------------------------
+
+
+# --- РАЗДАЧА ЗАЩИЩЕННЫХ ФАЙЛОВ (core/downloads.py) ---
+# Префикс internal-location nginx (например /protected-media/): после проверки прав файл отдает nginx
+# по X-Accel-Redirect. Пусто - отдает Django (FileResponse через wsgi.file_wrapper, Range - ответом 206)
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX', '')
+# -------------------------------------------------------------
+
+
+# Верхняя граница для ?page_size= в списковых эндпоинтах (core.pagination)
+API_MAX_PAGE_SIZE = 500
+
+
+# --- КЭШ ---
+# По умолчанию LocMem (в пределах процесса, подходит для тестов и разработки).
+# С REDIS_URL (например redis://redis:6379/1) кэш общий для всех процессов/воркеров.
+REDIS_URL = os.environ.get('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'med-data-default',
+        }
+    }
+# Справочники (core/cache.py): срок жизни данных в общем кэше и как часто
+# процесс сверяет версию с общим кэшем (секунды)
+REFERENCE_CACHE_TIMEOUT = 24 * 60 * 60
+REFERENCE_CACHE_LOCAL_TTL = float(os.environ.get('REFERENCE_CACHE_LOCAL_TTL', 5))
+REFERENCE_CACHE_LOCAL_MAX_VARIANTS = 256
+# -------------------------------------------------------------
+
+
+# --- ПАРТИЦИОНИРОВАНИЕ НАБЛЮДЕНИЙ (только PostgreSQL) ---
+# '' - выключено, 'month' или 'year' - секции core_observation по timestamp (см. core/partitioning.py)
+OBSERVATION_PARTITIONING = os.environ.get('OBSERVATION_PARTITIONING', '')
+# Сколько будущих секций создавать заранее (manage.py observation_partitions)
+OBSERVATION_PARTITIONS_AHEAD = int(os.environ.get('OBSERVATION_PARTITIONS_AHEAD', 3))
+# -------------------------------------------------------------
+
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -111,13 +222,21 @@ REST_FRAMEWORK = {
  ),
     'DEFAULT_PERMISSION_CLASSES': ( 'rest_framework.permissions.IsAuthenticated',
  ),
-    # 'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    # 'PAGE_SIZE': 10
+    # Keyset-пагинация (?cursor=...&page_size=...), у ViewSet'ов - классы под их сортировку
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
     'DEFAULT_RENDERER_CLASSES': (
-    'rest_framework.renderers.JSONRenderer',
-    'rest_framework.renderers.BrowsableAPIRenderer', # Для веб-интерфейса DRF
+    'core.renderers.ORJSONRenderer', # JSON через orjson (без него - стандартный JSONRenderer)
+    'rest_framework.renderers.BrowsableAPIRenderer', # Для веб-интерфейса DRF (только is_staff, см. ниже)
     'rest_framework_csv.renderers.CSVRenderer', # Добавляем CSV рендерер
     ),
+    'DEFAULT_PARSER_CLASSES': (
+    'core.parsers.ORJSONParser',
+    'rest_framework.parsers.FormParser',
+    'rest_framework.parsers.MultiPartParser',
+    ),
+    # Browsable API отдается только сотрудникам, остальным - JSON
+    'DEFAULT_CONTENT_NEGOTIATION_CLASS': 'core.negotiation.StaffBrowsableAPINegotiation',
     # FORMAT_SUFFIX_PATTERNS можно оставить [], т.к. мы используем ?format=csv
     'FORMAT_SUFFIX_PATTERNS': []
 }
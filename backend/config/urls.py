@@ -6,6 +6,8 @@ from django.conf import settings
 from django.conf.urls.static import static
 # -------------------------------------------
 
+from core.instrumentation import metrics_view
+
 # Импорты для Simple JWT
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
@@ -22,6 +24,9 @@ urlpatterns = [
     # Подключение URL-путей вашего API приложения ('core')
     path('api/', include('core.urls')),
 
+    # Гистограммы производительности для Prometheus (при PERF_INSTRUMENTATION=True, иначе 404)
+    path('metrics', metrics_view, name='metrics'),
+
     # Можно добавить другие пути вашего проекта
 ]
 
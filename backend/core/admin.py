@@ -1,7 +1,8 @@
 # backend/core/admin.py
 from django.contrib import admin
 # --- Добавляем импорт MedicalTest ---
-from .models import Patient, ParameterCode, Observation, MKBCode, MedicalTest
+from .models import Patient, ParameterCode, Observation, MKBCode, MedicalTest, PatientParameterSummary, ResearchExportJob, Cohort, MedicalTestUpload, FileBlob, MedicalTestExtraction
+from .cohorts import refresh_cohort
 
 @admin.register(Patient)
 class PatientAdmin(admin.ModelAdmin):
@@ -27,6 +28,7 @@ class ObservationAdmin(admin.ModelAdmin):
     list_filter = ('parameter', 'timestamp', 'patient') # Добавили фильтр по пациенту
     search_fields = ('patient__last_name', 'patient__first_name', 'parameter__code', 'parameter__name', 'value')
     autocomplete_fields = ['patient', 'parameter']
+    list_select_related = ('patient', 'parameter') # Без запроса на каждую строку списка
     list_per_page = 25
     # Делаем дату и время более читаемыми
     # readonly_fields = ('created_at',) # Если у Observation есть created_at
@@ -40,6 +42,7 @@ class MedicalTestAdmin(admin.ModelAdmin):
     search_fields = ('patient__last_name', 'patient__first_name', 'test_name', 'result_text') # Поля для поиска
     autocomplete_fields = ['patient', 'uploaded_by'] # Автодополнение для ForeignKey
     readonly_fields = ('created_at', 'filename') # Поля только для чтения
+    list_select_related = ('patient', 'uploaded_by')
     list_per_page = 25
     # date_hierarchy = 'test_date' # Навигация по дате теста
 
@@ -48,3 +51,69 @@ class MedicalTestAdmin(admin.ModelAdmin):
     #     return obj.filename
     # get_filename.short_description = 'Имя файла' # Название колонки
 # --- /РЕГИСТРАЦИЯ НОВОЙ МОДЕЛИ MedicalTest ---
+
+@admin.register(PatientParameterSummary)
+class PatientParameterSummaryAdmin(admin.ModelAdmin):
+    list_display = ('patient', 'parameter', 'observation_count', 'value_min', 'value_max', 'last_value', 'last_timestamp')
+    list_filter = ('parameter',)
+    search_fields = ('patient__last_name', 'patient__first_name', 'parameter__code')
+    # Сводки поддерживаются автоматически (core/summaries.py) - только просмотр
+    readonly_fields = [f.name for f in PatientParameterSummary._meta.fields]
+    list_select_related = ('patient', 'parameter')
+    list_per_page = 25
+
+
+@admin.register(ResearchExportJob)
+class ResearchExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'export_format', 'status', 'row_count', 'created_by', 'created_at', 'finished_at', 'expires_at')
+    list_filter = ('status', 'export_format')
+    # Задания создаются через API и выполняются воркером (core/jobs.py) - только просмотр
+    readonly_fields = [f.name for f in ResearchExportJob._meta.fields]
+    list_select_related = ('created_by',)
+    list_per_page = 25
+
+
+@admin.register(MedicalTestUpload)
+class MedicalTestUploadAdmin(admin.ModelAdmin):
+    list_display = ('id', 'medical_test', 'filename', 'size', 'received_bytes', 'status', 'created_by', 'updated_at')
+    list_filter = ('status',)
+    # Загрузки идут через API частями (core/uploads.py) - только просмотр
+    readonly_fields = [f.name for f in MedicalTestUpload._meta.fields]
+    list_select_related = ('medical_test', 'created_by')
+    list_per_page = 25
+
+
+@admin.register(MedicalTestExtraction)
+class MedicalTestExtractionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'medical_test', 'extractor', 'status', 'item_count', 'score', 'created_at', 'finished_at')
+    list_filter = ('status', 'extractor')
+    # Задания создаются при смене файла теста (core/extraction.py) - только просмотр
+    readonly_fields = [f.name for f in MedicalTestExtraction._meta.fields]
+    list_select_related = ('medical_test__patient',)
+    list_per_page = 25
+
+
+@admin.register(FileBlob)
+class FileBlobAdmin(admin.ModelAdmin):
+    list_display = ('digest', 'size', 'ref_count', 'created_at')
+    search_fields = ('digest',)
+    # Счетчики ведет хранилище (core/storage.py) - только просмотр
+    readonly_fields = [f.name for f in FileBlob._meta.fields]
+    list_per_page = 25
+
+
+@admin.register(Cohort)
+class CohortAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'created_by', 'evaluated_on', 'membership_version', 'updated_at')
+    search_fields = ('name', 'description')
+    # Состав поддерживается автоматически (core/cohorts.py); критерии проверяются через API
+    readonly_fields = ('evaluated_on', 'membership_version', 'created_at', 'updated_at')
+    list_select_related = ('created_by',)
+    list_per_page = 25
+
+    def save_model(self, request, obj, form, change):
+        if not change and obj.created_by_id is None:
+            obj.created_by = request.user
+        super().save_model(request, obj, form, change)
+        if not change or 'criteria' in form.changed_data:
+            refresh_cohort(obj)
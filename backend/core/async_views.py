@@ -0,0 +1,242 @@
+# backend/core/async_views.py
+"""
+Асинхронные представления карточки пациента для режима ASGI (ASYNC_PATIENT_VIEWS=True).
+
+Дашборд пациента одновременно запрашивает /patients/<id>/, /dynamics/, /tests/ и
+/episodes/. Под WSGI каждый из этих запросов занимает поток воркера на все время
+ожидания БД. Здесь те же ответы собираются асинхронным ORM Django (aget, async for),
+а /patients/<id>/overview/ отдает их одним ответом, запуская подзапросы через
+asyncio.gather.
+
+Django 4.2 выполняет запросы асинхронного ORM в потоке запроса (sync_to_async,
+thread_sensitive), так что SQL одного запроса по-прежнему идет по очереди в одном
+соединении, а переходы между циклом событий и потоком делают отдельный запрос
+немного медленнее, чем под WSGI. Выигрыш в другом: воркеру не нужен пул потоков под
+пиковое число параллельных запросов, а overview заменяет четыре HTTP-запроса (и
+четыре проверки JWT) одним. Сравнение с WSGI под нагрузкой - manage.py benchmark_concurrency.
+
+Каждый выполняющийся запрос держит свой поток и свое соединение с БД, а цикл событий
+принимает запросы без ограничения - без предела пик нагрузки исчерпал бы max_connections
+PostgreSQL. Поэтому одновременно выполняется не больше ASYNC_VIEW_CONCURRENCY
+представлений на процесс, остальные ждут в очереди (как запросы в очереди пула потоков WSGI).
+
+DRF 3.15 не поддерживает асинхронные обработчики, поэтому это обычные async-view
+Django: аутентификация - теми же классами DRF (JWT), ответ - тот же JSON, что у
+PatientViewSet (формат ?format=csv и Browsable API здесь не поддерживаются).
+Изменение пациента (PUT/PATCH/DELETE) передается прежнему синхронному представлению.
+"""
+import asyncio
+import functools
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from rest_framework import exceptions, permissions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .fast_serializers import (
+    FIELDS_QUERY_PARAM, MEDICAL_TEST_PLAN, OBSERVATION_PLAN, FieldsQueryError,
+)
+from .models import HospitalizationEpisode, MedicalTest, Observation, Patient
+from .renderers import dumps_json
+from .serializers import HospitalizationEpisodeSerializer, PatientSerializer
+from .timeseries import DynamicsQueryError, build_dynamics_series, parse_downsampling_params
+
+READ_METHODS = ('GET', 'HEAD')
+
+_limits = weakref.WeakKeyDictionary()  # цикл событий -> asyncio.Semaphore
+
+
+class QueryParamError(ValueError):
+    """Некорректный параметр запроса (отдается клиенту как 400)."""
+
+
+# --- Ответы и аутентификация ---
+
+def json_response(data, status=200, headers=None):
+    return HttpResponse(dumps_json(data), status=status, content_type='application/json', headers=headers)
+
+
+def _exception_response(exc, drf_request):
+    """Ответ на исключение DRF в том же виде, что у exception_handler DRF."""
+    headers = {}
+    status = exc.status_code
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        authenticators = drf_request.authenticators
+        header = authenticators[0].authenticate_header(drf_request) if authenticators else None
+        if header:
+            headers['WWW-Authenticate'] = header
+        else:
+            status = 403
+    return json_response({'detail': exc.detail}, status=status, headers=headers)
+
+
+def _authenticate(request):
+    """
+    Аутентификация и IsAuthenticated как у DRF-представлений (DEFAULT_AUTHENTICATION_CLASSES).
+    Синхронная: классы DRF читают пользователя из БД. Возвращает ответ с ошибкой или None.
+    """
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        if not permissions.IsAuthenticated().has_permission(drf_request, None):
+            raise exceptions.NotAuthenticated()
+    except exceptions.APIException as exc:
+        return _exception_response(exc, drf_request)
+    request.user = drf_request.user
+    return None
+
+
+def _concurrency_limit():
+    """Семафор ASYNC_VIEW_CONCURRENCY текущего цикла событий (asyncio.Semaphore привязан к циклу)."""
+    loop = asyncio.get_running_loop()
+    limit = _limits.get(loop)
+    if limit is None:
+        limit = _limits[loop] = asyncio.Semaphore(settings.ASYNC_VIEW_CONCURRENCY)
+    return limit
+
+
+def async_api_view(handler):
+    """
+    Асинхронное read-only представление: аутентификация как у DRF, обработчик возвращает
+    данные для JSON. Http404 -> 404, QueryParamError и ошибки разбора параметров -> 400.
+    """
+    @functools.wraps(handler)
+    async def view(request, *args, **kwargs):
+        if request.method not in READ_METHODS:
+            return json_response(
+                {'detail': f'Method "{request.method}" not allowed.'}, status=405, headers={'Allow': ', '.join(READ_METHODS)}
+            )
+        async with _concurrency_limit():
+            denied = await sync_to_async(_authenticate)(request)
+            if denied is not None:
+                return denied
+            try:
+                return json_response(await handler(request, *args, **kwargs))
+            except Http404 as exc:
+                return json_response({'detail': str(exc) or 'Not found.'}, status=404)
+            except (QueryParamError, FieldsQueryError, DynamicsQueryError) as exc:
+                return json_response({'error': str(exc)}, status=400)
+
+    # JWT в заголовке, не cookie - как и у DRF-представлений, CSRF не нужен
+    view.csrf_exempt = True
+    return view
+
+
+def with_sync_fallback(async_view, sync_view):
+    """Чтение - асинхронным представлением, остальные методы - прежним синхронным (в потоке, как делает сам Django)."""
+    @functools.wraps(async_view)
+    async def view(request, *args, **kwargs):
+        if request.method in READ_METHODS:
+            return await async_view(request, *args, **kwargs)
+        return await sync_to_async(sync_view)(request, *args, **kwargs)
+
+    view.csrf_exempt = True
+    return view
+
+
+# --- Данные карточки пациента (общие для отдельных эндпоинтов и overview) ---
+
+def _not_found():
+    return Http404(f"No {Patient._meta.object_name} matches the given query.")
+
+
+async def _require_patient(pk):
+    if not await Patient.objects.filter(pk=pk).aexists():
+        raise _not_found()
+
+
+async def patient_data(pk):
+    """Как PatientViewSet.retrieve; None - пациента нет."""
+    patient = await Patient.objects.select_related('primary_diagnosis_mkb').filter(pk=pk).afirst()
+    return PatientSerializer(patient).data if patient is not None else None
+
+
+def parse_dynamics_params(query_params, required=True):
+    """(коды показателей, max_points, bucket) из ?param=..., ?max_points=, ?bucket=; без ?param= - None."""
+    parameter_codes = query_params.getlist('param')
+    if not parameter_codes:
+        if required:
+            raise QueryParamError("Query parameter 'param' is required.")
+        return None
+    max_points, bucket = parse_downsampling_params(query_params)
+    return parameter_codes, max_points, bucket
+
+
+async def dynamics_data(pk, params, names, request):
+    """Как PatientViewSet.get_patient_dynamics: колоночные ряды при прореживании, иначе список наблюдений."""
+    parameter_codes, max_points, bucket = params
+    if max_points or bucket:
+        # LTTB и агрегация - готовая синхронная функция, целиком в потоке запроса
+        return await sync_to_async(build_dynamics_series)(pk, parameter_codes, max_points=max_points, bucket=bucket)
+    observations = Observation.objects.filter(
+        patient_id=pk, parameter__code__in=parameter_codes, parameter__is_numeric=True,
+    ).order_by('timestamp')
+    rows = [row async for row in observations.values(*OBSERVATION_PLAN.columns(names))]
+    # План дочитывает справочник показателей из кэша (или БД) - в потоке
+    return await sync_to_async(OBSERVATION_PLAN.serialize)(rows, names, request)
+
+
+async def tests_data(pk, names, request):
+    """Как PatientViewSet.get_patient_tests."""
+    tests = MedicalTest.objects.filter(patient_id=pk).order_by('-test_date')
+    rows = [row async for row in tests.values(*MEDICAL_TEST_PLAN.columns(names))]
+    return MEDICAL_TEST_PLAN.serialize(rows, names, request)
+
+
+async def episodes_data(pk, request):
+    """Как PatientViewSet.get_patient_episodes."""
+    episodes = HospitalizationEpisode.objects.filter(patient_id=pk).select_related('patient').order_by('-start_date')
+    episodes = [episode async for episode in episodes]
+    return HospitalizationEpisodeSerializer(episodes, many=True, context={'request': request}).data
+
+
+# --- Представления ---
+
+@async_api_view
+async def patient_detail(request, pk):
+    data = await patient_data(pk)
+    if data is None:
+        raise _not_found()
+    return data
+
+
+@async_api_view
+async def patient_dynamics(request, pk):
+    params = parse_dynamics_params(request.GET)
+    names = OBSERVATION_PLAN.parse_fields(request.GET.get(FIELDS_QUERY_PARAM))
+    _, data = await asyncio.gather(_require_patient(pk), dynamics_data(pk, params, names, request))
+    return data
+
+
+@async_api_view
+async def patient_tests(request, pk):
+    names = MEDICAL_TEST_PLAN.parse_fields(request.GET.get(FIELDS_QUERY_PARAM))
+    _, data = await asyncio.gather(_require_patient(pk), tests_data(pk, names, request))
+    return data
+
+
+@async_api_view
+async def patient_episodes(request, pk):
+    _, data = await asyncio.gather(_require_patient(pk), episodes_data(pk, request))
+    return data
+
+
+@async_api_view
+async def patient_overview(request, pk):
+    """
+    Карточка пациента одним ответом: {"patient", "tests", "episodes", "dynamics"}.
+    dynamics - как у /dynamics/ (те же ?param=, ?max_points=, ?bucket=), без ?param= - null.
+    Подзапросы запускаются одновременно через asyncio.gather.
+    """
+    params = parse_dynamics_params(request.GET, required=False)
+    observation_names = OBSERVATION_PLAN.parse_fields(None)
+    test_names = MEDICAL_TEST_PLAN.parse_fields(None)
+    parts = [patient_data(pk), tests_data(pk, test_names, request), episodes_data(pk, request)]
+    if params is not None:
+        parts.append(dynamics_data(pk, params, observation_names, request))
+    patient, tests, episodes, *dynamics = await asyncio.gather(*parts)
+    if patient is None:
+        raise _not_found()
+    return {'patient': patient, 'tests': tests, 'episodes': episodes, 'dynamics': dynamics[0] if dynamics else None}
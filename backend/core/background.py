@@ -0,0 +1,83 @@
+# backend/core/background.py
+"""
+Очередь фоновых заданий в таблице модели - общая для выгрузок (core/jobs.py)
+и разбора файлов тестов (core/extraction.py).
+
+Задание создается в статусе pending и после коммита отправляется в локальный пул
+потоков процесса (размер - настройка workers_setting; 0 - выполнить сразу в
+on_commit запроса). Воркер "захватывает" задание атомарным UPDATE ... WHERE
+status='pending', поэтому одно задание никогда не выполняется дважды. Задания,
+не дошедшие до пула из-за перезапуска, выполняет run_pending() из management-команды,
+а зависшие в running дольше stale_timeout_setting возвращает в очередь requeue_stale().
+
+Модели нужны поля status (STATUS_PENDING / STATUS_RUNNING), started_at и created_at.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+
+class TableQueue:
+    """runner(task) выполняет захваченное задание и сам записывает его итоговый статус."""
+
+    def __init__(self, model, runner, workers_setting, stale_timeout_setting, thread_name_prefix):
+        self.model = model
+        self.runner = runner
+        self.workers_setting = workers_setting
+        self.stale_timeout_setting = stale_timeout_setting
+        self.thread_name_prefix = thread_name_prefix
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, self.workers_setting), thread_name_prefix=self.thread_name_prefix,
+                )
+            return self._executor
+
+    def _run_in_worker(self, task_id):
+        # Поток пула держит собственное соединение с БД - закрываем его после каждого задания
+        close_old_connections()
+        try:
+            self.run(task_id)
+        finally:
+            connection.close()
+
+    def enqueue(self, task_id):
+        """После коммита отправляет задание в пул потоков (или выполняет сразу, если воркеров 0)."""
+        if getattr(settings, self.workers_setting) <= 0:
+            transaction.on_commit(lambda: self.run(task_id))
+        else:
+            transaction.on_commit(lambda: self._get_executor().submit(self._run_in_worker, task_id))
+
+    def run(self, task_id):
+        """Выполняет задание, если его еще никто не захватил. Возвращает True, если задание выполнялось."""
+        claimed = self.model.objects.filter(pk=task_id, status=self.model.STATUS_PENDING).update(
+            status=self.model.STATUS_RUNNING, started_at=timezone.now()
+        )
+        if not claimed:
+            return False
+        self.runner(self.model.objects.get(pk=task_id))
+        return True
+
+    def run_pending(self, limit=None):
+        """Выполняет задания из очереди в текущем процессе (management-команды). Возвращает их число."""
+        done = 0
+        pending = self.model.objects.filter(status=self.model.STATUS_PENDING).order_by('created_at')
+        for task_id in pending.values_list('pk', flat=True)[:limit]:
+            if self.run(task_id):
+                done += 1
+        return done
+
+    def requeue_stale(self):
+        """Возвращает в очередь задания, зависшие в running дольше stale_timeout_setting (упавший процесс)."""
+        cutoff = timezone.now() - timedelta(seconds=getattr(settings, self.stale_timeout_setting))
+        return self.model.objects.filter(status=self.model.STATUS_RUNNING, started_at__lt=cutoff).update(
+            status=self.model.STATUS_PENDING, started_at=None
+        )
@@ -0,0 +1,123 @@
+# backend/core/cache.py
+"""
+Версионируемый кэш справочников (ParameterCode, MKBCode).
+
+Два уровня:
+- общий кэш Django (CACHES['default']: LocMem или Redis при REDIS_URL) хранит
+  номер версии справочника и закэшированные данные под ключом с этой версией;
+- словарь в памяти процесса держит последние данные и не спрашивает общий кэш
+  чаще, чем раз в REFERENCE_CACHE_LOCAL_TTL секунд.
+
+Сохранение/удаление записи справочника (админка, API) увеличивает версию после
+коммита транзакции (см. core/signals.py), старые ключи просто перестают читаться.
+Версия - время изменения в миллисекундах, поэтому из нее же получаются ETag и
+Last-Modified для условных запросов.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+KEY_PREFIX = 'refdata'
+PARAMETER_CODES = 'parametercode'
+MKB_CODES = 'mkbcode'
+
+_local = {}
+_local_lock = threading.Lock()
+
+
+def _version_key(name):
+    return f'{KEY_PREFIX}:{name}:version'
+
+
+def _data_key(name, version, variant=''):
+    return f'{KEY_PREFIX}:{name}:{version}:{variant}'
+
+
+def get_version(name):
+    """Текущая версия справочника. Если ее нет в кэше (холодный старт, вытеснение) - начинаем новую."""
+    version = cache.get(_version_key(name))
+    if version is None:
+        version = int(time.time() * 1000)
+        # add() не перезапишет версию, которую успел записать другой процесс
+        if not cache.add(_version_key(name), version, timeout=None):
+            version = cache.get(_version_key(name), version)
+    return version
+
+
+def bump_version(name):
+    """Инвалидирует справочник: новая версия не меньше текущего времени и строго больше старой."""
+    old = cache.get(_version_key(name)) or 0
+    version = max(int(time.time() * 1000), old + 1)
+    cache.set(_version_key(name), version, timeout=None)
+    with _local_lock:
+        _local.pop(name, None)
+    return version
+
+
+def get_cached(name, loader, variant=''):
+    """
+    (версия, данные) для справочника name. loader() вызывается только при промахе
+    в обоих уровнях кэша. variant различает разные выборки одного справочника (например,
+    поисковые запросы).
+    """
+    now = time.monotonic()
+    with _local_lock:
+        entry = _local.get(name, {}).get(variant)
+    if entry is not None and now - entry[2] < settings.REFERENCE_CACHE_LOCAL_TTL:
+        return entry[0], entry[1]
+
+    version = get_version(name)
+    if entry is not None and entry[0] == version:
+        data = entry[1]
+    else:
+        key = _data_key(name, version, variant)
+        data = cache.get(key)
+        if data is None:
+            data = loader()
+            cache.set(key, data, timeout=settings.REFERENCE_CACHE_TIMEOUT)
+    with _local_lock:
+        variants = _local.setdefault(name, {})
+        if len(variants) >= settings.REFERENCE_CACHE_LOCAL_MAX_VARIANTS:
+            variants.clear()  # Простейшее ограничение памяти для поисковых вариантов
+        variants[variant] = (version, data, now)
+    return version, data
+
+
+def variant_key(*parts):
+    """Короткий ключ варианта из произвольных строк (например, поисковой строки)."""
+    return hashlib.md5('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+# --- Справочник параметров ---
+
+def parameter_code_map():
+    """{код: ParameterCode} из кэша - для проверки кодов при записи наблюдений."""
+    from .models import ParameterCode
+    _, data = get_cached(PARAMETER_CODES, lambda: {p.code: p for p in ParameterCode.objects.all()}, variant='map')
+    return data
+
+
+# --- Условные запросы (ETag / Last-Modified) ---
+
+def conditional_headers(name, version, variant=''):
+    etag = quote_etag(f'{name}-{version}-{variant}' if variant else f'{name}-{version}')
+    return {
+        'ETag': etag,
+        'Last-Modified': http_date(version // 1000),
+        # Ответ зависит от авторизации - только кэш браузера, с обязательной ревалидацией
+        'Cache-Control': 'private, no-cache',
+    }
+
+
+def is_not_modified(request, headers):
+    """True, если клиент уже имеет актуальную версию (If-None-Match / If-Modified-Since)."""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        etags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in etags or headers['ETag'] in etags or f'W/{headers["ETag"]}' in etags
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since') or '')
+    return if_modified_since is not None and parse_http_date_safe(headers['Last-Modified']) <= if_modified_since
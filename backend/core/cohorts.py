@@ -0,0 +1,138 @@
+# backend/core/cohorts.py
+"""
+Сохраненные когорты (Cohort) и их материализованный состав (CohortMembership).
+
+Состав пересчитывается целиком только при создании когорты / смене критериев
+(один INSERT ... SELECT). Дальше он поддерживается инкрементально:
+- сохранение пациента (core/signals.py) перепроверяет только этого пациента
+  во всех когортах;
+- для когорт с возрастом смена даты меняет только пациентов, чьи даты рождения
+  попали в "сдвинувшуюся" полосу границ (ensure_current при обращении к когорте).
+Все проверки идут на дату evaluated_on, поэтому состав всегда согласован с одной датой.
+
+Выгрузки, матрица и фоновые задания с ?cohort_id= берут пациентов из состава
+(JOIN по core_cohortmembership) вместо повторного вычисления критериев.
+Загрузка пациентов в обход ORM (bulk_create, COPY) сигналов не вызывает -
+после нее нужен manage.py refresh_cohorts.
+"""
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .criteria import PATIENT_CRITERIA, ResearchCriteria, ResearchQueryError, birth_date_bounds, research_query_dict
+from .models import Cohort, CohortMembership, Patient
+
+
+def cohort_criteria(cohort):
+    return ResearchCriteria.from_params(research_query_dict(cohort.criteria), require_param_codes=False)
+
+
+def refresh_cohort(cohort, today=None):
+    """Полный пересчет состава на дату today (по умолчанию - сегодня)."""
+    today = today or timezone.localdate()
+    criteria = cohort_criteria(cohort)
+    members = Patient.objects.filter(criteria.patient_filter(today)).order_by().values('id')
+    sql, params = members.query.sql_with_params()
+    added_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    with transaction.atomic():
+        CohortMembership.objects.filter(cohort=cohort).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {CohortMembership._meta.db_table} (cohort_id, patient_id, added_at) "
+                f"SELECT %s, members.id, %s FROM ({sql}) AS members",
+                [cohort.pk, added_at, *params],
+            )
+        Cohort.objects.filter(pk=cohort.pk).update(evaluated_on=today, membership_version=F('membership_version') + 1)
+    cohort.refresh_from_db(fields=['evaluated_on', 'membership_version'])
+    return cohort
+
+
+def _sync_members(cohort, criteria, candidates, today):
+    """Приводит состав в соответствие критериям для пациентов из candidates. True, если состав изменился."""
+    matching = set(candidates.filter(criteria.patient_filter(today)).values_list('id', flat=True))
+    current = set(
+        CohortMembership.objects.filter(cohort=cohort, patient__in=candidates.values('id')).values_list('patient_id', flat=True)
+    )
+    to_add, to_remove = matching - current, current - matching
+    if to_remove:
+        CohortMembership.objects.filter(cohort=cohort, patient_id__in=to_remove).delete()
+    if to_add:
+        CohortMembership.objects.bulk_create(
+            [CohortMembership(cohort=cohort, patient_id=patient_id) for patient_id in to_add], ignore_conflicts=True
+        )
+    if to_add or to_remove:
+        Cohort.objects.filter(pk=cohort.pk).update(membership_version=F('membership_version') + 1)
+        return True
+    return False
+
+
+def refresh_patient_memberships(patient_ids):
+    """Перепроверяет пациентов во всех посчитанных когортах (после изменения даты рождения / диагноза)."""
+    candidates = Patient.objects.filter(pk__in=list(patient_ids))
+    for cohort in Cohort.objects.filter(evaluated_on__isnull=False):
+        _sync_members(cohort, cohort_criteria(cohort), candidates, cohort.evaluated_on)
+
+
+def _age_band(old_day, new_day, criteria):
+    """Условие на даты рождения, для которых возрастной критерий на old_day и new_day может отличаться."""
+    old_earliest, old_latest = birth_date_bounds(criteria.age_min, criteria.age_max, old_day)
+    new_earliest, new_latest = birth_date_bounds(criteria.age_min, criteria.age_max, new_day)
+    band = Q(pk__in=[])
+    if old_latest is not None:
+        band |= Q(date_of_birth__gt=min(old_latest, new_latest), date_of_birth__lte=max(old_latest, new_latest))
+    if old_earliest is not None:
+        band |= Q(date_of_birth__gte=min(old_earliest, new_earliest), date_of_birth__lt=max(old_earliest, new_earliest))
+    return band
+
+
+def ensure_current(cohort, today=None):
+    """
+    Состав на сегодня. Когорта без возраста от даты не зависит; с возрастом -
+    перепроверяются только пациенты на сдвинувшихся границах дат рождения.
+    """
+    today = today or timezone.localdate()
+    if cohort.evaluated_on == today:
+        return cohort
+    with transaction.atomic():
+        # Блокировка строки: параллельные запросы не досчитывают одну и ту же смену даты
+        locked = Cohort.objects.select_for_update().get(pk=cohort.pk)
+        if locked.evaluated_on is None:
+            return refresh_cohort(cohort, today)
+        if locked.evaluated_on != today:
+            criteria = cohort_criteria(locked)
+            if criteria.has_age_criteria:
+                _sync_members(locked, criteria, Patient.objects.filter(_age_band(locked.evaluated_on, today, criteria)), today)
+            Cohort.objects.filter(pk=cohort.pk).update(evaluated_on=today)
+    cohort.refresh_from_db(fields=['evaluated_on', 'membership_version'])
+    return cohort
+
+
+def get_cohort(raw_id):
+    try:
+        cohort_id = int(raw_id)
+    except (TypeError, ValueError):
+        raise ResearchQueryError("Query parameter 'cohort_id' must be an integer.")
+    cohort = Cohort.objects.filter(pk=cohort_id).first()
+    if cohort is None:
+        raise ResearchQueryError(f"Cohort {cohort_id} not found.")
+    return cohort
+
+
+def cohort_research_query(query_params):
+    """
+    (patient_qs, ResearchCriteria) для ?cohort_id=: пациенты - из состава когорты,
+    показатели и период - из запроса, а если их там нет - сохраненные в когорте.
+    """
+    conflicting = [key for key in PATIENT_CRITERIA if query_params.get(key)]
+    if conflicting:
+        raise ResearchQueryError(f"Parameter(s) {', '.join(conflicting)} cannot be combined with 'cohort_id'.")
+    cohort = ensure_current(get_cohort(query_params.get('cohort_id')))
+    params = {key: value for key, value in cohort.criteria.items() if key not in PATIENT_CRITERIA}
+    if query_params.getlist('param_codes'):
+        params['param_codes'] = query_params.getlist('param_codes')
+    for key in ('start_date', 'end_date'):
+        if query_params.get(key):
+            params[key] = query_params.get(key)
+    criteria = ResearchCriteria.from_params(research_query_dict(params))
+    patient_qs = Patient.objects.filter(cohort_memberships__cohort_id=cohort.pk).select_related('primary_diagnosis_mkb')
+    return patient_qs, criteria
@@ -0,0 +1,153 @@
+# backend/core/criteria.py
+"""
+Критерии исследовательской выборки (диагноз, возраст, показатели, период) и их
+компиляция в условия ORM.
+
+Каждый критерий превращается в условие, которое обслуживает индекс
+(sargable): сравнение самой колонки с константой, без функций над ней.
+- возраст -> диапазон date_of_birth с точными календарными границами
+  (patient_dob_idx / patient_diag_dob_idx); "N лет" считается как в жизни:
+  день рождения 29 февраля в невисокосный год наступает 1 марта;
+- период -> диапазон timestamp от начала дня start_date до начала дня после
+  end_date в текущем часовом поясе (obs_param_ts_cover_idx, partition pruning);
+- показатели -> parameter_id IN (...) (PK параметра - код, JOIN не нужен);
+- диагноз -> primary_diagnosis_mkb_id IN (коды справочника без учета регистра):
+  поиск без учета регистра идет по небольшому справочнику МКБ, а по пациентам -
+  равенство внешнего ключа.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db.models import Q
+from django.http import QueryDict
+from django.utils import timezone
+
+from .models import MKBCode, Patient
+
+MAX_AGE = 150
+# Критерии, задающие состав пациентов (остальные - отбор наблюдений)
+PATIENT_CRITERIA = ('diagnosis_mkb', 'age_min', 'age_max')
+
+
+class ResearchQueryError(ValueError):
+    """Некорректные параметры исследовательского запроса (отдается клиенту как 400)."""
+
+
+def years_before(day, years):
+    """Та же календарная дата years лет назад; 29 февраля в невисокосном году -> 28 февраля."""
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)
+
+
+def birth_date_bounds(age_min=None, age_max=None, today=None):
+    """
+    (самая ранняя, самая поздняя) дата рождения включительно для полных лет в [age_min, age_max].
+    Возраст >= N  <=>  дата рождения <= сегодня минус N лет;
+    возраст <= M  <=>  возраст < M + 1  <=>  дата рождения > сегодня минус (M + 1) лет.
+    """
+    today = today or timezone.localdate()
+    latest = years_before(today, age_min) if age_min is not None else None
+    earliest = years_before(today, age_max + 1) + timedelta(days=1) if age_max is not None else None
+    return earliest, latest
+
+
+def age_on(date_of_birth, today):
+    """Полных лет на дату today (для проверок и отчетов)."""
+    return today.year - date_of_birth.year - ((today.month, today.day) < (date_of_birth.month, date_of_birth.day))
+
+
+def start_of_day(day):
+    """Начало дня в текущем часовом поясе - та же граница, что и у lookup'а timestamp__date."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def research_query_dict(params):
+    """QueryDict из dict параметров ({ключ: значение или список}) - вход для ResearchCriteria.from_params."""
+    query = QueryDict(mutable=True)
+    for key, value in params.items():
+        query.setlist(key, [str(item) for item in value] if isinstance(value, list) else [str(value)])
+    return query
+
+
+def _parse_age(name, raw_value):
+    if raw_value in (None, ''):
+        return None
+    try:
+        age = int(raw_value)
+    except (ValueError, TypeError):
+        raise ResearchQueryError("Age parameters must be integers.")
+    if not 0 <= age <= MAX_AGE:
+        raise ResearchQueryError(f"Query parameter '{name}' must be between 0 and {MAX_AGE}.")
+    return age
+
+
+def _parse_date(raw_value):
+    if not raw_value:
+        return None
+    try:
+        return datetime.strptime(raw_value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ResearchQueryError("Invalid date format (use YYYY-MM-DD).")
+
+
+class ResearchCriteria:
+    """Разобранные критерии выборки; from_params() проверяет значения, остальные методы строят запросы."""
+
+    def __init__(self, param_codes, diagnosis_mkb=None, age_min=None, age_max=None, start_date=None, end_date=None):
+        self.param_codes = list(param_codes)
+        self.diagnosis_mkb = diagnosis_mkb or None
+        self.age_min = age_min
+        self.age_max = age_max
+        self.start_date = start_date
+        self.end_date = end_date
+
+    @classmethod
+    def from_params(cls, query_params, require_param_codes=True):
+        """
+        Из query_params / QueryDict. Бросает ResearchQueryError при некорректных значениях.
+        require_param_codes=False - для определения когорты, где показатели необязательны.
+        """
+        param_codes = query_params.getlist('param_codes')
+        if not param_codes and require_param_codes:
+            raise ResearchQueryError("Query parameter 'param_codes' is required.")
+        return cls(
+            param_codes=param_codes,
+            diagnosis_mkb=(query_params.get('diagnosis_mkb') or '').strip() or None,
+            age_min=_parse_age('age_min', query_params.get('age_min')),
+            age_max=_parse_age('age_max', query_params.get('age_max')),
+            start_date=_parse_date(query_params.get('start_date')),
+            end_date=_parse_date(query_params.get('end_date')),
+        )
+
+    @property
+    def has_age_criteria(self):
+        return self.age_min is not None or self.age_max is not None
+
+    # --- Пациенты ---
+
+    def patient_filter(self, today=None):
+        condition = Q()
+        if self.diagnosis_mkb:
+            codes = MKBCode.objects.filter(code__iexact=self.diagnosis_mkb).values('code')
+            condition &= Q(primary_diagnosis_mkb_id__in=codes)
+        earliest, latest = birth_date_bounds(self.age_min, self.age_max, today)
+        if latest is not None:
+            condition &= Q(date_of_birth__lte=latest)
+        if earliest is not None:
+            condition &= Q(date_of_birth__gte=earliest)
+        return condition
+
+    def patient_queryset(self, today=None):
+        return Patient.objects.filter(self.patient_filter(today)).select_related('primary_diagnosis_mkb')
+
+    # --- Наблюдения ---
+
+    def observation_filter(self):
+        # Диапазон по самому timestamp (а не timestamp__date): индекс и partition pruning работают
+        condition = Q(parameter_id__in=self.param_codes)
+        if self.start_date:
+            condition &= Q(timestamp__gte=start_of_day(self.start_date))
+        if self.end_date:
+            condition &= Q(timestamp__lt=start_of_day(self.end_date + timedelta(days=1)))
+        return condition
@@ -0,0 +1,130 @@
+# backend/core/downloads.py
+"""
+Раздача защищенных файлов (MedicalTest.uploaded_file, готовые выгрузки исследований):
+права проверяет Django, байты отдает веб-сервер.
+
+С MEDIA_ACCEL_REDIRECT_PREFIX (nginx перед backend) ответ - пустой, с заголовком
+X-Accel-Redirect: <префикс><путь в MEDIA_ROOT>. Файл из internal-location отдает nginx
+(sendfile, Range, условные запросы), воркер Python освобождается сразу после проверки.
+
+Без nginx - FileResponse: целый файл уходит через wsgi.file_wrapper (sendfile у gunicorn),
+Range: bytes=... отдается ответом 206 потоково блоками по READ_BLOCK_SIZE.
+ETag в обоих режимах в формате nginx ("<mtime hex>-<size hex>") - кэш клиента
+и докачка не ломаются при переключении режима.
+"""
+import mimetypes
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+from .cache import is_not_modified
+
+READ_BLOCK_SIZE = 256 * 1024
+
+
+def file_validators(stat):
+    """ETag (как у nginx) и Last-Modified по mtime и размеру файла."""
+    return {
+        'ETag': '"%x-%x"' % (int(stat.st_mtime), stat.st_size),
+        'Last-Modified': http_date(int(stat.st_mtime)),
+        # Ответ зависит от авторизации - только кэш браузера, с обязательной ревалидацией
+        'Cache-Control': 'private, no-cache',
+    }
+
+
+def parse_range(header, size):
+    """
+    (start, end) включительно для одного диапазона Range: bytes=...; None - отдать файл целиком
+    (заголовка нет, он некорректен или диапазонов несколько - RFC 9110 это допускает).
+    ValueError - диапазон за концом файла (416).
+    """
+    if not header or not header.startswith('bytes=') or ',' in header or not size:
+        return None
+    first, sep, last = header[len('bytes='):].strip().partition('-')
+    if not sep or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:  # bytes=-N: последние N байт
+        if int(last) == 0:
+            raise ValueError("Empty suffix range.")
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None  # bytes=5-2 - синтаксически неверный диапазон игнорируется
+    if start >= size:
+        raise ValueError("Range starts past the end of file.")
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def _range_applies(request, validators):
+    """If-Range: диапазон действует, только если у клиента та же версия файла."""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == validators['ETag']
+    return parse_http_date_safe(if_range) == parse_http_date_safe(validators['Last-Modified'])
+
+
+def _iter_range(path, start, length):
+    with open(path, 'rb') as source:
+        source.seek(start)
+        while length > 0:
+            block = source.read(min(READ_BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def protected_file_response(request, field_file, as_attachment=True, filename=None):
+    """Ответ с файлом FieldFile после того, как вызывающий проверил права на объект."""
+    if not field_file:
+        raise Http404("No file attached.")
+    filename = filename or os.path.basename(field_file.name)
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        # Удаленное хранилище: ни X-Accel-Redirect, ни sendfile - просто потоковая отдача
+        return FileResponse(field_file.open('rb'), as_attachment=as_attachment, filename=filename)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404("File not found.")
+
+    validators = file_validators(stat)
+    if is_not_modified(request, validators):
+        return HttpResponse(status=304, headers=validators)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    disposition = content_disposition_header(as_attachment, filename)
+
+    prefix = settings.MEDIA_ACCEL_REDIRECT_PREFIX
+    if prefix:
+        # Range, If-Range и sendfile выполнит nginx; заголовки Content-* он берет из этого ответа
+        response = HttpResponse(content_type=content_type, headers={'Content-Disposition': disposition})
+        # Путь на диске относительно корня хранилища: у адресных имен (core/storage.py) он не совпадает с именем
+        relative = os.path.relpath(path, field_file.storage.location).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(relative)
+        response['Cache-Control'] = validators['Cache-Control']
+        return response
+
+    try:
+        byte_range = parse_range(request.headers.get('Range'), stat.st_size) \
+            if _range_applies(request, validators) else None
+    except ValueError:
+        return HttpResponse(status=416, headers={'Content-Range': f'bytes */{stat.st_size}', **validators})
+
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), as_attachment=as_attachment, filename=filename)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(_iter_range(path, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Disposition'] = disposition
+    response['Accept-Ranges'] = 'bytes'
+    for header, value in validators.items():
+        response[header] = value
+    return response
@@ -0,0 +1,393 @@
+# backend/core/extraction.py
+"""
+Фоновое извлечение ответов из загруженных файлов тестов (MedicalTestExtraction).
+
+После сохранения теста с новым файлом поддерживаемого формата создается задание,
+которое после коммита уходит в локальный пул потоков процесса (EXTRACTION_WORKERS) -
+той же очередью в таблице, что и фоновые выгрузки (core/background.py); прерванные
+перезапуском задания подбирает manage.py extract_test_files.
+
+Форматы подключаются декоратором @register_extractor: класс с расширениями и
+iter_items(файл), который по одному отдает пары (пункт, ответ). Встроены:
+- CSV/TSV: длинная таблица (колонки "item, answer" / "вопрос, ответ") или широкая
+  (заголовок с пунктами и одна строка ответов); кодировка UTF-8 или cp1251;
+- XLSX: те же таблицы на первом листе (openpyxl, read-only режим; без openpyxl - выключен);
+- JSON: массив объектов {"item", "answer"}, объект с "answers" (массив или {пункт: ответ})
+  либо плоский объект {пункт: ответ}. С ijson документ читается потоково, без него -
+  целиком, если не больше EXTRACTION_JSON_MAX_IN_MEMORY.
+
+Файл читается потоком, ответы пишутся пакетами по EXTRACTION_BATCH_SIZE - память не
+зависит от размера файла. Пункты с именами итогов (score, total, сумма...) и заключения
+(result, интерпретация...) не сохраняются как ответы, а дают score / result_text теста;
+без явного итога score - сумма числовых ответов. Значения вписываются в тест, только
+если поле пустое или содержит результат прошлого разбора (ручной ввод не затирается).
+"""
+import csv
+import datetime
+import io
+import itertools
+import json
+import logging
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .background import TableQueue
+from .models import MedicalTest, MedicalTestAnswer, MedicalTestExtraction, parse_numeric_value
+
+try:
+    import openpyxl
+except ImportError:  # openpyxl необязателен - без него XLSX не разбирается
+    openpyxl = None
+
+try:
+    import ijson
+except ImportError:  # ijson необязателен - без него JSON читается целиком (с ограничением размера)
+    ijson = None
+
+logger = logging.getLogger(__name__)
+
+# Имена пунктов (без учета регистра), которые несут итог теста, а не ответ
+SCORE_ITEMS = {'score', 'total', 'total_score', 'total score', 'sum', 'балл', 'баллы', 'итог', 'итоговый балл', 'сумма', 'сумма баллов'}
+RESULT_ITEMS = {'result', 'result_text', 'interpretation', 'conclusion', 'результат', 'интерпретация', 'заключение'}
+# Заголовки длинной таблицы и ключи объектов ответа в JSON
+ITEM_KEYS = {'item', 'question', 'code', 'name', 'пункт', 'вопрос', 'код'}
+ANSWER_KEYS = {'answer', 'value', 'response', 'ответ', 'значение'}
+# Ключ JSON-объекта, под которым лежат ответы
+ANSWER_CONTAINERS = {'answers', 'items', 'responses', 'ответы'}
+JSON_SCALAR_EVENTS = {'null', 'boolean', 'integer', 'double', 'number', 'string'}
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+
+class ExtractionError(ValueError):
+    """Файл не удалось разобрать (текст ошибки - в статусе задания)."""
+
+
+class ExtractionSuperseded(Exception):
+    """Файл теста заменили, пока шел разбор - результат не нужен."""
+
+
+# --- Форматы ---
+
+EXTRACTORS = {}  # расширение -> экземпляр экстрактора
+
+
+def register_extractor(cls):
+    """Декоратор класса экстрактора: регистрирует его для всех cls.extensions."""
+    extractor = cls()
+    for extension in cls.extensions:
+        EXTRACTORS[extension] = extractor
+    return cls
+
+
+def get_extractor(file_name):
+    """Экстрактор по расширению файла или None (формат не поддерживается или нет зависимости)."""
+    extractor = EXTRACTORS.get(os.path.splitext(file_name or '')[1].lower())
+    return extractor if extractor is not None and extractor.available() else None
+
+
+class Extractor:
+    """iter_items(двоичный файл) отдает (пункт, ответ) по одному, не читая файл целиком."""
+    name = ''
+    extensions = ()
+
+    def available(self):
+        return True
+
+    def iter_items(self, source):
+        raise NotImplementedError
+
+
+def _cell(value):
+    return '' if value is None else str(value).strip()
+
+
+def iter_table_items(rows):
+    """Пункты из строк таблицы: длинный вид (пункт, ответ) или широкий (заголовок + одна строка ответов)."""
+    rows = (row for row in rows if any(_cell(value) for value in row))
+    header = next(rows, None)
+    if header is None:
+        return
+    names = [_cell(value) for value in header]
+    if len(names) >= 2 and names[0].lower() in ITEM_KEYS and names[1].lower() in ANSWER_KEYS:
+        for row in rows:
+            if _cell(row[0]):
+                yield _cell(row[0]), row[1] if len(row) > 1 else None
+        return
+    values = next(rows, None)
+    if values is None:
+        raise ExtractionError("The table has a header row but no answers.")
+    if next(rows, None) is not None:
+        raise ExtractionError("A wide table must contain exactly one row of answers (one response per test).")
+    for name, value in zip(names, values):
+        if name:
+            yield name, value
+
+
+@register_extractor
+class CSVExtractor(Extractor):
+    name = 'csv'
+    extensions = ('.csv', '.tsv')
+
+    def iter_items(self, source):
+        # Экспорт из русского Excel часто в cp1251: кодировка определяется по началу файла
+        sample = source.read(ENCODING_SAMPLE_SIZE)
+        source.seek(0)
+        try:
+            sample.decode('utf-8')
+            encoding = 'utf-8-sig'
+        except UnicodeDecodeError as exc:
+            # Обрезанный посередине многобайтный символ в конце образца - не ошибка кодировки
+            encoding = 'utf-8-sig' if exc.start >= len(sample) - 3 else 'cp1251'
+        text = io.TextIOWrapper(getattr(source, 'file', source), encoding=encoding, newline='')
+        first_line = text.readline()
+        delimiter = max((',', ';', '\t'), key=first_line.count)
+        try:
+            yield from iter_table_items(csv.reader(itertools.chain([first_line], text), delimiter=delimiter))
+        except (csv.Error, UnicodeDecodeError) as exc:
+            raise ExtractionError(f"Malformed CSV: {exc}")
+        finally:
+            text.detach()
+
+
+@register_extractor
+class XLSXExtractor(Extractor):
+    name = 'xlsx'
+    extensions = ('.xlsx', '.xlsm')
+
+    def available(self):
+        return openpyxl is not None
+
+    def iter_items(self, source):
+        try:
+            # read_only: строки читаются из XML по одной, а не весь лист в память
+            workbook = openpyxl.load_workbook(getattr(source, 'file', source), read_only=True, data_only=True)
+        except Exception as exc:
+            raise ExtractionError(f"Malformed XLSX: {exc}")
+        try:
+            yield from iter_table_items(workbook.worksheets[0].iter_rows(values_only=True))
+        finally:
+            workbook.close()
+
+
+def _document_events(value, prefix=''):
+    """События в формате ijson.parse для уже прочитанного документа - один разбор для обоих путей."""
+    if isinstance(value, dict):
+        yield prefix, 'start_map', None
+        for key, item in value.items():
+            yield prefix, 'map_key', key
+            yield from _document_events(item, f'{prefix}.{key}' if prefix else key)
+        yield prefix, 'end_map', None
+    elif isinstance(value, list):
+        yield prefix, 'start_array', None
+        for item in value:
+            yield from _document_events(item, f'{prefix}.item' if prefix else 'item')
+        yield prefix, 'end_array', None
+    else:
+        yield prefix, 'string' if isinstance(value, str) else 'number', value
+
+
+def iter_json_items(events):
+    """(пункт, ответ) из событий JSON-парсера; вложенные структуры внутри ответов пропускаются."""
+    events = iter(events)
+    _, top, _ = next(events, ('', None, None))
+    if top not in ('start_map', 'start_array'):
+        raise ExtractionError("The JSON document must be an object or an array.")
+    container = '' if top == 'start_array' else None  # Префикс контейнера ответов
+    container_kind = top
+    # Поля плоского объекта - ответы, только если контейнера так и не встретилось
+    # (большие файлы лучше выгружать массивом или с "answers": они не буферизуются)
+    buffered = []
+    key = entry = field = None
+    for prefix, event, value in events:
+        if top == 'start_map':
+            # Верхний уровень объекта: итоги, контейнер ответов или поля плоского объекта
+            if prefix == '' and event == 'map_key':
+                key = value
+                continue
+            if prefix == key:
+                if event in JSON_SCALAR_EVENTS:
+                    if key.strip().lower() in SCORE_ITEMS | RESULT_ITEMS:
+                        yield key, value
+                    elif container is None:
+                        buffered.append((key, value))
+                elif event in ('start_map', 'start_array') and container is None \
+                        and key.strip().lower() in ANSWER_CONTAINERS:
+                    container, container_kind, buffered = key, event, []
+                continue
+        if container is None:
+            continue
+        entry_prefix = f'{container}.item' if container else 'item'
+        if container_kind == 'start_array':
+            if prefix == entry_prefix and event == 'start_map':
+                entry = {}
+            elif prefix == entry_prefix and event == 'map_key':
+                field = value
+            elif entry is not None and event in JSON_SCALAR_EVENTS and prefix == f'{entry_prefix}.{field}':
+                entry[field.strip().lower()] = value
+            elif prefix == entry_prefix and event == 'end_map':
+                item = next((entry[name] for name in ITEM_KEYS if name in entry), None)
+                if _cell(item):
+                    yield _cell(item), next((entry[name] for name in ANSWER_KEYS if name in entry), None)
+                entry = None
+        else:
+            if prefix == container and event == 'map_key':
+                field = value
+            elif event in JSON_SCALAR_EVENTS and prefix == f'{container}.{field}':
+                yield field, value
+    yield from buffered
+
+
+@register_extractor
+class JSONExtractor(Extractor):
+    name = 'json'
+    extensions = ('.json',)
+
+    def iter_items(self, source):
+        if ijson is not None:
+            try:
+                yield from iter_json_items(ijson.parse(source))
+            except ijson.JSONError as exc:
+                raise ExtractionError(f"Malformed JSON: {exc}")
+            return
+        if source.size > settings.EXTRACTION_JSON_MAX_IN_MEMORY:
+            raise ExtractionError(
+                f"JSON files larger than {settings.EXTRACTION_JSON_MAX_IN_MEMORY} bytes need ijson installed on the server."
+            )
+        try:
+            document = json.load(source)
+        except ValueError as exc:
+            raise ExtractionError(f"Malformed JSON: {exc}")
+        yield from iter_json_items(_document_events(document))
+
+
+# --- Разбор и сохранение ---
+
+def _answer_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value).strip()
+
+
+def write_answers(extraction):
+    """
+    Заменяет ответы теста ответами из файла и заполняет score/result_text.
+    Все в одной транзакции под блокировкой строки теста. Возвращает (ответов, балл, текст).
+    """
+    extractor = get_extractor(extraction.file_name)
+    if extractor is None:
+        raise ExtractionError(f"Unsupported file format: {os.path.basename(extraction.file_name)}.")
+    storage = MedicalTest._meta.get_field('uploaded_file').storage
+    batch_size = settings.EXTRACTION_BATCH_SIZE
+    with transaction.atomic():
+        medical_test = (
+            MedicalTest.objects.select_for_update()
+            .filter(pk=extraction.medical_test_id, uploaded_file=extraction.file_name).first()
+        )
+        if medical_test is None:
+            raise ExtractionSuperseded()
+        MedicalTestAnswer.objects.filter(medical_test_id=medical_test.pk).delete()
+
+        count, numeric_total, numeric_count = 0, 0.0, 0
+        explicit_score, result_text, batch = None, '', []
+        with storage.open(extraction.file_name, 'rb') as source:
+            for item, value in extractor.iter_items(source):
+                item, answer = _answer_text(item)[:255], _answer_text(value)
+                if item.lower() in SCORE_ITEMS:
+                    explicit_score = parse_numeric_value(answer)
+                    continue
+                if item.lower() in RESULT_ITEMS:
+                    result_text = answer
+                    continue
+                number = parse_numeric_value(answer)
+                if number is not None:
+                    numeric_total += number
+                    numeric_count += 1
+                count += 1
+                batch.append(MedicalTestAnswer(
+                    medical_test_id=medical_test.pk, position=count, item=item, answer=answer, value_numeric=number,
+                ))
+                if len(batch) >= batch_size:
+                    MedicalTestAnswer.objects.bulk_create(batch)
+                    batch = []
+        MedicalTestAnswer.objects.bulk_create(batch)
+
+        score = explicit_score if explicit_score is not None else (numeric_total if numeric_count else None)
+        # Ручной ввод не затирается: поле меняется, если пусто или равно результату прошлого разбора
+        previous = (
+            MedicalTestExtraction.objects.filter(medical_test_id=medical_test.pk, status=MedicalTestExtraction.STATUS_DONE)
+            .exclude(pk=extraction.pk).order_by('-finished_at').first()
+        )
+        updates = {}
+        if score is not None and (medical_test.score is None or (previous and medical_test.score == previous.score)):
+            updates['score'] = score
+        if result_text and (not medical_test.result_text or (previous and medical_test.result_text == previous.result_text)):
+            updates['result_text'] = result_text
+        if updates:
+            # update() без сигналов: файл не менялся, повторный разбор не нужен
+            MedicalTest.objects.filter(pk=medical_test.pk).update(updated_at=timezone.now(), **updates)
+    return count, score, result_text
+
+
+# --- Очередь ---
+
+def schedule_extraction(medical_test):
+    """Создает задание на разбор текущего файла теста (после коммита - в пул). None - формат не поддерживается."""
+    name = medical_test.uploaded_file.name if medical_test.uploaded_file else None
+    extractor = get_extractor(name)
+    if extractor is None:
+        return None
+    extraction = MedicalTestExtraction.objects.create(medical_test=medical_test, file_name=name, extractor=extractor.name)
+    enqueue_extraction(extraction.pk)
+    return extraction
+
+
+def _execute_extraction(extraction):
+    """Разбирает файл захваченного задания и записывает итоговый статус."""
+    result = {'status': MedicalTestExtraction.STATUS_DONE}
+    try:
+        result['item_count'], result['score'], result['result_text'] = write_answers(extraction)
+    except ExtractionSuperseded:
+        result = {'status': MedicalTestExtraction.STATUS_SKIPPED, 'error': "The test file was replaced before extraction finished."}
+    except (ExtractionError, FileNotFoundError) as exc:
+        result = {'status': MedicalTestExtraction.STATUS_FAILED, 'error': str(exc)[:2000]}
+    except Exception as exc:
+        logger.exception("Medical test extraction %s failed", extraction.pk)
+        result = {'status': MedicalTestExtraction.STATUS_FAILED, 'error': str(exc)[:2000]}
+    MedicalTestExtraction.objects.filter(pk=extraction.pk).update(finished_at=timezone.now(), **result)
+
+
+EXTRACTION_QUEUE = TableQueue(
+    MedicalTestExtraction, _execute_extraction,
+    workers_setting='EXTRACTION_WORKERS', stale_timeout_setting='EXTRACTION_STALE_TIMEOUT',
+    thread_name_prefix='test-extraction',
+)
+# После коммита - в пул потоков (или сразу при EXTRACTION_WORKERS = 0)
+enqueue_extraction = EXTRACTION_QUEUE.enqueue
+# Выполнить задание, если его еще никто не захватил (True - выполнялось)
+run_extraction = EXTRACTION_QUEUE.run
+# Очередь в текущем процессе и возврат зависших заданий (manage.py extract_test_files)
+run_pending_extractions = EXTRACTION_QUEUE.run_pending
+requeue_stale_extractions = EXTRACTION_QUEUE.requeue_stale
+
+
+def schedule_missing_extractions():
+    """Задания для тестов, текущий файл которых еще не разбирался (файлы, загруженные до разбора). Возвращает их число."""
+    scheduled = 0
+    tests = MedicalTest.objects.exclude(uploaded_file__isnull=True).exclude(uploaded_file='').order_by('pk')
+    for medical_test in tests.iterator():
+        if get_extractor(medical_test.uploaded_file.name) is None:
+            continue
+        if medical_test.extractions.filter(file_name=medical_test.uploaded_file.name).exists():
+            continue
+        with transaction.atomic():
+            scheduled += schedule_extraction(medical_test) is not None
+    return scheduled
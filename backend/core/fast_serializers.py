@@ -0,0 +1,192 @@
+# backend/core/fast_serializers.py
+"""
+Быстрые read-only сериализаторы для горячих списков (наблюдения, пациенты, тесты).
+
+Вместо ModelSerializer на каждую строку (создание полей, source-цепочки,
+вложенный ParameterCodeSerializer) строки читаются через .values() и
+преобразуются заранее собранным планом полей: {имя: (колонки, функция)}.
+JSON совпадает с ответом обычных сериализаторов (даты форматируют те же
+поля DRF), а ?fields=a,b,c выбирает только нужные поля и колонки БД.
+
+Запись и детальные ответы по-прежнему идут через serializers.py.
+"""
+import os
+
+from rest_framework import serializers
+from rest_framework.reverse import reverse
+
+from .cache import parameter_code_map
+from .models import MedicalTest, ParameterCode, episode_display_name, patient_display_name
+
+# Те же поля DRF, что используют ModelSerializer'ы: формат и часовой пояс совпадают
+_datetime = serializers.DateTimeField()
+_date = serializers.DateField()
+
+FIELDS_QUERY_PARAM = 'fields'
+
+
+class FieldsQueryError(ValueError):
+    """Неизвестное поле в ?fields= (отдается клиенту как 400)."""
+
+
+def _datetime_repr(value):
+    return _datetime.to_representation(value) if value is not None else None
+
+
+def _date_repr(value):
+    return _date.to_representation(value) if value is not None else None
+
+
+def _column(name):
+    """Поле, которое просто копирует колонку .values()."""
+    return (name,), lambda row, context: row[name]
+
+
+class FieldPlan:
+    """
+    План сериализации: упорядоченный {имя_поля: (колонки .values(), функция(row, context))}.
+    Порядок полей - как в Meta.fields соответствующего ModelSerializer.
+    """
+    def __init__(self, fields, prepare=None):
+        self.fields = fields
+        self.prepare = prepare  # prepare(rows, names, context) - общие данные на весь ответ
+
+    def parse_fields(self, raw_value):
+        """Список полей из ?fields= (или все поля). Бросает FieldsQueryError."""
+        if not raw_value:
+            return list(self.fields)
+        requested = [name.strip() for name in raw_value.split(',') if name.strip()]
+        unknown = [name for name in requested if name not in self.fields]
+        if unknown:
+            raise FieldsQueryError(f"Unknown field(s) in '{FIELDS_QUERY_PARAM}': {', '.join(unknown)}.")
+        requested = set(requested)
+        return [name for name in self.fields if name in requested]
+
+    def columns(self, names, extra=()):
+        """Колонки для .values(): нужные выбранным полям плюс extra (например, поля сортировки)."""
+        columns = dict.fromkeys(extra)
+        for name in names:
+            columns.update(dict.fromkeys(self.fields[name][0]))
+        return list(columns)
+
+    def serialize(self, rows, names, request=None):
+        rows = list(rows)
+        context = {'request': request}
+        if self.prepare is not None:
+            self.prepare(rows, names, context)
+        getters = [(name, self.fields[name][1]) for name in names]
+        return [{name: getter(row, context) for name, getter in getters} for row in rows]
+
+
+# --- Наблюдения (ObservationSerializer) ---
+
+PARAMETER_DETAIL_FIELDS = ('code', 'name', 'unit', 'description', 'is_numeric')
+PATIENT_DISPLAY_COLUMNS = ('patient__last_name', 'patient__first_name', 'patient__middle_name', 'patient__date_of_birth')
+EPISODE_DISPLAY_COLUMNS = (
+    'episode_id', 'episode__start_date', 'episode__end_date',
+    'episode__patient__last_name', 'episode__patient__first_name',
+    'episode__patient__middle_name', 'episode__patient__date_of_birth',
+)
+
+
+def _patient_display(row, context):
+    return patient_display_name(
+        row['patient__last_name'], row['patient__first_name'], row['patient__middle_name'], row['patient__date_of_birth']
+    )
+
+
+def _episode_display(row, context):
+    if row['episode_id'] is None:
+        return None
+    patient = patient_display_name(
+        row['episode__patient__last_name'], row['episode__patient__first_name'],
+        row['episode__patient__middle_name'], row['episode__patient__date_of_birth'],
+    )
+    return episode_display_name(patient, row['episode__start_date'], row['episode__end_date'])
+
+
+def _prepare_parameter_details(rows, names, context):
+    if 'parameter_details' not in names:
+        return
+    # Справочник из кэша; коды, которых там еще нет (кэш другого процесса), - одним запросом
+    cached = parameter_code_map()
+    codes = {row['parameter_id'] for row in rows}
+    parameters = {code: cached[code] for code in codes if code in cached}
+    missing = codes - parameters.keys()
+    if missing:
+        parameters.update((p.code, p) for p in ParameterCode.objects.filter(code__in=missing))
+    context['parameter_details'] = {
+        code: {field: getattr(parameter, field) for field in PARAMETER_DETAIL_FIELDS}
+        for code, parameter in parameters.items()
+    }
+
+
+OBSERVATION_PLAN = FieldPlan({
+    'id': _column('id'),
+    'patient': (('patient_id',), lambda row, context: row['patient_id']),
+    'patient_display': (PATIENT_DISPLAY_COLUMNS, _patient_display),
+    'parameter': (('parameter_id',), lambda row, context: row['parameter_id']),
+    'parameter_details': (('parameter_id',), lambda row, context: context['parameter_details'].get(row['parameter_id'])),
+    'value': _column('value'),
+    'value_numeric': _column('value_numeric'),
+    'timestamp': (('timestamp',), lambda row, context: _datetime_repr(row['timestamp'])),
+    'episode': (('episode_id',), lambda row, context: row['episode_id']),
+    'episode_display': (EPISODE_DISPLAY_COLUMNS, _episode_display),
+    'recorded_by': (('recorded_by_id',), lambda row, context: row['recorded_by_id']),
+    'recorded_by_display': (('recorded_by__username',), lambda row, context: row['recorded_by__username']),
+}, prepare=_prepare_parameter_details)
+
+
+# --- Пациенты (PatientSerializer) ---
+
+PATIENT_PLAN = FieldPlan({
+    'id': _column('id'),
+    'last_name': _column('last_name'),
+    'first_name': _column('first_name'),
+    'middle_name': _column('middle_name'),
+    'date_of_birth': (('date_of_birth',), lambda row, context: _date_repr(row['date_of_birth'])),
+    'clinic_id': _column('clinic_id'),
+    'primary_diagnosis_mkb': (('primary_diagnosis_mkb_id',), lambda row, context: row['primary_diagnosis_mkb_id']),
+    'primary_diagnosis_mkb_name': _column('primary_diagnosis_mkb__name'),
+    'created_at': (('created_at',), lambda row, context: _datetime_repr(row['created_at'])),
+    'updated_at': (('updated_at',), lambda row, context: _datetime_repr(row['updated_at'])),
+})
+
+
+# --- Медицинские тесты (MedicalTestSerializer) ---
+
+_test_file_storage = MedicalTest._meta.get_field('uploaded_file').storage
+
+
+def _test_file_url(row, context):
+    request = context['request']
+    name = row['uploaded_file']
+    if name and request:
+        try:
+            return request.build_absolute_uri(_test_file_storage.url(name))
+        except ValueError:
+            return None
+    return None
+
+
+def _test_download_url(row, context):
+    if not row['uploaded_file']:
+        return None
+    return reverse('medicaltest-download', args=[row['id']], request=context['request'])
+
+
+MEDICAL_TEST_PLAN = FieldPlan({
+    'id': _column('id'),
+    'patient': (('patient_id',), lambda row, context: row['patient_id']),
+    'patient_display': (PATIENT_DISPLAY_COLUMNS, _patient_display),
+    'test_name': _column('test_name'),
+    'test_date': (('test_date',), lambda row, context: _date_repr(row['test_date'])),
+    'file_url': (('uploaded_file',), _test_file_url),
+    'download_url': (('id', 'uploaded_file'), _test_download_url),
+    'file_name': (('uploaded_file',), lambda row, context: os.path.basename(row['uploaded_file']) if row['uploaded_file'] else None),
+    'score': _column('score'),
+    'result_text': _column('result_text'),
+    'uploaded_by': _column('uploaded_by__username'),
+    'created_at': (('created_at',), lambda row, context: _datetime_repr(row['created_at'])),
+    'updated_at': (('updated_at',), lambda row, context: _datetime_repr(row['updated_at'])),
+})
@@ -0,0 +1,174 @@
+# backend/core/ingest.py
+"""
+Пакетная загрузка наблюдений (POST /api/observations/bulk/).
+
+Справочник параметров берется из кэша (core/cache.py), пациенты и эпизоды - одним
+запросом на пакет, value_numeric считается для всего пакета сразу, а запись
+идет через bulk_create. Observation.save() при этом не вызывается, поэтому
+правило разбора числа берется из той же функции parse_numeric_value, а сводки
+PatientParameterSummary пересчитываются явно - один раз на пакет.
+"""
+import csv
+import io
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Observation, Patient, HospitalizationEpisode, parse_numeric_value
+from .cache import parameter_code_map
+from .summaries import refresh_summaries
+
+# Колонки CSV / ключи JSON-объектов (те же имена, что и у ObservationSerializer)
+BULK_COLUMNS = ('patient', 'parameter', 'value', 'timestamp', 'episode')
+VALUE_MAX_LENGTH = Observation._meta.get_field('value').max_length
+
+
+class BulkIngestError(ValueError):
+    """Запрос на пакетную загрузку не может быть обработан целиком (отдается как 400)."""
+
+
+def iter_bulk_rows(request):
+    """Строки загрузки: CSV-файл из поля 'file' или JSON-массив объектов в теле запроса."""
+    upload = request.FILES.get('file')
+    if upload is not None:
+        # utf-8-sig: Excel добавляет BOM в начало CSV
+        return csv.DictReader(io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline=''))
+    if isinstance(request.data, list):
+        return iter(request.data)
+    raise BulkIngestError("Expected a JSON array of observations or a CSV file in the 'file' field.")
+
+
+def get_batch_size(raw_value):
+    """Размер пакета bulk_create из ?batch_size=, ограниченный сверху настройкой."""
+    try:
+        batch_size = int(raw_value) if raw_value else settings.OBSERVATION_BULK_BATCH_SIZE
+    except (TypeError, ValueError):
+        raise BulkIngestError("Query parameter 'batch_size' must be an integer.")
+    return max(1, min(batch_size, settings.OBSERVATION_BULK_MAX_BATCH_SIZE))
+
+
+def _clean_id(raw):
+    if raw in (None, ''):
+        return None
+    return int(raw)
+
+
+def _validate_batch(batch, numeric_by_code, recorded_by):
+    """
+    Проверяет пакет строк [(номер_строки, dict), ...].
+    Возвращает (список Observation, список ошибок).
+    """
+    errors = []
+    parsed = []
+    for row_number, row in batch:
+        row_errors = {}
+        if not isinstance(row, dict):
+            errors.append({'row': row_number, 'errors': {'non_field_errors': 'Expected an object.'}})
+            continue
+        try:
+            patient_id = _clean_id(row.get('patient'))
+            if patient_id is None: row_errors['patient'] = 'This field is required.'
+        except (TypeError, ValueError):
+            patient_id, row_errors['patient'] = None, 'Must be an integer patient id.'
+        try:
+            episode_id = _clean_id(row.get('episode'))
+        except (TypeError, ValueError):
+            episode_id, row_errors['episode'] = None, 'Must be an integer episode id.'
+
+        parameter_code = row.get('parameter')
+        if not parameter_code:
+            row_errors['parameter'] = 'This field is required.'
+        elif not isinstance(parameter_code, str):
+            # Список или объект из JSON - не ключ словаря (TypeError), а ошибка строки
+            row_errors['parameter'] = 'Must be a parameter code string.'
+        elif parameter_code not in numeric_by_code:
+            row_errors['parameter'] = f"Unknown parameter code '{parameter_code}'."
+
+        value = row.get('value')
+        value = '' if value is None else str(value).strip()
+        if not value:
+            row_errors['value'] = 'This field is required.'
+        elif len(value) > VALUE_MAX_LENGTH:
+            row_errors['value'] = f'Ensure this field has no more than {VALUE_MAX_LENGTH} characters.'
+
+        raw_timestamp = row.get('timestamp')
+        if raw_timestamp:
+            timestamp = parse_datetime(str(raw_timestamp).strip())
+            if timestamp is None:
+                row_errors['timestamp'] = 'Invalid datetime (use ISO 8601).'
+            elif timezone.is_naive(timestamp):
+                timestamp = timezone.make_aware(timestamp)
+        else:
+            timestamp = timezone.now()
+
+        if row_errors:
+            errors.append({'row': row_number, 'errors': row_errors})
+        else:
+            parsed.append((row_number, patient_id, parameter_code, value, timestamp, episode_id))
+
+    # Существование пациентов и принадлежность эпизодов - по одному запросу на пакет
+    patient_ids = set(Patient.objects.filter(id__in={p[1] for p in parsed}).values_list('id', flat=True))
+    episode_owner = dict(
+        HospitalizationEpisode.objects.filter(id__in={p[5] for p in parsed if p[5] is not None})
+        .values_list('id', 'patient_id')
+    )
+
+    observations = []
+    for row_number, patient_id, parameter_code, value, timestamp, episode_id in parsed:
+        if patient_id not in patient_ids:
+            errors.append({'row': row_number, 'errors': {'patient': f'Patient {patient_id} does not exist.'}})
+            continue
+        if episode_id is not None and episode_owner.get(episode_id) != patient_id:
+            errors.append({'row': row_number, 'errors': {'episode': f'Episode {episode_id} does not exist for patient {patient_id}.'}})
+            continue
+        observations.append(Observation(
+            patient_id=patient_id,
+            parameter_id=parameter_code,
+            value=value,
+            # То же правило, что и в Observation.save(): число только для числовых параметров
+            value_numeric=parse_numeric_value(value) if numeric_by_code[parameter_code] else None,
+            timestamp=timestamp,
+            episode_id=episode_id,
+            recorded_by=recorded_by,
+        ))
+    return observations, errors
+
+
+def ingest_observations(rows, recorded_by=None, batch_size=None, all_or_nothing=False):
+    """
+    Загружает наблюдения пакетами. Возвращает отчет:
+    {'total': N, 'created': M, 'errors': [{'row': <номер с 1>, 'errors': {поле: сообщение}}]}.
+    При all_or_nothing=True любая ошибка отменяет всю загрузку.
+    """
+    batch_size = batch_size or settings.OBSERVATION_BULK_BATCH_SIZE
+    # Справочник параметров небольшой - берем целиком из кэша справочников
+    numeric_by_code = {code: parameter.is_numeric for code, parameter in parameter_code_map().items()}
+    report = {'total': 0, 'created': 0, 'errors': []}
+
+    with transaction.atomic():
+        batch = []
+        for row_number, row in enumerate(rows, start=1):
+            batch.append((row_number, row))
+            if len(batch) >= batch_size:
+                _write_batch(batch, numeric_by_code, recorded_by, batch_size, report)
+                batch = []
+        if batch:
+            _write_batch(batch, numeric_by_code, recorded_by, batch_size, report)
+        report['total'] = report['created'] + len(report['errors'])
+        report['errors'].sort(key=lambda error: error['row'])
+        if all_or_nothing and report['errors']:
+            transaction.set_rollback(True)
+            report['created'] = 0
+    return report
+
+
+def _write_batch(batch, numeric_by_code, recorded_by, batch_size, report):
+    observations, errors = _validate_batch(batch, numeric_by_code, recorded_by)
+    if observations:
+        Observation.objects.bulk_create(observations, batch_size=batch_size)
+        # bulk_create не шлет сигналы - пересчитываем затронутые пары в той же транзакции
+        refresh_summaries({(o.patient_id, o.parameter_id) for o in observations})
+    report['created'] += len(observations)
+    report['errors'].extend(errors)
@@ -0,0 +1,350 @@
+# backend/core/instrumentation.py
+"""
+Замеры производительности каждого запроса (включаются PERF_INSTRUMENTATION=True).
+
+PerformanceMiddleware на каждый запрос собирает:
+- общее время (wall time);
+- число SQL-запросов и их суммарное время - через connection.execute_wrapper на всех БД;
+- время сериализации и рендеринга - InstrumentedViewMixin у DRF-представлений:
+  "serialize" - время Python в обработчике за вычетом БД (сериализаторы, планы
+  полей, сборка ответа), "render" - рендерер (JSON/CSV/...);
+- размер ответа в байтах.
+
+Результат отдается в заголовке Server-Timing (видно во вкладке Network браузера)
+и копится в гистограммах по представлениям (PatientViewSet.get_patient_dynamics,
+ResearchQueryView, ...), которые отдает /metrics в текстовом формате Prometheus.
+Запросы к БД дольше PERF_SLOW_QUERY_MS пишутся в лог core.performance.
+
+Гистограммы живут в памяти процесса: у каждого воркера gunicorn свои, Prometheus
+собирает их со всех (или используйте один процесс на под). Потоковые ответы
+(?stream=1, parquet/arrow) досчитываются, когда тело отдано целиком, - в
+Server-Timing у них только время до заголовков.
+"""
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+logger = logging.getLogger('core.performance')
+
+METRICS_PREFIX = 'meddata'
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2)
+UNMATCHED_VIEW = 'unmatched'
+
+_current = ContextVar('request_metrics', default=None)
+
+
+# --- Замеры одного запроса ---
+
+class RequestMetrics:
+    def __init__(self, method):
+        self.method = method
+        self.view = UNMATCHED_VIEW
+        self.started = time.perf_counter()
+        self.db_count = 0
+        self.db_time = 0.0
+        self.serialize_time = None
+        self.render_time = None
+        self.response_bytes = 0
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.db_count += 1
+            self.db_time += elapsed
+            if elapsed * 1000 >= settings.PERF_SLOW_QUERY_MS:
+                REGISTRY.slow_queries.inc((self.view,))
+                logger.warning(
+                    "Slow query %.1f ms in %s (%s): %s",
+                    elapsed * 1000, self.view, context['connection'].alias, str(sql)[:2000],
+                )
+
+    def capture_queries(self):
+        """Контекст: все SQL-запросы на всех БД в этом потоке учитываются в замере."""
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self.record_query))
+        return stack
+
+    def server_timing(self, total):
+        parts = [f'db;dur={self.db_time * 1000:.1f};desc="{self.db_count} queries"']
+        if self.serialize_time is not None:
+            parts.append(f'serialize;dur={self.serialize_time * 1000:.1f}')
+        if self.render_time is not None:
+            parts.append(f'render;dur={self.render_time * 1000:.1f}')
+        parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+    def observe(self, status_code):
+        total = time.perf_counter() - self.started
+        labels = (self.view, self.method)
+        REGISTRY.requests.inc((self.view, self.method, str(status_code)))
+        REGISTRY.duration.observe(labels, total)
+        REGISTRY.db_queries.observe(labels, self.db_count)
+        REGISTRY.db_duration.observe(labels, self.db_time)
+        if self.serialize_time is not None:
+            REGISTRY.serialize_duration.observe(labels, self.serialize_time)
+        if self.render_time is not None:
+            REGISTRY.render_duration.observe(labels, self.render_time)
+        REGISTRY.response_size.observe(labels, self.response_bytes)
+
+
+def current_metrics():
+    """Замер текущего запроса или None (инструментирование выключено / вне запроса)."""
+    return _current.get()
+
+
+def view_name(view_func, method):
+    """PatientViewSet.get_patient_dynamics для action'ов ViewSet'а, ResearchQueryView для APIView."""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{getattr(view_func, "__name__", type(view_func).__name__)}'
+    actions = getattr(view_func, 'actions', None)
+    if actions:
+        return f'{view_class.__name__}.{actions.get(method.lower(), method.lower())}'
+    return view_class.__name__
+
+
+# --- Гистограммы и счетчики (формат Prometheus) ---
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name, self.help_text, self.label_names = name, help_text, label_names
+        self.values = {}
+
+    def inc(self, labels, amount=1):
+        with REGISTRY.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_label_text(self.label_names, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name, self.help_text, self.label_names, self.buckets = name, help_text, label_names, buckets
+        self.values = {}  # labels -> [счетчики по корзинам..., сумма, количество]
+
+    def observe(self, labels, value):
+        with REGISTRY.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, state in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, state):
+                bucket_labels = _label_text(self.label_names, labels, ['le="%s"' % bound])
+                lines.append(f'{self.name}_bucket{bucket_labels} {count}')
+            bucket_labels = _label_text(self.label_names, labels, ['le="+Inf"'])
+            lines.append(f'{self.name}_bucket{bucket_labels} {state[-1]}')
+            lines.append(f'{self.name}_sum{_label_text(self.label_names, labels)} {state[-2]:.6f}')
+            lines.append(f'{self.name}_count{_label_text(self.label_names, labels)} {state[-1]}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        labels = ('view', 'method')
+        self.requests = Counter(f'{METRICS_PREFIX}_http_requests_total', "Requests by view and status.", labels + ('status',))
+        self.duration = Histogram(f'{METRICS_PREFIX}_http_request_duration_seconds', "Wall time per request.", labels, DURATION_BUCKETS)
+        self.db_queries = Histogram(f'{METRICS_PREFIX}_db_queries_per_request', "SQL queries per request.", labels, QUERY_COUNT_BUCKETS)
+        self.db_duration = Histogram(f'{METRICS_PREFIX}_db_duration_seconds', "Total SQL time per request.", labels, DURATION_BUCKETS)
+        self.serialize_duration = Histogram(
+            f'{METRICS_PREFIX}_serialize_duration_seconds', "Python time in the view handler excluding SQL.", labels, DURATION_BUCKETS
+        )
+        self.render_duration = Histogram(f'{METRICS_PREFIX}_render_duration_seconds', "Renderer time per response.", labels, DURATION_BUCKETS)
+        self.response_size = Histogram(f'{METRICS_PREFIX}_response_size_bytes', "Response body size.", labels, SIZE_BUCKETS)
+        self.slow_queries = Counter(f'{METRICS_PREFIX}_db_slow_queries_total', "SQL queries above PERF_SLOW_QUERY_MS.", ('view',))
+
+    def render(self):
+        metrics = (
+            self.requests, self.duration, self.db_queries, self.db_duration,
+            self.serialize_duration, self.render_duration, self.response_size, self.slow_queries,
+        )
+        with self.lock:
+            lines = [line for metric in metrics for line in metric.render()]
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+# --- Middleware ---
+
+class PerformanceMiddleware:
+    """
+    Ставится первым в MIDDLEWARE; при PERF_INSTRUMENTATION=False Django его не подключает.
+    Работает и под ASGI без перехода в поток: SQL асинхронного ORM выполняется в потоке
+    запроса (sync_to_async), перехватчик запросов ставится в этом потоке.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PERF_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics(request.method)
+        token = _current.set(metrics)
+        try:
+            with metrics.capture_queries():
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics(request.method)
+        token = _current.set(metrics)
+        # connections - свои у каждого потока: перехватчик ставится и снимается в потоке запроса
+        capture = await sync_to_async(metrics.capture_queries)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(capture.close)()
+            _current.reset(token)
+        return self.finish(response, metrics)
+
+    def finish(self, response, metrics):
+        total = time.perf_counter() - metrics.started
+        response['Server-Timing'] = metrics.server_timing(total)
+        if response.streaming:
+            observe = self.observe_async_stream if getattr(response, 'is_async', False) else self.observe_stream
+            response.streaming_content = observe(response.streaming_content, metrics, response.status_code)
+        else:
+            metrics.response_bytes = len(response.content)
+            metrics.observe(response.status_code)
+        return response
+
+    @staticmethod
+    def name_view(request, view_func):
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.view = view_name(view_func, request.method)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.name_view(request, view_func)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        # Под ASGI - без sync_to_async на каждый запрос
+        self.name_view(request, view_func)
+
+    @staticmethod
+    def observe_stream(content, metrics, status_code):
+        # Запросы потоковой выгрузки идут во время чтения тела - учитываем и их
+        try:
+            with metrics.capture_queries():
+                for chunk in content:
+                    metrics.response_bytes += len(chunk)
+                    yield chunk
+        finally:
+            metrics.observe(status_code)
+
+    @staticmethod
+    async def observe_async_stream(content, metrics, status_code):
+        try:
+            async for chunk in content:
+                metrics.response_bytes += len(chunk)
+                yield chunk
+        finally:
+            metrics.observe(status_code)
+
+
+# --- DRF: время сериализации и рендеринга ---
+
+class _TimedRenderer:
+    """Обертка над выбранным рендерером: время render() - в замер запроса, остальное - как у оригинала."""
+
+    def __init__(self, renderer, metrics):
+        self._renderer = renderer
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._renderer, name)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        started = time.perf_counter()
+        try:
+            return self._renderer.render(data, accepted_media_type, renderer_context)
+        finally:
+            self._metrics.render_time = (self._metrics.render_time or 0.0) + time.perf_counter() - started
+
+
+class InstrumentedViewMixin:
+    """
+    Для DRF-представлений: делит время ответа на обработчик (за вычетом БД) и рендеринг.
+    Без PerformanceMiddleware ничего не делает.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        metrics = current_metrics()
+        if metrics is not None:
+            # Отсчет после аутентификации и проверки прав - только сам обработчик
+            self._handler_started = (time.perf_counter(), metrics.db_time)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        metrics = current_metrics()
+        started = getattr(self, '_handler_started', None)
+        if metrics is not None and started is not None:
+            handler_time = time.perf_counter() - started[0]
+            metrics.serialize_time = max(handler_time - (metrics.db_time - started[1]), 0.0)
+        renderer = getattr(response, 'accepted_renderer', None)
+        if metrics is not None and renderer is not None and not isinstance(renderer, _TimedRenderer):
+            response.accepted_renderer = _TimedRenderer(renderer, metrics)
+        return response
+
+
+# --- /metrics ---
+
+def metrics_view(request):
+    """Гистограммы процесса в текстовом формате Prometheus. С PERF_METRICS_TOKEN - только с Bearer-токеном."""
+    if not settings.PERF_INSTRUMENTATION:
+        raise Http404
+    token = settings.PERF_METRICS_TOKEN
+    if token and request.headers.get('Authorization', '') != f'Bearer {token}':
+        return HttpResponse(status=401)
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
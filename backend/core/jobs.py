@@ -0,0 +1,196 @@
+# backend/core/jobs.py
+"""
+Фоновые исследовательские выгрузки (POST /api/research/jobs/).
+
+Очередь - сама таблица ResearchExportJob (core/background.py): задание создается
+в статусе pending, после коммита уходит в локальный пул потоков процесса
+(RESEARCH_JOB_WORKERS) и захватывается воркером атомарным UPDATE, поэтому никогда
+не выполняется дважды. Если процесс перезапустился, не дойдя до задания, его подберет
+manage.py research_jobs (cron / отдельный контейнер). Внешний брокер не нужен.
+
+Одинаковые запросы (хэш нормализованных параметров + формат) получают уже
+существующее задание: выполняющееся или готовое и еще не просроченное. Активное
+задание на запрос одно - это гарантирует частичный уникальный индекс, а не проверка.
+Готовые файлы лежат в MEDIA_ROOT/research_exports/ до expires_at
+(RESEARCH_JOB_RESULT_TTL), затем удаляются вместе с записью.
+"""
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .background import TableQueue
+from .columnar import (
+    COLUMNAR_WRITERS, LAYOUT_WIDE, ColumnarExportError, columnar_available, iter_columnar_export, parse_layout,
+)
+from .models import Cohort, ResearchExportJob
+from .research import (
+    STREAM_WRITERS, iter_research_records, iter_research_rows, normalize_research_params, research_params_hash,
+    research_query_dict, resolve_research_query,
+)
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = 'research_exports'
+JOB_FORMATS = tuple(STREAM_WRITERS) + tuple(COLUMNAR_WRITERS)
+
+
+class ResearchJobError(ValueError):
+    """Некорректный запрос на создание задания (отдается клиенту как 400)."""
+
+
+# --- Создание и дедупликация ---
+
+def create_or_reuse_job(data, export_format, user=None):
+    """
+    (задание, создано_ли) для параметров data. Параметры проверяются сразу,
+    чтобы ошибка вернулась клиенту, а не в статус задания.
+    """
+    if export_format not in JOB_FORMATS:
+        raise ResearchJobError(f"Unsupported format '{export_format}'. Use one of: {', '.join(JOB_FORMATS)}.")
+    params = normalize_research_params(data)
+    _, criteria = resolve_research_query(research_query_dict(params))  # ResearchQueryError -> 400
+    if params.get('cohort_id'):
+        # Показатели могли прийти из когорты; версия состава - в хэше, чтобы после
+        # изменения состава не отдавался файл по старому списку пациентов
+        params['param_codes'] = sorted(set(criteria.param_codes))
+        params['cohort_version'] = Cohort.objects.values_list('membership_version', flat=True).get(pk=params['cohort_id'])
+    if export_format in COLUMNAR_WRITERS:
+        if not columnar_available():
+            raise ResearchJobError(f"Format '{export_format}' requires pyarrow, which is not installed on the server.")
+        try:
+            if parse_layout(data.get('layout')) == LAYOUT_WIDE:
+                params['layout'] = LAYOUT_WIDE  # Не фильтр: resolve_research_query его не читает
+        except ColumnarExportError as exc:
+            raise ResearchJobError(str(exc))
+    params_hash = research_params_hash(params, export_format)
+
+    purge_expired_jobs()
+    existing = find_reusable_job(params_hash, export_format)
+    if existing is not None:
+        return existing, False
+
+    try:
+        # Одновременный одинаковый запрос мог создать задание после нашей проверки:
+        # тогда INSERT нарушит research_job_active_unique (savepoint - транзакция запроса цела)
+        with transaction.atomic():
+            job = ResearchExportJob.objects.create(
+                params=params, params_hash=params_hash, export_format=export_format,
+                created_by=user if user is not None and user.is_authenticated else None,
+            )
+    except IntegrityError:
+        existing = find_reusable_job(params_hash, export_format)
+        if existing is None:
+            raise
+        return existing, False
+    enqueue_job(job.pk)
+    return job, True
+
+
+def find_reusable_job(params_hash, export_format):
+    """Выполняющееся или готовое и еще не просроченное задание с теми же параметрами."""
+    return (
+        ResearchExportJob.objects
+        .filter(params_hash=params_hash, export_format=export_format)
+        .filter(
+            Q(status__in=[ResearchExportJob.STATUS_PENDING, ResearchExportJob.STATUS_RUNNING])
+            | Q(status=ResearchExportJob.STATUS_DONE, expires_at__gt=timezone.now())
+        )
+        .order_by('-created_at')
+        .first()
+    )
+
+
+# --- Исполнение ---
+
+def _execute_job(job):
+    """Пишет файл захваченного задания и записывает итоговый статус."""
+    try:
+        name, row_count = write_export_file(job)
+    except Exception as exc:
+        logger.exception("Research export job %s failed", job.pk)
+        ResearchExportJob.objects.filter(pk=job.pk).update(
+            status=ResearchExportJob.STATUS_FAILED, error=str(exc)[:2000], finished_at=timezone.now()
+        )
+        return
+    finished_at = timezone.now()
+    ResearchExportJob.objects.filter(pk=job.pk).update(
+        status=ResearchExportJob.STATUS_DONE, result_file=name, row_count=row_count, finished_at=finished_at,
+        expires_at=finished_at + timedelta(seconds=settings.RESEARCH_JOB_RESULT_TTL),
+    )
+
+
+JOB_QUEUE = TableQueue(
+    ResearchExportJob, _execute_job,
+    workers_setting='RESEARCH_JOB_WORKERS', stale_timeout_setting='RESEARCH_JOB_STALE_TIMEOUT',
+    thread_name_prefix='research-job',
+)
+# После коммита - в пул потоков (или сразу при RESEARCH_JOB_WORKERS = 0)
+enqueue_job = JOB_QUEUE.enqueue
+# Выполнить задание, если его еще никто не захватил (True - выполнялось)
+run_job = JOB_QUEUE.run
+# Очередь в текущем процессе и возврат зависших заданий (manage.py research_jobs)
+run_pending_jobs = JOB_QUEUE.run_pending
+requeue_stale_jobs = JOB_QUEUE.requeue_stale
+
+
+def _counting(rows, counter):
+    for row in rows:
+        counter[0] += 1
+        yield row
+
+
+def write_export_file(job):
+    """
+    Пишет выгрузку тем же потоковым writer'ом, что и ResearchQueryView (?stream=1,
+    ?format=parquet/arrow): память не зависит от размера выборки. Файл появляется
+    под итоговым именем только целиком (запись во временный .part и os.replace).
+    """
+    patient_qs, criteria = resolve_research_query(research_query_dict(job.params))
+    observation_filter = criteria.observation_filter()
+    counter = [0]
+    if job.export_format in COLUMNAR_WRITERS:
+        extension = COLUMNAR_WRITERS[job.export_format][2]
+        records = _counting(iter_research_records(patient_qs, observation_filter), counter)
+        content = iter_columnar_export(records, job.export_format, job.params.get('layout'), job.params.get('param_codes', ()))
+        mode, encoding = 'wb', None
+    else:
+        writer, _, extension = STREAM_WRITERS[job.export_format]
+        content = writer(_counting(iter_research_rows(patient_qs, observation_filter), counter))
+        mode, encoding = 'w', 'utf-8'
+
+    storage = job.result_file.storage
+    name = f'{EXPORT_DIR}/research_export_{job.pk}_{job.params_hash[:12]}.{extension}'
+    path = storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.part'
+    try:
+        with open(temp_path, mode, encoding=encoding, newline='' if encoding else None) as output:
+            for chunk in content:
+                output.write(chunk)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return name, counter[0]
+
+
+# --- Очистка по TTL ---
+
+def purge_expired_jobs(now=None):
+    """Удаляет просроченные готовые задания (вместе с файлами) и старые ошибки. Возвращает число заданий."""
+    now = now or timezone.now()
+    ttl_cutoff = now - timedelta(seconds=settings.RESEARCH_JOB_RESULT_TTL)
+    expired = list(ResearchExportJob.objects.filter(
+        Q(status=ResearchExportJob.STATUS_DONE, expires_at__lte=now)
+        | Q(status=ResearchExportJob.STATUS_FAILED, finished_at__lte=ttl_cutoff)
+    ))
+    for job in expired:
+        if job.result_file:
+            job.result_file.storage.delete(job.result_file.name)
+        job.delete()
+    return len(expired)
@@ -0,0 +1,319 @@
+# backend/core/management/commands/benchmark_concurrency.py
+"""
+Пропускная способность карточки пациента под параллельной нагрузкой: WSGI против ASGI.
+
+Оба режима запускаются в этом же процессе, без сети, через настоящие обработчики Django
+со всеми middleware и JWT-аутентификацией:
+- wsgi - WSGIHandler в пуле из --threads потоков (как gunicorn с gthread), синхронные
+  представления PatientViewSet;
+- asgi - ASGIHandler в цикле событий, асинхронные представления (core/async_views.py,
+  ASYNC_PATIENT_VIEWS=True); синхронные части каждого запроса идут в его собственном потоке,
+  как под uvicorn.
+--concurrency клиентов параллельно выполняют --requests единиц работы. Сценарии:
+- reads - по одному GET из /patients/<id>/, /dynamics/, /tests/, /episodes/;
+- dashboard - те же четыре GET одновременно (так грузит карточку фронтенд);
+- overview - один GET /patients/<id>/overview/ вместо четырех.
+Результат - единиц в секунду, медиана и p95 времени единицы, число ошибок.
+
+Пациенты - с наибольшим числом наблюдений (synthetic, если они есть). Для JWT
+создается пользователь benchmark без пароля и удаляется после прогона.
+
+Примеры:
+    python manage.py benchmark_concurrency
+    python manage.py benchmark_concurrency --concurrency 1,16,64 --requests 500 --threads 8 --output concurrency.json
+    python manage.py benchmark_concurrency --modes asgi --scenarios overview
+"""
+import asyncio
+import io
+import itertools
+import json
+import platform
+import statistics
+import sys
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import override_settings
+from django.urls import include, path
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.models import Observation, Patient
+from core.synthetic import synthetic_patients
+from core.urls import build_urlpatterns
+
+MODES = ('wsgi', 'asgi')
+SCENARIOS = ('reads', 'dashboard', 'overview')
+HOST = 'testserver'
+BENCHMARK_USERNAME = 'benchmark'
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+
+def mode_urlconf(mode):
+    """URL-схема режима: /api/ с асинхронной карточкой пациента или без нее."""
+    urlconf = types.ModuleType(f'benchmark_concurrency_{mode}_urls')
+    urlconf.urlpatterns = [path('api/', include(build_urlpatterns(async_patient_views=mode == 'asgi')))]
+    return urlconf
+
+
+def fixture_patients(limit):
+    """(id пациентов, код показателя): самый частый показатель и пациенты с наибольшим числом его наблюдений."""
+    patients = synthetic_patients() if synthetic_patients().exists() else Patient.objects.all()
+    observations = Observation.objects.filter(patient__in=patients.values('id'))
+    top = observations.values('parameter_id').annotate(n=Count('id')).order_by('-n').first()
+    if top is None:
+        raise CommandError("Нет наблюдений для бенчмарка - запустите generate_synthetic_data.")
+    patient_ids = list(
+        observations.filter(parameter_id=top['parameter_id']).values('patient_id').annotate(n=Count('id'))
+        .order_by('-n').values_list('patient_id', flat=True)[:limit]
+    )
+    return patient_ids, top['parameter_id']
+
+
+def scenario_units(scenario, patient_ids, param_code):
+    """Единицы работы сценария: списки URL, запрашиваемых одновременно."""
+    units = []
+    for patient_id in patient_ids:
+        base = f'/api/patients/{patient_id}/'
+        card = [base, f'{base}dynamics/?param={param_code}', f'{base}tests/', f'{base}episodes/']
+        if scenario == 'reads':
+            units.extend([url] for url in card)
+        elif scenario == 'dashboard':
+            units.append(card)
+        else:
+            units.append([f'{base}overview/?param={param_code}'])
+    return units
+
+
+# --- Клиенты обработчиков ---
+
+class WSGIClient:
+    """Запросы к WSGIHandler из пула потоков сервера."""
+
+    def __init__(self, token, threads):
+        self.handler = WSGIHandler()
+        self.token = token
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi-benchmark')
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+    def call(self, url):
+        path_info, _, query_string = url.partition('?')
+        environ = {
+            'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': path_info, 'QUERY_STRING': query_string,
+            'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': HOST,
+            'HTTP_AUTHORIZATION': f'Bearer {self.token}', 'REMOTE_ADDR': '127.0.0.1',
+            'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(b''),
+            'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        }
+        status = []
+        result = self.handler(environ, lambda status_line, headers, exc_info=None: status.append(status_line))
+        try:
+            size = sum(len(chunk) for chunk in result)
+        finally:
+            result.close()  # request_finished: соединение с БД закрывается, как у сервера
+        return int(status[0].split()[0]), size
+
+    async def fetch(self, url):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, self.call, url)
+
+
+class ASGIClient:
+    """Запросы к ASGIHandler в текущем цикле событий."""
+
+    def __init__(self, token):
+        self.handler = ASGIHandler()
+        self.token = token
+
+    def close(self):
+        pass
+
+    async def fetch(self, url):
+        path_info, _, query_string = url.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path_info, 'raw_path': path_info.encode(), 'query_string': query_string.encode(), 'root_path': '',
+            'headers': [(b'host', HOST.encode()), (b'authorization', f'Bearer {self.token}'.encode())],
+            'client': ('127.0.0.1', 0), 'server': (HOST, 80),
+        }
+        finished = asyncio.Event()
+        requested = False
+        response = {'status': None, 'size': 0}
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await finished.wait()  # Как у сервера: disconnect - только после ответа
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                response['size'] += len(message.get('body', b''))
+                if not message.get('more_body'):
+                    finished.set()
+
+        await self.handler(scope, receive, send)
+        return response['status'], response['size']
+
+
+# --- Нагрузка ---
+
+async def run_load(client, units, concurrency, total):
+    """total единиц работы силами concurrency клиентов: (секунд всего, [секунд на единицу], ошибок)."""
+    counter = itertools.count()
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while (index := next(counter)) < total:
+            started = time.perf_counter()
+            results = await asyncio.gather(*(client.fetch(url) for url in units[index % len(units)]))
+            latencies.append(time.perf_counter() - started)
+            errors += sum(status != 200 for status, _ in results)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies, errors
+
+
+class Command(BaseCommand):
+    help = "Сравнивает пропускную способность карточки пациента под нагрузкой: WSGI против ASGI"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default=','.join(MODES), help=f"Режимы через запятую: {', '.join(MODES)}")
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Сценарии через запятую: {', '.join(SCENARIOS)}")
+        parser.add_argument('--concurrency', default='1,8,32', help="Число параллельных клиентов через запятую")
+        parser.add_argument('--requests', type=int, default=200, help="Единиц работы на прогон")
+        parser.add_argument('--warmup', type=int, default=10, help="Единиц работы до измерений")
+        parser.add_argument('--threads', type=int, default=8, help="Потоков WSGI-сервера (workers x threads у gunicorn)")
+        parser.add_argument('--patients', type=int, default=20, help="Сколько разных пациентов запрашивать")
+        parser.add_argument('--output', help="Файл для JSON с результатами (по умолчанию - только таблица)")
+
+    def handle(self, *args, **options):
+        modes = self.parse_names(options['modes'], MODES, '--modes')
+        scenarios = self.parse_names(options['scenarios'], SCENARIOS, '--scenarios')
+        try:
+            levels = [int(value) for value in options['concurrency'].split(',') if value.strip()]
+        except ValueError:
+            raise CommandError("--concurrency: ожидаются целые числа через запятую.")
+        if not levels or min(levels) < 1 or options['requests'] < 1 or options['threads'] < 1:
+            raise CommandError("--concurrency, --requests и --threads должны быть >= 1.")
+
+        patient_ids, param_code = fixture_patients(options['patients'])
+        user, created = get_user_model().objects.get_or_create(username=BENCHMARK_USERNAME)
+        if created:
+            user.set_unusable_password()
+            user.save(update_fields=['password'])
+        token = str(AccessToken.for_user(user))
+
+        results = []
+        try:
+            for mode in modes:
+                with override_settings(ROOT_URLCONF=mode_urlconf(mode), ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, HOST]):
+                    for scenario in scenarios:
+                        units = scenario_units(scenario, patient_ids, param_code)
+                        for concurrency in levels:
+                            result = self.measure(mode, units, concurrency, token, options)
+                            result.update({'mode': mode, 'scenario': scenario, 'concurrency': concurrency})
+                            results.append(result)
+                            self.print_result(result)
+        finally:
+            if created:
+                user.delete()
+
+        report = {'meta': self.meta(options, len(patient_ids)), 'results': results}
+        self.print_comparison(results)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Результаты записаны в {options['output']}"))
+
+    @staticmethod
+    def parse_names(raw_value, known, option):
+        names = [name.strip() for name in raw_value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in known]
+        if not names or unknown:
+            raise CommandError(f"{option}: доступны {', '.join(known)}.")
+        return names
+
+    def measure(self, mode, units, concurrency, token, options):
+        client = WSGIClient(token, options['threads']) if mode == 'wsgi' else ASGIClient(token)
+        try:
+            if options['warmup']:
+                asyncio.run(run_load(client, units, min(concurrency, options['warmup']), options['warmup']))
+            elapsed, latencies, errors = asyncio.run(run_load(client, units, concurrency, options['requests']))
+        finally:
+            client.close()
+        return {
+            'units': len(latencies),
+            'requests_per_unit': len(units[0]),
+            'errors': errors,
+            'throughput_per_s': round(len(latencies) / elapsed, 1),
+            'latency_ms': {
+                'median': round(statistics.median(latencies) * 1000, 3),
+                'p95': round(percentile(latencies, 0.95) * 1000, 3),
+                'max': round(max(latencies) * 1000, 3),
+            },
+        }
+
+    # --- Вывод ---
+
+    def print_result(self, result):
+        style = self.style.ERROR if result['errors'] else self.style.SUCCESS
+        latency = result['latency_ms']
+        self.stdout.write(style(
+            f"{result['mode']:<5} {result['scenario']:<10} x{result['concurrency']:<4} "
+            f"{result['throughput_per_s']:>9.1f}/s  median {latency['median']:>9.1f} ms  "
+            f"p95 {latency['p95']:>9.1f} ms  errors {result['errors']}"
+        ))
+
+    def print_comparison(self, results):
+        by_key = {(item['mode'], item['scenario'], item['concurrency']): item for item in results}
+        lines = []
+        for (mode, scenario, concurrency), item in by_key.items():
+            baseline = by_key.get(('wsgi', scenario, concurrency))
+            if mode == 'asgi' and baseline:
+                ratio = item['throughput_per_s'] / max(baseline['throughput_per_s'], 1e-6)
+                lines.append(f"{scenario:<10} x{concurrency:<4} asgi/wsgi = {ratio:5.2f}")
+        dashboard = {item['concurrency']: item for item in results if item['mode'] == 'wsgi' and item['scenario'] == 'dashboard'}
+        for item in results:
+            baseline = dashboard.get(item['concurrency'])
+            if item['mode'] == 'asgi' and item['scenario'] == 'overview' and baseline:
+                ratio = item['throughput_per_s'] / max(baseline['throughput_per_s'], 1e-6)
+                lines.append(f"overview (asgi) / dashboard (wsgi) x{item['concurrency']:<4} = {ratio:5.2f}")
+        if lines:
+            self.stdout.write("\nПропускная способность относительно WSGI:")
+            for line in lines:
+                self.stdout.write(line)
+
+    @staticmethod
+    def meta(options, patients):
+        return {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'threads': options['threads'],
+            'requests': options['requests'],
+            'warmup': options['warmup'],
+            'patients': patients,
+        }
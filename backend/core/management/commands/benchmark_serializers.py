@@ -0,0 +1,110 @@
+# backend/core/management/commands/benchmark_serializers.py
+"""
+Микро-бенчмарк сериализации списков: ModelSerializer против core/fast_serializers.py.
+
+Создает временные данные внутри транзакции (в конце откатывается), проверяет,
+что оба пути дают одинаковый JSON, и печатает пропускную способность (строк/с).
+
+Примеры:
+    python manage.py benchmark_serializers
+    python manage.py benchmark_serializers --rows 5000 --repeat 5
+"""
+import json
+import time
+from datetime import date, timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.fast_serializers import MEDICAL_TEST_PLAN, OBSERVATION_PLAN, PATIENT_PLAN
+from core.models import HospitalizationEpisode, MedicalTest, MKBCode, Observation, ParameterCode, Patient
+from core.serializers import MedicalTestSerializer, ObservationSerializer, PatientSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Сравнивает скорость ModelSerializer и быстрых сериализаторов на временных данных"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help="Строк каждого типа")
+        parser.add_argument('--repeat', type=int, default=3, help="Повторов (берется лучший)")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['rows'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def create_data(self, rows):
+        user = get_user_model().objects.create_user(f'benchmark-{time.time_ns()}')
+        mkb, _ = MKBCode.objects.get_or_create(code='BENCH.0', defaults={'name': 'Бенчмарк'})
+        parameter, _ = ParameterCode.objects.get_or_create(code='BENCH_HB', defaults={'name': 'Гемоглобин', 'unit': 'g/l'})
+        patient = Patient.objects.create(last_name='Бенчмарк', first_name='Тест', middle_name='Тестович',
+                                         date_of_birth=date(1980, 1, 1), primary_diagnosis_mkb=mkb)
+        episode = HospitalizationEpisode.objects.create(patient=patient, start_date=date(2024, 1, 1))
+        Patient.objects.bulk_create([
+            Patient(last_name=f'Пациент{i}', first_name='Имя', date_of_birth=date(1980, 1, 1), primary_diagnosis_mkb=mkb)
+            for i in range(rows)
+        ])
+        now = timezone.now()
+        Observation.objects.bulk_create([
+            Observation(patient=patient, parameter=parameter, value=str(i), value_numeric=float(i),
+                        timestamp=now - timedelta(minutes=i), episode=episode, recorded_by=user)
+            for i in range(rows)
+        ])
+        MedicalTest.objects.bulk_create([
+            MedicalTest(patient=patient, test_name='HADS', test_date=date(2024, 1, 1), score=i, uploaded_by=user)
+            for i in range(rows)
+        ])
+        return patient
+
+    def run(self, rows, repeat):
+        patient = self.create_data(rows)
+        cases = [
+            ('observations', ObservationSerializer, OBSERVATION_PLAN,
+             Observation.objects.filter(patient=patient).select_related('patient', 'parameter', 'recorded_by', 'episode__patient').order_by('-timestamp', '-id'),
+             Observation.objects.filter(patient=patient).order_by('-timestamp', '-id')),
+            ('patients', PatientSerializer, PATIENT_PLAN,
+             Patient.objects.select_related('primary_diagnosis_mkb').order_by('last_name', 'first_name', 'id')[:rows],
+             Patient.objects.order_by('last_name', 'first_name', 'id')[:rows]),
+            ('medical tests', MedicalTestSerializer, MEDICAL_TEST_PLAN,
+             MedicalTest.objects.filter(patient=patient).select_related('patient', 'uploaded_by').order_by('-test_date', '-id'),
+             MedicalTest.objects.filter(patient=patient).order_by('-test_date', '-id')),
+        ]
+        self.stdout.write(f"{'endpoint':<15}{'rows':>8}{'DRF rows/s':>14}{'fast rows/s':>14}{'speedup':>10}")
+        for name, serializer_class, plan, model_qs, values_qs in cases:
+            names = plan.parse_fields(None)
+            columns = plan.columns(names)
+
+            def drf():
+                return serializer_class(list(model_qs), many=True, context={'request': None}).data
+
+            def fast():
+                return plan.serialize(values_qs.values(*columns), names)
+
+            drf_data, drf_time = self.best_of(drf, repeat)
+            fast_data, fast_time = self.best_of(fast, repeat)
+            if json.dumps(drf_data, cls=JSONEncoder) != json.dumps(fast_data, cls=JSONEncoder):
+                raise CommandError(f"{name}: fast serializer output differs from {serializer_class.__name__}")
+            count = len(fast_data)
+            self.stdout.write(
+                f"{name:<15}{count:>8}{count / drf_time:>14.0f}{count / fast_time:>14.0f}{drf_time / fast_time:>9.1f}x"
+            )
+
+    @staticmethod
+    def best_of(func, repeat):
+        best, result = None, None
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
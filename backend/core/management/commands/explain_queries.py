@@ -0,0 +1,90 @@
+# backend/core/management/commands/explain_queries.py
+"""
+Печатает планы выполнения (EXPLAIN ANALYZE на PostgreSQL) для запросов горячих эндпоинтов,
+чтобы проверить использование индексов на реальных данных.
+
+Пример:
+    python manage.py explain_queries
+    python manage.py explain_queries --patient-id 42 --param HB --param WEIGHT --no-analyze
+    python manage.py explain_queries --search C71 --search-name опухоль
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.http import QueryDict
+
+from core.models import Observation, Patient
+from core.research import build_research_filters, research_queryset
+from core.search import DEFAULT_LIMIT, mkb_code_prefix_queryset, mkb_trigram_query, trigram_available
+from core.timeseries import raw_series_queryset, bucketed_series_queryset
+
+
+class Command(BaseCommand):
+    help = "Печатает EXPLAIN (ANALYZE) для запросов основных эндпоинтов API"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patient-id', type=int, help="Пациент для динамики/списка (по умолчанию - с наибольшим числом наблюдений)")
+        parser.add_argument('--param', action='append', dest='params', help="Код показателя (можно несколько раз)")
+        parser.add_argument('--start-date', help="start_date для исследовательского запроса (YYYY-MM-DD)")
+        parser.add_argument('--end-date', help="end_date для исследовательского запроса (YYYY-MM-DD)")
+        parser.add_argument('--search', default='C7', help="Начало кода МКБ для поиска по префиксу")
+        parser.add_argument('--search-name', default='опухоль', help="Строка поиска по названию МКБ (pg_trgm)")
+        parser.add_argument('--no-analyze', action='store_true', help="Только EXPLAIN, без выполнения запросов")
+
+    def handle(self, *args, **options):
+        patient_id = options['patient_id'] or self._busiest_patient_id()
+        if patient_id is None:
+            raise CommandError("Нет наблюдений в БД - укажите --patient-id или загрузите данные.")
+        params = options['params'] or self._top_params(patient_id)
+
+        research_params = QueryDict(mutable=True)
+        research_params.setlist('param_codes', params)
+        if options['start_date']: research_params['start_date'] = options['start_date']
+        if options['end_date']: research_params['end_date'] = options['end_date']
+        patient_qs, observation_filter = build_research_filters(research_params)
+
+        observation_list = Observation.objects.filter(patient_id=patient_id).order_by('-timestamp', '-id')
+        queries = [
+            ("dynamics (raw / max_points)", raw_series_queryset(patient_id, params)),
+            ("dynamics (bucket=day)", bucketed_series_queryset(patient_id, params, 'day')),
+            ("observations list ?patient_id=", observation_list[:51]),
+            ("observations list ?patient_id=&parameter_code=", observation_list.filter(parameter_id=params[0])[:51]),
+            ("research query: patients + observations", research_queryset(patient_qs, observation_filter)),
+            ("patients list (first page)", Patient.objects.order_by('last_name', 'first_name', 'id')[:51]),
+            ("mkb search: code prefix", mkb_code_prefix_queryset(options['search'], DEFAULT_LIMIT)),
+        ]
+        # Поиск по названию - сырой SQL (word_similarity); без pg_trgm он идет в памяти процесса
+        raw_queries = []
+        if trigram_available():
+            raw_queries.append(("mkb search: name (pg_trgm)", mkb_trigram_query(options['search_name'], DEFAULT_LIMIT)))
+
+        explain_options = {}
+        if connection.vendor == 'postgresql':
+            explain_options = {'analyze': not options['no_analyze'], 'buffers': not options['no_analyze']}
+        self.stdout.write(f"patient_id={patient_id} params={params} vendor={connection.vendor}\n")
+        for title, queryset in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"=== {title} ==="))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write("")
+        for title, (sql, sql_params) in raw_queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"=== {title} ==="))
+            with connection.cursor() as cursor:
+                cursor.execute(f"{connection.ops.explain_query_prefix(**explain_options)} {sql}", sql_params)
+                self.stdout.write("\n".join(row[0] for row in cursor.fetchall()))
+            self.stdout.write("")
+        if not raw_queries:
+            self.stdout.write("mkb search: name - pg_trgm недоступен, поиск по названию идет в памяти процесса (MKBIndex)")
+
+    def _busiest_patient_id(self):
+        row = (
+            Observation.objects.values('patient_id').annotate(n=Count('id'))
+            .order_by('-n').values_list('patient_id', flat=True).first()
+        )
+        return row
+
+    def _top_params(self, patient_id):
+        return list(
+            Observation.objects.filter(patient_id=patient_id, value_numeric__isnull=False)
+            .values('parameter_id').annotate(n=Count('id')).order_by('-n')
+            .values_list('parameter_id', flat=True)[:2]
+        ) or ['HB']
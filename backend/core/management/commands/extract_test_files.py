@@ -0,0 +1,42 @@
+# backend/core/management/commands/extract_test_files.py
+"""
+Обслуживание очереди разбора файлов тестов (MedicalTestExtraction, см. core/extraction.py).
+
+Возвращает в очередь зависшие задания и выполняет ожидающие. Запускается по cron
+или в отдельном контейнере (--loop), если разбор не должен идти в процессах
+веб-сервера. --backfill ставит в очередь файлы, загруженные до появления разбора.
+
+Примеры:
+    python manage.py extract_test_files
+    python manage.py extract_test_files --backfill
+    python manage.py extract_test_files --loop --interval 5
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.extraction import requeue_stale_extractions, run_pending_extractions, schedule_missing_extractions
+
+
+class Command(BaseCommand):
+    help = "Выполняет ожидающие задания разбора файлов тестов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true', help="Поставить в очередь еще не разобранные файлы")
+        parser.add_argument('--loop', action='store_true', help="Работать постоянно, опрашивая очередь")
+        parser.add_argument('--interval', type=float, default=5.0, help="Пауза между опросами очереди (секунды)")
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.stdout.write(f"Поставлено в очередь: {schedule_missing_extractions()}")
+        while True:
+            self.run_once()
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def run_once(self):
+        requeued = requeue_stale_extractions()
+        done = run_pending_extractions()
+        if requeued or done:
+            self.stdout.write(self.style.SUCCESS(f"Возвращено в очередь: {requeued}, выполнено: {done}"))
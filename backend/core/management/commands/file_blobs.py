@@ -0,0 +1,54 @@
+# backend/core/management/commands/file_blobs.py
+"""
+Обслуживание контентно-адресуемого хранилища файлов тестов (core/storage.py).
+
+Без флагов печатает статистику: число blob'ов и ссылок, объем на диске и
+сколько занимали бы те же файлы без дедупликации.
+
+    --import-legacy  перенести файлы с прежними именами (patient_files/...) в blob'ы;
+                     одинаковые файлы сольются в один
+    --recount        пересчитать счетчики ссылок по MedicalTest (после правок в обход ORM)
+    --purge          удалить blob'ы без ссылок, файлы без записи FileBlob и старые
+                     временные файлы (старше --grace секунд)
+
+Примеры:
+    python manage.py file_blobs
+    python manage.py file_blobs --import-legacy
+    python manage.py file_blobs --recount --purge
+"""
+from django.core.management.base import BaseCommand
+
+from core.storage import blob_statistics, import_legacy_files, purge_orphan_blobs, recount_blob_references
+
+
+class Command(BaseCommand):
+    help = "Статистика, перенос прежних файлов и очистка контентно-адресуемого хранилища файлов тестов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--import-legacy', action='store_true', help="Перенести файлы с прежними именами в blob'ы")
+        parser.add_argument('--recount', action='store_true', help="Пересчитать счетчики ссылок")
+        parser.add_argument('--purge', action='store_true', help="Удалить blob'ы без ссылок и осиротевшие файлы")
+        parser.add_argument('--grace', type=int, default=3600,
+                            help="--purge не трогает файлы моложе стольких секунд (могут принадлежать идущей записи)")
+
+    def handle(self, *args, **options):
+        if options['import_legacy']:
+            imported, missing = import_legacy_files()
+            self.stdout.write(f"Перенесено файлов: {imported}")
+            for name in missing:
+                self.stdout.write(self.style.WARNING(f"Файл не найден: {name}"))
+        if options['recount']:
+            fixed, missing = recount_blob_references()
+            self.stdout.write(f"Исправлено счетчиков: {fixed}")
+            for digest in missing:
+                self.stdout.write(self.style.WARNING(f"Нет файла blob'а: {digest}"))
+        if options['purge']:
+            self.stdout.write(f"Удалено файлов: {purge_orphan_blobs(options['grace'])}")
+
+        stats = blob_statistics()
+        saved = stats['logical_bytes'] - stats['stored_bytes']
+        self.stdout.write(self.style.SUCCESS(
+            f"Blob'ов: {stats['blobs']}, ссылок: {stats['references']}, на диске {stats['stored_bytes']} байт, "
+            f"без дедупликации {stats['logical_bytes']} байт (экономия {saved} байт); "
+            f"файлов с прежними именами: {stats['legacy_files']}"
+        ))
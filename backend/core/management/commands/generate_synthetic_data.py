@@ -0,0 +1,78 @@
+# backend/core/management/commands/generate_synthetic_data.py
+"""
+Синтетические пациенты, эпизоды и наблюдения для нагрузочных проверок (core/synthetic.py).
+
+Справочники МКБ и показателей дополняются недостающими кодами. Пациенты получают
+clinic_id с префиксом SYN- и удаляются через --clear, настоящие данные не трогаются.
+После вставки пересчитываются сводки по показателям и состав когорт (bulk_create
+сигналов не вызывает) и обновляется статистика планировщика (PostgreSQL).
+
+Примеры:
+    python manage.py generate_synthetic_data --patients 10000 --observations-per-patient 200
+    python manage.py generate_synthetic_data --clear --patients 100000 --observations-per-patient 50 --days 730
+    python manage.py generate_synthetic_data --clear --patients 0        # только удалить synthetic данные
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.synthetic import SyntheticConfig, clear_synthetic_data, generate_synthetic_data, rebuild_derived_data
+
+
+class Command(BaseCommand):
+    help = "Генерирует синтетические данные (пациенты, эпизоды, наблюдения) пакетными вставками"
+
+    def add_arguments(self, parser):
+        defaults = SyntheticConfig()
+        parser.add_argument('--patients', type=int, default=defaults.patients, help="Число пациентов")
+        parser.add_argument('--mkb-codes', type=int, default=defaults.mkb_codes, help="Размер справочника МКБ")
+        parser.add_argument('--parameters', type=int, default=defaults.parameters, help="Число показателей")
+        parser.add_argument('--observations-per-patient', type=int, default=defaults.observations_per_patient,
+                            help="Среднее число наблюдений на пациента (плотность)")
+        parser.add_argument('--parameters-per-patient', type=int, default=defaults.parameters_per_patient,
+                            help="Сколько разных показателей измеряется у одного пациента")
+        parser.add_argument('--episodes-per-patient', type=int, default=defaults.episodes_per_patient,
+                            help="Эпизодов госпитализации на пациента")
+        parser.add_argument('--days', type=int, default=defaults.days, help="Период наблюдений (дней до сегодня)")
+        parser.add_argument('--batch-size', type=int, default=defaults.batch_size, help="Строк в одной вставке")
+        parser.add_argument('--seed', type=int, default=defaults.seed, help="Seed генератора (одинаковые данные при повторе)")
+        parser.add_argument('--clear', action='store_true', help="Сначала удалить ранее созданные synthetic данные")
+        parser.add_argument('--skip-summaries', action='store_true', help="Не пересчитывать сводки и когорты")
+
+    def handle(self, *args, **options):
+        config = SyntheticConfig(
+            patients=options['patients'], mkb_codes=options['mkb_codes'], parameters=options['parameters'],
+            observations_per_patient=options['observations_per_patient'],
+            parameters_per_patient=options['parameters_per_patient'],
+            episodes_per_patient=options['episodes_per_patient'], days=options['days'],
+            batch_size=options['batch_size'], seed=options['seed'],
+        )
+        if min(config.patients, config.observations_per_patient, config.episodes_per_patient) < 0:
+            raise CommandError("Количества не могут быть отрицательными.")
+        if min(config.mkb_codes, config.parameters, config.parameters_per_patient, config.days, config.batch_size) < 1:
+            raise CommandError("--mkb-codes, --parameters, --parameters-per-patient, --days и --batch-size должны быть >= 1.")
+
+        if options['clear']:
+            removed = clear_synthetic_data()
+            self.stdout.write(f"Удалено synthetic пациентов: {removed}")
+        if not config.patients:
+            return
+
+        started = time.perf_counter()
+        counts = generate_synthetic_data(config, progress=self.report_progress)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано: пациентов {counts['patients']}, эпизодов {counts['episodes']}, "
+            f"наблюдений {counts['observations']} за {elapsed:.1f} с "
+            f"({counts['observations'] / max(elapsed, 1e-9):.0f} наблюдений/с)"
+        ))
+        if not options['skip_summaries']:
+            pairs = rebuild_derived_data()
+            self.stdout.write(f"Пересчитано сводок: {pairs}")
+
+    def report_progress(self, created, expected):
+        # Примерно каждые 10% ожидаемого объема
+        step = max(expected // 10, 1)
+        if created // step != getattr(self, '_reported_step', 0):
+            self._reported_step = created // step
+            self.stdout.write(f"  наблюдений: {created} / ~{expected}")
@@ -0,0 +1,85 @@
+# backend/core/management/commands/observation_partitions.py
+"""
+Обслуживание секций партиционированной таблицы наблюдений (PostgreSQL).
+
+Примеры:
+    python manage.py observation_partitions                  # создать секции на OBSERVATION_PARTITIONS_AHEAD периодов вперед
+    python manage.py observation_partitions --ahead 12 --list
+    python manage.py observation_partitions --detach-before 2020-01-01          # отсоединить для архивации
+    python manage.py observation_partitions --detach core_observation_p2019_01 --drop
+    python manage.py observation_partitions --convert --granularity month      # конвертировать существующую таблицу
+"""
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core import partitioning
+from core.models import Observation
+
+
+class Command(BaseCommand):
+    help = "Создает будущие секции core_observation, отсоединяет старые, конвертирует таблицу"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--granularity', choices=partitioning.GRANULARITIES,
+                            default=settings.OBSERVATION_PARTITIONING or None,
+                            help="Размер секции (по умолчанию OBSERVATION_PARTITIONING)")
+        parser.add_argument('--ahead', type=int, default=settings.OBSERVATION_PARTITIONS_AHEAD,
+                            help="Сколько будущих периодов создать заранее")
+        parser.add_argument('--convert', action='store_true', help="Конвертировать обычную таблицу в партиционированную")
+        parser.add_argument('--detach', action='append', default=[], metavar='PARTITION', help="Отсоединить секцию по имени")
+        parser.add_argument('--detach-before', metavar='YYYY-MM-DD', help="Отсоединить все секции, целиком лежащие до даты")
+        parser.add_argument('--drop', action='store_true', help="Удалять отсоединенные секции (без --drop они остаются таблицами)")
+        parser.add_argument('--list', action='store_true', help="Показать секции")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Партиционирование поддерживается только на PostgreSQL.")
+        table = Observation._meta.db_table
+        granularity = options['granularity']
+
+        with transaction.atomic(), connection.schema_editor(atomic=False) as schema_editor:
+            if not partitioning.is_partitioned(connection, table):
+                if not options['convert']:
+                    raise CommandError(f"{table} не партиционирована. Используйте --convert (и --granularity).")
+                if not granularity:
+                    raise CommandError("Укажите --granularity или настройку OBSERVATION_PARTITIONING.")
+                partitioning.convert_to_partitioned(schema_editor, Observation, granularity, ahead=options['ahead'])
+                self.stdout.write(self.style.SUCCESS(f"{table} сконвертирована (секции по {granularity})."))
+            elif granularity:
+                created = partitioning.ensure_partitions(
+                    schema_editor, table, granularity, datetime.now(dt_timezone.utc), options['ahead']
+                )
+                self.stdout.write(f"Секции на текущий и {options['ahead']} следующих периодов: {', '.join(created)}")
+
+            to_detach = list(options['detach'])
+            if options['detach_before']:
+                to_detach += self._partitions_before(table, options['detach_before'])
+            for name in to_detach:
+                partitioning.detach_partition(schema_editor, table, name, drop=options['drop'])
+                self.stdout.write(self.style.WARNING(f"{'Удалена' if options['drop'] else 'Отсоединена'} секция {name}"))
+
+        if options['list']:
+            for name, bounds in partitioning.list_partitions(connection, table):
+                self.stdout.write(f"{name}: {bounds}")
+
+    def _partitions_before(self, table, date_str):
+        try:
+            limit = datetime.strptime(date_str, '%Y-%m-%d').replace(tzinfo=dt_timezone.utc)
+        except ValueError:
+            raise CommandError("Invalid date format (use YYYY-MM-DD).")
+        pattern = re.compile(rf'^{re.escape(table)}_p(\d{{4}})(?:_(\d{{2}}))?$')
+        names = []
+        for name, _ in partitioning.list_partitions(connection, table):
+            match = pattern.match(name)
+            if not match:
+                continue  # DEFAULT и секции с нестандартными именами не трогаем
+            year, month = int(match.group(1)), match.group(2)
+            granularity = 'month' if month else 'year'
+            _, end = partitioning.partition_bounds(datetime(year, int(month or 1), 1, tzinfo=dt_timezone.utc), granularity)
+            if end <= limit:
+                names.append(name)
+        return names
@@ -0,0 +1,27 @@
+# backend/core/management/commands/rebuild_parameter_summaries.py
+"""
+Полная перестройка PatientParameterSummary из Observation.
+
+Нужна после загрузки данных в обход ORM (COPY, восстановление дампа) и для
+первичного заполнения после миграции. В обычной работе сводки обновляются сами.
+
+Примеры:
+    python manage.py rebuild_parameter_summaries
+    python manage.py rebuild_parameter_summaries --patient-id 12 --patient-id 15
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.summaries import rebuild_all_summaries
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает сводки по показателям пациентов (PatientParameterSummary)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patient-id', type=int, action='append', default=[], help="Только для указанных пациентов")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_all_summaries(options['patient_id'] or None)
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано пар (пациент, показатель): {count}"))
@@ -0,0 +1,34 @@
+# backend/core/management/commands/refresh_cohorts.py
+"""
+Полный пересчет состава сохраненных когорт (Cohort, см. core/cohorts.py).
+
+Обычно не нужен: состав поддерживается сигналами и при обращении к когорте.
+Запускать после загрузки или правки пациентов в обход ORM (bulk_create,
+COPY, миграции данных) - такие изменения сигналов не вызывают.
+
+Примеры:
+    python manage.py refresh_cohorts
+    python manage.py refresh_cohorts --cohort-id 3
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.cohorts import refresh_cohort
+from core.models import Cohort
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает состав сохраненных когорт"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cohort-id', type=int, action='append', help="Только указанная когорта (можно несколько раз)")
+
+    def handle(self, *args, **options):
+        cohorts = Cohort.objects.order_by('id')
+        if options['cohort_id']:
+            cohorts = cohorts.filter(pk__in=options['cohort_id'])
+            if not cohorts.exists():
+                raise CommandError("Когорты с указанными id не найдены.")
+        for cohort in cohorts:
+            refresh_cohort(cohort)
+            self.stdout.write(f"{cohort.name}: {cohort.memberships.count()} пациентов (версия {cohort.membership_version})")
+        self.stdout.write(self.style.SUCCESS("Готово"))
@@ -0,0 +1,46 @@
+# backend/core/management/commands/research_jobs.py
+"""
+Обслуживание очереди фоновых выгрузок (ResearchExportJob, см. core/jobs.py).
+
+Возвращает в очередь зависшие задания, выполняет ожидающие и удаляет
+просроченные результаты. Запускается по cron или в отдельном контейнере
+(--loop), если задания не должны выполняться в процессах веб-сервера
+(RESEARCH_JOB_WORKERS=0 там не подходит - тогда выгрузка идет в самом запросе).
+
+Примеры:
+    python manage.py research_jobs
+    python manage.py research_jobs --purge-only
+    python manage.py research_jobs --loop --interval 5
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.jobs import purge_expired_jobs, requeue_stale_jobs, run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Выполняет ожидающие фоновые выгрузки и удаляет просроченные результаты"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--purge-only', action='store_true', help="Только удалить просроченные результаты")
+        parser.add_argument('--loop', action='store_true', help="Работать постоянно, опрашивая очередь")
+        parser.add_argument('--interval', type=float, default=5.0, help="Пауза между опросами очереди (секунды)")
+
+    def handle(self, *args, **options):
+        while True:
+            self.run_once(options['purge_only'])
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def run_once(self, purge_only):
+        requeued = done = 0
+        if not purge_only:
+            requeued = requeue_stale_jobs()
+            done = run_pending_jobs()
+        purged = purge_expired_jobs()
+        if requeued or done or purged:
+            self.stdout.write(self.style.SUCCESS(
+                f"Возвращено в очередь: {requeued}, выполнено: {done}, удалено просроченных: {purged}"
+            ))
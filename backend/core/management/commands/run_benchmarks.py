@@ -0,0 +1,263 @@
+# backend/core/management/commands/run_benchmarks.py
+"""
+Нагрузочный бенчмарк основных эндпоинтов: задержка, число SQL-запросов и пиковая
+память Python (tracemalloc) на запрос. Результат - JSON, который можно сохранить
+и сравнить со следующим прогоном (--baseline).
+
+Запросы идут через тестовый клиент DRF в том же процессе (без сети и сервера):
+измеряется код приложения и БД. Задержка - по --repeat прогонам после --warmup,
+память - отдельным прогоном (tracemalloc замедляет выполнение и искажал бы время).
+
+Без --scales бенчмарк идет на текущих данных (synthetic пациенты, если они есть).
+С --scales для каждого масштаба synthetic данные пересоздаются
+(core/synthetic.py, как в generate_synthetic_data --clear).
+
+Примеры:
+    python manage.py run_benchmarks
+    python manage.py run_benchmarks --scales 1000,10000,50000 --observations-per-patient 100 --output bench.json
+    python manage.py run_benchmarks --baseline bench.json --max-slowdown 1.3
+"""
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.models import Observation, Patient
+from core.synthetic import (
+    SyntheticConfig, clear_synthetic_data, generate_synthetic_data, rebuild_derived_data, synthetic_patients,
+)
+
+# Имя -> шаблон URL; подстановки берутся из fixtures()
+CASES = {
+    'dynamics': '/api/patients/{patient_id}/dynamics/?param={param_code}',
+    'dynamics_downsampled': '/api/patients/{patient_id}/dynamics/?param={param_code}&max_points=200',
+    'observation_list': '/api/observations/?patient_id={patient_id}',
+    'research_json': '/api/research/query/?param_codes={param_code}&diagnosis_mkb={diagnosis}&format=json',
+    'research_csv': '/api/research/query/?param_codes={param_code}&diagnosis_mkb={diagnosis}&format=csv',
+    'mkb_search_code': '/api/mkb-codes/?search={diagnosis_prefix}',
+    'mkb_search_name': '/api/mkb-codes/?search=новообразование',
+}
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+
+def fixtures():
+    """Параметры URL: пациент с наибольшим числом наблюдений, его частый показатель, частый диагноз."""
+    patients = synthetic_patients() if synthetic_patients().exists() else Patient.objects.all()
+    top = (
+        Observation.objects.filter(patient__in=patients.values('id'))
+        .values('patient_id', 'parameter_id').annotate(n=Count('id')).order_by('-n').first()
+    )
+    if top is None:
+        raise CommandError("Нет наблюдений для бенчмарка - запустите generate_synthetic_data или укажите --scales.")
+    diagnosis = (
+        patients.exclude(primary_diagnosis_mkb__isnull=True)
+        .values('primary_diagnosis_mkb_id').annotate(n=Count('id')).order_by('-n')
+        .values_list('primary_diagnosis_mkb_id', flat=True).first()
+    ) or ''
+    return {
+        'patient_id': top['patient_id'], 'param_code': top['parameter_id'],
+        'diagnosis': diagnosis, 'diagnosis_prefix': diagnosis[:2],
+    }
+
+
+def data_size():
+    return {'patients': Patient.objects.count(), 'observations': Observation.objects.count()}
+
+
+class Command(BaseCommand):
+    help = "Измеряет задержку, число запросов и пиковую память основных эндпоинтов; пишет JSON"
+
+    def add_arguments(self, parser):
+        defaults = SyntheticConfig()
+        parser.add_argument('--scales', help="Число synthetic пациентов через запятую (данные пересоздаются)")
+        parser.add_argument('--observations-per-patient', type=int, default=defaults.observations_per_patient,
+                            help="Плотность наблюдений для --scales")
+        parser.add_argument('--parameters-per-patient', type=int, default=defaults.parameters_per_patient)
+        parser.add_argument('--seed', type=int, default=defaults.seed)
+        parser.add_argument('--cases', help=f"Только указанные сценарии через запятую: {', '.join(CASES)}")
+        parser.add_argument('--repeat', type=int, default=5, help="Измеряемых прогонов на сценарий")
+        parser.add_argument('--warmup', type=int, default=1, help="Прогонов до измерений (кэши, соединение)")
+        parser.add_argument('--output', help="Файл для JSON с результатами (по умолчанию - только таблица)")
+        parser.add_argument('--baseline', help="JSON прошлого прогона для сравнения")
+        parser.add_argument('--max-slowdown', type=float,
+                            help="С --baseline: ошибка, если медиана задержки выросла больше чем в N раз "
+                                 "или выросло число запросов")
+
+    def handle(self, *args, **options):
+        cases = self.selected_cases(options['cases'])
+        if options['repeat'] < 1:
+            raise CommandError("--repeat должен быть >= 1.")
+        scales = self.parse_scales(options['scales'])
+
+        results = []
+        for scale in scales:
+            if scale is not None:
+                self.prepare_scale(scale, options)
+            size = data_size()
+            self.stdout.write(f"\nДанные: пациентов {size['patients']}, наблюдений {size['observations']}")
+            params = fixtures()
+            for name in cases:
+                result = self.measure(CASES[name].format(**params), options['repeat'], options['warmup'])
+                result.update({'scale': scale, 'case': name, 'data': size})
+                results.append(result)
+                self.print_result(result)
+
+        report = {'meta': self.meta(options), 'results': results}
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Результаты записаны в {options['output']}"))
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['max_slowdown'])
+
+    # --- Подготовка ---
+
+    @staticmethod
+    def selected_cases(raw_value):
+        if not raw_value:
+            return list(CASES)
+        names = [name.strip() for name in raw_value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in CASES]
+        if unknown:
+            raise CommandError(f"Неизвестные сценарии: {', '.join(unknown)}. Доступны: {', '.join(CASES)}.")
+        return names
+
+    @staticmethod
+    def parse_scales(raw_value):
+        if not raw_value:
+            return [None]
+        try:
+            scales = [int(value) for value in raw_value.split(',') if value.strip()]
+        except ValueError:
+            raise CommandError("--scales: ожидаются целые числа через запятую.")
+        if not scales or min(scales) < 1:
+            raise CommandError("--scales: масштабы должны быть >= 1.")
+        return scales
+
+    def prepare_scale(self, scale, options):
+        self.stdout.write(f"\nМасштаб {scale}: пересоздание synthetic данных...")
+        clear_synthetic_data()
+        config = SyntheticConfig(
+            patients=scale, observations_per_patient=options['observations_per_patient'],
+            parameters_per_patient=options['parameters_per_patient'], seed=options['seed'],
+        )
+        generate_synthetic_data(config)
+        rebuild_derived_data()
+
+    # --- Измерения ---
+
+    def measure(self, url, repeat, warmup):
+        client = APIClient()
+        # Пользователь без записи в БД: аутентификация не добавляет запросов к измеряемым
+        client.force_authenticate(get_user_model()(username='benchmark'))
+        # Тестовый клиент ходит на хост testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for _ in range(warmup):
+                self.request(client, url)
+            timings = []
+            # При DEBUG=True журнал запросов ограничен 9000 записями - заполненный дал бы 0
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                status_code, size, elapsed = self.request(client, url)
+            # Срез журнала - считать сразу: следующие запросы (request_started) его очищают
+            query_count = len(queries)
+            timings.append(elapsed)
+            for _ in range(repeat - 1):
+                timings.append(self.request(client, url)[2])
+            tracemalloc.start()
+            try:
+                self.request(client, url)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        return {
+            'url': url,
+            'status': status_code,
+            'response_bytes': size,
+            'queries': query_count,
+            'latency_ms': {
+                'min': round(min(timings) * 1000, 3),
+                'median': round(statistics.median(timings) * 1000, 3),
+                'p95': round(percentile(timings, 0.95) * 1000, 3),
+                'mean': round(statistics.fmean(timings) * 1000, 3),
+                'max': round(max(timings) * 1000, 3),
+            },
+            'peak_memory_kib': round(peak / 1024, 1),
+            'repeat': repeat,
+        }
+
+    @staticmethod
+    def request(client, url):
+        """(статус, байт, секунд); потоковый ответ читается целиком - в время входит вся выгрузка."""
+        started = time.perf_counter()
+        response = client.get(url)
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        return response.status_code, size, time.perf_counter() - started
+
+    # --- Вывод ---
+
+    def print_result(self, result):
+        latency = result['latency_ms']
+        style = self.style.SUCCESS if result['status'] == 200 else self.style.ERROR
+        self.stdout.write(style(
+            f"{result['case']:<22} {result['status']:>3}  median {latency['median']:>9.1f} ms  "
+            f"p95 {latency['p95']:>9.1f} ms  queries {result['queries']:>3}  "
+            f"peak {result['peak_memory_kib']:>9.1f} KiB  {result['response_bytes']:>10} B"
+        ))
+
+    @staticmethod
+    def meta(options):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT version()" if connection.vendor == 'postgresql' else "SELECT sqlite_version()")
+            database_version = cursor.fetchone()[0]
+        return {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'database_version': database_version,
+            'repeat': options['repeat'],
+            'warmup': options['warmup'],
+            'observations_per_patient': options['observations_per_patient'] if options['scales'] else None,
+        }
+
+    def compare(self, results, baseline_path, max_slowdown):
+        try:
+            with open(baseline_path, encoding='utf-8') as baseline_file:
+                baseline = {(item['scale'], item['case']): item for item in json.load(baseline_file)['results']}
+        except (OSError, ValueError, KeyError) as exc:
+            raise CommandError(f"Не удалось прочитать {baseline_path}: {exc}")
+
+        self.stdout.write(f"\nСравнение с {baseline_path} (медиана задержки, запросы):")
+        regressions = []
+        for result in results:
+            previous = baseline.get((result['scale'], result['case']))
+            if previous is None:
+                continue
+            ratio = result['latency_ms']['median'] / max(previous['latency_ms']['median'], 1e-6)
+            self.stdout.write(
+                f"{result['case']:<22} x{ratio:5.2f}  queries {previous['queries']} -> {result['queries']}"
+            )
+            if max_slowdown and (ratio > max_slowdown or result['queries'] > previous['queries']):
+                regressions.append(f"{result['case']} (scale {result['scale']}): x{ratio:.2f}, "
+                                   f"queries {previous['queries']} -> {result['queries']}")
+        if regressions:
+            raise CommandError("Регрессии производительности:\n" + "\n".join(regressions))
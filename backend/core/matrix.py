@@ -0,0 +1,134 @@
+# backend/core/matrix.py
+"""
+Матрица когорты пациент x показатель x интервал (/api/research/matrix/).
+
+Вместо длинного списка наблюдений (строка на каждое измерение) value_numeric
+сворачивается в БД одним GROUP BY (patient, parameter, bucket) с агрегатом
+mean / min / max; для last - оконная функция ROW_NUMBER() по убыванию времени.
+В Python приходят уже готовые ячейки, из них собирается плотный массив
+values[пациент][показатель][интервал] и оси к нему.
+
+Интервалы:
+- day / week - дата (начало недели - понедельник) в текущем часовом поясе,
+  по оси только интервалы, где есть хотя бы одно значение;
+- episode - порядковый номер госпитализации пациента (1, 2, ...), id эпизодов
+  по пациентам отдаются в episodes[пациент][номер - 1]; наблюдения вне эпизодов
+  не учитываются.
+"""
+from django.conf import settings
+from django.db.models import Avg, DateField, F, Max, Min, Window
+from django.db.models.functions import RowNumber, TruncDate, TruncWeek
+
+from .models import HospitalizationEpisode, Observation
+
+BUCKET_DAY = 'day'
+BUCKET_WEEK = 'week'
+BUCKET_EPISODE = 'episode'
+BUCKETS = (BUCKET_DAY, BUCKET_WEEK, BUCKET_EPISODE)
+
+AGG_LAST = 'last'
+AGGREGATES = {'mean': Avg, 'min': Min, 'max': Max, AGG_LAST: None}
+
+
+class MatrixQueryError(ValueError):
+    """Некорректные параметры матрицы (отдается клиенту как 400)."""
+
+
+def parse_matrix_params(query_params):
+    """(bucket, agg) из ?bucket= (day по умолчанию) и ?agg= (mean по умолчанию)."""
+    bucket = (query_params.get('bucket') or BUCKET_DAY).strip().lower()
+    agg = (query_params.get('agg') or 'mean').strip().lower()
+    if bucket not in BUCKETS:
+        raise MatrixQueryError(f"Query parameter 'bucket' must be one of: {', '.join(BUCKETS)}.")
+    if agg not in AGGREGATES:
+        raise MatrixQueryError(f"Query parameter 'agg' must be one of: {', '.join(AGGREGATES)}.")
+    return bucket, agg
+
+
+def _bucket_expression(bucket):
+    if bucket == BUCKET_DAY:
+        return TruncDate('timestamp')
+    if bucket == BUCKET_WEEK:
+        return TruncWeek('timestamp', output_field=DateField())
+    return F('episode_id')
+
+
+def aggregate_cells(patient_qs, observation_filter, bucket, agg):
+    """Запрос ячеек: (patient_id, parameter_id, bucket, value) - по одной на непустую ячейку."""
+    observations = Observation.objects.filter(
+        observation_filter, patient__in=patient_qs.values('id'), value_numeric__isnull=False
+    )
+    if bucket == BUCKET_EPISODE:
+        observations = observations.filter(episode__isnull=False)
+    observations = observations.annotate(bucket=_bucket_expression(bucket))
+    if agg == AGG_LAST:
+        # Фильтр по оконной функции (Django 4.2+) - подзапрос с ROW_NUMBER() в самой БД
+        return (
+            observations.annotate(row_number=Window(
+                RowNumber(),
+                partition_by=[F('patient_id'), F('parameter_id'), _bucket_expression(bucket)],
+                order_by=[F('timestamp').desc(), F('id').desc()],
+            ))
+            .filter(row_number=1)
+            .order_by()
+            .values_list('patient_id', 'parameter_id', 'bucket', 'value_numeric')
+        )
+    return (
+        observations.order_by()
+        .values('patient_id', 'parameter_id', 'bucket')
+        .annotate(value=AGGREGATES[agg]('value_numeric'))
+        .values_list('patient_id', 'parameter_id', 'bucket', 'value')
+    )
+
+
+def _episode_ordinals(patient_qs):
+    """{episode_id: (patient_id, номер госпитализации с 1)} и {patient_id: [episode_id, ...]}."""
+    ordinals, by_patient = {}, {}
+    episodes = (
+        HospitalizationEpisode.objects.filter(patient__in=patient_qs.values('id'))
+        .order_by('patient_id', 'start_date', 'id')
+        .values_list('id', 'patient_id')
+    )
+    for episode_id, patient_id in episodes:
+        patient_episodes = by_patient.setdefault(patient_id, [])
+        patient_episodes.append(episode_id)
+        ordinals[episode_id] = len(patient_episodes)
+    return ordinals, by_patient
+
+
+def build_matrix(patient_qs, observation_filter, param_codes, bucket=BUCKET_DAY, agg='mean'):
+    """Плотная матрица и ее оси (dict для Response). Бросает MatrixQueryError, если ячеек слишком много."""
+    parameters = sorted(set(param_codes))
+    patients = list(patient_qs.order_by('id').values_list('id', flat=True))
+    cells = list(aggregate_cells(patient_qs, observation_filter, bucket, agg))
+
+    payload = {'bucket': bucket, 'agg': agg, 'patients': patients, 'parameters': parameters}
+    if bucket == BUCKET_EPISODE:
+        ordinals, by_patient = _episode_ordinals(patient_qs)
+        bucket_count = max((len(episodes) for episodes in by_patient.values()), default=0)
+        bucket_labels = list(range(1, bucket_count + 1))
+        bucket_index = {episode_id: ordinal - 1 for episode_id, ordinal in ordinals.items()}
+        payload['episodes'] = [
+            by_patient.get(patient_id, []) + [None] * (bucket_count - len(by_patient.get(patient_id, [])))
+            for patient_id in patients
+        ]
+    else:
+        bucket_labels = sorted({cell[2] for cell in cells})
+        bucket_index = {label: index for index, label in enumerate(bucket_labels)}
+        bucket_labels = [label.isoformat() for label in bucket_labels]
+
+    cell_count = len(patients) * len(parameters) * len(bucket_labels)
+    if cell_count > settings.RESEARCH_MATRIX_MAX_CELLS:
+        raise MatrixQueryError(
+            f"Matrix would have {cell_count} cells (limit {settings.RESEARCH_MATRIX_MAX_CELLS}). "
+            f"Use a coarser 'bucket', fewer 'param_codes' or narrower filters."
+        )
+
+    patient_index = {patient_id: index for index, patient_id in enumerate(patients)}
+    parameter_index = {code: index for index, code in enumerate(parameters)}
+    values = [[[None] * len(bucket_labels) for _ in parameters] for _ in patients]
+    for patient_id, parameter_id, bucket_value, value in cells:
+        values[patient_index[patient_id]][parameter_index[parameter_id]][bucket_index[bucket_value]] = value
+
+    payload.update({'buckets': bucket_labels, 'filled': len(cells), 'values': values})
+    return payload
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_alter_hospitalizationepisode_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='observation',
+            index=models.Index(fields=['patient', 'parameter', 'timestamp'], name='obs_patient_param_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='observation',
+            index=models.Index(fields=['patient', 'timestamp', 'id'], name='obs_patient_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='observation',
+            index=models.Index(condition=models.Q(('value_numeric__isnull', False)), fields=['patient', 'parameter', 'timestamp'], include=('value_numeric',), name='obs_numeric_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='observation',
+            index=models.Index(fields=['parameter', 'timestamp'], include=('patient', 'value', 'value_numeric', 'episode'), name='obs_param_ts_cover_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['last_name', 'first_name', 'id'], name='patient_name_idx'),
+        ),
+    ]
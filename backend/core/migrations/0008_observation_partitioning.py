@@ -0,0 +1,32 @@
+# Партиционирование core_observation по timestamp (только PostgreSQL и только
+# при заданной настройке OBSERVATION_PARTITIONING = 'month' | 'year').
+# На больших таблицах миграция переливает данные - запускайте в окно обслуживания.
+
+from django.conf import settings
+from django.db import migrations
+
+from core import partitioning
+
+
+def partition_observations(apps, schema_editor):
+    granularity = settings.OBSERVATION_PARTITIONING
+    if schema_editor.connection.vendor != 'postgresql' or not granularity:
+        return
+    partitioning.convert_to_partitioned(schema_editor, apps.get_model('core', 'Observation'), granularity)
+
+
+def unpartition_observations(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    partitioning.convert_to_regular(schema_editor, apps.get_model('core', 'Observation'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_observation_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_observations, unpartition_observations),
+    ]
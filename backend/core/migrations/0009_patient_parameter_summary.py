@@ -0,0 +1,72 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_summaries(apps, schema_editor):
+    """Первичное заполнение сводок по уже существующим наблюдениям."""
+    Observation = apps.get_model('core', 'Observation')
+    PatientParameterSummary = apps.get_model('core', 'PatientParameterSummary')
+    # Последнее значение пары - первая строка в порядке (пара, timestamp DESC, id DESC)
+    latest = {}
+    rows = (
+        Observation.objects.order_by('patient_id', 'parameter_id', '-timestamp', '-id')
+        .values_list('patient_id', 'parameter_id', 'value', 'value_numeric')
+        .iterator(chunk_size=5000)
+    )
+    for patient_id, parameter_id, value, value_numeric in rows:
+        latest.setdefault((patient_id, parameter_id), (value, value_numeric))
+    aggregates = (
+        Observation.objects.values('patient_id', 'parameter_id')
+        .annotate(
+            observation_count=models.Count('id'),
+            numeric_count=models.Count('value_numeric'),
+            value_min=models.Min('value_numeric'),
+            value_max=models.Max('value_numeric'),
+            value_sum=models.Sum('value_numeric'),
+            first_timestamp=models.Min('timestamp'),
+            last_timestamp=models.Max('timestamp'),
+        )
+        .order_by()
+    )
+    summaries = []
+    for row in aggregates:
+        value, value_numeric = latest[(row['patient_id'], row['parameter_id'])]
+        summaries.append(PatientParameterSummary(**row, last_value=value, last_value_numeric=value_numeric))
+    PatientParameterSummary.objects.bulk_create(summaries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_observation_partitioning'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientParameterSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('observation_count', models.PositiveIntegerField(default=0, verbose_name='Всего наблюдений')),
+                ('numeric_count', models.PositiveIntegerField(default=0, verbose_name='Числовых наблюдений')),
+                ('value_min', models.FloatField(blank=True, null=True, verbose_name='Минимум')),
+                ('value_max', models.FloatField(blank=True, null=True, verbose_name='Максимум')),
+                ('value_sum', models.FloatField(blank=True, null=True, verbose_name='Сумма числовых значений')),
+                ('first_timestamp', models.DateTimeField(blank=True, null=True, verbose_name='Первое наблюдение')),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True, verbose_name='Последнее наблюдение')),
+                ('last_value', models.CharField(blank=True, default='', max_length=255, verbose_name='Последнее значение')),
+                ('last_value_numeric', models.FloatField(blank=True, null=True, verbose_name='Последнее числовое значение')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления записи')),
+                ('parameter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='patient_summaries', to='core.parametercode', verbose_name='Показатель')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parameter_summaries', to='core.patient', verbose_name='Пациент')),
+            ],
+            options={
+                'verbose_name': 'Сводка по показателю пациента',
+                'verbose_name_plural': 'Сводки по показателям пациентов',
+                'ordering': ['patient', 'parameter'],
+                'unique_together': {('patient', 'parameter')},
+            },
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
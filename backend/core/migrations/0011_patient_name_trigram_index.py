@@ -0,0 +1,53 @@
+# GIN-индекс по триграммам ФИО пациента для поиска (core/search.py, PatientSearchFilter).
+# Выражение индекса совпадает с search.PATIENT_NAME_EXPRESSION - иначе планировщик его не использует.
+# Только PostgreSQL с доступным pg_trgm; без него поиск идет обычными icontains/istartswith.
+
+from django.db import DatabaseError, migrations, transaction
+
+INDEX_NAME = 'core_patient_full_name_trgm_idx'
+
+
+def _ensure_trigram_extension(schema_editor):
+    """
+    Включает pg_trgm, если расширение есть в сборке PostgreSQL и хватает прав.
+    Копия на момент миграции: миграции не импортируют код приложения, который может измениться.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return False
+        try:
+            with transaction.atomic(using=connection.alias):  # Savepoint: ошибка прав не ломает миграцию
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except DatabaseError:
+            return False
+    return True
+
+
+def create_trigram_index(apps, schema_editor):
+    if not _ensure_trigram_extension(schema_editor):
+        return
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON core_patient USING gin "
+        f"((UPPER(last_name || ' ' || first_name || ' ' || COALESCE(middle_name, ''))) gin_trgm_ops)"
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_mkbcode_name_trigram_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
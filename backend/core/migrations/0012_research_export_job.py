@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0011_patient_name_trigram_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResearchExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('params', models.JSONField(default=dict, verbose_name='Параметры выборки')),
+                ('params_hash', models.CharField(db_index=True, max_length=64, verbose_name='Хэш параметров')),
+                ('export_format', models.CharField(max_length=16, verbose_name='Формат')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], db_index=True, default='pending', max_length=16, verbose_name='Статус')),
+                ('result_file', models.FileField(blank=True, max_length=500, upload_to='research_exports/', verbose_name='Файл результата')),
+                ('row_count', models.PositiveIntegerField(blank=True, null=True, verbose_name='Строк в выгрузке')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начато')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершено')),
+                ('expires_at', models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Хранить до')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='research_export_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+            ],
+            options={
+                'verbose_name': 'Задание исследовательской выгрузки',
+                'verbose_name_plural': 'Задания исследовательских выгрузок',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_research_export_job'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['date_of_birth'], name='patient_dob_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['primary_diagnosis_mkb', 'date_of_birth'], name='patient_diag_dob_idx'),
+        ),
+    ]
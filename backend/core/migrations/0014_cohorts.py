@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0013_patient_cohort_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cohort',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Название')),
+                ('description', models.TextField(blank=True, default='', verbose_name='Описание')),
+                ('criteria', models.JSONField(default=dict, verbose_name='Критерии')),
+                ('evaluated_on', models.DateField(blank=True, null=True, verbose_name='Состав рассчитан на дату')),
+                ('membership_version', models.PositiveIntegerField(default=0, verbose_name='Версия состава')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания записи')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления записи')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cohorts', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+            ],
+            options={
+                'verbose_name': 'Когорта',
+                'verbose_name_plural': 'Когорты',
+                'ordering': ['name', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CohortMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('added_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Добавлен')),
+                ('cohort', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='core.cohort', verbose_name='Когорта')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cohort_memberships', to='core.patient', verbose_name='Пациент')),
+            ],
+            options={
+                'verbose_name': 'Пациент когорты',
+                'verbose_name_plural': 'Пациенты когорт',
+                'unique_together': {('cohort', 'patient')},
+            },
+        ),
+    ]
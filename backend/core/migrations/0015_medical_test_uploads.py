@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0014_cohorts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicalTestUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255, verbose_name='Имя файла')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Размер (байт)')),
+                ('received_bytes', models.PositiveBigIntegerField(default=0, verbose_name='Принято (байт)')),
+                ('sha256', models.CharField(blank=True, default='', max_length=64, verbose_name='SHA-256')),
+                ('part_name', models.CharField(max_length=500, verbose_name='Временный файл')),
+                ('status', models.CharField(choices=[('receiving', 'Принимается'), ('complete', 'Завершена')], default='receiving', max_length=16, verbose_name='Статус')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True, verbose_name='Обновлено')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='medical_test_uploads', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+                ('medical_test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='core.medicaltest', verbose_name='Тест')),
+            ],
+            options={
+                'verbose_name': 'Загрузка файла теста',
+                'verbose_name_plural': 'Загрузки файлов тестов',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:47
+
+import core.models
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_medical_test_uploads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileBlob',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='SHA-256')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Размер (байт)')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='Число ссылок')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+            ],
+            options={
+                'verbose_name': 'Файл хранилища',
+                'verbose_name_plural': 'Файлы хранилища',
+            },
+        ),
+        migrations.AlterField(
+            model_name='medicaltest',
+            name='uploaded_file',
+            field=models.FileField(blank=True, max_length=500, null=True, storage=core.storage.ContentAddressedStorage(), upload_to=core.models.get_patient_test_upload_path, verbose_name='Загруженный файл'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_file_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicalTestExtraction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(max_length=500, verbose_name='Файл')),
+                ('extractor', models.CharField(max_length=16, verbose_name='Формат')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка'), ('skipped', 'Пропущено')], db_index=True, default='pending', max_length=16, verbose_name='Статус')),
+                ('item_count', models.PositiveIntegerField(blank=True, null=True, verbose_name='Ответов')),
+                ('score', models.FloatField(blank=True, null=True, verbose_name='Итоговый балл')),
+                ('result_text', models.TextField(blank=True, default='', verbose_name='Результат')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начато')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершено')),
+                ('medical_test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='extractions', to='core.medicaltest', verbose_name='Тест')),
+            ],
+            options={
+                'verbose_name': 'Разбор файла теста',
+                'verbose_name_plural': 'Разборы файлов тестов',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MedicalTestAnswer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(verbose_name='Порядковый номер')),
+                ('item', models.CharField(max_length=255, verbose_name='Пункт')),
+                ('answer', models.TextField(blank=True, default='', verbose_name='Ответ')),
+                ('value_numeric', models.FloatField(blank=True, null=True, verbose_name='Числовое значение')),
+                ('medical_test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='core.medicaltest', verbose_name='Тест')),
+            ],
+            options={
+                'verbose_name': 'Ответ на пункт теста',
+                'verbose_name_plural': 'Ответы на пункты тестов',
+                'ordering': ['medical_test', 'position'],
+                'indexes': [models.Index(fields=['item', 'medical_test'], name='answer_item_test_idx')],
+                'unique_together': {('medical_test', 'position')},
+            },
+        ),
+    ]
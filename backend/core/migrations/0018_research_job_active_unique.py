@@ -0,0 +1,39 @@
+# Не больше одного активного (pending/running) задания выгрузки на запрос (core/jobs.py, create_or_reuse_job).
+# Дубликаты, созданные до ограничения одновременными запросами, помечаются failed - остается самое новое.
+
+from django.db import migrations, models
+
+ACTIVE_STATUSES = ['pending', 'running']
+
+
+def fail_duplicate_active_jobs(apps, schema_editor):
+    ResearchExportJob = apps.get_model('core', 'ResearchExportJob')
+    kept = set()
+    duplicates = []
+    active = ResearchExportJob.objects.filter(status__in=ACTIVE_STATUSES).order_by('-created_at', '-id')
+    for job_id, params_hash, export_format in active.values_list('id', 'params_hash', 'export_format'):
+        if (params_hash, export_format) in kept:
+            duplicates.append(job_id)
+        else:
+            kept.add((params_hash, export_format))
+    if duplicates:
+        ResearchExportJob.objects.filter(pk__in=duplicates).update(status='failed', error='Duplicate of an active job.')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_medical_test_extraction'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='researchexportjob',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('status__in', ACTIVE_STATUSES)),
+                fields=('params_hash', 'export_format'),
+                name='research_job_active_unique',
+            ),
+        ),
+    ]
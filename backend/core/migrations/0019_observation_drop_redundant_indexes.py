@@ -0,0 +1,60 @@
+# Убирает индексы наблюдений, которые дублируют префиксы составных (план - manage.py explain_queries):
+# - одиночные индексы FK patient_id и parameter_id (+ parameter_id _like в PostgreSQL) - префиксы
+#   obs_patient_param_ts_idx / obs_patient_ts_idx и obs_param_ts_cover_idx;
+# - obs_numeric_idx - те же ключи, что у obs_patient_param_ts_idx, динамика идет по нему.
+# Для FK удаляются только индексы: AlterField пересоздал бы и ограничения FK с проверкой всей таблицы.
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+FK_INDEXES = [
+    ('core_observation_patient_id_17c3f426', 'patient_id', ''),
+    ('core_observation_parameter_id_3b8a6923', 'parameter_id', ''),
+    ('core_observation_parameter_id_3b8a6923_like', 'parameter_id', 'varchar_pattern_ops'),
+]
+
+
+def drop_fk_indexes(apps, schema_editor):
+    for name, _column, _opclass in FK_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(name)}')
+
+
+def create_fk_indexes(apps, schema_editor):
+    for name, column, opclass in FK_INDEXES:
+        if opclass and schema_editor.connection.vendor != 'postgresql':
+            continue
+        schema_editor.execute(
+            f'CREATE INDEX {schema_editor.quote_name(name)} ON "core_observation" '
+            f'({schema_editor.quote_name(column)} {opclass})'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_research_job_active_unique'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='observation',
+            name='obs_numeric_idx',
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(drop_fk_indexes, create_fk_indexes),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='observation',
+                    name='parameter',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='observations', to='core.parametercode', verbose_name='Показатель'),
+                ),
+                migrations.AlterField(
+                    model_name='observation',
+                    name='patient',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='observations', to='core.patient', verbose_name='Пациент'),
+                ),
+            ],
+        ),
+    ]
@@ -1,10 +1,13 @@
 # backend/core/models.py
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings # Используем для связи с User и настроек MEDIA
 # Лучше всегда использовать get_user_model для получения модели пользователя
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 import os # Для работы с путями файлов
+import uuid
+
+from .storage import medical_test_storage
 
 # Получаем активную модель пользователя
 User = get_user_model()
@@ -21,6 +24,22 @@ class MKBCode(models.Model):
     def __str__(self):
         return f"{self.code} - {self.name}"
 
+# Строковые представления вынесены в функции: их же используют быстрые
+# сериализаторы (core/fast_serializers.py), работающие со строками из .values()
+
+def patient_display_name(last_name, first_name, middle_name, date_of_birth):
+    # Улучшаем форматирование даты и обрабатываем случай отсутствия отчества
+    dob_str = date_of_birth.strftime('%d.%m.%Y') if date_of_birth else '??.??.????'
+    middle_name_str = f" {middle_name}" if middle_name else ""
+    return f"{last_name} {first_name}{middle_name_str} ({dob_str})"
+
+
+def episode_display_name(patient_display, start_date, end_date):
+    start_str = start_date.strftime('%d.%m.%Y') if start_date else '??.??.????'
+    end_str = end_date.strftime('%d.%m.%Y') if end_date else "..."
+    return f"Эпизод для {patient_display} ({start_str} - {end_str})"
+
+
 class Patient(models.Model):
     """Модель пациента"""
     last_name = models.CharField("Фамилия", max_length=100)
@@ -40,15 +59,19 @@ class Patient(models.Model):
     updated_at = models.DateTimeField("Дата обновления записи", auto_now=True)
 
     def __str__(self):
-        # Улучшаем форматирование даты и обрабатываем случай отсутствия отчества
-        dob_str = self.date_of_birth.strftime('%d.%m.%Y') if self.date_of_birth else '??.??.????'
-        middle_name_str = f" {self.middle_name}" if self.middle_name else ""
-        return f"{self.last_name} {self.first_name}{middle_name_str} ({dob_str})"
+        return patient_display_name(self.last_name, self.first_name, self.middle_name, self.date_of_birth)
 
     class Meta:
         verbose_name = "Пациент"
         verbose_name_plural = "Пациенты"
         ordering = ['last_name', 'first_name']
+        indexes = [
+            # Сортировка списка и keyset-пагинация (core.pagination.PatientPagination)
+            models.Index(fields=['last_name', 'first_name', 'id'], name='patient_name_idx'),
+            # Диапазон дат рождения для фильтра по возрасту (core/criteria.py), в т.ч. вместе с диагнозом
+            models.Index(fields=['date_of_birth'], name='patient_dob_idx'),
+            models.Index(fields=['primary_diagnosis_mkb', 'date_of_birth'], name='patient_diag_dob_idx'),
+        ]
 
 class HospitalizationEpisode(models.Model):
     """Эпизод госпитализации/наблюдения"""
@@ -60,10 +83,8 @@ class HospitalizationEpisode(models.Model):
     updated_at = models.DateTimeField("Дата обновления записи", auto_now=True)
 
     def __str__(self):
-        start_str = self.start_date.strftime('%d.%m.%Y') if self.start_date else '??.??.????'
-        end_str = self.end_date.strftime('%d.%m.%Y') if self.end_date else "..."
         # Используем __str__ пациента для краткости
-        return f"Эпизод для {self.patient} ({start_str} - {end_str})"
+        return episode_display_name(str(self.patient), self.start_date, self.end_date)
 
     class Meta:
         verbose_name = "Эпизод госпитализации"
@@ -89,10 +110,39 @@ class ParameterCode(models.Model):
         unit_str = f" ({self.unit})" if self.unit else ""
         return f"{self.name} ({self.code}){unit_str}"
 
+def parse_numeric_value(value):
+    """
+    Преобразует строковое значение наблюдения в число (запятая считается десятичным разделителем).
+    Возвращает None для пустых и нечисловых значений.
+    Используется в Observation.save() и при пакетной загрузке (bulk_create не вызывает save()).
+    """
+    if not value: # Проверяем, что значение не пустое
+        return None
+    try:
+        # Заменяем запятую на точку и пытаемся преобразовать во float
+        return float(str(value).replace(',', '.'))
+    except (ValueError, TypeError):
+        return None
+
+class ObservationQuerySet(models.QuerySet):
+    def delete(self):
+        """Удаление с пересчетом сводок (core/summaries.py) - один раз для всех затронутых пар."""
+        from .summaries import refresh_summaries
+        with transaction.atomic(using=self.db):
+            pairs = set(self.values_list('patient_id', 'parameter_id').distinct().order_by())
+            result = super().delete()
+            refresh_summaries(pairs)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class Observation(models.Model):
     """Модель для хранения наблюдений/значений показателей"""
-    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='observations', verbose_name="Пациент")
-    parameter = models.ForeignKey(ParameterCode, on_delete=models.PROTECT, related_name='observations', verbose_name="Показатель") # Убрали null=True, blank=True - параметр должен быть всегда
+    # Отдельные индексы FK не нужны: patient_id и parameter_id - префиксы составных индексов из Meta
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='observations', verbose_name="Пациент", db_index=False)
+    parameter = models.ForeignKey(ParameterCode, on_delete=models.PROTECT, related_name='observations', verbose_name="Показатель", db_index=False) # Убрали null=True, blank=True - параметр должен быть всегда
     timestamp = models.DateTimeField(verbose_name="Дата и время", default=timezone.now, db_index=True) # Добавили db_index для ускорения фильтрации по времени
     value = models.CharField(max_length=255, verbose_name="Значение") # Убрали blank=True - значение должно быть
     value_numeric = models.FloatField(blank=True, null=True, verbose_name="Числовое значение (если применимо)")
@@ -107,9 +157,32 @@ class Observation(models.Model):
         ordering = ['patient', 'parameter', '-timestamp']
         # Уникальность наблюдения для пациента по параметру и времени? Возможно, но может быть нужно несколько замеров в одну секунду.
         # unique_together = [['patient', 'parameter', 'timestamp']] # Раскомментировать, если нужна уникальность
+        # Индексы под реальные пути доступа (проверять планы: manage.py explain_queries).
+        # Каждый индекс - лишняя запись на каждую вставленную строку (bulk ingest), поэтому
+        # индексов с одинаковым префиксом ключа здесь нет
+        indexes = [
+            # Динамика и список наблюдений пациента по параметру: patient + parameter, сортировка по времени;
+            # он же - индекс FK patient (каскадное удаление)
+            models.Index(fields=['patient', 'parameter', 'timestamp'], name='obs_patient_param_ts_idx'),
+            # Список наблюдений пациента (?patient_id=) с сортировкой -timestamp, -id (keyset-пагинация):
+            # без него страница читается обратным проходом по timestamp через строки всех пациентов
+            models.Index(fields=['patient', 'timestamp', 'id'], name='obs_patient_ts_idx'),
+            # Исследовательская выгрузка: parameter IN (...) + диапазон timestamp,
+            # остальные читаемые колонки в INCLUDE, чтобы обходиться без heap (PostgreSQL);
+            # он же - индекс FK parameter (проверка PROTECT при удалении показателя)
+            models.Index(
+                fields=['parameter', 'timestamp'], include=['patient', 'value', 'value_numeric', 'episode'],
+                name='obs_param_ts_cover_idx',
+            ),
+        ]
+
+    # Сводки при удалении пересчитываются здесь и в ObservationQuerySet.delete(), а не сигналом
+    # post_delete: обработчик сигнала отключил бы быстрое удаление (один DELETE) наблюдений
+    # при каскаде от пациента, а сводки пациента и так удаляются своим каскадом
+    objects = ObservationQuerySet.as_manager()
 
     def __str__(self):
-        param_code = self.parameter.code if self.parameter else 'N/A'
+        param_code = self.parameter_id or 'N/A' # PK параметра - код, без запроса к ParameterCode
         time_str = self.timestamp.strftime('%Y-%m-%d %H:%M') if self.timestamp else '??'
         return f"{self.patient} - {param_code} = {self.value} ({time_str})"
 
@@ -117,23 +190,58 @@ class Observation(models.Model):
     def save(self, *args, **kwargs):
         # Заполняем value_numeric только если параметр помечен как числовой
         if self.parameter and self.parameter.is_numeric:
-            if self.value: # Проверяем, что значение не пустое
-                try:
-                    # Заменяем запятую на точку и пытаемся преобразовать во float
-                    numeric_val = float(str(self.value).replace(',', '.'))
-                    self.value_numeric = numeric_val
-                except (ValueError, TypeError):
-                    # Если преобразование не удалось, ставим None
-                    self.value_numeric = None
-            else:
-                 # Если значение пустое, ставим None
-                self.value_numeric = None
+            self.value_numeric = parse_numeric_value(self.value)
         else:
             # Если параметр нечисловой, value_numeric всегда None
             self.value_numeric = None
         super().save(*args, **kwargs) # Вызываем оригинальный метод save
     # --- КОНЕЦ МЕТОДА SAVE ---
 
+    def delete(self, *args, **kwargs):
+        from .summaries import refresh_summaries
+        pair = (self.patient_id, self.parameter_id)
+        with transaction.atomic(using=kwargs.get('using')):
+            result = super().delete(*args, **kwargs)
+            refresh_summaries([pair])
+        return result
+
+
+# --- СВОДКА ПО ПОКАЗАТЕЛЯМ ПАЦИЕНТА ---
+
+class PatientParameterSummary(models.Model):
+    """
+    Сводка по показателю пациента: количество, min/max/среднее и последнее значение.
+    Поддерживается инкрементально при изменении наблюдений (см. core/summaries.py),
+    чтобы не сканировать сырые Observation при каждом запросе.
+    """
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='parameter_summaries', verbose_name="Пациент")
+    parameter = models.ForeignKey(ParameterCode, on_delete=models.CASCADE, related_name='patient_summaries', verbose_name="Показатель")
+    observation_count = models.PositiveIntegerField("Всего наблюдений", default=0)
+    numeric_count = models.PositiveIntegerField("Числовых наблюдений", default=0)
+    value_min = models.FloatField("Минимум", blank=True, null=True)
+    value_max = models.FloatField("Максимум", blank=True, null=True)
+    value_sum = models.FloatField("Сумма числовых значений", blank=True, null=True) # Для среднего без пересчета
+    first_timestamp = models.DateTimeField("Первое наблюдение", blank=True, null=True)
+    last_timestamp = models.DateTimeField("Последнее наблюдение", blank=True, null=True)
+    last_value = models.CharField("Последнее значение", max_length=255, blank=True, default='')
+    last_value_numeric = models.FloatField("Последнее числовое значение", blank=True, null=True)
+    updated_at = models.DateTimeField("Дата обновления записи", auto_now=True)
+
+    class Meta:
+        verbose_name = "Сводка по показателю пациента"
+        verbose_name_plural = "Сводки по показателям пациентов"
+        ordering = ['patient', 'parameter']
+        unique_together = [['patient', 'parameter']]
+
+    def __str__(self):
+        return f"{self.patient_id} - {self.parameter_id}: {self.observation_count} набл."
+
+    @property
+    def value_mean(self):
+        if not self.numeric_count or self.value_sum is None:
+            return None
+        return self.value_sum / self.numeric_count
+
 
 # --- МОДЕЛЬ ДЛЯ МЕДИЦИНСКИХ ТЕСТОВ/ОПРОСНИКОВ ---
 
@@ -148,8 +256,10 @@ class MedicalTest(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='medical_tests', verbose_name="Пациент")
     test_name = models.CharField(max_length=255, verbose_name="Название теста/опросника")
     test_date = models.DateField(verbose_name="Дата проведения теста", default=timezone.now, db_index=True) # Добавили db_index
+    # Файлы хранятся по содержимому (core/storage.py): одинаковые загрузки - один файл на диске
     uploaded_file = models.FileField(
         upload_to=get_patient_test_upload_path,
+        storage=medical_test_storage,
         max_length=500,
         blank=True,
         null=True,
@@ -177,12 +287,217 @@ class MedicalTest(models.Model):
             return os.path.basename(self.uploaded_file.name)
         return None
 
-    # Опционально: Метод для удаления файла при удалении записи
-    # def delete(self, *args, **kwargs):
-    #     if self.uploaded_file:
-    #         # Получаем путь к хранилищу (важно для S3 и т.д.)
-    #         storage, path = self.uploaded_file.storage, self.uploaded_file.name
-    #         # Удаляем файл из хранилища
-    #         if storage.exists(path):
-    #             storage.delete(path)
-    #     super().delete(*args, **kwargs)
+    # Файл освобождается при удалении записи и при замене файла - сигналы в core/signals.py
+    # (ContentAddressedStorage.release: blob удаляется, когда на него не осталось ссылок)
+
+
+# --- КОНТЕНТНО-АДРЕСУЕМОЕ ХРАНИЛИЩЕ ФАЙЛОВ ---
+
+class FileBlob(models.Model):
+    """Файл в хранилище core/storage.py: один на SHA-256 содержимого, со счетчиком ссылок из MedicalTest."""
+    digest = models.CharField("SHA-256", max_length=64, primary_key=True)
+    size = models.PositiveBigIntegerField("Размер (байт)")
+    ref_count = models.PositiveIntegerField("Число ссылок", default=0)
+    created_at = models.DateTimeField("Создано", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Файл хранилища"
+        verbose_name_plural = "Файлы хранилища"
+
+    def __str__(self):
+        return f"{self.digest[:12]}… ({self.size} байт, ссылок: {self.ref_count})"
+
+
+# --- ДОКАЧИВАЕМАЯ ЗАГРУЗКА ФАЙЛОВ ТЕСТОВ ---
+
+class MedicalTestUpload(models.Model):
+    """
+    Загрузка файла MedicalTest частями (см. core/uploads.py). Части пишутся сразу
+    во временный файл в каталоге хранилища; после проверки контрольной суммы
+    файл становится blob'ом (core/storage.py) и прикрепляется к тесту. id - токен загрузки в URL.
+    """
+    STATUS_RECEIVING = 'receiving'
+    STATUS_COMPLETE = 'complete'
+    STATUS_CHOICES = [
+        (STATUS_RECEIVING, 'Принимается'),
+        (STATUS_COMPLETE, 'Завершена'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    medical_test = models.ForeignKey(MedicalTest, on_delete=models.CASCADE, related_name='uploads', verbose_name="Тест")
+    filename = models.CharField("Имя файла", max_length=255)
+    size = models.PositiveBigIntegerField("Размер (байт)")
+    received_bytes = models.PositiveBigIntegerField("Принято (байт)", default=0)
+    # Ожидаемый SHA-256 всего файла (hex), если клиент передал его при создании
+    sha256 = models.CharField("SHA-256", max_length=64, blank=True, default='')
+    part_name = models.CharField("Временный файл", max_length=500)
+    status = models.CharField("Статус", max_length=16, choices=STATUS_CHOICES, default=STATUS_RECEIVING)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name='medical_test_uploads', verbose_name="Автор")
+    created_at = models.DateTimeField("Создано", auto_now_add=True)
+    updated_at = models.DateTimeField("Обновлено", auto_now=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Загрузка файла теста"
+        verbose_name_plural = "Загрузки файлов тестов"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Загрузка {self.filename} ({self.received_bytes}/{self.size})"
+
+
+# --- ФОНОВЫЕ ИССЛЕДОВАТЕЛЬСКИЕ ВЫГРУЗКИ ---
+
+class ResearchExportJob(models.Model):
+    """
+    Задание на выгрузку исследовательской выборки в файл (см. core/jobs.py).
+    Одинаковые запросы (params_hash + формат) переиспользуют одно задание,
+    готовый файл хранится до expires_at.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Готово'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    params = models.JSONField("Параметры выборки", default=dict)
+    params_hash = models.CharField("Хэш параметров", max_length=64, db_index=True)
+    export_format = models.CharField("Формат", max_length=16)
+    status = models.CharField("Статус", max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    result_file = models.FileField("Файл результата", upload_to='research_exports/', max_length=500, blank=True)
+    row_count = models.PositiveIntegerField("Строк в выгрузке", blank=True, null=True)
+    error = models.TextField("Ошибка", blank=True, default='')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name='research_export_jobs', verbose_name="Автор")
+    created_at = models.DateTimeField("Создано", auto_now_add=True)
+    started_at = models.DateTimeField("Начато", blank=True, null=True)
+    finished_at = models.DateTimeField("Завершено", blank=True, null=True)
+    expires_at = models.DateTimeField("Хранить до", blank=True, null=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Задание исследовательской выгрузки"
+        verbose_name_plural = "Задания исследовательских выгрузок"
+        ordering = ['-created_at']
+        constraints = [
+            # Не больше одного активного задания на запрос: из одновременных одинаковых
+            # запросов задание создаст только один, остальные получат его (core/jobs.py)
+            models.UniqueConstraint(
+                fields=['params_hash', 'export_format'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='research_job_active_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Выгрузка #{self.pk} ({self.export_format}, {self.status})"
+
+
+# --- ИЗВЛЕЧЕНИЕ ОТВЕТОВ ИЗ ФАЙЛОВ ТЕСТОВ ---
+
+class MedicalTestExtraction(models.Model):
+    """
+    Фоновый разбор загруженного файла теста (CSV, XLSX, JSON, см. core/extraction.py):
+    ответы по пунктам сохраняются в MedicalTestAnswer, итог - в score/result_text теста.
+    Задание создается при каждой смене файла; статус теста - его последнее задание.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_SKIPPED = 'skipped'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Готово'),
+        (STATUS_FAILED, 'Ошибка'),
+        (STATUS_SKIPPED, 'Пропущено'),  # Файл заменили до завершения разбора
+    ]
+
+    medical_test = models.ForeignKey(MedicalTest, on_delete=models.CASCADE, related_name='extractions', verbose_name="Тест")
+    file_name = models.CharField("Файл", max_length=500)
+    extractor = models.CharField("Формат", max_length=16)
+    status = models.CharField("Статус", max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    item_count = models.PositiveIntegerField("Ответов", blank=True, null=True)
+    # Что извлечено из файла (в тест попадает, только если там пусто или прежнее извлеченное значение)
+    score = models.FloatField("Итоговый балл", blank=True, null=True)
+    result_text = models.TextField("Результат", blank=True, default='')
+    error = models.TextField("Ошибка", blank=True, default='')
+    created_at = models.DateTimeField("Создано", auto_now_add=True)
+    started_at = models.DateTimeField("Начато", blank=True, null=True)
+    finished_at = models.DateTimeField("Завершено", blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Разбор файла теста"
+        verbose_name_plural = "Разборы файлов тестов"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Разбор #{self.pk} теста {self.medical_test_id} ({self.extractor}, {self.status})"
+
+
+class MedicalTestAnswer(models.Model):
+    """Ответ на пункт опросника из файла теста (core/extraction.py) - для исследовательских выборок."""
+    medical_test = models.ForeignKey(MedicalTest, on_delete=models.CASCADE, related_name='answers', verbose_name="Тест")
+    position = models.PositiveIntegerField("Порядковый номер")
+    item = models.CharField("Пункт", max_length=255)
+    answer = models.TextField("Ответ", blank=True, default='')
+    value_numeric = models.FloatField("Числовое значение", blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Ответ на пункт теста"
+        verbose_name_plural = "Ответы на пункты тестов"
+        ordering = ['medical_test', 'position']
+        unique_together = [['medical_test', 'position']]
+        indexes = [
+            # Выборки по пункту опросника: /api/research/test-answers/?items=...
+            models.Index(fields=['item', 'medical_test'], name='answer_item_test_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.item}: {self.answer}"
+
+
+# --- СОХРАНЕННЫЕ КОГОРТЫ ---
+
+class Cohort(models.Model):
+    """
+    Сохраненное определение когорты: критерии ResearchQueryView (диагноз, возраст,
+    а также показатели и период по умолчанию для выгрузок) и материализованный
+    состав в CohortMembership. Состав поддерживается инкрементально (см. core/cohorts.py).
+    """
+    name = models.CharField("Название", max_length=255)
+    description = models.TextField("Описание", blank=True, default='')
+    criteria = models.JSONField("Критерии", default=dict)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name='cohorts', verbose_name="Автор")
+    # Дата, на которую посчитан возраст пациентов в составе
+    evaluated_on = models.DateField("Состав рассчитан на дату", blank=True, null=True)
+    # Растет при каждом изменении состава (ключ дедупликации выгрузок по когорте)
+    membership_version = models.PositiveIntegerField("Версия состава", default=0)
+    created_at = models.DateTimeField("Дата создания записи", auto_now_add=True)
+    updated_at = models.DateTimeField("Дата обновления записи", auto_now=True)
+
+    class Meta:
+        verbose_name = "Когорта"
+        verbose_name_plural = "Когорты"
+        ordering = ['name', 'id']
+
+    def __str__(self):
+        return self.name
+
+
+class CohortMembership(models.Model):
+    """Пациент в составе когорты (материализованный результат критериев)."""
+    cohort = models.ForeignKey(Cohort, on_delete=models.CASCADE, related_name='memberships', verbose_name="Когорта")
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='cohort_memberships', verbose_name="Пациент")
+    added_at = models.DateTimeField("Добавлен", default=timezone.now)
+
+    class Meta:
+        verbose_name = "Пациент когорты"
+        verbose_name_plural = "Пациенты когорт"
+        unique_together = [['cohort', 'patient']]
+
+    def __str__(self):
+        return f"{self.cohort_id}: {self.patient_id}"
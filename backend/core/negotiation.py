@@ -0,0 +1,17 @@
+# backend/core/negotiation.py
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BrowsableAPIRenderer
+
+
+class StaffBrowsableAPINegotiation(DefaultContentNegotiation):
+    """
+    Browsable API (HTML) только для сотрудников (is_staff). Остальные клиенты,
+    включая браузер с Accept: text/html, получают JSON - рендеринг HTML-формы
+    с повторной сериализацией данных заметно дороже самого ответа.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        user = getattr(request, 'user', None)
+        if not (user is not None and user.is_staff):
+            renderers = [renderer for renderer in renderers if not isinstance(renderer, BrowsableAPIRenderer)] or renderers
+        return super().select_renderer(request, renderers, format_suffix)
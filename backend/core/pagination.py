@@ -0,0 +1,174 @@
+# backend/core/pagination.py
+"""
+Keyset (cursor) пагинация для списковых эндпоинтов.
+
+В отличие от rest_framework.pagination.CursorPagination, позиция курсора
+хранит значения ВСЕХ полей сортировки (например last_name, first_name, id),
+и следующая страница выбирается лексикографическим условием
+(a > x) OR (a = x AND b > y) OR ..., которое обслуживается индексом.
+Время ответа не зависит от номера страницы и размера таблицы.
+"""
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Базовый класс: ordering должен заканчиваться уникальным полем (обычно 'id'),
+    иначе позиция курсора неоднозначна. Поля с '-' сортируются по убыванию.
+    """
+    ordering = ('-id',)
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    # Параметр ранжированного поиска: при нем отдается только первая страница в порядке релевантности
+    ranked_query_param = None
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE') or 50
+        self.max_page_size = settings.API_MAX_PAGE_SIZE
+
+    # --- Основной метод ---
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        if self.ranked_query_param and request.query_params.get(self.ranked_query_param, '').strip():
+            # Сортировка по релевантности не годится для курсора: top-N лучших совпадений без ссылок
+            self.has_next = self.has_previous = False
+            return list(queryset[:self.page_size])
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+        reverse, position = self.decode_cursor(request, queryset.model)
+        # При движении назад инвертируем сортировку и разворачиваем страницу после выборки
+        order_by = [('-' if descending != reverse else '') + name for name, descending in self.fields]
+        queryset = queryset.order_by(*order_by)
+        if position is not None:
+            queryset = queryset.filter(self._after_position_q(position, reverse))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.first_position = self._get_position(rows[0]) if rows else None
+        self.last_position = self._get_position(rows[-1]) if rows else None
+        # Пустая страница при движении назад/вперед: оставляем ссылку туда, откуда пришли
+        if not rows and position is not None:
+            self.first_position = self.last_position = position
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True, cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return min(self.page_size, self.max_page_size)
+
+    def _after_position_q(self, position, reverse):
+        """Лексикографическое условие 'строго после позиции' с учетом направления каждого поля."""
+        condition = Q()
+        equal_prefix = {}
+        for index, (name, descending) in enumerate(self.fields):
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= Q(**equal_prefix, **{f'{name}__{lookup}': position[index]})
+            equal_prefix[name] = position[index]
+        return condition
+
+    def _get_position(self, row):
+        # Поддерживаем как модели, так и словари из .values() (быстрые сериализаторы)
+        if isinstance(row, dict):
+            return [row[name] for name, _ in self.fields]
+        return [getattr(row, name) for name, _ in self.fields]
+
+    # --- Кодирование курсора ---
+    def encode_cursor(self, position, reverse):
+        payload = {'p': [value.isoformat() if hasattr(value, 'isoformat') else value for value in position]}
+        if reverse:
+            payload['r'] = 1
+        token = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request, model):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return False, None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+            raw_position = payload['p']
+            if len(raw_position) != len(self.fields):
+                raise ValueError
+            # to_python приводит строки из курсора к типу поля (datetime, date, int)
+            position = [
+                model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(self.fields, raw_position)
+            ]
+            return bool(payload.get('r')), position
+        except (TypeError, ValueError, KeyError, binascii.Error, UnicodeError, DjangoValidationError):
+            # Испорченный курсор - ошибка запроса (400), а не отсутствующая страница
+            raise ParseError(self.invalid_cursor_message)
+
+    # --- Ответ ---
+    def get_next_link(self):
+        if not self.has_next or self.last_position is None:
+            return None
+        return self.encode_cursor(self.last_position, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_position is None:
+            return None
+        return self.encode_cursor(self.first_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+# --- Классы под существующие сортировки эндпоинтов ---
+
+class PatientPagination(KeysetPagination):
+    ordering = ('last_name', 'first_name', 'id')
+    ranked_query_param = 'search'  # core.search.PatientSearchFilter
+
+
+class ObservationPagination(KeysetPagination):
+    ordering = ('-timestamp', '-id')
+
+
+class MedicalTestPagination(KeysetPagination):
+    ordering = ('-test_date', '-id')
+
+
+class EpisodePagination(KeysetPagination):
+    ordering = ('-start_date', '-id')
+
+
+class SummaryPagination(KeysetPagination):
+    ordering = ('patient_id', 'parameter_id')
@@ -0,0 +1,212 @@
+# backend/core/partitioning.py
+"""
+Декларативное партиционирование таблицы наблюдений (PostgreSQL) по timestamp.
+
+Включается настройкой OBSERVATION_PARTITIONING = 'month' | 'year'. Миграция 0008
+(или `manage.py observation_partitions --convert`) превращает core_observation в
+партиционированную таблицу: PRIMARY KEY становится (id, timestamp) - ключ
+партиционирования обязан входить в уникальные ограничения, а индексы и FK модели
+создаются на родительской таблице и наследуются секциями. Строки вне созданных
+диапазонов попадают в секцию DEFAULT.
+
+Запросы с диапазоном по timestamp (см. research.build_research_filters)
+получают partition pruning; старые секции можно отсоединить (DETACH) для архивации.
+"""
+import copy
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+
+GRANULARITIES = ('month', 'year')
+
+
+def _quote(schema_editor, name):
+    return schema_editor.quote_name(name)
+
+
+def partition_bounds(moment, granularity):
+    """Границы [start, end) секции, содержащей moment (в UTC)."""
+    if granularity == 'year':
+        start = datetime(moment.year, 1, 1, tzinfo=dt_timezone.utc)
+        end = datetime(moment.year + 1, 1, 1, tzinfo=dt_timezone.utc)
+    else:
+        start = datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+        end = datetime(moment.year + (moment.month == 12), moment.month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+    return start, end
+
+
+def partition_name(table, start, granularity):
+    suffix = f'p{start:%Y}' if granularity == 'year' else f'p{start:%Y_%m}'
+    return f'{table}_{suffix}'
+
+
+def default_partition_name(table):
+    return f'{table}_default'
+
+
+def is_partitioned(connection, table):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table]
+        )
+        return cursor.fetchone() is not None
+
+
+def list_partitions(connection, table):
+    """[(имя_секции, выражение_границ)] в порядке имен."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+            ORDER BY c.relname
+            """,
+            [table],
+        )
+        return cursor.fetchall()
+
+
+def create_partition(schema_editor, table, moment, granularity):
+    """
+    Создает секцию, содержащую moment, если ее еще нет. Строки этого диапазона,
+    уже попавшие в DEFAULT, переносятся в новую секцию. Возвращает имя секции.
+    """
+    start, end = partition_bounds(moment, granularity)
+    name = partition_name(table, start, granularity)
+    default = default_partition_name(table)
+    quote = lambda n: _quote(schema_editor, n)  # noqa: E731
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+        if cursor.fetchone()[0]:
+            return name
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [default])
+        has_default = cursor.fetchone()[0]
+        moved = False
+        if has_default:
+            cursor.execute(
+                f'SELECT 1 FROM {quote(default)} WHERE "timestamp" >= %s AND "timestamp" < %s LIMIT 1', [start, end]
+            )
+            moved = cursor.fetchone() is not None
+        if moved:
+            # PostgreSQL не даст создать секцию, пока DEFAULT содержит строки ее диапазона
+            cursor.execute(f'ALTER TABLE {quote(table)} DETACH PARTITION {quote(default)}')
+        cursor.execute(
+            f'CREATE TABLE {quote(name)} PARTITION OF {quote(table)} FOR VALUES FROM (%s) TO (%s)', [start, end]
+        )
+        if moved:
+            cursor.execute(
+                f'WITH moved AS (DELETE FROM {quote(default)} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+                f'INSERT INTO {quote(table)} SELECT * FROM moved', [start, end]
+            )
+            cursor.execute(f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(default)} DEFAULT')
+    return name
+
+
+def ensure_partitions(schema_editor, table, granularity, since, ahead):
+    """Создает секции от since до текущего периода + ahead периодов вперед."""
+    created = []
+    now = datetime.now(dt_timezone.utc)
+    start, _ = partition_bounds(since, granularity)
+    limit, _ = partition_bounds(now, granularity)
+    for _ in range(ahead):
+        _, limit = partition_bounds(limit, granularity)
+    while start <= limit:
+        created.append(create_partition(schema_editor, table, start, granularity))
+        _, start = partition_bounds(start, granularity)
+    return created
+
+
+def detach_partition(schema_editor, table, name, drop=False):
+    """Отсоединяет секцию (остается обычной таблицей для архивации) или удаляет ее."""
+    quote = lambda n: _quote(schema_editor, n)  # noqa: E731
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}')
+        if drop:
+            cursor.execute(f'DROP TABLE {quote(name)}')
+
+
+def _recreate_constraints_and_indexes(schema_editor, model):
+    """
+    FK, индексы полей и Meta.indexes / Meta.constraints модели на новой таблице - публичным
+    API schema editor: alter_field() с "голой" копии поля (без FK и индекса) создает их
+    так же, как Django при изменении поля, с теми же именами, что и create_model().
+    """
+    for field in model._meta.local_fields:
+        has_fk = bool(field.remote_field) and field.db_constraint
+        if field.primary_key or not (has_fk or field.db_index):
+            continue
+        bare = copy.copy(field)
+        bare.db_index = False
+        if has_fk:
+            bare.db_constraint = False
+        schema_editor.alter_field(model, bare, field)
+    for index in model._meta.indexes:
+        schema_editor.add_index(model, index)
+    for constraint in model._meta.constraints:
+        schema_editor.add_constraint(model, constraint)
+
+
+def _copy_table(schema_editor, model, old_table, partition_clause):
+    """
+    Общая часть конвертации: переименовать таблицу, создать новую с теми же колонками,
+    перелить данные, восстановить identity, FK и индексы.
+    """
+    table = model._meta.db_table
+    quote = lambda n: _quote(schema_editor, n)  # noqa: E731
+    schema_editor.execute(f'ALTER TABLE {quote(table)} RENAME TO {quote(old_table)}')
+    schema_editor.execute(f'ALTER INDEX {quote(table + "_pkey")} RENAME TO {quote(old_table + "_pkey")}')
+    schema_editor.execute(
+        f'CREATE TABLE {quote(table)} (LIKE {quote(old_table)} INCLUDING DEFAULTS INCLUDING IDENTITY) {partition_clause}'
+    )
+
+
+def _finish_copy(schema_editor, model, old_table):
+    table = model._meta.db_table
+    quote = lambda n: _quote(schema_editor, n)  # noqa: E731
+    schema_editor.execute(f'INSERT INTO {quote(table)} OVERRIDING SYSTEM VALUE SELECT * FROM {quote(old_table)}')
+    schema_editor.execute(
+        f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE((SELECT MAX(id) FROM {quote(table)}), 0) + 1, false)",
+        [table],
+    )
+    schema_editor.execute(f'DROP TABLE {quote(old_table)}')
+    _recreate_constraints_and_indexes(schema_editor, model)
+
+
+def convert_to_partitioned(schema_editor, model, granularity, ahead=None):
+    """Превращает таблицу модели в партиционированную по timestamp (RANGE)."""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unsupported partitioning granularity: {granularity!r}")
+    connection = schema_editor.connection
+    table = model._meta.db_table
+    if is_partitioned(connection, table):
+        return
+    ahead = settings.OBSERVATION_PARTITIONS_AHEAD if ahead is None else ahead
+    old_table = f'{table}_unpartitioned'
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT MIN("timestamp") FROM {_quote(schema_editor, table)}')
+        since = cursor.fetchone()[0] or datetime.now(dt_timezone.utc)
+
+    _copy_table(schema_editor, model, old_table, 'PARTITION BY RANGE ("timestamp")')
+    schema_editor.execute(f'ALTER TABLE {_quote(schema_editor, table)} ADD PRIMARY KEY (id, "timestamp")')
+    ensure_partitions(schema_editor, table, granularity, since, ahead)
+    schema_editor.execute(
+        f'CREATE TABLE {_quote(schema_editor, default_partition_name(table))} '
+        f'PARTITION OF {_quote(schema_editor, table)} DEFAULT'
+    )
+    _finish_copy(schema_editor, model, old_table)
+
+
+def convert_to_regular(schema_editor, model):
+    """Обратная операция: партиционированная таблица -> обычная (для отката миграции)."""
+    connection = schema_editor.connection
+    table = model._meta.db_table
+    if not is_partitioned(connection, table):
+        return
+    old_table = f'{table}_partitioned'
+    _copy_table(schema_editor, model, old_table, '')
+    schema_editor.execute(f'ALTER TABLE {_quote(schema_editor, table)} ADD PRIMARY KEY (id)')
+    _finish_copy(schema_editor, model, old_table)
@@ -0,0 +1,81 @@
+# backend/core/renderers.py
+import json
+
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен - без него работаем через stdlib json
+    orjson = None
+
+# Типы, которых orjson не знает (Decimal, UUID, lazy-строки, QuerySet, ...), - как в DRF
+_drf_encoder = encoders.JSONEncoder()
+if orjson is not None:
+    # numpy-массивы/скаляры, ключи-не-строки, 'Z' для UTC - как у DRF JSONEncoder
+    ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+
+
+def dumps_json(data):
+    """JSON в bytes: через orjson, если он установлен, иначе stdlib json с энкодером DRF."""
+    if orjson is not None:
+        return orjson.dumps(data, default=_drf_encoder.default, option=ORJSON_OPTIONS)
+    return json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    """
+    JSONRenderer на orjson: datetime, numpy и dataclass сериализуются нативно,
+    остальное - через JSONEncoder DRF. Без orjson (или при запросе с отступами,
+    которые orjson не поддерживает) - обычный JSONRenderer.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps_json(data)
+
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    """
+    Newline-delimited JSON: один объект на строку.
+    Используется для выгрузок исследовательских данных (?format=ndjson).
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        items = data if isinstance(data, (list, tuple)) else [data]
+        return ''.join(dumps_ndjson_line(item) for item in items).encode(self.charset)
+
+
+def dumps_ndjson_line(item):
+    """Сериализует один объект в строку NDJSON (с завершающим переводом строки)."""
+    return dumps_json(item).decode('utf-8') + '\n'
+
+
+class ColumnarRenderer(renderers.BaseRenderer):
+    """
+    Заглушка для согласования формата (?format=parquet / ?format=arrow): сами данные
+    пишутся потоком в core/columnar.py, через рендерер проходят только ответы об ошибках.
+    """
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps_json(data)
+
+
+class ParquetRenderer(ColumnarRenderer):
+    media_type = 'application/vnd.apache.parquet'
+    format = 'parquet'
+
+
+class ArrowRenderer(ColumnarRenderer):
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
@@ -0,0 +1,278 @@
+# backend/core/research.py
+"""
+Выборки для исследовательских запросов (ResearchQueryView) и их потоковая выгрузка.
+
+Потоковый режим читает пациентов с наблюдениями одним упорядоченным курсором
+(LEFT JOIN, .values_list().iterator()), поэтому память не растет с размером
+когорты, а первые байты уходят клиенту сразу.
+"""
+import copy
+import csv
+import hashlib
+import json
+
+from django.conf import settings
+from django.db.models import F, FilteredRelation, Q
+from django.http import StreamingHttpResponse
+
+# ResearchQueryError и research_query_dict импортируют отсюда
+from .criteria import ResearchCriteria, ResearchQueryError, research_query_dict  # noqa: F401
+from .cohorts import cohort_research_query, ensure_current, get_cohort
+from .criteria import PATIENT_CRITERIA
+from .models import MedicalTestAnswer, Observation, Patient
+from .renderers import dumps_json, dumps_ndjson_line
+
+# Поля строки выгрузки (совпадают с ключами, которые ResearchQueryView отдавал всегда)
+PATIENT_COLUMNS = (
+    'patient_id', 'last_name', 'first_name', 'middle_name',
+    'date_of_birth', 'clinic_id', 'primary_diagnosis_code',
+)
+OBSERVATION_COLUMNS = (
+    'observation_timestamp', 'parameter_code', 'parameter_name', 'unit',
+    'value', 'value_numeric', 'episode_id',
+)
+# CSVRenderer сортирует заголовки по алфавиту - сохраняем тот же порядок колонок
+CSV_HEADER = tuple(sorted(PATIENT_COLUMNS + OBSERVATION_COLUMNS))
+
+# Число полей пациента в начале строки research_queryset
+PATIENT_FIELD_COUNT = 7
+
+# Сколько строк склеивать в один chunk ответа (слишком мелкие chunk'и дороги для WSGI)
+STREAM_ROWS_PER_CHUNK = 500
+
+
+def resolve_research_query(query_params):
+    """
+    (patient_qs, ResearchCriteria) по параметрам запроса. С ?cohort_id= пациенты берутся
+    из сохраненного состава когорты (core/cohorts.py), а не из критериев.
+    Бросает ResearchQueryError при некорректных значениях (см. core/criteria.py).
+    """
+    if query_params.get('cohort_id'):
+        return cohort_research_query(query_params)
+    criteria = ResearchCriteria.from_params(query_params)
+    return criteria.patient_queryset(), criteria
+
+
+def build_research_filters(query_params):
+    """Разбирает параметры запроса и возвращает (patient_qs, observation_filter)."""
+    patient_qs, criteria = resolve_research_query(query_params)
+    return patient_qs, criteria.observation_filter()
+
+
+def _relative_to(condition, relation):
+    """Копия Q с путями полей от relation ('timestamp__gte' -> 'observations__timestamp__gte')."""
+    relative = copy.copy(condition)
+    relative.children = [
+        _relative_to(child, relation) if isinstance(child, Q) else (f'{relation}__{child[0]}', child[1])
+        for child in condition.children
+    ]
+    return relative
+
+
+def research_queryset(patient_qs, observation_filter):
+    """
+    Пациенты LEFT JOIN подходящие наблюдения одним запросом, по пациенту и времени.
+    Один запрос - один снимок БД: пациент, переименованный или удаленный во время
+    выгрузки, не рассогласует пациентов и наблюдения.
+    У пациента без наблюдений - одна строка с NULL в полях наблюдения.
+    """
+    return (
+        patient_qs
+        .annotate(research_obs=FilteredRelation('observations', condition=_relative_to(observation_filter, 'observations')))
+        .order_by('last_name', 'first_name', 'id', 'research_obs__timestamp', 'research_obs__id')
+        .values_list('id', 'last_name', 'first_name', 'middle_name',
+                     'date_of_birth', 'clinic_id', 'primary_diagnosis_mkb_id',
+                     'research_obs__id', 'research_obs__timestamp', 'research_obs__parameter_id',
+                     'research_obs__parameter__name', 'research_obs__parameter__unit', 'research_obs__value',
+                     'research_obs__value_numeric', 'research_obs__episode_id')
+    )
+
+
+def iter_research_records(patient_qs, observation_filter, chunk_size=None):
+    """
+    Пары (patient, observation) кортежей в исходных типах БД из одного курсора.
+    Для пациента без наблюдений observation = None. Общая основа текстовых
+    (iter_research_rows) и колоночных (core/columnar.py) выгрузок.
+    """
+    chunk_size = chunk_size or settings.RESEARCH_EXPORT_CHUNK_SIZE
+    patient = None
+    for row in research_queryset(patient_qs, observation_filter).iterator(chunk_size=chunk_size):
+        if patient is None or patient[0] != row[0]:
+            patient = row[:PATIENT_FIELD_COUNT]  # Один кортеж на пациента: потребители сравнивают по is
+        if row[PATIENT_FIELD_COUNT] is None:
+            yield patient, None
+        else:
+            yield patient, (row[0], *row[PATIENT_FIELD_COUNT + 1:])
+
+
+def iter_research_rows(patient_qs, observation_filter, chunk_size=None):
+    """
+    Генератор плоских строк выгрузки (dict) в том же виде, что и обычный ответ
+    ResearchQueryView: пациент без наблюдений дает одну строку только с полями пациента.
+    """
+    current_patient = patient_info = None
+    for patient, obs in iter_research_records(patient_qs, observation_filter, chunk_size):
+        if patient is not current_patient:
+            current_patient = patient
+            patient_id, last_name, first_name, middle_name, dob, clinic_id, diagnosis_code = patient
+            patient_info = {
+                'patient_id': patient_id,
+                'last_name': last_name,
+                'first_name': first_name,
+                'middle_name': middle_name,
+                'date_of_birth': dob.strftime('%Y-%m-%d') if dob else '',
+                'clinic_id': clinic_id,
+                'primary_diagnosis_code': diagnosis_code or '',
+            }
+        if obs is None:
+            yield patient_info
+            continue
+        _, timestamp, parameter_code, parameter_name, unit, value, value_numeric, episode_id = obs
+        yield {
+            **patient_info,
+            'observation_timestamp': timestamp.isoformat() if timestamp else '',
+            'parameter_code': parameter_code or '',
+            'parameter_name': parameter_name or '',
+            'unit': unit or '',
+            'value': value,
+            'value_numeric': value_numeric,
+            'episode_id': episode_id if episode_id is not None else '',
+        }
+
+
+# --- Нормализация параметров (для фоновых заданий, core/jobs.py) ---
+
+RESEARCH_PARAMS = ('cohort_id', 'diagnosis_mkb', 'age_min', 'age_max', 'param_codes', 'start_date', 'end_date')
+RESEARCH_LIST_PARAMS = ('param_codes',)
+
+
+def normalize_research_params(data):
+    """
+    Канонический dict параметров выборки из query_params/тела запроса (QueryDict или JSON).
+    Порядок и повторы кодов, регистр диагноза и пустые значения не влияют на результат,
+    поэтому одинаковые по смыслу запросы дают одинаковый хэш.
+    """
+    normalized = {}
+    for key in RESEARCH_PARAMS:
+        if key in RESEARCH_LIST_PARAMS:
+            values = data.getlist(key) if hasattr(data, 'getlist') else data.get(key)
+            if isinstance(values, str):
+                values = values.split(',')
+            values = sorted({str(value).strip() for value in values or () if str(value).strip()})
+            if values:
+                normalized[key] = values
+            continue
+        value = data.get(key)
+        value = str(value).strip() if value is not None else ''
+        if not value:
+            continue
+        if key == 'diagnosis_mkb':
+            value = value.upper()  # Фильтр по диагнозу без учета регистра (iexact)
+        elif key in ('cohort_id', 'age_min', 'age_max'):
+            try:
+                value = str(int(value))
+            except ValueError:
+                pass  # Ошибку сообщит build_research_filters
+        normalized[key] = value
+    return normalized
+
+
+def research_params_hash(params, export_format):
+    payload = json.dumps({'format': export_format, 'params': params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# --- Потоковые writer'ы: генераторы строк для StreamingHttpResponse ---
+
+class _Echo:
+    """Псевдо-файл для csv.writer: возвращает записанную строку вместо записи."""
+    def write(self, value):
+        return value
+
+
+def _batched(lines):
+    """Склеивает строки в chunk'и по STREAM_ROWS_PER_CHUNK штук."""
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= STREAM_ROWS_PER_CHUNK:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER)  # Заголовок уходит до выполнения запроса
+    yield from _batched(writer.writerow([row.get(column) for column in CSV_HEADER]) for row in rows)
+
+
+def stream_ndjson(rows):
+    yield from _batched(dumps_ndjson_line(row) for row in rows)
+
+
+def stream_json(rows):
+    yield '['
+    yield from _batched((',' if i else '') + dumps_json(row).decode('utf-8') for i, row in enumerate(rows))
+    yield ']'
+
+
+STREAM_WRITERS = {
+    'csv': (stream_csv, 'text/csv; charset=utf-8', 'csv'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson; charset=utf-8', 'ndjson'),
+    'json': (stream_json, 'application/json', 'json'),
+}
+
+
+def research_streaming_response(patient_qs, observation_filter, export_format):
+    """StreamingHttpResponse с выгрузкой в формате csv / ndjson / json."""
+    writer, content_type, extension = STREAM_WRITERS.get(export_format, STREAM_WRITERS['ndjson'])
+    response = StreamingHttpResponse(writer(iter_research_rows(patient_qs, observation_filter)), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="research_export.{extension}"'
+    response['X-Accel-Buffering'] = 'no'  # Не даем nginx буферизовать поток целиком
+    return response
+
+
+# --- Ответы на пункты тестов (MedicalTestAnswer, core/extraction.py) ---
+
+TEST_ANSWER_COLUMNS = (
+    'patient_id', 'medical_test_id', 'test_name', 'test_date', 'position', 'item', 'answer', 'value_numeric',
+)
+
+
+def test_answer_queryset(query_params):
+    """
+    Ответы из разобранных файлов тестов: пациенты - по diagnosis_mkb / age_min / age_max
+    или из когорты (?cohort_id=), ?test_name= (без учета регистра), ?items= (пункты, можно
+    несколько), start_date / end_date - по дате теста. Значения - словари TEST_ANSWER_COLUMNS.
+    """
+    criteria = ResearchCriteria.from_params(query_params, require_param_codes=False)
+    if query_params.get('cohort_id'):
+        conflicting = [key for key in PATIENT_CRITERIA if query_params.get(key)]
+        if conflicting:
+            raise ResearchQueryError(f"Parameter(s) {', '.join(conflicting)} cannot be combined with 'cohort_id'.")
+        cohort = ensure_current(get_cohort(query_params.get('cohort_id')))
+        patients = Patient.objects.filter(cohort_memberships__cohort_id=cohort.pk)
+    else:
+        patients = Patient.objects.filter(criteria.patient_filter())
+
+    answers = MedicalTestAnswer.objects.filter(medical_test__patient__in=patients.values('id'))
+    test_name = (query_params.get('test_name') or '').strip()
+    if test_name:
+        answers = answers.filter(medical_test__test_name__iexact=test_name)
+    items = [item.strip() for item in query_params.getlist('items') if item.strip()]
+    if items:
+        answers = answers.filter(item__in=items)
+    if criteria.start_date:
+        answers = answers.filter(medical_test__test_date__gte=criteria.start_date)
+    if criteria.end_date:
+        answers = answers.filter(medical_test__test_date__lte=criteria.end_date)
+    return (
+        answers.order_by('medical_test__patient_id', 'medical_test__test_date', 'medical_test_id', 'position')
+        .values(
+            'medical_test_id', 'position', 'item', 'answer', 'value_numeric',
+            patient_id=F('medical_test__patient_id'), test_name=F('medical_test__test_name'),
+            test_date=F('medical_test__test_date'),
+        )
+    )
@@ -0,0 +1,258 @@
+# backend/core/search.py
+"""
+Поиск по справочнику МКБ для автодополнения (MKBCodeSearchView) и поиск пациентов
+(PatientSearchFilter для PatientViewSet).
+
+- Строка, похожая на код ('C71', 'c71.0'), ищется по префиксу кода:
+  code LIKE 'C71%' обслуживается B-tree индексом varchar_pattern_ops
+  (core_mkbcode_code_..._like, Django создает его для CharField-ключа).
+- Остальные строки ищутся по названию: на PostgreSQL с pg_trgm - GIN-индекс
+  gin_trgm_ops (миграция 0010) и ранжирование по word_similarity;
+  без pg_trgm (SQLite в тестах, БД без расширения) - отсортированный массив
+  в памяти процесса, построенный из кэша справочника.
+
+Результат всегда ограничен top-N (?limit=) и упорядочен по релевантности.
+
+Пациенты: точное совпадение clinic_id идет первым, затем совпадения по ФИО.
+Строка разбивается на слова ("Иванов И." -> Иванов, И): слова от 3 букв ищутся
+по выражению UPPER(фамилия || ' ' || имя || ' ' || отчество) с GIN-индексом
+gin_trgm_ops (миграция 0011, индекс поддерживается самой БД при любом сохранении),
+с допуском опечаток через word_similarity; короткие слова считаются инициалами.
+"""
+import bisect
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, Case, FloatField, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+from .cache import MKB_CODES, get_cached
+from .models import MKBCode
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Буква + цифра (+ продолжение кода): 'C7', 'c71.0', 'Z00'
+CODE_TERM_RE = re.compile(r'^[A-Za-z]\d[\dA-Za-z.\-]*$')
+
+_trigram_available = {}
+
+
+class SearchQueryError(ValueError):
+    """Некорректные параметры поиска (отдается клиенту как 400)."""
+
+
+def parse_limit(raw_value):
+    if not raw_value:
+        return DEFAULT_LIMIT
+    try:
+        limit = int(raw_value)
+    except ValueError:
+        raise SearchQueryError("Query parameter 'limit' must be an integer.")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise SearchQueryError(f"Query parameter 'limit' must be between 1 and {MAX_LIMIT}.")
+    return limit
+
+
+def trigram_available(using='default'):
+    """Установлено ли расширение pg_trgm (результат запоминается на процесс)."""
+    if using not in _trigram_available:
+        connection = connections[using]
+        available = False
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                available = cursor.fetchone() is not None
+        _trigram_available[using] = available
+    return _trigram_available[using]
+
+
+def is_code_term(term):
+    return bool(CODE_TERM_RE.match(term))
+
+
+# --- PostgreSQL ---
+
+# Запросы вынесены отдельно - их же печатает manage.py explain_queries
+
+def mkb_code_prefix_queryset(term, limit):
+    return MKBCode.objects.filter(code__startswith=term.upper()).order_by('code')[:limit]
+
+
+def mkb_trigram_query(term, limit):
+    """
+    (sql, params) поиска по названию: name ILIKE '%term%' и term <% name (порог
+    pg_trgm.word_similarity_threshold) используют один GIN-индекс (gin_trgm_ops).
+    """
+    sql = """
+        SELECT code, name
+        FROM core_mkbcode
+        WHERE name ILIKE %s OR %s <%% name
+        ORDER BY (name ILIKE %s) DESC, word_similarity(%s, name) DESC, code
+        LIMIT %s
+    """
+    return sql, [f'%{_escape_like(term)}%', term, f'{_escape_like(term)}%', term, limit]
+
+
+def _search_codes_db(term, limit):
+    return list(mkb_code_prefix_queryset(term, limit))
+
+
+def _search_names_trigram(term, limit):
+    return list(MKBCode.objects.raw(*mkb_trigram_query(term, limit)))
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+# --- Запасной вариант в памяти процесса ---
+
+class MKBIndex:
+    """Отсортированные массивы кодов и названий в нижнем регистре для поиска без pg_trgm."""
+    def __init__(self, rows):
+        self.rows = sorted(rows)  # [(code, name)] по коду
+        self.codes = [code.upper() for code, _ in self.rows]
+        self.names = [name.lower() for _, name in self.rows]
+
+    def search_codes(self, term, limit):
+        term = term.upper()
+        start = bisect.bisect_left(self.codes, term)
+        found = []
+        for index in range(start, min(start + limit, len(self.codes))):
+            if not self.codes[index].startswith(term):
+                break
+            found.append(self.rows[index])
+        return found
+
+    def search_names(self, term, limit):
+        term = term.lower()
+        ranked = []
+        for index, name in enumerate(self.names):
+            position = name.find(term)
+            if position < 0:
+                continue
+            # Начало названия > начало слова > вхождение внутри слова
+            if position == 0:
+                rank = 0
+            elif not name[position - 1].isalnum():
+                rank = 1
+            else:
+                rank = 2
+            ranked.append((rank, index))
+        ranked.sort()
+        return [self.rows[index] for _, index in ranked[:limit]]
+
+
+def get_memory_index():
+    _, index = get_cached(MKB_CODES, lambda: MKBIndex(MKBCode.objects.values_list('code', 'name')), variant='index')
+    return index
+
+
+# --- Точка входа ---
+
+def search_mkb(term, limit=DEFAULT_LIMIT):
+    """До limit кодов МКБ [(code, name)] для строки term, в порядке релевантности."""
+    term = term.strip()
+    if not term:
+        return []
+    found = []
+    if is_code_term(term):
+        if connections['default'].vendor == 'postgresql':
+            found = [(m.code, m.name) for m in _search_codes_db(term, limit)]
+        else:
+            found = get_memory_index().search_codes(term, limit)
+    if not found:
+        # Обычный текст или строка-код без совпадений по коду - ищем по названию
+        if trigram_available():
+            found = [(m.code, m.name) for m in _search_names_trigram(term, limit)]
+        else:
+            found = get_memory_index().search_names(term, limit)
+    return found
+
+
+# --- Поиск пациентов ---
+
+# То же выражение, что и в индексе core_patient_full_name_trgm_idx (миграция 0011)
+PATIENT_NAME_EXPRESSION = (
+    "UPPER(\"core_patient\".\"last_name\" || ' ' || \"core_patient\".\"first_name\" || ' ' "
+    "|| COALESCE(\"core_patient\".\"middle_name\", ''))"
+)
+# Короче - инициал ("И."): триграммы для него не строятся, ищем по началу имени/отчества
+MIN_TRIGRAM_TOKEN = 3
+TOKEN_RE = re.compile(r'[\w-]+')
+
+
+def tokenize(term):
+    # Регистр сохраняем: SQLite (запасной путь) сравнивает без учета регистра только латиницу
+    return TOKEN_RE.findall(term)
+
+
+def _name_token_q(token, use_trigram):
+    if len(token) < MIN_TRIGRAM_TOKEN:
+        return Q(first_name__istartswith=token) | Q(middle_name__istartswith=token) | Q(last_name__istartswith=token)
+    if use_trigram:
+        # Подстрока (LIKE) или слово с опечаткой (<%) - оба условия обслуживает один GIN-индекс
+        return Q(RawSQL(
+            f"({PATIENT_NAME_EXPRESSION} LIKE %s OR %s <%% {PATIENT_NAME_EXPRESSION})",
+            [f'%{_escape_like(token.upper())}%', token.upper()],
+            output_field=BooleanField(),
+        ))
+    return Q(last_name__icontains=token) | Q(first_name__icontains=token) | Q(middle_name__icontains=token)
+
+
+def search_patients(queryset, term):
+    """Фильтрует и ранжирует пациентов: clinic_id, затем фамилия с начала, затем сходство ФИО."""
+    term = term.strip()
+    tokens = tokenize(term)
+    use_trigram = trigram_available(queryset.db)
+
+    condition = Q(clinic_id=term)
+    if tokens:
+        name_q = Q()
+        for token in tokens:
+            name_q &= _name_token_q(token, use_trigram)
+        condition |= name_q
+    queryset = queryset.filter(condition).annotate(
+        search_clinic_hit=Case(When(clinic_id=term, then=Value(1)), default=Value(0), output_field=IntegerField()),
+    )
+    ordering = ['-search_clinic_hit']
+    if tokens:
+        queryset = queryset.annotate(
+            search_last_name_hit=Case(
+                When(last_name__iexact=tokens[0], then=Value(2)),
+                When(last_name__istartswith=tokens[0], then=Value(1)),
+                default=Value(0), output_field=IntegerField(),
+            ),
+        )
+        ordering.append('-search_last_name_hit')
+        if use_trigram:
+            queryset = queryset.annotate(search_rank=RawSQL(
+                f"word_similarity(%s, {PATIENT_NAME_EXPRESSION})", [' '.join(tokens).upper()], output_field=FloatField()
+            ))
+            ordering.append('-search_rank')
+    return queryset.order_by(*ordering, 'last_name', 'first_name', 'id')
+
+
+class PatientSearchFilter(filters.BaseFilterBackend):
+    """
+    ?search= для пациентов с ранжированием (вместо SearchFilter c icontains по четырем полям).
+    Пагинатор отдает по такому запросу одну страницу лучших совпадений (см. KeysetPagination.ranked_query_param).
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+        return search_patients(queryset, term)
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            'name': self.search_param,
+            'required': False,
+            'in': 'query',
+            'description': 'clinic_id или ФИО (например "Иванов И.")',
+            'schema': {'type': 'string'},
+        }]
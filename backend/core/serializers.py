@@ -1,10 +1,17 @@
 # backend/core/serializers.py
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from django.contrib.auth import get_user_model
 from django.db import models # Импортируем models для Prefetch
 
 # --- Импорты моделей ---
-from .models import Patient, ParameterCode, Observation, MKBCode, MedicalTest, HospitalizationEpisode
+from .models import (
+    Patient, ParameterCode, Observation, MKBCode, MedicalTest, HospitalizationEpisode, PatientParameterSummary,
+    ResearchExportJob, Cohort, MedicalTestUpload, MedicalTestExtraction, MedicalTestAnswer,
+)
+from .cache import parameter_code_map
+from .criteria import ResearchCriteria, ResearchQueryError, research_query_dict
+from .research import normalize_research_params
 
 User = get_user_model()
 
@@ -24,6 +31,23 @@ class ParameterCodeSerializer(serializers.ModelSerializer):
         fields = ['code', 'name', 'unit', 'description', 'is_numeric']
 
 
+class CachedParameterCodeField(serializers.SlugRelatedField):
+    """Код параметра ('HB') -> ParameterCode из кэша справочника, без загрузки строки на каждую запись"""
+    def __init__(self, **kwargs):
+        kwargs.setdefault('slug_field', 'code')
+        kwargs.setdefault('queryset', ParameterCode.objects.all())
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        parameter = parameter_code_map().get(data) if isinstance(data, str) else None
+        # Локальный кэш процесса живет до REFERENCE_CACHE_LOCAL_TTL после изменения справочника:
+        # удаленный за это время код отсеиваем exists() по PK, иначе запись упала бы на FK (500, а не 400)
+        if parameter is not None and self.get_queryset().filter(pk=parameter.pk).exists():
+            return parameter
+        # Промах кэша, удаленный код или некорректное значение - обычная проверка через БД с ее сообщениями
+        return super().to_internal_value(data)
+
+
 # --- Основные Сериализаторы для CRUD ---
 
 class HospitalizationEpisodeSerializer(serializers.ModelSerializer):
@@ -50,10 +74,7 @@ class HospitalizationEpisodeSerializer(serializers.ModelSerializer):
 class ObservationSerializer(serializers.ModelSerializer):
     """Сериализатор для Наблюдений (Observation) (для CRUD и списков)"""
     # Позволяет записывать/читать параметр по его коду ('HB', 'TEMP')
-    parameter = serializers.SlugRelatedField(
-        queryset=ParameterCode.objects.all(),
-        slug_field='code'
-    )
+    parameter = CachedParameterCodeField()
     # Ожидаем ID пациента при создании/обновлении
     patient = serializers.PrimaryKeyRelatedField(queryset=Patient.objects.all())
     # Эпизод по ID, необязательно
@@ -64,7 +85,8 @@ class ObservationSerializer(serializers.ModelSerializer):
     # Для отображения параметра можно добавить поле с деталями
     parameter_details = ParameterCodeSerializer(source='parameter', read_only=True)
     recorded_by_display = serializers.CharField(source='recorded_by.username', read_only=True, allow_null=True)
-    episode_display = serializers.CharField(source='episode.__str__', read_only=True, allow_null=True)
+    # source='episode' (а не 'episode.__str__'): для наблюдения без эпизода DRF отдает null
+    episode_display = serializers.CharField(source='episode', read_only=True, allow_null=True)
 
     class Meta:
         model = Observation
@@ -93,12 +115,33 @@ class ObservationSerializer(serializers.ModelSerializer):
     # Валидацию можно добавить здесь, если нужно
 
 
+class PatientParameterSummarySerializer(serializers.ModelSerializer):
+    """Сводка по показателю пациента (только чтение)"""
+    patient = serializers.PrimaryKeyRelatedField(read_only=True)
+    parameter = serializers.SlugRelatedField(slug_field='code', read_only=True)
+    parameter_name = serializers.CharField(source='parameter.name', read_only=True)
+    unit = serializers.CharField(source='parameter.unit', read_only=True)
+    value_mean = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = PatientParameterSummary
+        fields = [
+            'patient', 'parameter', 'parameter_name', 'unit',
+            'observation_count', 'numeric_count',
+            'value_min', 'value_max', 'value_mean',
+            'first_timestamp', 'last_timestamp', 'last_value', 'last_value_numeric',
+            'updated_at',
+        ]
+        read_only_fields = fields
+
+
 class MedicalTestSerializer(serializers.ModelSerializer):
     """Сериализатор для Медицинских тестов/Опросников (для CRUD и списков)"""
     patient = serializers.PrimaryKeyRelatedField(queryset=Patient.objects.all())
     uploaded_by = serializers.SlugRelatedField(slug_field='username', read_only=True, allow_null=True) # Отображаем username
     patient_display = serializers.CharField(source='patient.__str__', read_only=True)
     file_url = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
     file_name = serializers.CharField(source='filename', read_only=True)
 
     class Meta:
@@ -111,6 +154,7 @@ class MedicalTestSerializer(serializers.ModelSerializer):
             'test_date',
             'uploaded_file', # Для ЗАПИСИ файла
             'file_url',      # Для ЧТЕНИЯ URL
+            'download_url',  # Скачивание с проверкой прав (core/downloads.py)
             'file_name',     # Для ЧТЕНИЯ имени файла
             'score',
             'result_text',
@@ -120,7 +164,7 @@ class MedicalTestSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = [
             'id', 'patient_display', 'uploaded_by',
-            'file_url', 'file_name', 'created_at', 'updated_at'
+            'file_url', 'download_url', 'file_name', 'created_at', 'updated_at'
         ]
         extra_kwargs = {
             # write_only=True скрывает поле из GET-ответов
@@ -135,6 +179,11 @@ class MedicalTestSerializer(serializers.ModelSerializer):
             except ValueError: return None
         return None
 
+    def get_download_url(self, obj):
+        if not obj.uploaded_file:
+            return None
+        return reverse('medicaltest-download', args=[obj.pk], request=self.context.get('request'))
+
 
 class PatientSerializer(serializers.ModelSerializer):
     """Сериализатор для модели Пациента (для CRUD и списков)"""
@@ -204,3 +253,89 @@ class ResearchPatientSerializer(serializers.ModelSerializer):
             'observations',
         ]
         read_only_fields = fields # Весь сериализатор только для чтения
+
+
+class ResearchExportJobSerializer(serializers.ModelSerializer):
+    """Статус фоновой выгрузки; download_url появляется, когда файл готов"""
+    created_by = serializers.SlugRelatedField(slug_field='username', read_only=True, allow_null=True)
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ResearchExportJob
+        fields = [
+            'id', 'status', 'export_format', 'params', 'row_count', 'error', 'created_by',
+            'created_at', 'started_at', 'finished_at', 'expires_at', 'download_url',
+        ]
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        if obj.status != ResearchExportJob.STATUS_DONE or not obj.result_file:
+            return None
+        return reverse('research-job-download', args=[obj.pk], request=self.context.get('request'))
+
+
+class CohortSerializer(serializers.ModelSerializer):
+    """
+    Сохраненная когорта. criteria - те же параметры, что у /api/research/query/
+    (diagnosis_mkb, age_min, age_max, param_codes, start_date, end_date), хранятся нормализованными.
+    """
+    created_by = serializers.SlugRelatedField(slug_field='username', read_only=True, allow_null=True)
+    member_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Cohort
+        fields = [
+            'id', 'name', 'description', 'criteria', 'member_count', 'evaluated_on', 'membership_version',
+            'created_by', 'created_at', 'updated_at',
+        ]
+        read_only_fields = ['evaluated_on', 'membership_version', 'created_at', 'updated_at']
+
+    def get_member_count(self, obj):
+        # В списке - аннотация Count из get_queryset, после создания/пересчета - отдельный запрос
+        if hasattr(obj, 'member_count'):
+            return obj.member_count
+        return obj.memberships.count()
+
+    def validate_criteria(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Expected an object with research criteria.")
+        criteria = normalize_research_params(value)
+        criteria.pop('cohort_id', None)  # Когорта не может ссылаться на другую когорту
+        try:
+            ResearchCriteria.from_params(research_query_dict(criteria), require_param_codes=False)
+        except ResearchQueryError as exc:
+            raise serializers.ValidationError(str(exc))
+        return criteria
+
+
+class MedicalTestUploadSerializer(serializers.ModelSerializer):
+    """Состояние докачиваемой загрузки: offset - сколько байт уже принято (с него продолжать)."""
+    offset = serializers.IntegerField(source='received_bytes', read_only=True)
+    upload_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = MedicalTestUpload
+        fields = ['id', 'medical_test', 'filename', 'size', 'offset', 'sha256', 'status', 'upload_url', 'created_at', 'updated_at']
+        read_only_fields = fields
+
+    def get_upload_url(self, obj):
+        return reverse('medicaltest-upload-detail', args=[obj.pk], request=self.context.get('request'))
+
+
+class MedicalTestExtractionSerializer(serializers.ModelSerializer):
+    """Статус фонового разбора файла теста (core/extraction.py) и что из него извлечено."""
+
+    class Meta:
+        model = MedicalTestExtraction
+        fields = [
+            'id', 'medical_test', 'file_name', 'extractor', 'status', 'item_count', 'score', 'result_text', 'error',
+            'created_at', 'started_at', 'finished_at',
+        ]
+        read_only_fields = fields
+
+
+class MedicalTestAnswerSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MedicalTestAnswer
+        fields = ['position', 'item', 'answer', 'value_numeric']
+        read_only_fields = fields
@@ -0,0 +1,117 @@
+# backend/core/signals.py
+"""
+Обработчики сигналов моделей. Подключаются в CoreConfig.ready().
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import MKB_CODES, PARAMETER_CODES, bump_version
+from .cohorts import refresh_patient_memberships
+from .extraction import schedule_extraction
+from .models import MedicalTest, MedicalTestUpload, MKBCode, Observation, ParameterCode, Patient
+from .summaries import apply_created_observation, refresh_summaries
+from .uploads import delete_part_file
+
+
+# --- Сводки по показателям (PatientParameterSummary) ---
+# Сводка обновляется в той же транзакции, что и наблюдение: откат отменяет и ее,
+# а upsert строки сводки сериализует конкурентные изменения одной пары.
+# Удаление наблюдений - в Observation.delete() и ObservationQuerySet.delete() (см. core/models.py).
+
+@receiver(pre_save, sender=Observation)
+def remember_observation_pair(sender, instance, raw=False, **kwargs):
+    # При изменении пациента/показателя нужно пересчитать и старую пару
+    if instance.pk and not raw:
+        instance._summary_previous_pair = (
+            Observation.objects.filter(pk=instance.pk).values_list('patient_id', 'parameter_id').first()
+        )
+
+
+@receiver(post_save, sender=Observation)
+def update_summary_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        apply_created_observation(instance)
+        return
+    pairs = {(instance.patient_id, instance.parameter_id)}
+    previous = getattr(instance, '_summary_previous_pair', None)
+    if previous:
+        pairs.add(previous)
+    refresh_summaries(pairs)
+
+
+
+# --- Состав сохраненных когорт (core/cohorts.py) ---
+# Удаление пациента убирает его из когорт каскадно; при сохранении перепроверяется
+# только он сам и только если могли измениться поля критериев.
+
+COHORT_PATIENT_FIELDS = {'date_of_birth', 'primary_diagnosis_mkb', 'primary_diagnosis_mkb_id'}
+
+
+@receiver(post_save, sender=Patient)
+def update_cohorts_on_patient_save(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    if not created and update_fields is not None and not COHORT_PATIENT_FIELDS & set(update_fields):
+        return
+    refresh_patient_memberships([instance.pk])
+
+
+# --- Файлы тестов в контентно-адресуемом хранилище (core/storage.py) ---
+# Ссылка на blob снимается при удалении теста и при замене файла; сам blob
+# удаляется после коммита, когда ссылок не осталось. Новый файл ставится в очередь разбора.
+
+@receiver(pre_save, sender=MedicalTest)
+def remember_test_file(sender, instance, raw=False, update_fields=None, **kwargs):
+    if instance.pk and not raw and (update_fields is None or 'uploaded_file' in update_fields):
+        instance._previous_file_name = (
+            MedicalTest.objects.filter(pk=instance.pk).values_list('uploaded_file', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=MedicalTest)
+def on_test_file_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    current = instance.uploaded_file.name if instance.uploaded_file else None
+    # Без запомненного имени (update_fields без uploaded_file) файл не менялся
+    known = '_previous_file_name' in instance.__dict__
+    previous = instance.__dict__.pop('_previous_file_name', None)
+    changed = previous != current if created or known else False
+    if previous and changed:
+        instance.uploaded_file.storage.release(previous)
+    if changed and current:
+        # Новый файл - фоновый разбор ответов и итога (core/extraction.py), если формат поддерживается
+        schedule_extraction(instance)
+
+
+@receiver(post_delete, sender=MedicalTest)
+def release_deleted_test_file(sender, instance, **kwargs):
+    if instance.uploaded_file:
+        instance.uploaded_file.storage.release(instance.uploaded_file.name)
+
+
+# --- Докачиваемые загрузки (core/uploads.py) ---
+# Отмена, очистка по сроку и удаление теста убирают и временный файл незавершенной загрузки
+
+@receiver(post_delete, sender=MedicalTestUpload)
+def delete_upload_part(sender, instance, **kwargs):
+    delete_part_file(instance)
+
+
+# --- Кэш справочников (core/cache.py) ---
+# Версия меняется после коммита: иначе параллельный запрос успел бы закэшировать
+# старые данные уже под новой версией.
+
+@receiver(post_save, sender=ParameterCode)
+@receiver(post_delete, sender=ParameterCode)
+def invalidate_parameter_codes(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(PARAMETER_CODES))
+
+
+@receiver(post_save, sender=MKBCode)
+@receiver(post_delete, sender=MKBCode)
+def invalidate_mkb_codes(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(MKB_CODES))
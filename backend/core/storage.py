@@ -0,0 +1,271 @@
+# backend/core/storage.py
+"""
+Контентно-адресуемое хранилище файлов тестов (MedicalTest.uploaded_file).
+
+Одинаковые файлы (бланки опросников, повторно загруженные сканы) хранятся на диске
+один раз: файл лежит по SHA-256 содержимого в blobs/sha256/ab/cd/<digest>, а в поле
+модели записывается имя blobs/sha256/<digest>/<исходное имя файла> - исходное имя
+нужно для file_name и Content-Disposition при скачивании. Каталог из upload_to
+в имя не попадает: путь определяется только содержимым, суффиксов от коллизий нет.
+
+SHA-256 считается на лету при записи загружаемого файла во временный файл
+(один проход), затем временный файл переименовывается в blob или удаляется,
+если такой blob уже есть. Учет ссылок - FileBlob.ref_count: +1 при каждом
+сохранении файла в поле, -1 при удалении теста или замене файла (сигналы
+в core/signals.py). Blob без ссылок удаляется после коммита; файлы,
+оставшиеся после откатов, убирает manage.py file_blobs --purge.
+
+Имена, созданные до хранилища (patient_files/...), продолжают работать как в
+FileSystemStorage; manage.py file_blobs --import-legacy переносит их в blob'ы.
+"""
+import hashlib
+import os
+import re
+import shutil
+import time
+import uuid
+from collections import Counter
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils.deconstruct import deconstructible
+
+BLOB_ROOT = 'blobs'
+NAME_RE = re.compile(r'^blobs/sha256/(?P<digest>[0-9a-f]{64})/[^/]+$')
+MAX_FILENAME_LENGTH = 255
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    """SHA-256 файла одним потоковым проходом блоками READ_BLOCK_SIZE."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(READ_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def name_digest(name):
+    """SHA-256 из адресного имени или None для обычного имени."""
+    match = NAME_RE.match(name or '')
+    return match.group('digest') if match else None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    # --- Имена и пути ---
+
+    @staticmethod
+    def blob_name(digest):
+        # Два уровня каталогов: не больше 256 записей в каждом
+        return f'{BLOB_ROOT}/sha256/{digest[:2]}/{digest[2:4]}/{digest}'
+
+    @staticmethod
+    def temp_name(label):
+        # Временные файлы - на той же файловой системе, что и blob'ы: перенос - переименование
+        return f'{BLOB_ROOT}/tmp/{label}'
+
+    def content_name(self, digest, filename):
+        filename = self.get_valid_name(os.path.basename(filename.replace('\\', '/'))) or 'file'
+        if len(filename) > MAX_FILENAME_LENGTH:
+            stem, ext = os.path.splitext(filename)
+            filename = stem[:MAX_FILENAME_LENGTH - len(ext)] + ext
+        return f'{BLOB_ROOT}/sha256/{digest}/{filename}'
+
+    def blob_path(self, digest):
+        return super().path(self.blob_name(digest))
+
+    def path(self, name):
+        digest = name_digest(name)
+        return super().path(self.blob_name(digest) if digest else name)
+
+    def url(self, name):
+        digest = name_digest(name)
+        return super().url(self.blob_name(digest) if digest else name)
+
+    def get_available_name(self, name, max_length=None):
+        # Итоговое имя определяется содержимым в _save - подбирать свободное не нужно
+        return name
+
+    # --- Запись ---
+
+    def _save(self, name, content):
+        temp_path = super().path(self.temp_name(f'{uuid.uuid4().hex}.tmp'))
+        os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+        digest = hashlib.sha256()
+        try:
+            with open(temp_path, 'wb') as temp:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    temp.write(chunk)
+            return self.adopt(temp_path, digest.hexdigest(), os.path.basename(name))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def adopt(self, path, digest, filename, keep_source=False):
+        """
+        Помещает готовый файл path с известным SHA-256 в хранилище и берет на blob ссылку.
+        keep_source=True - исходный файл остается на месте (жесткая ссылка или копия),
+        иначе он переносится или удаляется, если такой blob уже есть. Возвращает имя для поля.
+        """
+        from .models import FileBlob
+        blob_path = self.blob_path(digest)
+        with transaction.atomic():
+            # Блокировка строки упорядочивает запись blob'а и его удаление после обнуления ссылок
+            FileBlob.objects.select_for_update().get_or_create(digest=digest, defaults={'size': os.path.getsize(path)})
+            if not os.path.exists(blob_path):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                if keep_source:
+                    try:
+                        os.link(path, blob_path)
+                    except OSError:
+                        shutil.copyfile(path, blob_path)
+                else:
+                    os.replace(path, blob_path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(blob_path, self.file_permissions_mode)
+            elif not keep_source:
+                os.remove(path)
+            # mtime - возраст blob'а для purge_orphan_blobs: жесткая ссылка и os.replace сохраняют
+            # время исходного файла, а строка FileBlob до коммита другим соединениям не видна
+            os.utime(blob_path)
+            FileBlob.objects.filter(pk=digest).update(ref_count=F('ref_count') + 1)
+        return self.content_name(digest, filename)
+
+    # --- Ссылки и удаление ---
+
+    def delete(self, name):
+        # Адресный blob может быть нужен другим тестам: его удаляет только release()
+        if not name_digest(name):
+            super().delete(name)
+
+    def release(self, name):
+        """Снимает ссылку поля на файл: blob без ссылок и старый обычный файл удаляются после коммита."""
+        digest = name_digest(name)
+        if digest is None:
+            transaction.on_commit(lambda: self.delete(name))
+            return
+        from .models import FileBlob
+        FileBlob.objects.filter(pk=digest, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        transaction.on_commit(lambda: self.purge_blob(digest))
+
+    def purge_blob(self, digest):
+        """Удаляет blob, если на него не осталось ссылок. True - удален."""
+        from .models import FileBlob
+        with transaction.atomic():
+            if not FileBlob.objects.select_for_update().filter(pk=digest, ref_count=0).exists():
+                return False
+            FileBlob.objects.filter(pk=digest).delete()
+            try:
+                os.remove(self.blob_path(digest))
+            except FileNotFoundError:
+                pass
+        return True
+
+
+medical_test_storage = ContentAddressedStorage()
+
+
+# --- Обслуживание (manage.py file_blobs) ---
+
+def _content_names():
+    from .models import MedicalTest
+    return MedicalTest.objects.filter(uploaded_file__startswith=f'{BLOB_ROOT}/sha256/').values_list('uploaded_file', flat=True)
+
+
+def _legacy_tests():
+    from .models import MedicalTest
+    return (
+        MedicalTest.objects.exclude(uploaded_file__isnull=True).exclude(uploaded_file='')
+        .exclude(uploaded_file__startswith=f'{BLOB_ROOT}/sha256/')
+    )
+
+
+def blob_statistics():
+    """Число blob'ов и ссылок, объем на диске и объем без дедупликации."""
+    from .models import FileBlob
+    stats = FileBlob.objects.aggregate(
+        blobs=Count('digest'), references=Sum('ref_count'),
+        stored_bytes=Sum('size'), logical_bytes=Sum(F('size') * F('ref_count')),
+    )
+    stats = {key: value or 0 for key, value in stats.items()}
+    stats['legacy_files'] = _legacy_tests().count()
+    return stats
+
+
+def import_legacy_files(storage=medical_test_storage):
+    """Переносит файлы тестов с обычными именами (patient_files/...) в blob'ы. (перенесено, [не найденные имена])."""
+    imported, missing = 0, []
+    for medical_test in _legacy_tests().iterator():
+        name = medical_test.uploaded_file.name
+        path = storage.path(name)
+        if not os.path.exists(path):
+            missing.append(name)
+            continue
+        with transaction.atomic():
+            medical_test.uploaded_file.name = storage.adopt(path, file_sha256(path), os.path.basename(name), keep_source=True)
+            # Старый файл удаляет сигнал post_save после коммита (release обычного имени)
+            medical_test.save(update_fields=['uploaded_file'])
+        imported += 1
+    return imported, missing
+
+
+def recount_blob_references(storage=medical_test_storage):
+    """
+    Пересчитывает FileBlob.ref_count по ссылкам из MedicalTest (после правок в обход ORM).
+    Возвращает (исправлено строк, [digest'ы со ссылками, но без файла]).
+    """
+    from .models import FileBlob
+    counts = Counter(name_digest(name) for name in _content_names().iterator())
+    counts.pop(None, None)
+    fixed, missing = 0, []
+    with transaction.atomic():
+        blobs = list(FileBlob.objects.select_for_update())
+        for blob in blobs:
+            if blob.ref_count != counts.get(blob.digest, 0):
+                blob.ref_count = counts.get(blob.digest, 0)
+                fixed += 1
+        FileBlob.objects.bulk_update(blobs, ['ref_count'], batch_size=1000)
+        known = {blob.digest for blob in blobs}
+        for digest, references in counts.items():
+            if digest in known:
+                continue
+            path = storage.blob_path(digest)
+            if not os.path.exists(path):
+                missing.append(digest)
+                continue
+            FileBlob.objects.create(digest=digest, size=os.path.getsize(path), ref_count=references)
+            fixed += 1
+    return fixed, missing
+
+
+def purge_orphan_blobs(grace_seconds=3600, storage=medical_test_storage):
+    """
+    Удаляет blob'ы без ссылок, файлы blob'ов без строки FileBlob (остались после откатов)
+    и временные файлы старше grace_seconds. Части докачиваемых загрузок не трогает -
+    их срок жизни ведет core/uploads.py. Возвращает число удаленных файлов.
+    """
+    from .models import FileBlob
+    removed = sum(storage.purge_blob(digest) for digest in FileBlob.objects.filter(ref_count=0).values_list('digest', flat=True))
+    threshold = time.time() - grace_seconds
+    # Недавние файлы могут принадлежать еще не закоммиченной записи - их не трогаем
+    blob_root = storage.path(f'{BLOB_ROOT}/sha256')
+    for directory, _, filenames in os.walk(blob_root):
+        candidates = [name for name in filenames if os.path.getmtime(os.path.join(directory, name)) < threshold]
+        known = set(FileBlob.objects.filter(pk__in=candidates).values_list('digest', flat=True))
+        for name in set(candidates) - known:
+            os.remove(os.path.join(directory, name))
+            removed += 1
+    temp_root = storage.path(storage.temp_name(''))
+    if os.path.isdir(temp_root):
+        for name in os.listdir(temp_root):
+            path = os.path.join(temp_root, name)
+            if not name.startswith('.upload-') and os.path.getmtime(path) < threshold:
+                os.remove(path)
+                removed += 1
+    return removed
@@ -0,0 +1,190 @@
+# backend/core/summaries.py
+"""
+Поддержка PatientParameterSummary.
+
+- Новое наблюдение применяется инкрементально одним INSERT ... ON CONFLICT DO UPDATE
+  (count + 1, min/max/sum, последнее значение, если наблюдение не старше текущего последнего).
+- Изменение или удаление наблюдения пересчитывает только затронутую пару
+  (пациент, показатель) - по индексу (patient, parameter, timestamp).
+- Пакетные операции (bulk_create, полная перестройка) вызывают refresh_summaries()
+  для набора пар: один агрегирующий запрос и один запрос последних значений на порцию.
+"""
+from django.db import connection
+from django.db.models import Case, Count, F, Max, Min, Q, Sum, Value, When
+from django.db.models import DateTimeField, FloatField
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
+
+from .models import Observation, PatientParameterSummary
+
+# Сколько пар (пациент, показатель) пересчитывать одним запросом
+REFRESH_CHUNK_SIZE = 500
+
+SUMMARY_UPDATE_FIELDS = [
+    'observation_count', 'numeric_count', 'value_min', 'value_max', 'value_sum',
+    'first_timestamp', 'last_timestamp', 'last_value', 'last_value_numeric',
+]
+
+# Функции min/max от двух аргументов для upsert; на остальных СУБД - UPDATE с пересчетом
+UPSERT_MIN_MAX = {'postgresql': ('LEAST', 'GREATEST'), 'sqlite': ('MIN', 'MAX')}
+
+
+def apply_created_observation(observation):
+    """
+    Инкрементально учитывает новое наблюдение. Сводки еще нет - она создается из этого
+    наблюдения тем же запросом: одновременные первые наблюдения пары не теряются, второй
+    INSERT ждет коммита первого и прибавляется к его строке. Поэтому сводка должна быть у каждой
+    пары с наблюдениями (загрузки в обход ORM - manage.py rebuild_parameter_summaries).
+    """
+    if connection.vendor in UPSERT_MIN_MAX:
+        _upsert_created_observation(observation, *UPSERT_MIN_MAX[connection.vendor])
+    else:
+        _update_created_observation(observation)
+
+
+def _upsert_created_observation(observation, least, greatest):
+    table = connection.ops.quote_name(PatientParameterSummary._meta.db_table)
+    value = observation.value_numeric
+    timestamp = connection.ops.adapt_datetimefield_value(observation.timestamp)
+    # Выражения SET вычисляются по прежней строке ({table}.*), EXCLUDED - вставляемая строка
+    is_latest = f'{table}.last_timestamp IS NULL OR {table}.last_timestamp <= EXCLUDED.last_timestamp'
+    updates = [
+        f'observation_count = {table}.observation_count + 1',
+        f'first_timestamp = {least}(COALESCE({table}.first_timestamp, EXCLUDED.first_timestamp), EXCLUDED.first_timestamp)',
+        f'last_timestamp = {greatest}(COALESCE({table}.last_timestamp, EXCLUDED.last_timestamp), EXCLUDED.last_timestamp)',
+        f'last_value = CASE WHEN {is_latest} THEN EXCLUDED.last_value ELSE {table}.last_value END',
+        f'last_value_numeric = CASE WHEN {is_latest} THEN EXCLUDED.last_value_numeric ELSE {table}.last_value_numeric END',
+        'updated_at = EXCLUDED.updated_at',
+    ]
+    if value is not None:
+        updates += [
+            f'numeric_count = {table}.numeric_count + 1',
+            f'value_min = {least}(COALESCE({table}.value_min, EXCLUDED.value_min), EXCLUDED.value_min)',
+            f'value_max = {greatest}(COALESCE({table}.value_max, EXCLUDED.value_max), EXCLUDED.value_max)',
+            f'value_sum = COALESCE({table}.value_sum, 0) + EXCLUDED.value_sum',
+        ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (patient_id, parameter_id, observation_count, numeric_count, value_min, value_max, "
+            f"value_sum, first_timestamp, last_timestamp, last_value, last_value_numeric, updated_at) "
+            f"VALUES (%s, %s, 1, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+            f"ON CONFLICT (patient_id, parameter_id) DO UPDATE SET {', '.join(updates)}",
+            [
+                observation.patient_id, observation.parameter_id, int(value is not None), value, value, value,
+                timestamp, timestamp, observation.value, value,
+                connection.ops.adapt_datetimefield_value(timezone.now()),
+            ],
+        )
+
+
+def _update_created_observation(observation):
+    """Без upsert: один UPDATE, а если сводки еще нет - пересчет пары."""
+    ts = Value(observation.timestamp, output_field=DateTimeField())
+    updates = {
+        'observation_count': F('observation_count') + 1,
+        'first_timestamp': Least(Coalesce('first_timestamp', ts), ts),
+        'last_timestamp': Greatest(Coalesce('last_timestamp', ts), ts),
+    }
+    is_latest = Q(last_timestamp__isnull=True) | Q(last_timestamp__lte=observation.timestamp)
+    updates['last_value'] = Case(When(is_latest, then=Value(observation.value)), default=F('last_value'))
+    value = observation.value_numeric
+    if value is not None:
+        v = Value(value, output_field=FloatField())
+        updates.update({
+            'numeric_count': F('numeric_count') + 1,
+            'value_min': Least(Coalesce('value_min', v), v),
+            'value_max': Greatest(Coalesce('value_max', v), v),
+            'value_sum': Coalesce('value_sum', Value(0.0)) + v,
+        })
+    updates['last_value_numeric'] = Case(
+        When(is_latest, then=Value(value, output_field=FloatField())), default=F('last_value_numeric')
+    )
+    updated = PatientParameterSummary.objects.filter(
+        patient_id=observation.patient_id, parameter_id=observation.parameter_id
+    ).update(**updates)
+    if not updated:
+        refresh_summaries([(observation.patient_id, observation.parameter_id)])
+
+
+def refresh_summaries(pairs):
+    """Полностью пересчитывает сводки для набора пар (patient_id, parameter_id)."""
+    pairs = list(set(pairs))
+    for start in range(0, len(pairs), REFRESH_CHUNK_SIZE):
+        _refresh_chunk(pairs[start:start + REFRESH_CHUNK_SIZE])
+
+
+def _pairs_q(pairs):
+    condition = Q()
+    for patient_id, parameter_id in pairs:
+        condition |= Q(patient_id=patient_id, parameter_id=parameter_id)
+    return condition
+
+
+def _refresh_chunk(pairs):
+    wanted = set(pairs)
+    aggregates = {
+        (row['patient_id'], row['parameter_id']): row
+        for row in (
+            Observation.objects.filter(_pairs_q(pairs))
+            .values('patient_id', 'parameter_id')
+            .annotate(
+                observation_count=Count('id'),
+                numeric_count=Count('value_numeric'),
+                value_min=Min('value_numeric'),
+                value_max=Max('value_numeric'),
+                value_sum=Sum('value_numeric'),
+                first_timestamp=Min('timestamp'),
+                last_timestamp=Max('timestamp'),
+            )
+            .order_by()
+        )
+        if (row['patient_id'], row['parameter_id']) in wanted
+    }
+
+    # Последние значения: строки с timestamp = max(timestamp) пары, при равенстве - с большим id
+    latest = {}
+    if aggregates:
+        latest_q = Q()
+        for (patient_id, parameter_id), row in aggregates.items():
+            latest_q |= Q(patient_id=patient_id, parameter_id=parameter_id, timestamp=row['last_timestamp'])
+        for row in Observation.objects.filter(latest_q).order_by('id').values('patient_id', 'parameter_id', 'value', 'value_numeric'):
+            latest[(row['patient_id'], row['parameter_id'])] = row
+
+    summaries = []
+    for key, row in aggregates.items():
+        summaries.append(PatientParameterSummary(
+            patient_id=key[0],
+            parameter_id=key[1],
+            observation_count=row['observation_count'],
+            numeric_count=row['numeric_count'],
+            value_min=row['value_min'],
+            value_max=row['value_max'],
+            value_sum=row['value_sum'],
+            first_timestamp=row['first_timestamp'],
+            last_timestamp=row['last_timestamp'],
+            last_value=latest[key]['value'],
+            last_value_numeric=latest[key]['value_numeric'],
+        ))
+    if summaries:
+        PatientParameterSummary.objects.bulk_create(
+            summaries, update_conflicts=True,
+            unique_fields=['patient', 'parameter'], update_fields=SUMMARY_UPDATE_FIELDS + ['updated_at'],
+        )
+    # Пары, у которых не осталось наблюдений
+    empty = wanted - set(aggregates)
+    if empty:
+        PatientParameterSummary.objects.filter(_pairs_q(empty)).delete()
+
+
+def rebuild_all_summaries(patient_ids=None):
+    """Перестраивает сводки по всем парам (или по указанным пациентам). Возвращает число пар."""
+    observations = Observation.objects.all()
+    summaries = PatientParameterSummary.objects.all()
+    if patient_ids:
+        observations = observations.filter(patient_id__in=patient_ids)
+        summaries = summaries.filter(patient_id__in=patient_ids)
+    pairs = set(observations.values_list('patient_id', 'parameter_id').distinct().order_by())
+    # Сводки без наблюдений (например, после прямого удаления в БД) тоже попадут в пересчет и удалятся
+    pairs.update(summaries.values_list('patient_id', 'parameter_id'))
+    refresh_summaries(pairs)
+    return len(pairs)
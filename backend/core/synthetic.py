@@ -0,0 +1,286 @@
+# backend/core/synthetic.py
+"""
+Синтетические данные для нагрузочных проверок (manage.py generate_synthetic_data,
+manage.py run_benchmarks).
+
+Все записи создаются пакетными вставками (bulk_create) и детерминированы seed'ом.
+Пациенты помечаются clinic_id с префиксом SYNTHETIC_PREFIX - по нему synthetic
+данные удаляются, не трогая настоящие. Справочники (МКБ, показатели) общие
+и не удаляются: на них могут ссылаться настоящие наблюдения.
+
+Распределения приближены к реальным:
+- диагнозы - с длинным хвостом (частота кода ~ 1 / ранг);
+- показатели - у каждого пациента свое подмножество, значения - нормальные
+  вокруг референсного среднего, небольшая доля нечисловых ("н/д");
+- наблюдения равномерно распределены по периоду days до now, часть попадает
+  в эпизоды госпитализации.
+"""
+import random
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from .cache import MKB_CODES, PARAMETER_CODES, bump_version
+from .cohorts import refresh_cohort
+from .models import Cohort, HospitalizationEpisode, MKBCode, Observation, ParameterCode, Patient, parse_numeric_value
+from .summaries import rebuild_all_summaries
+
+SYNTHETIC_PREFIX = 'SYN-'
+
+# (код, название, единица, среднее, стандартное отклонение)
+PARAMETERS = (
+    ('HB', 'Гемоглобин', 'g/l', 135, 15),
+    ('WBC', 'Лейкоциты', '10^9/l', 6.5, 2),
+    ('RBC', 'Эритроциты', '10^12/l', 4.7, 0.5),
+    ('PLT', 'Тромбоциты', '10^9/l', 250, 60),
+    ('GLU', 'Глюкоза', 'mmol/l', 5.2, 1.1),
+    ('CREA', 'Креатинин', 'umol/l', 85, 20),
+    ('UREA', 'Мочевина', 'mmol/l', 5.5, 1.5),
+    ('ALT', 'Аланинаминотрансфераза', 'U/l', 25, 10),
+    ('AST', 'Аспартатаминотрансфераза', 'U/l', 24, 9),
+    ('BILI', 'Билирубин общий', 'umol/l', 12, 5),
+    ('NA', 'Натрий', 'mmol/l', 140, 3),
+    ('K', 'Калий', 'mmol/l', 4.3, 0.4),
+    ('CRP', 'С-реактивный белок', 'mg/l', 4, 6),
+    ('ALB', 'Альбумин', 'g/l', 42, 5),
+    ('TEMP', 'Температура тела', 'C', 36.7, 0.5),
+    ('SBP', 'Систолическое давление', 'mmHg', 125, 15),
+    ('DBP', 'Диастолическое давление', 'mmHg', 80, 10),
+    ('HR', 'Частота сердечных сокращений', 'bpm', 75, 12),
+    ('SPO2', 'Сатурация', '%', 97, 1.5),
+    ('KPS', 'Индекс Карновского', '%', 70, 15),
+)
+
+DIAGNOSIS_TERMS = (
+    'Злокачественное новообразование', 'Доброкачественное новообразование', 'Хроническая болезнь',
+    'Острая недостаточность', 'Воспалительное заболевание', 'Травма', 'Нарушение обмена',
+)
+ORGANS = (
+    'головного мозга', 'лобной доли', 'височной доли', 'мозжечка', 'спинного мозга', 'оболочек мозга',
+    'молочной железы', 'легкого', 'почки', 'печени', 'поджелудочной железы', 'щитовидной железы',
+    'желудка', 'толстой кишки', 'предстательной железы', 'кожи', 'костей', 'сердца',
+)
+LAST_NAMES = (
+    'Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов', 'Новиков',
+    'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семенов', 'Егоров', 'Павлов', 'Козлов',
+    'Степанов', 'Николаев', 'Орлов', 'Андреев', 'Макаров', 'Никитин', 'Захаров', 'Зайцев', 'Соловьев',
+)
+FIRST_NAMES = {
+    'm': ('Александр', 'Сергей', 'Дмитрий', 'Андрей', 'Алексей', 'Максим', 'Евгений', 'Иван', 'Михаил', 'Николай'),
+    'f': ('Елена', 'Ольга', 'Наталья', 'Татьяна', 'Ирина', 'Анна', 'Мария', 'Светлана', 'Юлия', 'Екатерина'),
+}
+MIDDLE_NAMES = {
+    'm': ('Александрович', 'Сергеевич', 'Иванович', 'Петрович', 'Николаевич', 'Владимирович'),
+    'f': ('Александровна', 'Сергеевна', 'Ивановна', 'Петровна', 'Николаевна', 'Владимировна'),
+}
+NON_NUMERIC_SHARE = 0.01
+
+
+@dataclass
+class SyntheticConfig:
+    patients: int = 1000
+    mkb_codes: int = 200
+    parameters: int = 10
+    # Плотность: в среднем наблюдений на пациента и показателей у одного пациента
+    observations_per_patient: int = 100
+    parameters_per_patient: int = 5
+    episodes_per_patient: int = 1
+    days: int = 365
+    batch_size: int = 5000
+    seed: int = 42
+
+
+def mkb_code_rows(count):
+    """Коды вида C71.0 и названия 'термин + орган' (для поиска по коду и по названию)."""
+    rows = []
+    for index in range(count):
+        letter = chr(ord('A') + index % 26)
+        category, subcategory = divmod(index // 26, 10)
+        code = f'{letter}{category % 100:02d}.{subcategory}' if category < 100 else f'{letter}{category}.{subcategory}'
+        name = f'{DIAGNOSIS_TERMS[index % len(DIAGNOSIS_TERMS)]} {ORGANS[(index // len(DIAGNOSIS_TERMS)) % len(ORGANS)]}'
+        rows.append((code, name))
+    return rows
+
+
+def parameter_rows(count):
+    """(код, название, единица, среднее, ст. откл.): сначала реальные показатели, затем SYN_Pn."""
+    rows = list(PARAMETERS[:count])
+    for index in range(len(rows), count):
+        rows.append((f'SYN_P{index}', f'Синтетический показатель {index}', 'u', 100, 20))
+    return rows
+
+
+def ensure_reference_data(config):
+    """Создает недостающие коды МКБ и показатели; возвращает (коды МКБ, показатели)."""
+    mkb_rows = mkb_code_rows(config.mkb_codes)
+    MKBCode.objects.bulk_create([MKBCode(code=code, name=name) for code, name in mkb_rows], ignore_conflicts=True)
+    parameters = parameter_rows(config.parameters)
+    ParameterCode.objects.bulk_create(
+        [ParameterCode(code=code, name=name, unit=unit) for code, name, unit, _, _ in parameters], ignore_conflicts=True
+    )
+    # bulk_create не вызывает post_save - кэш справочников сбрасываем сами, как core/signals.py
+    transaction.on_commit(lambda: bump_version(MKB_CODES))
+    transaction.on_commit(lambda: bump_version(PARAMETER_CODES))
+    return [code for code, _ in mkb_rows], parameters
+
+
+def synthetic_patients():
+    return Patient.objects.filter(clinic_id__startswith=SYNTHETIC_PREFIX)
+
+
+def clear_synthetic_data():
+    """
+    Удаляет synthetic пациентов и все, что на них ссылается, прямыми DELETE/UPDATE:
+    каскад ORM с сигналами на миллионах наблюдений шел бы по одной строке.
+    Возвращает число удаленных пациентов.
+    """
+    patient_ids = synthetic_patients().values('id')
+    patient_sql, params = patient_ids.query.sql_with_params()
+    quote = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        for relation in Patient._meta.related_objects:
+            if relation.many_to_many:
+                continue
+            table, column = quote(relation.related_model._meta.db_table), quote(relation.field.column)
+            if relation.on_delete is models.CASCADE:
+                cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({patient_sql})', params)
+            elif relation.on_delete is models.SET_NULL:
+                cursor.execute(f'UPDATE {table} SET {column} = NULL WHERE {column} IN ({patient_sql})', params)
+        cursor.execute(f'DELETE FROM {quote(Patient._meta.db_table)} WHERE id IN ({patient_sql})', params)
+        return cursor.rowcount
+
+
+def _batched(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _weighted_codes(rng, codes, count):
+    # Частота ~ 1 / ранг: несколько частых диагнозов и длинный хвост
+    weights = [1 / rank for rank in range(1, len(codes) + 1)]
+    return rng.choices(codes, weights=weights, k=count)
+
+
+def _create_patients(rng, config, mkb_codes, new_patients, offset):
+    today = timezone.localdate()
+    diagnoses = _weighted_codes(rng, mkb_codes, config.patients)
+    patients = []
+    for index in range(config.patients):
+        sex = rng.choice('mf')
+        last_name = rng.choice(LAST_NAMES) + ('а' if sex == 'f' else '')
+        patients.append(Patient(
+            last_name=last_name,
+            first_name=rng.choice(FIRST_NAMES[sex]),
+            middle_name=rng.choice(MIDDLE_NAMES[sex]),
+            date_of_birth=today - timedelta(days=rng.randint(18 * 365, 90 * 365)),
+            clinic_id=f'{SYNTHETIC_PREFIX}{offset + index:08d}',
+            primary_diagnosis_mkb_id=diagnoses[index],
+        ))
+    for batch in _batched(patients, config.batch_size):
+        Patient.objects.bulk_create(batch)
+    # id нужны и на бэкендах без RETURNING - перечитываем по clinic_id
+    return list(new_patients.order_by('clinic_id').values_list('id', flat=True))
+
+
+def _create_episodes(rng, config, patient_ids, period_start, new_patients):
+    episodes = []
+    for patient_id in patient_ids:
+        for _ in range(config.episodes_per_patient):
+            start = period_start + timedelta(days=rng.randint(0, max(config.days - 1, 0)))
+            episodes.append(HospitalizationEpisode(
+                patient_id=patient_id, start_date=start, end_date=start + timedelta(days=rng.randint(3, 21)),
+            ))
+    for batch in _batched(episodes, config.batch_size):
+        HospitalizationEpisode.objects.bulk_create(batch)
+    by_patient = {}
+    for episode_id, patient_id, start, end in (
+        HospitalizationEpisode.objects.filter(patient__in=new_patients.values('id'))
+        .values_list('id', 'patient_id', 'start_date', 'end_date')
+    ):
+        by_patient.setdefault(patient_id, []).append((start, end, episode_id))
+    return by_patient
+
+
+def _observation_value(rng, mean, deviation):
+    if rng.random() < NON_NUMERIC_SHARE:
+        return 'н/д'
+    value = rng.gauss(mean, deviation)
+    return f'{value:.1f}' if abs(mean) < 1000 else str(round(value))
+
+
+def _iter_observations(rng, config, patient_ids, parameters, episodes, period_start):
+    now = timezone.now()
+    period_start_dt = timezone.make_aware(datetime.combine(period_start, time.min))
+    period_seconds = int((now - period_start_dt).total_seconds())
+    per_patient = min(config.parameters_per_patient, len(parameters))
+    for patient_id in patient_ids:
+        patient_parameters = rng.sample(parameters, per_patient)
+        patient_episodes = episodes.get(patient_id, ())
+        count = rng.randint(config.observations_per_patient // 2, config.observations_per_patient * 3 // 2)
+        for _ in range(count):
+            code, _, _, mean, deviation = rng.choice(patient_parameters)
+            moment = period_start_dt + timedelta(seconds=rng.randrange(max(period_seconds, 1)))
+            day = timezone.localtime(moment).date()
+            episode_id = next((episode for start, end, episode in patient_episodes if start <= day <= end), None)
+            value = _observation_value(rng, mean, deviation)
+            yield Observation(
+                patient_id=patient_id, parameter_id=code, timestamp=moment, value=value,
+                value_numeric=parse_numeric_value(value), episode_id=episode_id,
+            )
+
+
+def analyze_tables():
+    """Свежая статистика планировщика после массовой вставки (иначе планы строятся вслепую)."""
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for model in (Patient, HospitalizationEpisode, Observation):
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+
+def generate_synthetic_data(config, progress=None):
+    """
+    Добавляет config.patients synthetic пациентов с эпизодами и наблюдениями.
+    Наблюдения пишутся пакетами по config.batch_size (память не зависит от объема).
+    progress(счетчик, всего) вызывается после каждого пакета наблюдений.
+    Возвращает {'patients': ..., 'episodes': ..., 'observations': ...}.
+    """
+    rng = random.Random(config.seed)
+    mkb_codes, parameters = ensure_reference_data(config)
+    offset = synthetic_patients().count()
+    new_patients = synthetic_patients().filter(clinic_id__gte=f'{SYNTHETIC_PREFIX}{offset:08d}')
+    period_start = timezone.localdate() - timedelta(days=config.days)
+
+    with transaction.atomic():
+        patient_ids = _create_patients(rng, config, mkb_codes, new_patients, offset)
+        episodes = _create_episodes(rng, config, patient_ids, period_start, new_patients)
+    expected = config.patients * config.observations_per_patient
+
+    created, batch = 0, []
+    for observation in _iter_observations(rng, config, patient_ids, parameters, episodes, period_start):
+        batch.append(observation)
+        if len(batch) >= config.batch_size:
+            Observation.objects.bulk_create(batch)
+            created += len(batch)
+            batch = []
+            if progress:
+                progress(created, expected)
+    if batch:
+        Observation.objects.bulk_create(batch)
+        created += len(batch)
+    analyze_tables()
+    return {
+        'patients': len(patient_ids),
+        'episodes': sum(len(items) for items in episodes.values()),
+        'observations': created,
+    }
+
+
+def rebuild_derived_data():
+    """Сводки по показателям и состав когорт после вставки в обход сигналов. Возвращает число сводок."""
+    pairs = rebuild_all_summaries()
+    for cohort in Cohort.objects.all():
+        refresh_cohort(cohort)
+    return pairs
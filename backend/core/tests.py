@@ -1,3 +1,2193 @@
-from django.test import TestCase
+import base64
+import csv
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import quote
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.http import QueryDict
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import cache as reference_cache
+from . import renderers
+from . import extraction
+from . import research
+from . import search
+from .cohorts import ensure_current, refresh_cohort
+from .columnar import columnar_available
+from .criteria import ResearchCriteria, age_on, birth_date_bounds
+from .instrumentation import REGISTRY
+from . import jobs
+from . import partitioning
+from . import uploads
+from .jobs import purge_expired_jobs
+from .models import (
+    Cohort, CohortMembership, FileBlob, HospitalizationEpisode, MedicalTest, MedicalTestAnswer, MedicalTestExtraction,
+    MedicalTestUpload, MKBCode, Observation,
+    ParameterCode, Patient, PatientParameterSummary, ResearchExportJob, parse_numeric_value,
+)
+from .research import research_queryset
+from .search import MAX_LIMIT, trigram_available
+from .serializers import MedicalTestSerializer, ObservationSerializer, PatientSerializer
+from .storage import ContentAddressedStorage, purge_orphan_blobs
+from .summaries import rebuild_all_summaries
+from .synthetic import SyntheticConfig, clear_synthetic_data, ensure_reference_data, generate_synthetic_data, synthetic_patients
+from .timeseries import MAX_POINTS, lttb_indices
+from .urls import build_urlpatterns
+
+# URL-схема режима ASGI (ASYNC_PATIENT_VIEWS=True): @override_settings(ROOT_URLCONF='core.tests')
+urlpatterns = [path('api/', include(build_urlpatterns(async_patient_views=True)))]
+
+
+# --- Число SQL-запросов не зависит от количества строк (регрессия N+1) ---
+
+class QueryCountTests(TestCase):
+    """
+    Каждый эндпоинт вызывается дважды: на исходных данных и после добавления строк.
+    Число запросов закреплено и должно совпадать в обоих случаях.
+    Аутентификация через force_authenticate запросов к БД не делает.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        cls.mkb = MKBCode.objects.create(code='C71.0', name='Злокачественное новообразование большого мозга')
+        cls.hb = ParameterCode.objects.create(code='HB', name='Гемоглобин', unit='g/l')
+        cls.patient = Patient.objects.create(
+            last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1), primary_diagnosis_mkb=cls.mkb
+        )
+        cls.episode = HospitalizationEpisode.objects.create(patient=cls.patient, start_date=date(2024, 1, 1))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        cache.clear()
+        reference_cache._local.clear()
+        # Разовые на процесс/версию справочника запросы не зависят от числа строк - не считаем их
+        trigram_available()
+        reference_cache.parameter_code_map()
+
+    def add_rows(self, count):
+        """Добавляет count пациентов, наблюдений, эпизодов и тестов (с автором и эпизодом - худший случай для N+1)."""
+        start = Patient.objects.count()
+        now = timezone.now()
+        for i in range(count):
+            patient = Patient.objects.create(
+                last_name=f'Петров{start + i}', first_name='Петр', date_of_birth=date(1990, 1, 1), primary_diagnosis_mkb=self.mkb
+            )
+            HospitalizationEpisode.objects.create(patient=patient, start_date=date(2024, 2, 1))
+            episode = HospitalizationEpisode.objects.create(patient=self.patient, start_date=date(2023, 1, 1) - timedelta(days=start + i))
+            Observation.objects.create(
+                patient=self.patient, parameter=self.hb, value=str(100 + i), episode=episode,
+                recorded_by=self.user, timestamp=now - timedelta(hours=start + i),
+            )
+            MedicalTest.objects.create(
+                patient=self.patient, test_name='HADS', test_date=date(2024, 1, 1), uploaded_by=self.user
+            )
+
+    def assertConstantQueries(self, url, expected):
+        self.add_rows(3)
+        with self.assertNumQueries(expected):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.add_rows(20)
+        with self.assertNumQueries(expected):
+            self.client.get(url)
+        return response
+
+    def test_observation_list(self):
+        self.assertConstantQueries(f'/api/observations/?patient_id={self.patient.id}', 1)
+
+    def test_episode_list(self):
+        self.assertConstantQueries(f'/api/episodes/?patient_id={self.patient.id}', 1)
+
+    def test_medical_test_list(self):
+        self.assertConstantQueries(f'/api/medical-tests/?patient_id={self.patient.id}', 1)
+
+    def test_patient_list(self):
+        self.assertConstantQueries('/api/patients/', 1)
+
+    def test_patient_search(self):
+        self.assertConstantQueries('/api/patients/?search=Петров', 1)
+
+    def test_patient_detail(self):
+        self.assertConstantQueries(f'/api/patients/{self.patient.id}/', 1)
+
+    def test_patient_dynamics(self):
+        self.assertConstantQueries(f'/api/patients/{self.patient.id}/dynamics/?param=HB', 2)
+
+    def test_patient_dynamics_downsampled(self):
+        self.assertConstantQueries(f'/api/patients/{self.patient.id}/dynamics/?param=HB&max_points=10', 2)
+
+    def test_patient_tests(self):
+        self.assertConstantQueries(f'/api/patients/{self.patient.id}/tests/', 2)
+
+    def test_patient_episodes(self):
+        self.assertConstantQueries(f'/api/patients/{self.patient.id}/episodes/', 2)
+
+    def test_patient_summary(self):
+        self.assertConstantQueries(f'/api/patients/{self.patient.id}/summary/', 2)
+
+    def test_parameter_summaries(self):
+        self.assertConstantQueries('/api/parameter-summaries/?param_codes=HB', 1)
+
+    def test_research_query(self):
+        # Один курсор: пациенты LEFT JOIN наблюдения
+        self.assertConstantQueries('/api/research/query/?param_codes=HB', 1)
+
+    def test_research_matrix(self):
+        self.assertConstantQueries('/api/research/matrix/?param_codes=HB&bucket=week&agg=last', 2)
+
+    def test_research_matrix_by_episode(self):
+        self.assertConstantQueries('/api/research/matrix/?param_codes=HB&bucket=episode', 3)
+
+    def test_research_query_by_cohort(self):
+        # Когорта + один курсор; новые пациенты попадают в состав через сигнал
+        cohort = refresh_cohort(Cohort.objects.create(name='C71', criteria={'diagnosis_mkb': 'C71.0'}))
+        self.assertConstantQueries(f'/api/research/query/?param_codes=HB&cohort_id={cohort.id}', 2)
+
+    def test_reference_lists_are_cached(self):
+        with self.assertNumQueries(1):
+            self.client.get('/api/parameters/')
+        with self.assertNumQueries(0):
+            self.client.get('/api/parameters/')
+
+
+class FastSerializerTests(TestCase):
+    """Быстрые списки (core/fast_serializers.py) отдают тот же JSON, что и ModelSerializer."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        mkb = MKBCode.objects.create(code='C71.0', name='Опухоль')
+        ParameterCode.objects.create(code='HB', name='Гемоглобин', unit='g/l')
+        cls.patient = Patient.objects.create(
+            last_name='Иванов', first_name='Иван', middle_name='Иванович',
+            date_of_birth=date(1980, 1, 1), clinic_id='A-1', primary_diagnosis_mkb=mkb,
+        )
+        episode = HospitalizationEpisode.objects.create(patient=cls.patient, start_date=date(2024, 1, 1))
+        Observation.objects.create(patient=cls.patient, parameter_id='HB', value='120,5', episode=episode, recorded_by=cls.user)
+        Observation.objects.create(patient=cls.patient, parameter_id='HB', value='118')
+        MedicalTest.objects.create(patient=cls.patient, test_name='HADS', score=7, uploaded_by=cls.user)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertSameAsSerializer(self, url, serializer_class, queryset):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        request = response.wsgi_request
+        expected = serializer_class(queryset, many=True, context={'request': request}).data
+        self.assertEqual(response.json()['results'], [dict(item) for item in expected])
+
+    def test_observations(self):
+        self.assertSameAsSerializer(
+            f'/api/observations/?patient_id={self.patient.id}', ObservationSerializer,
+            Observation.objects.order_by('-timestamp', '-id'),
+        )
+
+    def test_patients(self):
+        self.assertSameAsSerializer('/api/patients/', PatientSerializer, Patient.objects.order_by('last_name', 'first_name', 'id'))
+
+    def test_medical_tests(self):
+        self.assertSameAsSerializer('/api/medical-tests/', MedicalTestSerializer, MedicalTest.objects.order_by('-test_date', '-id'))
+
+    def test_sparse_fieldset(self):
+        response = self.client.get(f'/api/observations/?patient_id={self.patient.id}&fields=value,id')
+        self.assertEqual([list(row) for row in response.json()['results']], [['id', 'value']] * 2)
+        self.assertIsNone(response.json()['next'])
+
+    def test_unknown_field(self):
+        response = self.client.get(f'/api/patients/?fields=id,password')
+        self.assertEqual(response.status_code, 400)
+
+
+class RendererTests(TestCase):
+
+    def test_orjson_and_stdlib_render_the_same_types(self):
+        data = {'n': Decimal('1.5'), 't': datetime(2024, 1, 1, 12, 0, tzinfo=dt_timezone.utc), 'text': 'Гемоглобин', 1: None}
+        fast = json.loads(renderers.ORJSONRenderer().render(data))
+        with mock.patch.object(renderers, 'orjson', None):
+            fallback = json.loads(renderers.ORJSONRenderer().render(data))
+        self.assertEqual(fast, fallback)
+        self.assertEqual(fast, {'n': 1.5, 't': '2024-01-01T12:00:00Z', 'text': 'Гемоглобин', '1': None})
+
+    def test_browsable_api_only_for_staff(self):
+        user = get_user_model().objects.create_user('doctor', password='secret')
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/api/patients/', HTTP_ACCEPT='text/html')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        user.is_staff = True
+        user.save()
+        response = client.get('/api/patients/', HTTP_ACCEPT='text/html')
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+
+
+class ModelStrTests(TestCase):
+
+    def test_observation_str_does_not_load_parameter(self):
+        parameter = ParameterCode.objects.create(code='HB', name='Гемоглобин')
+        patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+        observation = Observation.objects.create(patient=patient, parameter=parameter, value='120')
+        observation = Observation.objects.select_related('patient').get(pk=observation.pk)
+        with self.assertNumQueries(0):
+            self.assertIn('HB = 120', str(observation))
+
+
+class BulkIngestTests(TestCase):
+    """POST /api/observations/bulk/: JSON и CSV, ошибки по строкам, ?atomic=1, сводки после пакета."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        ParameterCode.objects.create(code='HB', name='Гемоглобин', unit='g/l')
+        ParameterCode.objects.create(code='NOTE', name='Комментарий', is_numeric=False)
+        cls.patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+        cls.other = Patient.objects.create(last_name='Петров', first_name='Петр', date_of_birth=date(1990, 1, 1))
+        cls.episode = HospitalizationEpisode.objects.create(patient=cls.patient, start_date=date(2024, 1, 1))
+        cls.other_episode = HospitalizationEpisode.objects.create(patient=cls.other, start_date=date(2024, 1, 1))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        cache.clear()
+        reference_cache._local.clear()
+
+    def post_json(self, rows, query=''):
+        return self.client.post(f'/api/observations/bulk/{query}', rows, format='json')
+
+    def test_json_rows_and_errors(self):
+        p = self.patient.id
+        rows = [
+            {'patient': p, 'parameter': 'HB', 'value': '120,5', 'timestamp': '2024-01-01T10:00:00', 'episode': self.episode.id},
+            {'patient': p, 'parameter': 'XX', 'value': '1'},
+            {'patient': 'abc', 'parameter': 'HB', 'value': ''},
+            {'patient': 999999, 'parameter': 'HB', 'value': '1'},
+            {'patient': p, 'parameter': 'HB', 'value': '1', 'episode': self.other_episode.id},
+            {'patient': p, 'parameter': 'HB', 'value': '1', 'timestamp': 'вчера'},
+            'строка',
+            {'patient': p, 'parameter': 'NOTE', 'value': '12,5'},
+            {'patient': p, 'parameter': 'HB', 'value': '118', 'timestamp': '2024-01-02T10:00:00+03:00'},
+            {'patient': p, 'parameter': ['HB'], 'value': '1'},
+            {'patient': p, 'parameter': {'code': 'HB'}, 'value': '1'},
+        ]
+        response = self.post_json(rows, '?batch_size=2')
+        self.assertEqual(response.status_code, 201, response.content)
+        report = response.json()
+        self.assertEqual((report['total'], report['created']), (11, 3))
+        self.assertEqual([error['row'] for error in report['errors']], [2, 3, 4, 5, 6, 7, 10, 11])
+        errors = {error['row']: error['errors'] for error in report['errors']}
+        self.assertIn('Unknown parameter', errors[2]['parameter'])
+        self.assertEqual(set(errors[3]), {'patient', 'value'})
+        self.assertIn('does not exist', errors[4]['patient'])
+        self.assertIn('episode', errors[5])
+        self.assertIn('timestamp', errors[6])
+        self.assertIn('non_field_errors', errors[7])
+        self.assertEqual(errors[10], errors[11])
+        self.assertEqual(errors[10], {'parameter': 'Must be a parameter code string.'})
+
+        values = dict(Observation.objects.values_list('value', 'value_numeric'))
+        self.assertEqual(values, {'120,5': 120.5, '12,5': None, '118': 118.0})
+        self.assertEqual(set(Observation.objects.values_list('recorded_by', flat=True)), {self.user.id})
+        self.assertEqual(Observation.objects.get(value='120,5').episode_id, self.episode.id)
+
+    def test_csv_file(self):
+        content = (
+            '\ufeffpatient,parameter,value,timestamp,episode\n'  # BOM, как у Excel
+            f'{self.patient.id},HB,"99,5",2024-01-01T10:00:00,\n'
+            f'{self.other.id},HB,101,,{self.other_episode.id}\n'
+            f'{self.other.id},HB,,,\n'
+        ).encode('utf-8')
+        upload = SimpleUploadedFile('observations.csv', content, content_type='text/csv')
+        response = self.client.post('/api/observations/bulk/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json(), {'total': 3, 'created': 2, 'errors': [{'row': 3, 'errors': {'value': 'This field is required.'}}]})
+        self.assertEqual(sorted(Observation.objects.values_list('value_numeric', flat=True)), [99.5, 101.0])
+
+        upload = SimpleUploadedFile('observations.csv', 'patient,parameter,value\n1,HB,ё\n'.encode('cp1251'))
+        response = self.client.post('/api/observations/bulk/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+    def test_atomic_rolls_back_on_error(self):
+        rows = [{'patient': self.patient.id, 'parameter': 'HB', 'value': str(100 + i)} for i in range(5)]
+        rows.append({'patient': self.patient.id, 'parameter': 'XX', 'value': '1'})
+        response = self.post_json(rows, '?atomic=1&batch_size=2')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((response.json()['total'], response.json()['created']), (6, 0))
+        self.assertFalse(Observation.objects.exists())
+        self.assertFalse(PatientParameterSummary.objects.exists())
+
+        response = self.post_json(rows[:-1], '?atomic=1')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Observation.objects.count(), 5)
+
+    def test_invalid_request(self):
+        self.assertEqual(self.post_json({'patient': self.patient.id}).status_code, 400)
+        self.assertEqual(self.post_json([], '?batch_size=abc').status_code, 400)
+
+    def test_summaries_refreshed_after_batch(self):
+        Observation.objects.create(patient=self.patient, parameter_id='HB', value='130',
+                                   timestamp=timezone.make_aware(datetime(2023, 12, 31)))
+        rows = [
+            {'patient': self.patient.id, 'parameter': 'HB', 'value': '90,5', 'timestamp': '2024-01-02T00:00:00'},
+            {'patient': self.patient.id, 'parameter': 'HB', 'value': 'н/д', 'timestamp': '2024-01-01T00:00:00'},
+            {'patient': self.other.id, 'parameter': 'HB', 'value': '110'},
+        ]
+        self.assertEqual(self.post_json(rows, '?batch_size=2').status_code, 201)
+
+        fields = ('patient_id', 'observation_count', 'numeric_count', 'value_min', 'value_max', 'value_sum', 'last_value')
+        incremental = list(PatientParameterSummary.objects.order_by('patient_id').values_list(*fields))
+        self.assertEqual(incremental[0], (self.patient.id, 3, 2, 90.5, 130.0, 220.5, '90,5'))
+        self.assertEqual(incremental[1], (self.other.id, 1, 1, 110.0, 110.0, 110.0, '110'))
+        rebuild_all_summaries()
+        self.assertEqual(incremental, list(PatientParameterSummary.objects.order_by('patient_id').values_list(*fields)))
+
+
+class LTTBTests(SimpleTestCase):
+
+    def test_keeps_ends_and_returns_exactly_max_points(self):
+        rng = random.Random(1)
+        xs = list(range(1000))
+        ys = [rng.gauss(100, 10) for _ in xs]
+        for threshold in (3, 4, 10, 57, 999):
+            indices = lttb_indices(xs, ys, threshold)
+            self.assertEqual(len(indices), threshold)
+            self.assertEqual((indices[0], indices[-1]), (0, 999))
+            self.assertEqual(indices, sorted(set(indices)))
+
+    def test_keeps_spike(self):
+        xs = list(range(1000))
+        ys = [100.0] * 1000
+        ys[500] = 500.0
+        self.assertIn(500, lttb_indices(xs, ys, 10))
+
+    def test_short_series_is_unchanged(self):
+        self.assertEqual(lttb_indices([1, 2, 3], [1, 2, 3], 10), [0, 1, 2])
+        self.assertEqual(lttb_indices([1, 2], [1, 2], 3), [0, 1])
+
+
+class DownsampledDynamicsTests(TestCase):
+    """?bucket= и ?max_points= у /api/patients/<id>/dynamics/."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        ParameterCode.objects.create(code='HB', name='Гемоглобин')
+        ParameterCode.objects.create(code='NOTE', name='Комментарий', is_numeric=False)
+        cls.patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+        # 2024-01-01 - понедельник; по три значения в день, 10 дней, плюс нечисловые строки
+        cls.start = timezone.make_aware(datetime(2024, 1, 1))
+        for day in range(10):
+            for hour, delta in ((8, 0), (12, 10), (20, 5)):
+                Observation.objects.create(patient=cls.patient, parameter_id='HB', value=str(100 + day + delta),
+                                           timestamp=cls.start + timedelta(days=day, hours=hour))
+        Observation.objects.create(patient=cls.patient, parameter_id='HB', value='н/д', timestamp=cls.start)
+        Observation.objects.create(patient=cls.patient, parameter_id='NOTE', value='1', timestamp=cls.start)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_series(self, query):
+        response = self.client.get(f'/api/patients/{self.patient.id}/dynamics/?param=HB&param=NOTE&{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def epoch_ms(self, days):
+        return int((self.start + timedelta(days=days)).timestamp() * 1000)
+
+    def test_day_buckets(self):
+        series = self.get_series('bucket=day')
+        self.assertEqual(series['NOTE'], {'t': [], 'v': [], 'min': [], 'max': [], 'n': []})
+        hb = series['HB']
+        self.assertEqual(hb['t'], [self.epoch_ms(day) for day in range(10)])
+        self.assertEqual(hb['min'], [100.0 + day for day in range(10)])
+        self.assertEqual(hb['max'], [110.0 + day for day in range(10)])
+        for day, mean in enumerate(hb['v']):
+            self.assertAlmostEqual(mean, 105.0 + day)
+        self.assertEqual(hb['n'], [3] * 10)
+
+    def test_week_buckets(self):
+        hb = self.get_series('bucket=week')['HB']
+        self.assertEqual(hb['t'], [self.epoch_ms(0), self.epoch_ms(7)])
+        self.assertEqual(hb['n'], [21, 9])
+        self.assertEqual((hb['min'], hb['max']), ([100.0, 107.0], [116.0, 119.0]))
+        self.assertAlmostEqual(hb['v'][0], 108.0)
+        self.assertAlmostEqual(hb['v'][1], 113.0)
+
+    def test_max_points(self):
+        hb = self.get_series('max_points=7')['HB']
+        self.assertEqual(len(hb['t']), 7)
+        self.assertEqual((hb['t'][0], hb['v'][0]), (self.epoch_ms(0) + 8 * 3600 * 1000, 100.0))
+        self.assertEqual((hb['t'][-1], hb['v'][-1]), (self.epoch_ms(9) + 20 * 3600 * 1000, 114.0))
+        # Агрегация, затем LTTB по средним
+        bucketed = self.get_series('bucket=day&max_points=4')['HB']
+        self.assertEqual([len(values) for values in bucketed.values()], [4] * 5)
+        self.assertEqual((bucketed['min'][0], bucketed['max'][-1]), (100.0, 119.0))
+
+    def test_invalid_params(self):
+        for query in ('max_points=abc', 'max_points=2', f'max_points={MAX_POINTS + 1}', 'bucket=month'):
+            response = self.client.get(f'/api/patients/{self.patient.id}/dynamics/?param=HB&{query}')
+            self.assertEqual(response.status_code, 400, query)
+            self.assertIn('error', response.json())
+
+
+class KeysetPaginationTests(TestCase):
+    """Курсоры вперед/назад при равных ключах сортировки, испорченный курсор, page_size, ранжированный поиск."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        ParameterCode.objects.create(code='HB', name='Гемоглобин')
+        # Однофамильцы-тезки различаются только id - последним полем сортировки
+        for last_name, count in (('Борисов', 5), ('Алексеев', 2), ('Васильев', 3)):
+            for i in range(count):
+                Patient.objects.create(last_name=last_name, first_name='Иван', date_of_birth=date(1980, 1, 1 + i))
+        cls.patient = Patient.objects.first()
+        moment = timezone.now()
+        for i in range(7):
+            Observation.objects.create(patient=cls.patient, parameter_id='HB', value=str(i),
+                                       timestamp=moment - timedelta(days=i // 3))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def walk(self, url):
+        """Проходит все страницы вперед, затем назад; возвращает id в обоих направлениях."""
+        forward, pages = [], []
+        page = self.get_page(url)
+        self.assertIsNone(page['previous'])
+        while True:
+            pages.append(page)
+            forward.extend(row['id'] for row in page['results'])
+            if page['next'] is None:
+                break
+            page = self.get_page(page['next'])
+        backward = []
+        while page['previous'] is not None:
+            page = self.get_page(page['previous'])
+            backward[:0] = [row['id'] for row in page['results']]
+        return forward, [row['id'] for row in pages[-1]['results']], backward
+
+    def test_patient_cursor_round_trip(self):
+        expected = list(Patient.objects.order_by('last_name', 'first_name', 'id').values_list('id', flat=True))
+        forward, last_page, backward = self.walk('/api/patients/?page_size=3')
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward + last_page, expected)
+
+    def test_observation_cursor_round_trip(self):
+        expected = list(Observation.objects.order_by('-timestamp', '-id').values_list('id', flat=True))
+        forward, last_page, backward = self.walk(f'/api/observations/?patient_id={self.patient.id}&page_size=2')
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward + last_page, expected)
+
+    def test_invalid_cursor(self):
+        tampered = base64.urlsafe_b64encode(b'{"p":["x","y","not-an-id"]}').decode('ascii')
+        short = base64.urlsafe_b64encode(b'{"p":["x"]}').decode('ascii')
+        for cursor in ('!!!', 'bm90LWpzb24=', tampered, short, base64.urlsafe_b64encode(b'[1]').decode('ascii')):
+            response = self.client.get(f'/api/patients/?cursor={quote(cursor)}')
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+
+    def test_page_size_cap(self):
+        self.assertEqual(len(self.get_page('/api/patients/?page_size=4')['results']), 4)
+        with self.settings(API_MAX_PAGE_SIZE=3):
+            self.assertEqual(len(self.get_page('/api/patients/?page_size=100')['results']), 3)
+            self.assertEqual(len(self.get_page('/api/patients/')['results']), 3)
+        for page_size in ('0', '-1', 'abc'):
+            self.assertEqual(len(self.get_page(f'/api/patients/?page_size={page_size}')['results']), 10)
+
+    def test_ranked_search_returns_single_page(self):
+        cursor = self.get_page('/api/patients/?page_size=2')['next']
+        page = self.get_page(f'{cursor}&search=Борисов')
+        self.assertEqual((page['next'], page['previous']), (None, None))
+        self.assertEqual([row['last_name'] for row in page['results']], ['Борисов', 'Борисов'])
+        # Пустой поиск - обычная постраничная выдача
+        self.assertIsNotNone(self.get_page('/api/patients/?page_size=2&search=%20')['next'])
+
+
+class SummaryConsistencyTests(TestCase):
+    """Инкрементальные сводки совпадают с полным пересчетом."""
+
+    def test_incremental_matches_rebuild(self):
+        parameter = ParameterCode.objects.create(code='HB', name='Гемоглобин')
+        patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+        now = timezone.now()
+        first = Observation.objects.create(patient=patient, parameter=parameter, value='120', timestamp=now)
+        Observation.objects.create(patient=patient, parameter=parameter, value='90', timestamp=now - timedelta(days=1))
+        last = Observation.objects.create(patient=patient, parameter=parameter, value='130', timestamp=now + timedelta(days=1))
+        last.value = '80'
+        last.save()
+        first.delete()
+
+        fields = ('observation_count', 'numeric_count', 'value_min', 'value_max', 'value_sum', 'last_value')
+        incremental = list(PatientParameterSummary.objects.values_list(*fields))
+        rebuild_all_summaries()
+        self.assertEqual(incremental, list(PatientParameterSummary.objects.values_list(*fields)))
+        self.assertEqual(incremental, [(2, 2, 80.0, 90.0, 170.0, '80')])
+
+    def test_first_observations_create_summary(self):
+        ParameterCode.objects.create(code='HB', name='Гемоглобин')
+        ParameterCode.objects.create(code='NOTE', name='Комментарий', is_numeric=False)
+        patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+        now = timezone.now()
+        Observation.objects.create(patient=patient, parameter_id='NOTE', value='норма', timestamp=now)
+        Observation.objects.create(patient=patient, parameter_id='NOTE', value='ранее', timestamp=now - timedelta(days=1))
+        Observation.objects.create(patient=patient, parameter_id='HB', value='н/д', timestamp=now)
+        Observation.objects.create(patient=patient, parameter_id='HB', value='120,5', timestamp=now - timedelta(days=1))
+
+        fields = ('parameter_id', 'observation_count', 'numeric_count', 'value_min', 'value_max', 'value_sum',
+                  'first_timestamp', 'last_timestamp', 'last_value', 'last_value_numeric')
+        incremental = list(PatientParameterSummary.objects.order_by('parameter_id').values_list(*fields))
+        self.assertEqual(incremental[0][:6] + incremental[0][8:], ('HB', 2, 1, 120.5, 120.5, 120.5, 'н/д', None))
+        self.assertEqual(incremental[1][:6] + incremental[1][8:], ('NOTE', 2, 0, None, None, None, 'норма', None))
+        rebuild_all_summaries()
+        self.assertEqual(incremental, list(PatientParameterSummary.objects.order_by('parameter_id').values_list(*fields)))
+
+    def test_queryset_delete_refreshes_summaries(self):
+        ParameterCode.objects.create(code='HB', name='Гемоглобин')
+        patients = [
+            Patient.objects.create(last_name=name, first_name='Иван', date_of_birth=date(1980, 1, 1))
+            for name in ('Иванов', 'Петров')
+        ]
+        for patient in patients:
+            for value in ('100', '110', '120'):
+                Observation.objects.create(patient=patient, parameter_id='HB', value=value)
+        Observation.objects.filter(value='120').delete()
+        Observation.objects.filter(patient=patients[1]).delete()
+        self.assertEqual(list(PatientParameterSummary.objects.values_list('patient_id', 'observation_count', 'value_max')),
+                         [(patients[0].id, 2, 110.0)])
+
+    def test_patient_delete_keeps_fast_delete(self):
+        ParameterCode.objects.create(code='HB', name='Гемоглобин')
+        queries = []
+        for count in (20, 200):
+            patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+            Observation.objects.bulk_create(
+                Observation(patient=patient, parameter_id='HB', value=str(i), value_numeric=i) for i in range(count)
+            )
+            rebuild_all_summaries()
+            with CaptureQueriesContext(connection) as captured:
+                patient.delete()
+            queries.append(len(captured))
+        # Наблюдения и сводки удаляются одним DELETE каждые, без строк в памяти и пересчетов
+        self.assertEqual(queries[0], queries[1])
+        self.assertFalse(Observation.objects.exists())
+        self.assertFalse(PatientParameterSummary.objects.exists())
+
+
+class ReferenceCacheTests(TestCase):
+    """Условные запросы к справочникам (304) и смена ETag при изменении ParameterCode / MKBCode."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        ParameterCode.objects.create(code='HB', name='Гемоглобин')
+        MKBCode.objects.create(code='C71.0', name='Опухоль головного мозга')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        cache.clear()
+        reference_cache._local.clear()
+
+    def get(self, url, **headers):
+        # Локальный уровень кэша не ждет REFERENCE_CACHE_LOCAL_TTL
+        with self.settings(REFERENCE_CACHE_LOCAL_TTL=0):
+            return self.client.get(url, **headers)
+
+    def change(self, action):
+        # Версия справочника меняется после коммита
+        with self.captureOnCommitCallbacks(execute=True):
+            action()
+
+    def test_conditional_requests(self):
+        response = self.get('/api/parameters/')
+        self.assertEqual(response.status_code, 200)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        for headers in ({'HTTP_IF_NONE_MATCH': etag}, {'HTTP_IF_NONE_MATCH': f'"other", W/{etag}'},
+                        {'HTTP_IF_NONE_MATCH': '*'}, {'HTTP_IF_MODIFIED_SINCE': last_modified}):
+            response = self.get('/api/parameters/', **headers)
+            self.assertEqual(response.status_code, 304, headers)
+            self.assertEqual((response['ETag'], response.content), (etag, b''))
+
+        self.assertEqual(self.get('/api/parameters/', HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+        self.assertEqual(self.get('/api/parameters/', HTTP_IF_MODIFIED_SINCE='Mon, 01 Jan 2001 00:00:00 GMT').status_code, 200)
+        # If-None-Match важнее If-Modified-Since
+        response = self.get('/api/parameters/', HTTP_IF_NONE_MATCH='"other"', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+    def test_search_variants_have_own_etags(self):
+        full = self.get('/api/mkb-codes/')['ETag']
+        search = self.get('/api/mkb-codes/?search=C71')
+        self.assertNotEqual(search['ETag'], full)
+        self.assertEqual(self.get('/api/mkb-codes/?search=C71', HTTP_IF_NONE_MATCH=search['ETag']).status_code, 304)
+        self.assertEqual(self.get('/api/mkb-codes/?search=C72', HTTP_IF_NONE_MATCH=search['ETag']).status_code, 200)
+
+    def assertChangesETag(self, url, action, expected):
+        etag = self.get(url)['ETag']
+        self.change(action)
+        response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(sorted(item['code'] for item in response.json()), expected)
+
+    def test_parameter_code_changes(self):
+        self.assertChangesETag('/api/parameters/', lambda: ParameterCode.objects.create(code='WBC', name='Лейкоциты'), ['HB', 'WBC'])
+        self.assertEqual(set(reference_cache.parameter_code_map()), {'HB', 'WBC'})
+        self.assertChangesETag('/api/parameters/', lambda: ParameterCode.objects.get(code='WBC').delete(), ['HB'])
+
+    def test_deleted_code_is_rejected_while_cached(self):
+        patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+        ParameterCode.objects.create(code='WBC', name='Лейкоциты')
+        self.assertIn('WBC', reference_cache.parameter_code_map())
+        # Удаление в другом процессе: здесь локальный кэш еще не устарел
+        with mock.patch('core.signals.bump_version'):
+            self.change(lambda: ParameterCode.objects.filter(code='WBC').delete())
+        self.assertIn('WBC', reference_cache.parameter_code_map())
+        response = self.client.post('/api/observations/', {'patient': patient.pk, 'parameter': 'WBC', 'value': '5'}, format='json')
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertIn('parameter', response.json())
+        response = self.client.post('/api/observations/', {'patient': patient.pk, 'parameter': 'HB', 'value': '120'}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_mkb_code_changes(self):
+        self.assertChangesETag('/api/mkb-codes/', lambda: MKBCode.objects.create(code='C71.1', name='Лобная доля'), ['C71.0', 'C71.1'])
+        self.assertChangesETag('/api/mkb-codes/?search=C71', lambda: MKBCode.objects.get(code='C71.1').delete(), ['C71.0'])
+
+
+class MKBSearchTests(TestCase):
+    """?search= у /api/mkb-codes/: префикс кода, ранжирование по названию, ?limit=."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        MKBCode.objects.bulk_create([
+            MKBCode(code='A00', name='Холера'),
+            MKBCode(code='C71.0', name='Опухоль головного мозга'),
+            MKBCode(code='C71.1', name='Злокачественная опухоль лобной доли'),
+            MKBCode(code='C710', name='Код без точки'),
+            MKBCode(code='D33', name='Доброкачественная нейроопухоль'),
+            *(MKBCode(code=f'C71.{i}', name=f'Новообразование {i}') for i in range(2, 10)),
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        cache.clear()
+        reference_cache._local.clear()
+
+    def search(self, query):
+        response = self.client.get(f'/api/mkb-codes/?{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [item['code'] for item in response.json()]
+
+    def test_code_prefix(self):
+        self.assertEqual(self.search('search=c71.&limit=3'), ['C71.0', 'C71.1', 'C71.2'])
+        self.assertEqual(self.search('search=C71'), [f'C71.{i}' for i in range(10)] + ['C710'])
+        self.assertEqual(self.search('search=C71.1'), ['C71.1'])
+
+    def test_name_ranking(self):
+        # Начало названия > начало слова > вхождение внутри слова
+        self.assertEqual(self.search('search=опухоль'), ['C71.0', 'C71.1', 'D33'])
+        self.assertEqual(self.search('search=Холера'), ['A00'])
+        # Похожая на код строка без совпадений по коду ищется по названию
+        self.assertEqual(self.search('search=Z99'), [])
+
+    def test_limit(self):
+        self.assertEqual(len(self.search('search=новообразование&limit=2')), 2)
+        self.assertEqual(len(self.search('search=новообразование')), 8)
+        self.assertEqual(len(self.search('')), 13)
+        for limit in ('0', f'{MAX_LIMIT + 1}', 'abc'):
+            response = self.client.get(f'/api/mkb-codes/?search=C71&limit={limit}')
+            self.assertEqual(response.status_code, 400, limit)
+
+    def test_memory_index_matches_database_path(self):
+        # Без PostgreSQL/pg_trgm поиск идет по MKBIndex - порядок тот же
+        index = search.MKBIndex(MKBCode.objects.values_list('code', 'name'))
+        self.assertEqual([code for code, _ in index.search_codes('c71.', 3)], ['C71.0', 'C71.1', 'C71.2'])
+        self.assertEqual([code for code, _ in index.search_names('ОПУХОЛЬ', 20)], ['C71.0', 'C71.1', 'D33'])
+        with mock.patch.object(search, 'trigram_available', return_value=False), \
+                mock.patch.object(search, 'connections', {'default': mock.Mock(vendor='sqlite')}):
+            self.assertEqual([code for code, _ in search.search_mkb('C71.', 2)], ['C71.0', 'C71.1'])
+            self.assertEqual([code for code, _ in search.search_mkb('опухоль')], ['C71.0', 'C71.1', 'D33'])
+
+    def test_trigram_search(self):
+        if not trigram_available():
+            self.skipTest("pg_trgm is not installed")
+        self.assertEqual([code for code, _ in search.search_mkb('опухоль')], ['C71.0', 'C71.1', 'D33'])
+        # Опечатка: word_similarity находит слово без точного вхождения
+        self.assertIn('A00', [code for code, _ in search.search_mkb('халера')])
+
+    def test_explain_queries_command(self):
+        ParameterCode.objects.create(code='HB', name='Гемоглобин')
+        patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+        Observation.objects.create(patient=patient, parameter_id='HB', value='120')
+        out = io.StringIO()
+        call_command('explain_queries', '--no-analyze', '--search', 'C71', stdout=out)
+        self.assertIn('=== mkb search: code prefix ===', out.getvalue())
+        self.assertIn('mkb search: name', out.getvalue())
+
+
+class PatientSearchTests(TestCase):
+    """?search= у /api/patients/: clinic_id первым, ФИО целиком, инициалы, путь без pg_trgm."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        people = {
+            'ivanov': ('Иванов', 'Иван', 'Петрович', 'A-100'),
+            'ivanova': ('Иванова', 'Иванна', None, 'A-101'),
+            'sidorov': ('Сидоров', 'Иван', 'Иванович', 'A-102'),
+            'ivanov_petr': ('Иванов', 'Петр', 'Сергеевич', 'A-103'),
+            'petrov': ('Петров', 'Петр', None, 'Иванов'),  # clinic_id дословно совпадает со строкой поиска
+        }
+        cls.ids = {}
+        for key, (last_name, first_name, middle_name, clinic_id) in people.items():
+            cls.ids[key] = Patient.objects.create(
+                last_name=last_name, first_name=first_name, middle_name=middle_name,
+                date_of_birth=date(1980, 1, 1), clinic_id=clinic_id,
+            ).id
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, term):
+        response = self.client.get('/api/patients/', {'search': term})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row['id'] for row in response.json()['results']]
+
+    def names(self, *keys):
+        return [self.ids[key] for key in keys]
+
+    def test_exact_clinic_id_first(self):
+        self.assertEqual(self.search('A-102'), self.names('sidorov'))
+        found = self.search('Иванов')
+        self.assertEqual(found[0], self.ids['petrov'])
+        # Затем фамилия целиком, затем с начала, затем вхождение в имя/отчество
+        self.assertEqual(found[1:3], self.names('ivanov', 'ivanov_petr'))
+        self.assertEqual(found[3:], self.names('ivanova', 'sidorov'))
+
+    def test_full_name(self):
+        # Каждое слово ищется во всех частях ФИО: 'Иван' есть и в фамилии 'Иванов'
+        self.assertEqual(self.search('Иванов Иван'), self.names('ivanov', 'ivanov_petr', 'ivanova', 'sidorov'))
+        self.assertEqual(self.search('Иванов Иван Петрович'), self.names('ivanov'))
+        self.assertEqual(self.search('Сидоров Петр'), [])
+
+    def test_initials(self):
+        # Инициал совпадает с началом имени или отчества
+        self.assertEqual(self.search('Иванов П.'), self.names('ivanov', 'ivanov_petr'))
+        self.assertEqual(self.search('Иванов П. С.'), self.names('ivanov_petr'))
+        self.assertEqual(self.search('Сидоров И.И.'), self.names('sidorov'))
+        self.assertEqual(self.search('Сидоров П.'), [])
+
+    def test_without_trigram(self):
+        # Путь без pg_trgm (SQLite, PostgreSQL без расширения): icontains, без word_similarity
+        with mock.patch.object(search, 'trigram_available', return_value=False):
+            queryset = search.search_patients(Patient.objects.all(), 'Иванов Иван')
+            self.assertNotIn('word_similarity', str(queryset.query))
+            self.assertEqual(list(queryset.values_list('id', flat=True)), self.names('ivanov', 'ivanov_petr', 'ivanova', 'sidorov'))
+            self.assertEqual(self.search('Иванов П. С.'), self.names('ivanov_petr'))
+
+    def test_trigram_search(self):
+        if not trigram_available():
+            self.skipTest("pg_trgm is not installed")
+        self.assertEqual(self.search('Иванов Иван')[:2], self.names('ivanov', 'ivanov_petr'))
+        # Опечатка в фамилии
+        self.assertIn(self.ids['sidorov'], self.search('Сидаров'))
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "Concurrent transactions are checked on PostgreSQL only")
+class ConcurrentSummaryTests(TransactionTestCase):
+
+    def test_concurrent_first_observations(self):
+        ParameterCode.objects.create(code='HB', name='Гемоглобин')
+        patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+        inserted = threading.Event()
+
+        def first():
+            try:
+                with transaction.atomic():
+                    Observation.objects.create(patient=patient, parameter_id='HB', value='100')
+                    inserted.set()
+                    # Второе наблюдение пары вставляется, пока первое не закоммичено
+                    time.sleep(0.5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=first)
+        thread.start()
+        inserted.wait(5)
+        Observation.objects.create(patient=patient, parameter_id='HB', value='120')
+        thread.join()
+
+        summary = PatientParameterSummary.objects.get()
+        self.assertEqual((summary.observation_count, summary.value_min, summary.value_max, summary.value_sum),
+                         (2, 100.0, 120.0, 220.0))
+
+
+@override_settings(RESEARCH_EXPORT_CHUNK_SIZE=2)
+class ResearchStreamingTests(TestCase):
+    """
+    Потоковые выгрузки (?stream=1, ?format=ndjson) совпадают с обычным JSON-ответом.
+    Маленький RESEARCH_EXPORT_CHUNK_SIZE - границы пачек курсоров попадают внутрь пациентов.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        mkb = MKBCode.objects.create(code='C71.0', name='Опухоль')
+        ParameterCode.objects.create(code='HB', name='Гемоглобин', unit='g/l')
+        ParameterCode.objects.create(code='WBC', name='Лейкоциты')
+        moment = timezone.make_aware(datetime(2024, 1, 1, 10, 0))
+        # Без наблюдений (или только с WBC, не попадающими в выборку) - первый, средний и последний
+        # по порядку склейки пациенты, однофамильцы различаются только id
+        names = ('Абрамов', 'Борисов', 'Борисов', 'Васильев', 'Григорьев', 'Яковлев')
+        observations = ((), ('120,5', 'н/д', '118'), ('99',), (), ('130', '131', '132'), ('4',))
+        for i, (last_name, values) in enumerate(zip(names, observations)):
+            patient = Patient.objects.create(
+                last_name=last_name, first_name='Иван', date_of_birth=date(1980, 1, 1 + i),
+                clinic_id=f'A-{i}' if i % 2 else None, primary_diagnosis_mkb=mkb if i % 3 else None,
+            )
+            parameter = 'WBC' if last_name == 'Яковлев' else 'HB'
+            episode = HospitalizationEpisode.objects.create(patient=patient, start_date=date(2024, 1, 1)) if values else None
+            for hours, value in enumerate(values):
+                Observation.objects.create(patient=patient, parameter_id=parameter, value=value,
+                                           episode=episode if hours else None, timestamp=moment + timedelta(hours=hours))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_rows(self, query='param_codes=HB'):
+        response = self.client.get(f'/api/research/query/?{query}&format=json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def get_stream(self, query):
+        response = self.client.get(f'/api/research/query/?{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_rows_include_patients_without_observations(self):
+        rows = self.get_rows()
+        self.assertEqual([row['last_name'] for row in rows],
+                         ['Абрамов', 'Борисов', 'Борисов', 'Борисов', 'Борисов', 'Васильев',
+                          'Григорьев', 'Григорьев', 'Григорьев', 'Яковлев'])
+        self.assertNotIn('parameter_code', rows[0])
+        self.assertNotIn('parameter_code', rows[-1])
+        self.assertEqual([row['value_numeric'] for row in rows[1:4]], [120.5, None, 118.0])
+
+    def test_csv_stream_matches_json(self):
+        rows = self.get_rows()
+        lines = list(csv.reader(io.StringIO(self.get_stream('param_codes=HB&format=csv&stream=1'))))
+        self.assertEqual(lines[0], list(research.CSV_HEADER))
+        expected = [['' if row.get(column) is None else str(row[column]) for column in research.CSV_HEADER] for row in rows]
+        self.assertEqual(lines[1:], expected)
+
+    def test_ndjson_stream_matches_json(self):
+        rows = self.get_rows()
+        with mock.patch.object(research, 'STREAM_ROWS_PER_CHUNK', 3):
+            body = self.get_stream('param_codes=HB&format=ndjson')
+        self.assertTrue(body.endswith('\n'))
+        self.assertEqual([json.loads(line) for line in body.splitlines()], rows)
+
+    def test_json_stream_matches_json(self):
+        query = 'param_codes=HB&param_codes=WBC&diagnosis_mkb=C71.0'
+        rows = self.get_rows(query)
+        self.assertEqual(json.loads(self.get_stream(f'{query}&format=json&stream=1')), rows)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', "snapshot of a server-side cursor (PostgreSQL)")
+    def test_export_is_consistent_when_patients_change(self):
+        criteria = ResearchCriteria.from_params(QueryDict('param_codes=HB'))
+        expected = list(research.iter_research_rows(criteria.patient_queryset(), criteria.observation_filter()))
+        rows = research.iter_research_rows(criteria.patient_queryset(), criteria.observation_filter(), chunk_size=2)
+        exported = [next(rows)]
+        # Во время выгрузки пациента с наблюдениями переименовали (он сменил место в порядке), другого удалили
+        Patient.objects.filter(last_name='Григорьев').update(last_name='Аверин')
+        Patient.objects.filter(last_name='Борисов').order_by('id').first().delete()
+        exported.extend(rows)
+        self.assertEqual(exported, expected)
+
+    def test_patient_ids_are_not_mixed(self):
+        # Пациенты и наблюдения - один запрос: у каждой строки наблюдения пациент - владелец наблюдения
+        criteria = ResearchCriteria.from_params(QueryDict('param_codes=HB&param_codes=WBC'))
+        records = list(research.iter_research_records(criteria.patient_queryset(), criteria.observation_filter(), chunk_size=2))
+        for patient, obs in records:
+            if obs is not None:
+                self.assertEqual(obs[0], patient[0])
+        self.assertEqual(sum(1 for _, obs in records if obs is not None), Observation.objects.count())
+
+    def test_empty_selection(self):
+        self.assertEqual(self.get_stream('param_codes=HB&diagnosis_mkb=Z00&format=ndjson'), '')
+        self.assertEqual(json.loads(self.get_stream('param_codes=HB&diagnosis_mkb=Z00&format=json&stream=1')), [])
+
+
+class ResearchMatrixTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        ParameterCode.objects.create(code='HB', name='Гемоглобин')
+        ParameterCode.objects.create(code='WBC', name='Лейкоциты')
+        cls.first = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+        cls.second = Patient.objects.create(last_name='Петров', first_name='Петр', date_of_birth=date(1990, 1, 1))
+        cls.early = HospitalizationEpisode.objects.create(patient=cls.first, start_date=date(2024, 1, 1))
+        cls.late = HospitalizationEpisode.objects.create(patient=cls.first, start_date=date(2024, 3, 1))
+        moment = timezone.make_aware(datetime(2024, 1, 1, 10, 0))  # Понедельник
+        for hours, value, episode in ((0, '100', cls.early), (2, '110', cls.early), (24 * 60, '90', cls.late), (26, 'н/д', None)):
+            Observation.objects.create(patient=cls.first, parameter_id='HB', value=value, episode=episode,
+                                       timestamp=moment + timedelta(hours=hours))
+        Observation.objects.create(patient=cls.second, parameter_id='WBC', value='4', timestamp=moment + timedelta(days=1))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_matrix(self, query):
+        response = self.client.get(f'/api/research/matrix/?param_codes=WBC&param_codes=HB&{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_day_mean(self):
+        data = self.get_matrix('bucket=day&agg=mean')
+        self.assertEqual(data['patients'], [self.first.id, self.second.id])
+        self.assertEqual(data['parameters'], ['HB', 'WBC'])
+        self.assertEqual(data['buckets'], ['2024-01-01', '2024-01-02', '2024-03-01'])
+        self.assertEqual(data['values'], [
+            [[105.0, None, 90.0], [None, None, None]],
+            [[None, None, None], [None, 4.0, None]],
+        ])
+
+    def test_week_last(self):
+        data = self.get_matrix('bucket=week&agg=last')
+        self.assertEqual(data['buckets'], ['2024-01-01', '2024-02-26'])
+        self.assertEqual(data['values'][0][0], [110.0, 90.0])
+
+    def test_episode_ordinals(self):
+        data = self.get_matrix('bucket=episode&agg=max')
+        self.assertEqual(data['buckets'], [1, 2])
+        self.assertEqual(data['episodes'], [[self.early.id, self.late.id], [None, None]])
+        self.assertEqual(data['values'][0][0], [110.0, 90.0])
+        self.assertEqual(data['values'][1][1], [None, None])
+
+    def test_invalid_params(self):
+        response = self.client.get('/api/research/matrix/?param_codes=HB&agg=median')
+        self.assertEqual(response.status_code, 400)
+        with self.settings(RESEARCH_MATRIX_MAX_CELLS=3):
+            response = self.client.get('/api/research/matrix/?param_codes=HB&param_codes=WBC')
+        self.assertEqual(response.status_code, 400)
+
+
+@unittest.skipUnless(columnar_available(), "pyarrow is not installed")
+class ColumnarExportTests(TestCase):
+    """?format=parquet / arrow: типизированные колонки, пачки ограничены RESEARCH_COLUMNAR_ROWS_PER_GROUP."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        ParameterCode.objects.create(code='HB', name='Гемоглобин', unit='g/l')
+        ParameterCode.objects.create(code='WBC', name='Лейкоциты')
+        cls.patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1), clinic_id='A-1')
+        Patient.objects.create(last_name='Петров', first_name='Петр', date_of_birth=date(1990, 1, 1))
+        cls.moment = datetime(2024, 1, 1, 9, 0, tzinfo=dt_timezone.utc)
+        Observation.objects.create(patient=cls.patient, parameter_id='HB', value='120,5', timestamp=cls.moment)
+        Observation.objects.create(patient=cls.patient, parameter_id='WBC', value='5', timestamp=cls.moment)
+        Observation.objects.create(patient=cls.patient, parameter_id='HB', value='н/д', timestamp=cls.moment + timedelta(days=1))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_table(self, query):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        response = self.client.get(f'/api/research/query/?param_codes=HB&param_codes=WBC&{query}')
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        if 'format=arrow' in query:
+            return pa.ipc.open_stream(content).read_all()
+        return pq.read_table(pa.BufferReader(content))
+
+    @override_settings(RESEARCH_COLUMNAR_ROWS_PER_GROUP=2)
+    def test_long_layout(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        response = self.client.get('/api/research/query/?param_codes=HB&param_codes=WBC&format=parquet')
+        parquet_file = pq.ParquetFile(pa.BufferReader(b''.join(response.streaming_content)))
+        self.assertEqual(parquet_file.metadata.num_row_groups, 2)  # 4 строки по 2
+        table = parquet_file.read()
+        self.assertEqual(table.schema.field('value_numeric').type, pa.float64())
+        self.assertTrue(pa.types.is_dictionary(table.schema.field('parameter_code').type))
+        self.assertEqual(table.column('value_numeric').to_pylist(), [120.5, 5.0, None, None])
+        self.assertEqual(table.column('observation_timestamp').to_pylist()[0], self.moment)
+        self.assertEqual(table.column('last_name').to_pylist(), ['Иванов', 'Иванов', 'Иванов', 'Петров'])
+
+    def test_wide_layout(self):
+        for export_format in ('parquet', 'arrow'):
+            table = self.get_table(f'format={export_format}&layout=wide')
+            self.assertEqual(table.column_names[-2:], ['HB', 'WBC'])
+            self.assertEqual(table.column('HB').to_pylist(), [120.5, None, None])
+            self.assertEqual(table.column('WBC').to_pylist(), [5.0, None, None])
+
+    def test_unknown_layout(self):
+        response = self.client.get('/api/research/query/?param_codes=HB&format=parquet&layout=diagonal')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(RESEARCH_JOB_WORKERS=0)
+class ResearchJobTests(TestCase):
+    """Фоновые выгрузки: с RESEARCH_JOB_WORKERS=0 задание выполняется в on_commit самого запроса."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        ParameterCode.objects.create(code='HB', name='Гемоглобин', unit='g/l')
+        ParameterCode.objects.create(code='WBC', name='Лейкоциты')
+        patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+        Observation.objects.create(patient=patient, parameter_id='HB', value='120')
+        Observation.objects.create(patient=patient, parameter_id='WBC', value='5,1')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def post_job(self, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/research/jobs/', data, format='json')
+
+    def test_job_builds_file_and_dedupes(self):
+        response = self.post_job({'param_codes': ['HB', 'WBC'], 'export_format': 'csv'})
+        self.assertEqual(response.status_code, 202, response.content)
+        job_id = response.json()['id']
+
+        status_response = self.client.get(f'/api/research/jobs/{job_id}/').json()
+        self.assertEqual(status_response['status'], 'done')
+        self.assertEqual(status_response['row_count'], 2)
+        download = self.client.get(status_response['download_url'])
+        self.assertEqual(download.status_code, 200)
+        lines = b''.join(download.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('clinic_id,date_of_birth'))
+
+        # Тот же запрос в другом порядке и с повтором кода - то же задание
+        again = self.post_job({'param_codes': ['WBC', 'HB', 'HB'], 'export_format': 'csv'})
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.json()['id'], job_id)
+        other_format = self.post_job({'param_codes': ['HB', 'WBC'], 'export_format': 'ndjson'})
+        self.assertNotEqual(other_format.json()['id'], job_id)
+
+    @unittest.skipUnless(columnar_available(), "pyarrow is not installed")
+    def test_parquet_job(self):
+        import pyarrow.parquet as pq
+        job_id = self.post_job({'param_codes': ['HB', 'WBC'], 'export_format': 'parquet', 'layout': 'wide'}).json()['id']
+        job = ResearchExportJob.objects.get(pk=job_id)
+        self.assertEqual(job.status, ResearchExportJob.STATUS_DONE, job.error)
+        self.assertEqual(job.params['layout'], 'wide')
+        table = pq.read_table(job.result_file.path)
+        # Разное время наблюдений - разные строки
+        self.assertEqual(table.column('HB').to_pylist(), [120.0, None])
+        self.assertEqual(table.column('WBC').to_pylist(), [None, 5.1])
+
+    def test_invalid_params(self):
+        self.assertEqual(self.post_job({'export_format': 'csv'}).status_code, 400)
+        self.assertEqual(self.post_job({'param_codes': ['HB'], 'export_format': 'xml'}).status_code, 400)
+        self.assertFalse(ResearchExportJob.objects.exists())
+
+    def test_concurrent_duplicate_request_reuses_job(self):
+        # Первый запрос создал задание, но еще не выполнил его (on_commit не вызван)
+        first, created = jobs.create_or_reuse_job({'param_codes': ['HB']}, 'csv')
+        self.assertTrue(created)
+        # Гонка: второй запрос проверил наличие задания до того, как первое было создано
+        real_find = jobs.find_reusable_job
+        with mock.patch.object(jobs, 'find_reusable_job', side_effect=[None, real_find(first.params_hash, 'csv')]), \
+                mock.patch.object(jobs, 'enqueue_job') as enqueue:
+            second, created = jobs.create_or_reuse_job({'param_codes': ['HB']}, 'csv')
+        self.assertFalse(created)
+        self.assertEqual(second.pk, first.pk)
+        enqueue.assert_not_called()
+        self.assertEqual(ResearchExportJob.objects.count(), 1)
+        # Завершенное задание не мешает новому
+        ResearchExportJob.objects.filter(pk=first.pk).update(status=ResearchExportJob.STATUS_FAILED)
+        self.assertTrue(jobs.create_or_reuse_job({'param_codes': ['HB']}, 'csv')[1])
+
+    def test_stale_jobs_are_requeued_and_run_once(self):
+        job, _ = jobs.create_or_reuse_job({'param_codes': ['HB']}, 'csv')  # on_commit не выполнен - задание ждет
+        ResearchExportJob.objects.filter(pk=job.pk).update(
+            status=ResearchExportJob.STATUS_RUNNING, started_at=timezone.now() - timedelta(days=1),
+        )
+        self.assertEqual(jobs.run_pending_jobs(), 0)
+        self.assertEqual(jobs.requeue_stale_jobs(), 1)
+        self.assertEqual(jobs.run_pending_jobs(), 1)
+        self.assertEqual(ResearchExportJob.objects.get(pk=job.pk).status, ResearchExportJob.STATUS_DONE)
+        # Уже захваченное задание второй раз не выполняется
+        self.assertFalse(jobs.run_job(job.pk))
+        self.assertEqual(jobs.requeue_stale_jobs(), 0)
+
+    def test_expired_results_are_purged(self):
+        job_id = self.post_job({'param_codes': ['HB']}).json()['id']
+        job = ResearchExportJob.objects.get(pk=job_id)
+        storage, name = job.result_file.storage, job.result_file.name
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(purge_expired_jobs(now=job.expires_at + timedelta(seconds=1)), 1)
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(ResearchExportJob.objects.exists())
+
+
+class AgeBoundsTests(SimpleTestCase):
+    """Границы дат рождения совпадают с полными годами по календарю, включая 29 февраля."""
+
+    def test_bounds_match_calendar_age(self):
+        todays = [date(2024, 2, 28), date(2024, 2, 29), date(2024, 3, 1), date(2023, 2, 28), date(2023, 3, 1), date(2025, 12, 31)]
+        for today in todays:
+            births = [date(1999, 12, 1) + timedelta(days=offset) for offset in range(0, 6 * 366)]
+            for age_min, age_max in ((20, 20), (21, 23), (None, 22), (24, None)):
+                earliest, latest = birth_date_bounds(age_min, age_max, today)
+                for birth in births:
+                    age = age_on(birth, today)
+                    expected = (age_min is None or age >= age_min) and (age_max is None or age <= age_max)
+                    actual = (latest is None or birth <= latest) and (earliest is None or birth >= earliest)
+                    self.assertEqual(actual, expected, (today, birth, age_min, age_max))
+
+    def test_invalid_age(self):
+        from django.http import QueryDict
+        from .criteria import ResearchQueryError
+        with self.assertRaises(ResearchQueryError):
+            ResearchCriteria.from_params(QueryDict('param_codes=HB&age_min=-1'))
+
+
+class CohortTests(TestCase):
+    """Сохраненные когорты: состав считается при создании и поддерживается инкрементально."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        cls.c71 = MKBCode.objects.create(code='C71.0', name='Глиобластома')
+        cls.c50 = MKBCode.objects.create(code='C50.9', name='Рак молочной железы')
+        ParameterCode.objects.create(code='HB', name='Гемоглобин')
+        ParameterCode.objects.create(code='WBC', name='Лейкоциты')
+        cls.young = Patient.objects.create(last_name='Алексеев', first_name='Алексей', date_of_birth=date(2000, 6, 15), primary_diagnosis_mkb=cls.c71)
+        cls.old = Patient.objects.create(last_name='Борисов', first_name='Борис', date_of_birth=date(1950, 1, 1), primary_diagnosis_mkb=cls.c71)
+        cls.other = Patient.objects.create(last_name='Васильева', first_name='Вера', date_of_birth=date(1990, 3, 3), primary_diagnosis_mkb=cls.c50)
+        for patient in (cls.young, cls.old, cls.other):
+            Observation.objects.create(patient=patient, parameter_id='HB', value='120')
+            Observation.objects.create(patient=patient, parameter_id='WBC', value='5')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def members(self, cohort):
+        return set(CohortMembership.objects.filter(cohort=cohort).values_list('patient_id', flat=True))
+
+    def test_create_builds_membership(self):
+        response = self.client.post('/api/cohorts/', {
+            'name': 'Глиомы', 'criteria': {'diagnosis_mkb': 'c71.0', 'param_codes': ['WBC', 'HB', 'HB']},
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        data = response.json()
+        self.assertEqual(data['member_count'], 2)
+        self.assertEqual(data['criteria'], {'diagnosis_mkb': 'C71.0', 'param_codes': ['HB', 'WBC']})
+        self.assertEqual(self.client.get('/api/cohorts/').json()['results'][0]['member_count'], 2)
+        patients = self.client.get(f"/api/cohorts/{data['id']}/patients/").json()['results']
+        self.assertEqual([row['id'] for row in patients], [self.young.id, self.old.id])
+
+        invalid = self.client.post('/api/cohorts/', {'name': 'x', 'criteria': {'age_min': 'abc'}}, format='json')
+        self.assertEqual(invalid.status_code, 400)
+
+    def test_patient_changes_update_membership(self):
+        cohort = refresh_cohort(Cohort.objects.create(name='C71', criteria={'diagnosis_mkb': 'C71.0', 'age_max': 60}))
+        self.assertEqual(self.members(cohort), {self.young.id})
+        version = cohort.membership_version
+
+        self.other.primary_diagnosis_mkb = self.c71
+        self.other.save()
+        self.assertEqual(self.members(cohort), {self.young.id, self.other.id})
+        self.young.date_of_birth = date(1940, 1, 1)
+        self.young.save(update_fields=['date_of_birth'])
+        self.assertEqual(self.members(cohort), {self.other.id})
+        cohort.refresh_from_db()
+        self.assertEqual(cohort.membership_version, version + 2)
+
+        # Изменение остальных полей состав не трогает
+        self.other.last_name = 'Васильева-Петрова'
+        self.other.save(update_fields=['last_name'])
+        cohort.refresh_from_db()
+        self.assertEqual(cohort.membership_version, version + 2)
+
+    def test_new_day_matches_full_refresh(self):
+        births = [date(1990, 1, 1) + timedelta(days=offset) for offset in range(0, 800, 7)]
+        for index, birth in enumerate(births):
+            Patient.objects.create(last_name=f'Г{index}', first_name='Г', date_of_birth=birth, primary_diagnosis_mkb=self.c71)
+        criteria = {'diagnosis_mkb': 'C71.0', 'age_min': 30, 'age_max': 31}
+        cohort = refresh_cohort(Cohort.objects.create(name='30-31', criteria=criteria), today=date(2021, 1, 1))
+        for today in (date(2021, 6, 1), date(2022, 2, 28), date(2022, 3, 1), date(2022, 12, 31)):
+            ensure_current(cohort, today)
+            reference = refresh_cohort(Cohort.objects.create(name='check', criteria=criteria), today=today)
+            self.assertEqual(self.members(cohort), self.members(reference), today)
+            self.assertEqual(cohort.evaluated_on, today)
+
+    def test_research_query_uses_membership(self):
+        cohort = refresh_cohort(Cohort.objects.create(
+            name='C71', criteria={'diagnosis_mkb': 'C71.0', 'param_codes': ['HB']}
+        ))
+        response = self.client.get(f'/api/research/query/?cohort_id={cohort.id}', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        rows = response.json()
+        self.assertEqual({row['patient_id'] for row in rows}, {self.young.id, self.old.id})
+        self.assertEqual({row['parameter_code'] for row in rows}, {'HB'})
+
+        # Показатели из запроса заменяют сохраненные; критерии пациентов вместе с когортой - ошибка
+        rows = self.client.get(f'/api/research/query/?cohort_id={cohort.id}&param_codes=WBC', HTTP_ACCEPT='application/json').json()
+        self.assertEqual({row['parameter_code'] for row in rows}, {'WBC'})
+        self.assertEqual(self.client.get(f'/api/research/query/?cohort_id={cohort.id}&age_min=10').status_code, 400)
+        self.assertEqual(self.client.get('/api/research/query/?cohort_id=999999').status_code, 400)
+
+        matrix = self.client.get(f'/api/research/matrix/?cohort_id={cohort.id}').json()
+        self.assertEqual(matrix['patients'], sorted([self.young.id, self.old.id]))
+
+
+class SyntheticDataTests(TestCase):
+    """Генератор synthetic данных и бенчмарк на них (manage.py generate_synthetic_data / run_benchmarks)."""
+    config = SyntheticConfig(patients=20, mkb_codes=30, parameters=4, observations_per_patient=10, parameters_per_patient=2)
+
+    def test_generate_and_clear(self):
+        real = Patient.objects.create(last_name='Настоящий', first_name='Пациент', date_of_birth=date(1970, 1, 1))
+        counts = generate_synthetic_data(self.config)
+        self.assertEqual(counts['patients'], 20)
+        self.assertEqual(synthetic_patients().count(), 20)
+        observations = Observation.objects.filter(patient__in=synthetic_patients())
+        self.assertEqual(observations.count(), counts['observations'])
+        self.assertGreaterEqual(counts['observations'], 20 * 5)
+        for value, value_numeric in observations.values_list('value', 'value_numeric')[:50]:
+            self.assertEqual(value_numeric, parse_numeric_value(value))
+        # Пакетная вставка дописывает новых пациентов после существующих
+        generate_synthetic_data(self.config)
+        self.assertEqual(synthetic_patients().count(), 40)
+
+        self.assertEqual(clear_synthetic_data(), 40)
+        self.assertEqual(list(Patient.objects.values_list('id', flat=True)), [real.id])
+        self.assertFalse(Observation.objects.exists())
+        self.assertFalse(HospitalizationEpisode.objects.exists())
+
+    def test_reference_data_invalidates_caches(self):
+        cache.clear()
+        reference_cache._local.clear()
+        # Справочники закэшированы до генерации; bulk_create не вызывает сигналов
+        self.assertEqual(reference_cache.parameter_code_map(), {})
+        self.assertEqual(search.search_mkb('A00'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            mkb_codes, parameters = ensure_reference_data(self.config)
+        self.assertEqual(set(reference_cache.parameter_code_map()), {code for code, *_ in parameters})
+        self.assertEqual(search.search_mkb('A00.0'), [('A00.0', MKBCode.objects.get(code='A00.0').name)])
+        self.assertIn('A00.0', mkb_codes)
+
+    def test_run_benchmarks_writes_json(self):
+        generate_synthetic_data(self.config)
+        output = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        output.close()
+        self.addCleanup(os.remove, output.name)
+        call_command('run_benchmarks', cases='dynamics,observation_list', repeat=2, warmup=0, output=output.name, stdout=io.StringIO())
+        with open(output.name, encoding='utf-8') as report_file:
+            report = json.load(report_file)
+        self.assertEqual([item['case'] for item in report['results']], ['dynamics', 'observation_list'])
+        for item in report['results']:
+            self.assertEqual(item['status'], 200)
+            self.assertGreater(item["queries"], 0, item)
+            self.assertGreater(item['response_bytes'], 0)
+            self.assertLessEqual(item['latency_ms']['min'], item['latency_ms']['max'])
+
+
+@override_settings(PERF_INSTRUMENTATION=True, PERF_SLOW_QUERY_MS=1000, PERF_METRICS_TOKEN='')
+class InstrumentationTests(TestCase):
+    """PerformanceMiddleware + InstrumentedViewMixin: Server-Timing, /metrics и лог медленных запросов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        ParameterCode.objects.create(code='HB', name='Гемоглобин')
+        cls.patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+        Observation.objects.create(patient=cls.patient, parameter_id='HB', value='120')
+
+    def setUp(self):
+        REGISTRY.reset()
+        self.addCleanup(REGISTRY.reset)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def metric_lines(self, name):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return [line for line in response.content.decode().splitlines() if line.startswith(name)]
+
+    def test_server_timing_and_histograms(self):
+        response = self.client.get(f'/api/patients/{self.patient.id}/dynamics/?param=HB')
+        self.assertEqual(response.status_code, 200)
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="2 queries"', timing)
+        for phase in ('serialize;dur=', 'render;dur=', 'total;dur='):
+            self.assertIn(phase, timing)
+
+        labels = '{view="PatientViewSet.get_patient_dynamics",method="GET"'
+        self.assertIn(f'meddata_http_request_duration_seconds_count{labels}}} 1', self.metric_lines('meddata_http_request_duration'))
+        self.assertIn(f'meddata_db_queries_per_request_bucket{labels},le="2"}} 1', self.metric_lines('meddata_db_queries'))
+        self.assertIn(f'meddata_db_queries_per_request_bucket{labels},le="1"}} 0', self.metric_lines('meddata_db_queries'))
+        self.assertIn(
+            'meddata_http_requests_total{view="PatientViewSet.get_patient_dynamics",method="GET",status="200"} 1',
+            self.metric_lines('meddata_http_requests_total'),
+        )
+
+    def test_streaming_response_counted_after_body(self):
+        response = self.client.get('/api/research/query/?param_codes=HB&format=ndjson')
+        body = b''.join(response.streaming_content)
+        sizes = self.metric_lines('meddata_response_size_bytes_sum{view="ResearchQueryView"')
+        self.assertEqual(sizes, [f'meddata_response_size_bytes_sum{{view="ResearchQueryView",method="GET"}} {len(body)}.000000'])
+        queries = self.metric_lines('meddata_db_queries_per_request_sum{view="ResearchQueryView"')
+        self.assertEqual(queries, ['meddata_db_queries_per_request_sum{view="ResearchQueryView",method="GET"} 1.000000'])
+
+    def test_slow_query_log(self):
+        with self.settings(PERF_SLOW_QUERY_MS=0), self.assertLogs('core.performance', level='WARNING') as logs:
+            self.client.get(f'/api/observations/?patient_id={self.patient.id}')
+        self.assertIn('ObservationViewSet.list', logs.output[0])
+        self.assertTrue(self.metric_lines('meddata_db_slow_queries_total{view="ObservationViewSet.list"}'))
+
+    def test_metrics_token_and_disabled(self):
+        with self.settings(PERF_METRICS_TOKEN='secret-token'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret-token').status_code, 200)
+        with self.settings(PERF_INSTRUMENTATION=False):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            response = client.get(f'/api/patients/{self.patient.id}/')
+            self.assertFalse(response.has_header('Server-Timing'))
+            self.assertEqual(client.get('/metrics').status_code, 404)
+
+
+@override_settings(MEDICAL_TEST_UPLOAD_MAX_CHUNK=8)
+class ChunkedUploadTests(TestCase):
+    """Докачиваемая загрузка файла теста частями (core/uploads.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+        cls.medical_test = MedicalTest.objects.create(patient=patient, test_name='MMSE')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.content = b'0123456789abcdefXYZ'
+
+    def start(self, **extra):
+        data = {'filename': 'scan.pdf', 'size': len(self.content), **extra}
+        response = self.client.post(f'/api/medical-tests/{self.medical_test.pk}/uploads/', data, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def put(self, upload_id, offset, body, **headers):
+        return self.client.put(
+            f'/api/uploads/{upload_id}/', body, content_type='application/octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset), **headers,
+        )
+
+    def test_resumable_upload_attaches_file(self):
+        upload_id = self.start(sha256=hashlib.sha256(self.content).hexdigest())['id']
+        self.assertEqual(self.put(upload_id, 0, self.content[:8]).json()['offset'], 8)
+        # Пропуск части - 409 с текущим смещением, с которого клиент продолжает
+        conflict = self.put(upload_id, 16, self.content[16:])
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(conflict['Upload-Offset'], '8')
+        # Повтор уже принятой части допустим
+        self.assertEqual(self.put(upload_id, 0, self.content[:8]).status_code, 200)
+        self.assertEqual(self.put(upload_id, 8, self.content[8:16]).status_code, 200)
+        self.assertEqual(self.client.head(f'/api/uploads/{upload_id}/')['Upload-Offset'], '16')
+        self.assertEqual(self.put(upload_id, 16, self.content[16:]).json()['offset'], len(self.content))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/uploads/{upload_id}/finalize/', {}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.medical_test.refresh_from_db()
+        with self.medical_test.uploaded_file.open('rb') as uploaded:
+            self.assertEqual(uploaded.read(), self.content)
+        self.assertEqual(self.medical_test.filename, 'scan.pdf')
+        # Временный файл стал blob'ом хранилища (core/storage.py)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'blobs', 'tmp')), [])
+        self.assertEqual(FileBlob.objects.get().ref_count, 1)
+        self.assertEqual(self.client.post(f'/api/uploads/{upload_id}/finalize/').status_code, 409)
+
+    def test_chunk_validation(self):
+        upload_id = self.start()['id']
+        mismatch = self.put(upload_id, 0, self.content[:8], HTTP_X_CHUNK_SHA256=hashlib.sha256(b'other').hexdigest())
+        self.assertEqual(mismatch.status_code, 400)
+        self.assertEqual(mismatch['Upload-Offset'], '0')
+        self.assertEqual(self.put(upload_id, 0, self.content[:9]).status_code, 400)  # Больше MAX_CHUNK
+        self.assertEqual(self.put(upload_id, -1, b'x').status_code, 400)
+        # Незавершенную загрузку не прикрепить
+        self.assertEqual(self.client.post(f'/api/uploads/{upload_id}/finalize/').status_code, 409)
+
+    def test_failed_retry_discards_overwritten_tail(self):
+        upload_id = self.start(sha256=hashlib.sha256(self.content).hexdigest())['id']
+        self.put(upload_id, 0, self.content[:8])
+        self.put(upload_id, 8, self.content[8:16])
+        # Повтор первой части с испорченным телом успел затереть принятые байты
+        retry = self.put(upload_id, 0, b'XXXXXXXX', HTTP_X_CHUNK_SHA256=hashlib.sha256(self.content[:8]).hexdigest())
+        self.assertEqual(retry.status_code, 400)
+        self.assertEqual(retry['Upload-Offset'], '0')
+        self.assertEqual(self.client.head(f'/api/uploads/{upload_id}/')['Upload-Offset'], '0')
+        self.assertEqual(self.put(upload_id, 8, self.content[8:16]).status_code, 409)
+
+        for offset in range(0, len(self.content), 8):
+            self.assertEqual(self.put(upload_id, offset, self.content[offset:offset + 8]).status_code, 200)
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/', {}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.medical_test.refresh_from_db()
+        with self.medical_test.uploaded_file.open('rb') as uploaded:
+            self.assertEqual(uploaded.read(), self.content)
+
+    def test_retry_after_failed_finalize_keeps_blob_intact(self):
+        upload_id = self.start()['id']
+        for offset in range(0, len(self.content), 8):
+            self.put(upload_id, offset, self.content[offset:offset + 8])
+        upload = MedicalTestUpload.objects.get(pk=upload_id)
+        # Откат после storage.adopt: blob уже на диске - жесткая ссылка на временный файл
+        with mock.patch.object(MedicalTest, 'save', side_effect=DatabaseError('boom')), self.assertRaises(DatabaseError):
+            uploads.finalize_upload(upload)
+        storage = MedicalTest._meta.get_field('uploaded_file').storage
+        blob_path = storage.blob_path(hashlib.sha256(self.content).hexdigest())
+        self.assertTrue(os.path.exists(blob_path))
+
+        # Клиент перезаливает файл другим содержимым того же размера
+        changed = self.content.upper()
+        for offset in range(0, len(changed), 8):
+            self.assertEqual(self.put(upload_id, offset, changed[offset:offset + 8]).status_code, 200)
+        with open(blob_path, 'rb') as blob:
+            self.assertEqual(blob.read(), self.content)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/uploads/{upload_id}/finalize/', {}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.medical_test.refresh_from_db()
+        with self.medical_test.uploaded_file.open('rb') as uploaded:
+            self.assertEqual(uploaded.read(), changed)
+
+    def test_finalize_checks_part_file_size(self):
+        upload_id = self.start()['id']
+        for offset in range(0, len(self.content), 8):
+            self.put(upload_id, offset, self.content[offset:offset + 8])
+        part_path = os.path.join(self.media_root, MedicalTestUpload.objects.get(pk=upload_id).part_name)
+        with open(part_path, 'r+b') as part:
+            part.truncate(10)
+        # received_bytes говорит "все принято", но на диске меньше - докачка с 10 байт
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/', {}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.head(f'/api/uploads/{upload_id}/')['Upload-Offset'], '10')
+        self.assertEqual(self.put(upload_id, 10, self.content[10:18]).status_code, 200)
+        self.assertEqual(self.put(upload_id, 18, self.content[18:]).status_code, 200)
+        self.assertEqual(self.client.post(f'/api/uploads/{upload_id}/finalize/', {}, format='json').status_code, 200)
+
+    def test_checksum_mismatch_and_abort(self):
+        upload_id = self.start()['id']
+        for offset in range(0, len(self.content), 8):
+            self.put(upload_id, offset, self.content[offset:offset + 8])
+        response = self.client.post(
+            f'/api/uploads/{upload_id}/finalize/', {'sha256': hashlib.sha256(b'other').hexdigest()}, format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.medical_test.refresh_from_db()
+        self.assertFalse(self.medical_test.uploaded_file)
+
+        part_path = MedicalTestUpload.objects.get(pk=upload_id).part_name
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, part_path)))
+        self.assertEqual(self.client.delete(f'/api/uploads/{upload_id}/').status_code, 204)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, part_path)))
+
+    def test_only_owner_sees_upload(self):
+        upload_id = self.start()['id']
+        other = APIClient()
+        other.force_authenticate(get_user_model().objects.create_user('nurse', password='secret'))
+        self.assertEqual(other.get(f'/api/uploads/{upload_id}/').status_code, 404)
+        self.assertEqual(other.put(f'/api/uploads/{upload_id}/', b'x', content_type='application/octet-stream',
+                                   HTTP_UPLOAD_OFFSET='0').status_code, 404)
+
+    def test_invalid_initiation(self):
+        url = f'/api/medical-tests/{self.medical_test.pk}/uploads/'
+        self.assertEqual(self.client.post(url, {'size': 10}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(url, {'filename': 'a.pdf', 'size': 0}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(url, {'filename': 'a.pdf', 'size': 1, 'sha256': 'zz'}, format='json').status_code, 400)
+        self.assertFalse(MedicalTestUpload.objects.exists())
+
+
+class ProtectedDownloadTests(TestCase):
+    """Скачивание файла теста с проверкой прав, Range и ETag (core/downloads.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        cls.patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root, MEDIA_ACCEL_REDIRECT_PREFIX='')
+        media.enable()
+        self.addCleanup(media.disable)
+        self.content = b'0123456789'
+        self.medical_test = MedicalTest.objects.create(patient=self.patient, test_name='MMSE')
+        self.medical_test.uploaded_file.save('результат.pdf', ContentFile(self.content))
+        self.url = f'/api/medical-tests/{self.medical_test.pk}/download/'
+
+    def test_full_download_and_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        detail = self.client.get(f'/api/medical-tests/{self.medical_test.pk}/').json()
+        self.assertTrue(detail['download_url'].endswith(self.url))
+        listed = self.client.get('/api/medical-tests/', {'patient_id': self.patient.pk}).json()['results']
+        self.assertEqual(listed[0]['download_url'], detail['download_url'])
+
+    def test_range_requests(self):
+        partial = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(b''.join(partial.streaming_content), b'2345')
+        self.assertEqual(partial['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(partial['Content-Length'], '4')
+        suffix = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(suffix.streaming_content), b'789')
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=7-').get('Content-Range'), 'bytes 7-9/10')
+        unsatisfiable = self.client.get(self.url, HTTP_RANGE='bytes=10-')
+        self.assertEqual(unsatisfiable.status_code, 416)
+        self.assertEqual(unsatisfiable['Content-Range'], 'bytes */10')
+        # Несколько диапазонов и устаревший If-Range - файл целиком
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1,4-5').status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"0-0"').status_code, 200)
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE=etag).status_code, 206)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_accel_redirect(self):
+        response = self.client.get(self.url, {'inline': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+        relative = os.path.relpath(self.medical_test.uploaded_file.path, self.media_root)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + quote(relative))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response['Content-Disposition'].startswith('inline'))
+
+    def test_permissions_and_missing_file(self):
+        self.assertEqual(APIClient().get(self.url).status_code, 401)
+        empty = MedicalTest.objects.create(patient=self.patient, test_name='HADS')
+        self.assertEqual(self.client.get(f'/api/medical-tests/{empty.pk}/download/').status_code, 404)
+        os.remove(self.medical_test.uploaded_file.path)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class ContentAddressedStorageTests(TestCase):
+    """Дедупликация файлов тестов и счетчик ссылок на blob'ы (core/storage.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        cls.first = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+        cls.second = Patient.objects.create(last_name='Петров', first_name='Петр', date_of_birth=date(1975, 5, 5))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def upload(self, patient, content, filename='бланк.pdf'):
+        response = self.client.post('/api/medical-tests/', {
+            'patient': patient.pk, 'test_name': 'HADS', 'test_date': '2024-01-10',
+            'uploaded_file': SimpleUploadedFile(filename, content),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return MedicalTest.objects.get(pk=response.json()['id'])
+
+    def blob_files(self):
+        return [name for _, _, names in os.walk(os.path.join(self.media_root, 'blobs', 'sha256')) for name in names]
+
+    def test_same_content_is_stored_once(self):
+        first = self.upload(self.first, b'questionnaire template')
+        second = self.upload(self.second, b'questionnaire template', filename='бланк.pdf')
+        digest = hashlib.sha256(b'questionnaire template').hexdigest()
+        self.assertEqual(self.blob_files(), [digest])
+        self.assertEqual(FileBlob.objects.get(pk=digest).ref_count, 2)
+        # Имя - по содержимому, без суффиксов коллизий; исходное имя сохраняется
+        self.assertEqual(first.uploaded_file.name, second.uploaded_file.name)
+        self.assertEqual(second.filename, 'бланк.pdf')
+        with second.uploaded_file.open('rb') as stored:
+            self.assertEqual(stored.read(), b'questionnaire template')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(FileBlob.objects.get(pk=digest).ref_count, 1)
+        self.assertEqual(self.blob_files(), [digest])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first.delete()  # Каскадом не затрагивает чужой тест
+            second.delete()
+        self.assertFalse(FileBlob.objects.exists())
+        self.assertEqual(self.blob_files(), [])
+
+    def test_replaced_file_is_released(self):
+        medical_test = self.upload(self.first, b'old scan')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/medical-tests/{medical_test.pk}/', {'uploaded_file': SimpleUploadedFile('new.pdf', b'new scan')},
+                format='multipart',
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.blob_files(), [hashlib.sha256(b'new scan').hexdigest()])
+        self.assertEqual(list(FileBlob.objects.values_list('ref_count', flat=True)), [1])
+
+    def test_maintenance_command(self):
+        legacy = MedicalTest.objects.create(patient=self.first, test_name='MMSE')
+        legacy_path = os.path.join(self.media_root, 'patient_files', f'patient_{self.first.pk}', 'tests', 'scan.pdf')
+        os.makedirs(os.path.dirname(legacy_path))
+        with open(legacy_path, 'wb') as legacy_file:
+            legacy_file.write(b'legacy scan')
+        MedicalTest.objects.filter(pk=legacy.pk).update(uploaded_file=f'patient_files/patient_{self.first.pk}/tests/scan.pdf')
+        duplicate = self.upload(self.second, b'legacy scan')
+        FileBlob.objects.update(ref_count=5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('file_blobs', '--import-legacy', '--recount', '--purge', stdout=io.StringIO())
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.uploaded_file.path, duplicate.uploaded_file.path)
+        self.assertEqual(legacy.filename, 'scan.pdf')
+        self.assertFalse(os.path.exists(legacy_path))
+        self.assertEqual(FileBlob.objects.get().ref_count, 2)
+
+        # Blob без записи (откат транзакции) удаляется, когда старше --grace
+        orphan = ContentAddressedStorage().blob_path('0' * 64)
+        os.makedirs(os.path.dirname(orphan))
+        open(orphan, 'wb').close()
+        call_command('file_blobs', '--purge', '--grace', '0', stdout=io.StringIO())
+        self.assertFalse(os.path.exists(orphan))
+        self.assertEqual(len(self.blob_files()), 1)
+
+    def test_adopted_blob_is_fresh_for_purge(self):
+        storage = ContentAddressedStorage()
+        hour_ago = time.time() - 3600
+        # Старый файл (импорт legacy, давно дописанная часть загрузки) и старый blob без записи
+        source = os.path.join(self.media_root, 'old.pdf')
+        for path, content in ((source, b'old scan'), (storage.blob_path(hashlib.sha256(b'orphan').hexdigest()), b'orphan')):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as old_file:
+                old_file.write(content)
+            os.utime(path, (hour_ago, hour_ago))
+        orphan_source = os.path.join(self.media_root, 'orphan.pdf')
+        with open(orphan_source, 'wb') as orphan_file:
+            orphan_file.write(b'orphan')
+
+        for path, content in ((source, b'old scan'), (orphan_source, b'orphan')):
+            digest = hashlib.sha256(content).hexdigest()
+            storage.adopt(path, digest, 'scan.pdf', keep_source=True)
+            self.assertGreater(os.path.getmtime(storage.blob_path(digest)), hour_ago + 60)
+        # Параллельная очистка не видит незакоммиченных строк FileBlob - свежие blob'ы она не трогает
+        FileBlob.objects.all().delete()
+        self.assertEqual(purge_orphan_blobs(grace_seconds=60, storage=storage), 0)
+        self.assertEqual(len(self.blob_files()), 2)
+
+
+
+@override_settings(EXTRACTION_WORKERS=0)
+class TestFileExtractionTests(TestCase):
+    """Разбор ответов и итога из загруженных файлов тестов (core/extraction.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        cls.patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def upload(self, filename, content, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/medical-tests/', {
+                'patient': self.patient.pk, 'test_name': 'HADS', 'test_date': '2024-01-10',
+                'uploaded_file': SimpleUploadedFile(filename, content), **fields,
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return MedicalTest.objects.get(pk=response.json()['id'])
+
+    def answers(self, medical_test):
+        return list(medical_test.answers.order_by('position').values_list('item', 'answer', 'value_numeric'))
+
+    def test_long_csv_in_cp1251(self):
+        content = 'Вопрос;Ответ\nA1;2\nA2;3\nA3;нет\nИтог;7\nЗаключение;Субклиническая тревога\n'.encode('cp1251')
+        medical_test = self.upload('hads.csv', content)
+        self.assertEqual(self.answers(medical_test), [('A1', '2', 2.0), ('A2', '3', 3.0), ('A3', 'нет', None)])
+        medical_test.refresh_from_db()
+        self.assertEqual(medical_test.score, 7.0)  # Явный итог важнее суммы ответов
+        self.assertEqual(medical_test.result_text, 'Субклиническая тревога')
+
+        response = self.client.get(f'/api/medical-tests/{medical_test.pk}/extraction/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], MedicalTestExtraction.STATUS_DONE)
+        self.assertEqual(response.json()['item_count'], 3)
+        self.assertEqual(len(self.client.get(f'/api/medical-tests/{medical_test.pk}/answers/').json()), 3)
+
+    def test_wide_csv_sums_numeric_answers(self):
+        medical_test = self.upload('phq.csv', b'q1,q2,q3\n1,2,3\n')
+        self.assertEqual([item for item, _, _ in self.answers(medical_test)], ['q1', 'q2', 'q3'])
+        medical_test.refresh_from_db()
+        self.assertEqual(medical_test.score, 6.0)
+
+    def test_wide_table_with_several_responses_fails(self):
+        medical_test = self.upload('phq.csv', b'q1,q2\n1,2\n3,4\n')
+        extraction = medical_test.extractions.get()
+        self.assertEqual(extraction.status, MedicalTestExtraction.STATUS_FAILED)
+        self.assertIn('exactly one row', extraction.error)
+        self.assertFalse(medical_test.answers.exists())
+
+    @unittest.skipIf(extraction.openpyxl is None, "openpyxl is not installed")
+    def test_xlsx(self):
+        workbook = extraction.openpyxl.Workbook()
+        for row in (('item', 'answer'), ('q1', 1), ('q2', 2.5), ('total', 10)):
+            workbook.active.append(row)
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        medical_test = self.upload('mmse.xlsx', buffer.getvalue())
+        self.assertEqual(self.answers(medical_test), [('q1', '1', 1.0), ('q2', '2.5', 2.5)])
+        medical_test.refresh_from_db()
+        self.assertEqual(medical_test.score, 10.0)
+
+    def test_json_with_and_without_streaming_parser(self):
+        document = json.dumps({
+            'patient': 'ignored', 'score': 4,
+            'answers': [{'item': 'q1', 'answer': 1}, {'question': 'q2', 'value': 'да', 'extra': {'nested': 1}}],
+        }).encode()
+        for streaming in (True, False):
+            with self.subTest(streaming=streaming), mock.patch.object(extraction, 'ijson', extraction.ijson if streaming else None):
+                if streaming and extraction.ijson is None:
+                    continue
+                medical_test = self.upload('sf36.json', document)
+                self.assertEqual(self.answers(medical_test), [('q1', '1', 1.0), ('q2', 'да', None)])
+                medical_test.refresh_from_db()
+                self.assertEqual(medical_test.score, 4.0)
+
+        medical_test = self.upload('flat.json', json.dumps({'q1': 2, 'q2': 3, 'Result': 'норма'}).encode())
+        self.assertEqual([item for item, _, _ in self.answers(medical_test)], ['q1', 'q2'])
+        medical_test.refresh_from_db()
+        self.assertEqual((medical_test.score, medical_test.result_text), (5.0, 'норма'))
+
+    def test_manual_score_is_kept(self):
+        medical_test = self.upload('phq.csv', b'q1,q2\n1,2\n', score='42')
+        medical_test.refresh_from_db()
+        self.assertEqual(medical_test.score, 42.0)
+        self.assertEqual(medical_test.extractions.get().score, 3.0)
+        # Значение, извлеченное прошлым разбором, новый файл заменяет
+        MedicalTest.objects.filter(pk=medical_test.pk).update(score=None)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/medical-tests/{medical_test.pk}/', {'uploaded_file': SimpleUploadedFile('phq.csv', b'q1,q2\n1,1\n')})
+        self.assertEqual(MedicalTest.objects.get(pk=medical_test.pk).score, 2.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/medical-tests/{medical_test.pk}/', {'uploaded_file': SimpleUploadedFile('phq.csv', b'q1,q2\n3,3\n')})
+        self.assertEqual(MedicalTest.objects.get(pk=medical_test.pk).score, 6.0)
+
+    def test_unsupported_and_replaced_files(self):
+        medical_test = self.upload('scan.pdf', b'%PDF')
+        self.assertFalse(medical_test.extractions.exists())
+        self.assertEqual(self.client.get(f'/api/medical-tests/{medical_test.pk}/extraction/').status_code, 404)
+        self.assertEqual(self.client.post(f'/api/medical-tests/{medical_test.pk}/extraction/').status_code, 400)
+
+        # Файл заменили до выполнения задания - задание пропускается
+        medical_test = self.upload('phq.csv', b'q1\n1\n')
+        job = MedicalTestExtraction.objects.create(medical_test=medical_test, file_name='blobs/sha256/old/phq.csv', extractor='csv')
+        self.assertTrue(extraction.run_extraction(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, MedicalTestExtraction.STATUS_SKIPPED)
+        self.assertEqual(medical_test.answers.count(), 1)
+
+    def test_backfill_command_and_research_endpoint(self):
+        medical_test = self.upload('phq.csv', b'q1,q2\n1,2\n')
+        medical_test.extractions.all().delete()
+        MedicalTestAnswer.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('extract_test_files', '--backfill', stdout=io.StringIO())
+        self.assertEqual(medical_test.extractions.get().status, MedicalTestExtraction.STATUS_DONE)
+
+        response = self.client.get('/api/research/test-answers/', {'test_name': 'hads', 'items': 'q2'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{
+            'patient_id': self.patient.pk, 'medical_test_id': medical_test.pk, 'test_name': 'HADS',
+            'test_date': '2024-01-10', 'position': 2, 'item': 'q2', 'answer': '2', 'value_numeric': 2.0,
+        }])
+        self.assertEqual(self.client.get('/api/research/test-answers/', {'start_date': '2024-02-01'}).json(), [])
+        response = self.client.get('/api/research/test-answers/', {'format': 'csv'})
+        self.assertEqual(response.content.decode().splitlines()[0], ','.join(
+            ('patient_id', 'medical_test_id', 'test_name', 'test_date', 'position', 'item', 'answer', 'value_numeric')
+        ))
+        self.assertEqual(self.client.get('/api/research/test-answers/', {'age_min': 'x'}).status_code, 400)
+
+
+class AsyncPatientViewTests(TestCase):
+    """Асинхронная карточка пациента (core/async_views.py) отдает то же, что PatientViewSet."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', password='secret')
+        cls.mkb = MKBCode.objects.create(code='C71.0', name='Злокачественное новообразование большого мозга')
+        ParameterCode.objects.create(code='HB', name='Гемоглобин', unit='g/l')
+        cls.patient = Patient.objects.create(
+            last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1), primary_diagnosis_mkb=cls.mkb
+        )
+        HospitalizationEpisode.objects.create(patient=cls.patient, start_date=date(2024, 1, 1))
+        MedicalTest.objects.create(patient=cls.patient, test_name='HADS', test_date=date(2024, 1, 10), score=7)
+        start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        for day in range(10):
+            Observation.objects.create(patient=cls.patient, parameter_id='HB', value=str(120 + day), timestamp=start + timedelta(days=day))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_both(self, url):
+        sync_response = self.client.get(url)
+        with override_settings(ROOT_URLCONF='core.tests'):
+            async_response = self.client.get(url)
+        self.assertEqual(async_response.status_code, sync_response.status_code, url)
+        self.assertEqual(async_response['Content-Type'], 'application/json')
+        return sync_response.json(), async_response.json()
+
+    def test_same_responses_as_sync_views(self):
+        base = f'/api/patients/{self.patient.id}/'
+        for url in (
+            base, f'{base}dynamics/?param=HB', f'{base}dynamics/?param=HB&max_points=3', f'{base}dynamics/?param=HB&bucket=day',
+            f'{base}dynamics/?param=HB&fields=value,timestamp', f'{base}tests/', f'{base}tests/?fields=test_name,score',
+            f'{base}episodes/', f'{base}dynamics/', f'{base}dynamics/?param=HB&max_points=1', f'{base}tests/?fields=nope',
+            '/api/patients/999999/', '/api/patients/999999/tests/',
+        ):
+            with self.subTest(url=url):
+                sync_data, async_data = self.get_both(url)
+                self.assertEqual(async_data, sync_data)
+
+    def test_overview(self):
+        base = f'/api/patients/{self.patient.id}/'
+        overview = self.client.get(f'{base}overview/?param=HB&max_points=5').json()
+        self.assertEqual(overview, {
+            'patient': self.client.get(base).json(),
+            'tests': self.client.get(f'{base}tests/').json(),
+            'episodes': self.client.get(f'{base}episodes/').json(),
+            'dynamics': self.client.get(f'{base}dynamics/?param=HB&max_points=5').json(),
+        })
+        self.assertIsNone(self.client.get(f'{base}overview/').json()['dynamics'])
+        self.assertEqual(self.client.get('/api/patients/999999/overview/').status_code, 404)
+        self.assertEqual(self.client.get(f'{base}overview/?param=HB&bucket=year').status_code, 400)
+        self.assertEqual(self.client.post(f'{base}overview/').status_code, 405)
+
+    @override_settings(ROOT_URLCONF='core.tests')
+    def test_writes_go_to_sync_view(self):
+        response = self.client.patch(f'/api/patients/{self.patient.id}/', {'middle_name': 'Петрович'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Patient.objects.get(pk=self.patient.pk).middle_name, 'Петрович')
+        self.assertEqual(self.client.post(f'/api/patients/{self.patient.id}/tests/').status_code, 405)
+
+    @override_settings(ROOT_URLCONF='core.tests')
+    async def test_jwt_authentication_under_asgi(self):
+        url = f'/api/patients/{self.patient.id}/'
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+        response = await self.async_client.get(url, headers={'Authorization': 'Bearer broken'})
+        self.assertEqual(response.status_code, 401)
+        token = await sync_to_async(AccessToken.for_user)(self.user)
+        response = await self.async_client.get(url, headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['primary_diagnosis_mkb'], 'C71.0')
+
+    @override_settings(ROOT_URLCONF='core.tests', PERF_INSTRUMENTATION=True, PERF_SLOW_QUERY_MS=1000)
+    async def test_instrumentation_under_asgi(self):
+        REGISTRY.reset()
+        self.addCleanup(REGISTRY.reset)
+        token = await sync_to_async(AccessToken.for_user)(self.user)
+        await sync_to_async(reference_cache.parameter_code_map)()  # Справочник показателей - уже в кэше
+        response = await AsyncClient().get(
+            f'/api/patients/{self.patient.id}/overview/?param=HB', headers={'Authorization': f'Bearer {token}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        # Пользователь JWT, пациент, тесты, эпизоды, наблюдения
+        self.assertIn('desc="5 queries"', response['Server-Timing'])
+        self.assertIn('core.async_views.patient_overview', REGISTRY.render())
+
+
+class ConcurrencyBenchmarkTests(TransactionTestCase):
+    """manage.py benchmark_concurrency: WSGI и ASGI обработчики в одном процессе, с потоками."""
+
+    def test_benchmark_writes_json(self):
+        generate_synthetic_data(SyntheticConfig(patients=3, mkb_codes=5, parameters=2, observations_per_patient=5, parameters_per_patient=1))
+        output = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        output.close()
+        self.addCleanup(os.remove, output.name)
+        call_command(
+            'benchmark_concurrency', concurrency='2', requests=4, warmup=0, threads=2, patients=2,
+            output=output.name, stdout=io.StringIO(),
+        )
+        with open(output.name, encoding='utf-8') as report_file:
+            report = json.load(report_file)
+        self.assertEqual(
+            [(item['mode'], item['scenario']) for item in report['results']],
+            [(mode, scenario) for mode in ('wsgi', 'asgi') for scenario in ('reads', 'dashboard', 'overview')],
+        )
+        for item in report['results']:
+            self.assertEqual(item['errors'], 0, item)
+            self.assertEqual(item['units'], 4)
+            self.assertGreater(item['throughput_per_s'], 0)
+        self.assertFalse(get_user_model().objects.filter(username='benchmark').exists())
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "declarative partitioning is PostgreSQL only")
+class ObservationPartitioningTests(TestCase):
+    """Конвертация core_observation в партиционированную таблицу и обратно (core/partitioning.py, миграция 0008)."""
+    table = Observation._meta.db_table
+
+    @classmethod
+    def setUpTestData(cls):
+        ParameterCode.objects.create(code='HB', name='Гемоглобин')
+        cls.patient = Patient.objects.create(last_name='Иванов', first_name='Иван', date_of_birth=date(1980, 1, 1))
+        cls.episode = HospitalizationEpisode.objects.create(patient=cls.patient, start_date=date(2024, 1, 1))
+        for month in (1, 2, 3):
+            Observation.objects.create(patient=cls.patient, parameter_id='HB', value=str(100 + month), episode=cls.episode,
+                                       timestamp=timezone.make_aware(datetime(2024, month, 15, 10, 0)))
+
+    def setUp(self):
+        # Отложенные FK-проверки тестовых данных не дают удалить старую таблицу в той же транзакции
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    def convert(self, ahead=0):
+        with connection.schema_editor() as schema_editor:
+            partitioning.convert_to_partitioned(schema_editor, Observation, 'month', ahead=ahead)
+
+    def partitions(self):
+        return [name for name, _ in partitioning.list_partitions(connection, self.table)]
+
+    def constraints(self):
+        with connection.cursor() as cursor:
+            return connection.introspection.get_constraints(cursor, self.table)
+
+    def schema(self):
+        """Ограничения и индексы таблицы кроме первичного ключа: {имя: (колонки, FK, индекс)}."""
+        return {
+            name: (tuple(item['columns']), item['foreign_key'], item['index'])
+            for name, item in self.constraints().items() if not item['primary_key']
+        }
+
+    def assertSchemaMatchesModel(self):
+        constraints = self.constraints()
+        foreign_keys = {tuple(item['columns']): item['foreign_key'] for item in constraints.values() if item['foreign_key']}
+        self.assertEqual(foreign_keys, {
+            ('patient_id',): ('core_patient', 'id'),
+            ('parameter_id',): ('core_parametercode', 'code'),
+            ('recorded_by_id',): (get_user_model()._meta.db_table, 'id'),
+            ('episode_id',): ('core_hospitalizationepisode', 'id'),
+        })
+        for index in Observation._meta.indexes:
+            self.assertIn(index.name, constraints)
+        # Индексы полей (db_index и FK) - как у create_model()
+        indexed = {tuple(item['columns']) for item in constraints.values() if item['index'] and not item['primary_key']}
+        for field in Observation._meta.local_fields:
+            if field.db_index and not field.primary_key:
+                self.assertIn((field.column,), indexed)
+        # patient_id и parameter_id индексируются только составными индексами (префиксами)
+        self.assertNotIn(('patient_id',), indexed)
+        self.assertNotIn(('parameter_id',), indexed)
+
+    def test_convert_keeps_rows_keys_and_indexes(self):
+        ids = list(Observation.objects.order_by('id').values_list('id', flat=True))
+        original_schema = self.schema()
+        self.convert()
+        self.assertTrue(partitioning.is_partitioned(connection, self.table))
+        self.assertIn(f'{self.table}_p2024_01', self.partitions())
+        self.assertIn(f'{self.table}_default', self.partitions())
+        self.assertEqual(list(Observation.objects.order_by('id').values_list('id', flat=True)), ids)
+        primary_key = [item['columns'] for item in self.constraints().values() if item['primary_key']]
+        self.assertEqual(primary_key, [['id', 'timestamp']])
+        self.assertSchemaMatchesModel()
+        # Те же имена и определения, что создали миграции модели (включая varchar_pattern_ops для parameter_id)
+        self.assertEqual(self.schema(), original_schema)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {self.table}_p2024_02')
+            self.assertEqual(cursor.fetchone()[0], 1)
+        # Identity продолжается после перенесенных id, FK по-прежнему проверяются
+        self.assertGreater(Observation.objects.create(patient=self.patient, parameter_id='HB', value='1').id, max(ids))
+
+        with connection.schema_editor() as schema_editor:
+            partitioning.convert_to_regular(schema_editor, Observation)
+        self.assertFalse(partitioning.is_partitioned(connection, self.table))
+        self.assertEqual(Observation.objects.count(), len(ids) + 1)
+        self.assertEqual(self.schema(), original_schema)
+
+    def test_new_partition_takes_rows_from_default(self):
+        self.convert()
+        future = timezone.make_aware(datetime(2031, 5, 1, 12, 0))
+        Observation.objects.create(patient=self.patient, parameter_id='HB', value='1', timestamp=future)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {self.table}_default')
+            self.assertEqual(cursor.fetchone()[0], 1)
+        with connection.schema_editor() as schema_editor:
+            name = partitioning.create_partition(schema_editor, self.table, future, 'month')
+            # Повторный вызов ничего не создает
+            self.assertEqual(partitioning.create_partition(schema_editor, self.table, future, 'month'), name)
+        self.assertEqual(name, f'{self.table}_p2031_05')
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {self.table}_default')
+            self.assertEqual(cursor.fetchone()[0], 0)
+            cursor.execute(f'SELECT COUNT(*) FROM {name}')
+            self.assertEqual(cursor.fetchone()[0], 1)
+        self.assertEqual(Observation.objects.count(), 4)
+
+    def test_ensure_partitions_covers_period_ahead(self):
+        self.convert(ahead=0)
+        with connection.schema_editor() as schema_editor:
+            created = partitioning.ensure_partitions(schema_editor, self.table, 'month', timezone.now(), 2)
+        start, _ = partitioning.partition_bounds(timezone.now(), 'month')
+        expected = [start]
+        for _ in range(2):
+            expected.append(partitioning.partition_bounds(expected[-1], 'month')[1])
+        self.assertEqual(created, [partitioning.partition_name(self.table, moment, 'month') for moment in expected])
+        self.assertTrue(set(created) <= set(self.partitions()))
+
+    def test_detach_and_drop(self):
+        self.convert()
+        with connection.schema_editor() as schema_editor:
+            partitioning.detach_partition(schema_editor, self.table, f'{self.table}_p2024_01')
+            partitioning.detach_partition(schema_editor, self.table, f'{self.table}_p2024_02', drop=True)
+        self.assertNotIn(f'{self.table}_p2024_01', self.partitions())
+        self.assertEqual(list(Observation.objects.values_list('value', flat=True)), ['103'])
+        with connection.cursor() as cursor:
+            # Отсоединенная секция осталась таблицей с данными, удаленной - нет
+            cursor.execute(f'SELECT value FROM {self.table}_p2024_01')
+            self.assertEqual(cursor.fetchall(), [('101',)])
+            cursor.execute("SELECT to_regclass(%s)", [f'{self.table}_p2024_02'])
+            self.assertIsNone(cursor.fetchone()[0])
+
+
+def plan_nodes(queryset):
+    """[(тип узла, таблица, индекс)] из EXPLAIN (FORMAT JSON)."""
+    nodes = []
+
+    def walk(node):
+        nodes.append((node['Node Type'], node.get('Relation Name'), node.get('Index Name')))
+        for child in node.get('Plans', ()):
+            walk(child)
+
+    walk(json.loads(queryset.explain(format='json'))[0]['Plan'])
+    return nodes
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "EXPLAIN plans are checked on PostgreSQL only")
+class SargablePlanTests(TestCase):
+    """
+    Критерии выборки компилируются в диапазоны по индексируемым колонкам:
+    на синтетических данных (20 000 пациентов, 100 000 наблюдений) планировщик выбирает индексы.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        MKBCode.objects.bulk_create([MKBCode(code=f'C{i:02d}.0', name=f'Диагноз {i}') for i in range(40)])
+        ParameterCode.objects.bulk_create([ParameterCode(code=f'P{i:02d}', name=f'Показатель {i}') for i in range(20)])
+        with connection.cursor() as cursor:
+            # generate_series быстрее bulk_create на таком объеме; даты рождения - 70 лет равномерно
+            cursor.execute("""
+                INSERT INTO core_patient (last_name, first_name, date_of_birth, primary_diagnosis_mkb_id, created_at, updated_at)
+                SELECT 'Пациент' || i, 'Имя', DATE '1940-01-01' + (i * 25 / 20), 'C' || LPAD((i % 40)::text, 2, '0') || '.0', NOW(), NOW()
+                FROM generate_series(0, 19999) AS i
+            """)
+            cursor.execute("""
+                INSERT INTO core_observation (patient_id, parameter_id, value, value_numeric, timestamp)
+                SELECT p.ids[1 + (i * 7919) % 20000], 'P' || LPAD((i % 20)::text, 2, '0'), '1', 1.0,
+                       TIMESTAMPTZ '2021-01-01 00:00+00' + i * INTERVAL '17 minutes'
+                FROM generate_series(0, 99999) AS i, (SELECT array_agg(id ORDER BY id) AS ids FROM core_patient) AS p
+            """)
+            cursor.execute('ANALYZE core_patient, core_observation, core_mkbcode')
+
+    def criteria(self, **params):
+        return ResearchCriteria(param_codes=params.pop('param_codes', ['P01']), **params)
+
+    def assertUsesIndex(self, queryset, index_name, table):
+        nodes = plan_nodes(queryset)
+        self.assertIn(index_name, [index for _, _, index in nodes], nodes)
+        self.assertNotIn(('Seq Scan', table), [(node_type, relation) for node_type, relation, _ in nodes], nodes)
+
+    def test_age_range_uses_birth_date_index(self):
+        queryset = self.criteria(age_min=60, age_max=61).patient_queryset(today=date(2024, 6, 1))
+        self.assertUsesIndex(queryset, 'patient_dob_idx', 'core_patient')
+
+    def test_diagnosis_and_age_use_composite_index(self):
+        queryset = self.criteria(diagnosis_mkb='c05.0', age_min=40, age_max=60).patient_queryset(today=date(2024, 6, 1))
+        self.assertUsesIndex(queryset, 'patient_diag_dob_idx', 'core_patient')
+
+    def test_period_uses_timestamp_index(self):
+        criteria = self.criteria(param_codes=['P03'], start_date=date(2021, 2, 1), end_date=date(2021, 2, 7))
+        nodes = plan_nodes(Observation.objects.filter(criteria.observation_filter()))
+        # obs_param_ts_cover_idx или индекс по timestamp - в зависимости от оценки селективности
+        self.assertTrue(any(index and index.startswith(('obs_', 'core_observation_timestamp')) for _, _, index in nodes), nodes)
+        self.assertNotIn('Seq Scan', [node_type for node_type, relation, _ in nodes if relation == 'core_observation'])
+
+    def test_research_export_avoids_observation_seq_scan(self):
+        criteria = self.criteria(param_codes=['P03'], age_min=60, age_max=61, start_date=date(2021, 2, 1), end_date=date(2021, 3, 1))
+        queryset = research_queryset(criteria.patient_queryset(today=date(2024, 6, 1)), criteria.observation_filter())
+        nodes = plan_nodes(queryset)
+        self.assertNotIn('Seq Scan', [node_type for node_type, relation, _ in nodes if relation == 'core_observation'], nodes)
@@ -0,0 +1,151 @@
+# backend/core/timeseries.py
+"""
+Прореживание временных рядов для графиков динамики (PatientViewSet.get_patient_dynamics).
+
+Два режима:
+- ?bucket=hour|day|week - агрегация min/max/avg/count по интервалам в БД;
+- ?max_points=N - алгоритм LTTB (Largest-Triangle-Three-Buckets), сохраняющий форму кривой.
+Режимы можно совмещать: сначала агрегация в БД, затем LTTB по средним.
+
+Ответ колоночный: {код_параметра: {"t": [...], "v": [...]}}, где t - время
+в миллисекундах Unix epoch (удобно для оси X в Recharts).
+"""
+from django.db.models import Avg, Count, Max, Min
+from django.db.models.functions import TruncDay, TruncHour, TruncWeek
+
+from .models import Observation
+
+BUCKET_FUNCTIONS = {
+    'hour': TruncHour,
+    'day': TruncDay,
+    'week': TruncWeek,
+}
+# LTTB требует минимум 3 точки (первая, последняя и хотя бы одна между ними)
+MIN_POINTS = 3
+MAX_POINTS = 10000
+
+
+class DynamicsQueryError(ValueError):
+    """Некорректные параметры прореживания (отдается клиенту как 400)."""
+
+
+def parse_downsampling_params(query_params):
+    """Возвращает (max_points, bucket) из параметров запроса; оба могут быть None."""
+    max_points = query_params.get('max_points')
+    bucket = query_params.get('bucket')
+    if max_points:
+        try:
+            max_points = int(max_points)
+        except ValueError:
+            raise DynamicsQueryError("Query parameter 'max_points' must be an integer.")
+        if not MIN_POINTS <= max_points <= MAX_POINTS:
+            raise DynamicsQueryError(f"Query parameter 'max_points' must be between {MIN_POINTS} and {MAX_POINTS}.")
+    else:
+        max_points = None
+    if bucket and bucket not in BUCKET_FUNCTIONS:
+        raise DynamicsQueryError(f"Query parameter 'bucket' must be one of: {', '.join(BUCKET_FUNCTIONS)}.")
+    return max_points, bucket or None
+
+
+def lttb_indices(xs, ys, threshold):
+    """Индексы точек, которые оставляет LTTB при прореживании до threshold точек."""
+    n = len(xs)
+    if threshold >= n or threshold < MIN_POINTS:
+        return list(range(n))
+
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Средняя точка следующего интервала - третья вершина треугольника
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_len = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / avg_len
+        avg_y = sum(ys[avg_start:avg_end]) / avg_len
+
+        # В текущем интервале выбираем точку с максимальной площадью треугольника
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        max_area = -1.0
+        next_a = range_start
+        for j in range(range_start, range_end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                next_a = j
+        selected.append(next_a)
+        a = next_a
+    selected.append(n - 1)
+    return selected
+
+
+def _epoch_ms(dt):
+    return int(dt.timestamp() * 1000)
+
+
+def _numeric_observations(patient_id, parameter_codes):
+    return Observation.objects.filter(
+        patient_id=patient_id,
+        parameter_id__in=parameter_codes,
+        parameter__is_numeric=True,
+        value_numeric__isnull=False,
+    )
+
+
+def raw_series_queryset(patient_id, parameter_codes):
+    """Точки рядов без агрегации (parameter_id, timestamp, value_numeric) по возрастанию времени."""
+    return (
+        _numeric_observations(patient_id, parameter_codes)
+        .order_by('parameter_id', 'timestamp')
+        .values_list('parameter_id', 'timestamp', 'value_numeric')
+    )
+
+
+def bucketed_series_queryset(patient_id, parameter_codes, bucket):
+    """Агрегаты avg/min/max/count по интервалам bucket, вычисляемые в БД."""
+    return (
+        _numeric_observations(patient_id, parameter_codes)
+        .annotate(bucket=BUCKET_FUNCTIONS[bucket]('timestamp'))
+        .values('parameter_id', 'bucket')
+        .annotate(avg=Avg('value_numeric'), min=Min('value_numeric'), max=Max('value_numeric'), n=Count('id'))
+        .order_by('parameter_id', 'bucket')
+    )
+
+
+def _raw_series(patient_id, parameter_codes):
+    series = {code: {'t': [], 'v': []} for code in parameter_codes}
+    for code, timestamp, value in raw_series_queryset(patient_id, parameter_codes).iterator():
+        series[code]['t'].append(_epoch_ms(timestamp))
+        series[code]['v'].append(value)
+    return series
+
+
+def _bucketed_series(patient_id, parameter_codes, bucket):
+    series = {code: {'t': [], 'v': [], 'min': [], 'max': [], 'n': []} for code in parameter_codes}
+    for row in bucketed_series_queryset(patient_id, parameter_codes, bucket):
+        points = series[row['parameter_id']]
+        points['t'].append(_epoch_ms(row['bucket']))
+        points['v'].append(row['avg'])
+        points['min'].append(row['min'])
+        points['max'].append(row['max'])
+        points['n'].append(row['n'])
+    return series
+
+
+def build_dynamics_series(patient_id, parameter_codes, max_points=None, bucket=None):
+    """Колоночные ряды {код: {"t": [...], "v": [...], ...}} для запрошенных параметров."""
+    parameter_codes = list(dict.fromkeys(parameter_codes))  # Убираем дубли, сохраняя порядок
+    if bucket:
+        series = _bucketed_series(patient_id, parameter_codes, bucket)
+    else:
+        series = _raw_series(patient_id, parameter_codes)
+
+    if max_points:
+        for points in series.values():
+            keep = lttb_indices(points['t'], points['v'], max_points)
+            if len(keep) < len(points['t']):
+                for key, values in points.items():
+                    points[key] = [values[i] for i in keep]
+    return series
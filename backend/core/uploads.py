@@ -0,0 +1,244 @@
+# backend/core/uploads.py
+"""
+Докачиваемая загрузка файлов MedicalTest частями (вместо одного multipart-запроса).
+
+Протокол:
+1. POST /api/medical-tests/<id>/uploads/ {"filename", "size", "sha256"?} -> id загрузки;
+2. PUT /api/uploads/<upload_id>/ с телом-частью (application/octet-stream) и
+   заголовком Upload-Offset (или ?offset=) - смещение части в файле;
+   необязательный X-Chunk-Sha256 проверяется на лету, при несовпадении часть
+   отбрасывается. GET/HEAD возвращают, сколько уже принято (Upload-Offset) -
+   с этого места продолжают после обрыва связи;
+3. POST /api/uploads/<upload_id>/finalize/ {"sha256"?} - SHA-256 всего файла считается
+   одним потоковым проходом и сверяется с ожидаемым, после чего файл становится
+   blob'ом контентно-адресуемого хранилища (core/storage.py) и прикрепляется к
+   тесту в одной транзакции. Если такой файл уже есть, второй копии не будет.
+
+Тело части читается из запроса кусками и пишется прямо во временный файл
+в каталоге хранилища (без буфера в памяти и промежуточной копии), blob получается
+жесткой ссылкой или переименованием, а не копированием. Нужно локальное хранилище:
+части пишутся по смещению в файл на диске.
+Брошенные загрузки удаляются через MEDICAL_TEST_UPLOAD_TTL (purge_stale_uploads).
+DELETE /api/uploads/<upload_id>/ отменяет загрузку.
+"""
+import hashlib
+import os
+import re
+import shutil
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MedicalTest, MedicalTestUpload
+from .storage import file_sha256
+
+READ_BLOCK_SIZE = 1024 * 1024
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(ValueError):
+    """Некорректный запрос загрузки (отдается клиенту как 400)."""
+
+
+class UploadConflict(UploadError):
+    """Смещение части не совпадает с принятым объемом или загрузка уже завершена (409)."""
+
+
+def _storage():
+    return MedicalTest._meta.get_field('uploaded_file').storage
+
+
+def _local_path(name):
+    try:
+        return _storage().path(name)
+    except NotImplementedError:
+        raise UploadError("Chunked uploads require local file storage.")
+
+
+def _parse_sha256(raw_value, name='sha256'):
+    value = (raw_value or '').strip().lower()
+    if value and not SHA256_RE.match(value):
+        raise UploadError(f"'{name}' must be a hex-encoded SHA-256 digest.")
+    return value
+
+
+def parse_offset(raw_value):
+    try:
+        offset = int(raw_value)
+    except (TypeError, ValueError):
+        raise UploadError("Header 'Upload-Offset' (or ?offset=) must be a non-negative integer.")
+    if offset < 0:
+        raise UploadError("Header 'Upload-Offset' (or ?offset=) must be a non-negative integer.")
+    return offset
+
+
+# --- Создание ---
+
+def initiate_upload(medical_test, data, user=None):
+    filename = os.path.basename(str(data.get('filename') or '').replace('\\', '/')).strip()
+    if not filename:
+        raise UploadError("Field 'filename' is required.")
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        raise UploadError("Field 'size' must be an integer (bytes).")
+    if not 0 < size <= settings.MEDICAL_TEST_UPLOAD_MAX_SIZE:
+        raise UploadError(f"Field 'size' must be between 1 and {settings.MEDICAL_TEST_UPLOAD_MAX_SIZE} bytes.")
+    sha256 = _parse_sha256(data.get('sha256'))
+
+    purge_stale_uploads()
+    upload = MedicalTestUpload(
+        medical_test=medical_test, filename=filename, size=size, sha256=sha256,
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+    # Временный файл - рядом с blob'ами хранилища: при завершении он не копируется
+    upload.part_name = _storage().temp_name(f'.upload-{upload.id}.part')
+    path = _local_path(upload.part_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    upload.save()
+    return upload
+
+
+# --- Части ---
+
+def write_chunk(upload, offset, stream, length=None, chunk_sha256=None):
+    """
+    Пишет часть из stream (файлоподобный объект тела запроса) с позиции offset.
+    Повтор уже принятой части (offset меньше принятого) перезаписывает хвост -
+    так клиент повторяет часть, ответ на которую потерялся. Если часть отброшена
+    (контрольная сумма, размер, обрыв чтения), принятым остается только то, что
+    до offset: повтор мог успеть затереть байты после него. Возвращает загрузку.
+    """
+    chunk_sha256 = _parse_sha256(chunk_sha256, 'X-Chunk-Sha256')
+    if length is not None and length > settings.MEDICAL_TEST_UPLOAD_MAX_CHUNK:
+        raise UploadError(f"Chunk is larger than {settings.MEDICAL_TEST_UPLOAD_MAX_CHUNK} bytes.")
+    failure = None
+    with transaction.atomic():
+        # Блокировка строки: две части одной загрузки не пишутся одновременно
+        upload = MedicalTestUpload.objects.select_for_update().get(pk=upload.pk)
+        if upload.status != MedicalTestUpload.STATUS_RECEIVING:
+            raise UploadConflict("Upload is already finalized.")
+        if offset > upload.received_bytes:
+            raise UploadConflict(f"Expected offset {upload.received_bytes}, got {offset}.")
+
+        limit = min(upload.size - offset, settings.MEDICAL_TEST_UPLOAD_MAX_CHUNK)
+        path = _local_path(upload.part_name)
+        try:
+            written = _write_part(path, offset, stream, limit, chunk_sha256)
+        except Exception as exc:
+            # Ошибка не выходит из транзакции, иначе откат вернул бы received_bytes над затертыми байтами
+            _truncate_part(path, offset)
+            written, failure = 0, exc
+
+        upload.received_bytes = offset + written
+        upload.save(update_fields=['received_bytes', 'updated_at'])
+    if failure is not None:
+        raise failure
+    return upload
+
+
+def _detach_part(path):
+    """
+    Если временный файл - жесткая ссылка на blob (finalize_upload откатился после
+    storage.adopt), дальше пишем в собственную копию: запись по месту изменила бы
+    содержимое blob'а, а его имя - это SHA-256 прежнего содержимого.
+    """
+    if os.stat(path).st_nlink > 1:
+        copy_path = f'{path}.copy'
+        shutil.copyfile(path, copy_path)
+        os.replace(copy_path, path)
+
+
+def _truncate_part(path, size):
+    _detach_part(path)
+    os.truncate(path, size)
+
+
+def _write_part(path, offset, stream, limit, chunk_sha256):
+    """Пишет тело части в файл с offset, сверяя размер и SHA-256 на лету; возвращает число байт."""
+    _detach_part(path)
+    digest = hashlib.sha256()
+    written = 0
+    with open(path, 'r+b') as part:
+        part.seek(offset)
+        while True:
+            block = stream.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            written += len(block)
+            if written > limit:
+                raise UploadError("Chunk exceeds the declared file size or the chunk size limit.")
+            part.write(block)
+            digest.update(block)
+        if chunk_sha256 and digest.hexdigest() != chunk_sha256:
+            raise UploadError("Chunk checksum mismatch (X-Chunk-Sha256); the chunk was discarded.")
+        part.truncate(offset + written)
+    return written
+
+
+# --- Завершение ---
+
+def finalize_upload(upload, sha256=None):
+    """
+    Проверяет размер и контрольную сумму и атомарно прикрепляет файл к тесту.
+    Прежний файл теста освобождается после коммита. Возвращает MedicalTest.
+    """
+    expected = _parse_sha256(sha256) or upload.sha256
+    storage = _storage()
+    with transaction.atomic():
+        upload = MedicalTestUpload.objects.select_for_update().get(pk=upload.pk)
+        if upload.status != MedicalTestUpload.STATUS_RECEIVING:
+            raise UploadConflict("Upload is already finalized.")
+        if upload.received_bytes != upload.size:
+            raise UploadConflict(f"Upload is incomplete: {upload.received_bytes} of {upload.size} bytes received.")
+        part_path = _local_path(upload.part_name)
+        part_size = os.path.getsize(part_path)
+        if part_size != upload.size:
+            # Файл на диске разошелся с received_bytes: докачивать нужно с того, что есть на диске.
+            # Исключение - после транзакции, иначе откат вернул бы прежний received_bytes
+            upload.received_bytes = min(part_size, upload.size)
+            upload.save(update_fields=['received_bytes', 'updated_at'])
+            _truncate_part(part_path, upload.received_bytes)
+        else:
+            actual = file_sha256(part_path)
+            if expected and actual != expected:
+                raise UploadError(f"Checksum mismatch: expected {expected}, got {actual}.")
+
+            medical_test = MedicalTest.objects.select_for_update().get(pk=upload.medical_test_id)
+            # Жесткая ссылка: при откате транзакции временный файл остается и завершение можно повторить
+            medical_test.uploaded_file.name = storage.adopt(part_path, actual, upload.filename, keep_source=True)
+            # Прежний файл теста освобождает сигнал post_save (core/signals.py)
+            medical_test.save(update_fields=['uploaded_file', 'updated_at'])
+            upload.status = MedicalTestUpload.STATUS_COMPLETE
+            upload.sha256 = actual
+            upload.save(update_fields=['status', 'sha256', 'updated_at'])
+            transaction.on_commit(lambda: _remove_quietly(part_path))
+    if part_size != upload.size:
+        raise UploadConflict(f"Upload is incomplete: {upload.received_bytes} of {upload.size} bytes on disk.")
+    return medical_test
+
+
+# --- Отмена и очистка ---
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def delete_part_file(upload):
+    """Удаляет временный файл незавершенной загрузки (вызывается сигналом post_delete)."""
+    if upload.status == MedicalTestUpload.STATUS_RECEIVING:
+        _remove_quietly(_local_path(upload.part_name))
+
+
+def purge_stale_uploads(now=None):
+    """Удаляет незавершенные загрузки без новых частей дольше MEDICAL_TEST_UPLOAD_TTL и завершенные записи."""
+    now = now or timezone.now()
+    threshold = now - timedelta(seconds=settings.MEDICAL_TEST_UPLOAD_TTL)
+    # Временные файлы удаляет сигнал post_delete (core/signals.py)
+    return MedicalTestUpload.objects.filter(updated_at__lt=threshold).delete()[0]
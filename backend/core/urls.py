@@ -1,16 +1,24 @@
 # backend/core/urls.py
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 # --- Импортируем ВСЕ необходимые Views, включая новые ---
 from .views import (
     PatientViewSet,
     ParameterCodeListView,
+    PatientParameterSummaryListView,
     ResearchQueryView,
+    ResearchMatrixView,
+    ResearchTestAnswersView,
+    ResearchExportJobViewSet,
+    CohortViewSet,
+    MedicalTestUploadViewSet,
     MKBCodeSearchView,
     MedicalTestViewSet,
     ObservationViewSet,            # <--- ДОБАВЛЕН ИМПОРТ
     HospitalizationEpisodeViewSet  # <--- ДОБАВЛЕН ИМПОРТ
 )
+from . import async_views
 
 # Создаем роутер и регистрируем ViewSet'ы
 router = DefaultRouter()
@@ -19,21 +27,52 @@ router.register(r'medical-tests', MedicalTestViewSet, basename='medicaltest')
 # --- РЕГИСТРИРУЕМ НОВЫЕ ViewSet'ы В РОУТЕРЕ ---
 router.register(r'observations', ObservationViewSet, basename='observation')
 router.register(r'episodes', HospitalizationEpisodeViewSet, basename='episode')
+router.register(r'research/jobs', ResearchExportJobViewSet, basename='research-job')
+router.register(r'cohorts', CohortViewSet, basename='cohort')
+router.register(r'uploads', MedicalTestUploadViewSet, basename='medicaltest-upload')
 # ----------------------------------------------
 
 # router.register(r'observation-types', ObservationTypeViewSet, basename='observationtype') # Удалено/закомментировано ранее
 
-urlpatterns = [
-    # Явные пути для ListAPIView и APIView (остаются без изменений)
-    path('parameters/', ParameterCodeListView.as_view(), name='parametercode-list'),
-    path('research/query/', ResearchQueryView.as_view(), name='research-query'),
-    path('mkb-codes/', MKBCodeSearchView.as_view(), name='mkbcode-search'),
-
-    # Включаем URL, сгенерированные роутером.
-    # Теперь он включает:
-    # /api/patients/ (+ actions dynamics, tests, episodes)
-    # /api/medical-tests/
-    # /api/observations/ (с фильтрацией по ?patient_id=...)
-    # /api/episodes/ (с фильтрацией по ?patient_id=...)
-    path('', include(router.urls)),
+# --- Асинхронная карточка пациента (core/async_views.py) ---
+# overview есть в обоих режимах; чтение пациента, dynamics, tests и episodes
+# заменяются асинхронными версиями при ASYNC_PATIENT_VIEWS (режим ASGI, config/asgi.py)
+patient_detail_view = PatientViewSet.as_view(
+    {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}, basename='patient', detail=True,
+)
+async_patient_urlpatterns = [
+    path('patients/<int:pk>/', async_views.with_sync_fallback(async_views.patient_detail, patient_detail_view), name='patient-detail'),
+    path('patients/<int:pk>/dynamics/', async_views.patient_dynamics, name='patient-get-patient-dynamics'),
+    path('patients/<int:pk>/tests/', async_views.patient_tests, name='patient-get-patient-tests'),
+    path('patients/<int:pk>/episodes/', async_views.patient_episodes, name='patient-get-patient-episodes'),
 ]
+
+
+def build_urlpatterns(async_patient_views):
+    """URL приложения; async_patient_views=True - чтение карточки пациента асинхронными представлениями."""
+    return [
+        # Явные пути для ListAPIView и APIView (остаются без изменений)
+        path('parameters/', ParameterCodeListView.as_view(), name='parametercode-list'),
+        path('research/query/', ResearchQueryView.as_view(), name='research-query'),
+        path('research/matrix/', ResearchMatrixView.as_view(), name='research-matrix'),
+        path('research/test-answers/', ResearchTestAnswersView.as_view(), name='research-test-answers'),
+        path('mkb-codes/', MKBCodeSearchView.as_view(), name='mkbcode-search'),
+        path('parameter-summaries/', PatientParameterSummaryListView.as_view(), name='parametersummary-list'),
+        path('patients/<int:pk>/overview/', async_views.patient_overview, name='patient-overview'),
+        # Раньше роутера: те же пути, что у PatientViewSet
+        *(async_patient_urlpatterns if async_patient_views else []),
+
+        # Включаем URL, сгенерированные роутером.
+        # Теперь он включает:
+        # /api/patients/ (+ actions dynamics, tests, episodes, summary)
+        # /api/medical-tests/ (+ actions uploads - докачиваемая загрузка файла, download, extraction, answers)
+        # /api/observations/ (с фильтрацией по ?patient_id=...)
+        # /api/episodes/ (с фильтрацией по ?patient_id=...)
+        # /api/research/jobs/ (+ action download)
+        # /api/cohorts/ (+ actions patients, refresh)
+        # /api/uploads/ (части файла PUT, + action finalize)
+        path('', include(router.urls)),
+    ]
+
+
+urlpatterns = build_urlpatterns(settings.ASYNC_PATIENT_VIEWS)
@@ -1,16 +1,18 @@
 # backend/core/views.py
-from rest_framework import generics, viewsets, permissions, status, filters
+import io
+
+from django.db import transaction
+from django.db.models import Count
+from rest_framework import generics, mixins, viewsets, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.parsers import MultiPartParser, FormParser
 # --- ИЗМЕНЕНИЕ: Импортируем необходимые классы для DRF CSV Renderer ---
 from rest_framework.settings import api_settings
 from rest_framework_csv.renderers import CSVRenderer
 # -------------------------------------------------------------------
-from django.db.models import Q, Prefetch
-from django.utils import timezone
-from datetime import datetime, timedelta
 # --- УБИРАЕМ ИМПОРТЫ ДЛЯ РУЧНОЙ ГЕНЕРАЦИИ CSV ---
 # from django.http import HttpResponse
 # import csv
@@ -19,7 +21,8 @@ from datetime import datetime, timedelta
 
 # --- Импорты моделей и сериализаторов ---
 from .models import (
-    Patient, ParameterCode, Observation, MKBCode, MedicalTest, HospitalizationEpisode
+    Patient, ParameterCode, Observation, MKBCode, MedicalTest, HospitalizationEpisode, PatientParameterSummary,
+    ResearchExportJob, Cohort, MedicalTestUpload, MedicalTestExtraction,
 )
 # Импортируем ВСЕ сериализаторы, включая новые для Research
 from .serializers import (
@@ -29,48 +32,129 @@ from .serializers import (
     MKBCodeSerializer,
     MedicalTestSerializer,
     HospitalizationEpisodeSerializer,
+    PatientParameterSummarySerializer,
+    ResearchExportJobSerializer,
+    CohortSerializer,
+    MedicalTestUploadSerializer,
+    MedicalTestExtractionSerializer,
+    MedicalTestAnswerSerializer,
     ResearchPatientSerializer,
     SimpleObservationSerializer # <- Теперь он нужен для подготовки данных для CSV рендерера
 )
+from .cache import MKB_CODES, PARAMETER_CODES, conditional_headers, get_cached, is_not_modified, variant_key
+from .cohorts import ensure_current, refresh_cohort
+from .columnar import (
+    COLUMNAR_WRITERS, LAYOUT_QUERY_PARAM, ColumnarExportError, columnar_streaming_response, parse_layout
+)
+from .pagination import PatientPagination, ObservationPagination, MedicalTestPagination, EpisodePagination, SummaryPagination
+from .downloads import protected_file_response
+from .extraction import schedule_extraction
+from .fast_serializers import (
+    FIELDS_QUERY_PARAM, MEDICAL_TEST_PLAN, OBSERVATION_PLAN, PATIENT_PLAN, FieldsQueryError
+)
+from .instrumentation import InstrumentedViewMixin
+from .ingest import BulkIngestError, get_batch_size, ingest_observations, iter_bulk_rows
+from .jobs import ResearchJobError, create_or_reuse_job
+from .matrix import MatrixQueryError, build_matrix, parse_matrix_params
+from .parsers import ORJSONParser
+from .renderers import ArrowRenderer, NDJSONRenderer, ParquetRenderer
+from .research import (
+    TEST_ANSWER_COLUMNS, ResearchQueryError, iter_research_rows, research_streaming_response, resolve_research_query,
+    test_answer_queryset,
+)
+from .search import PatientSearchFilter, SearchQueryError, parse_limit, search_mkb
+from .uploads import UploadConflict, UploadError, finalize_upload, initiate_upload, parse_offset, write_chunk
+from .timeseries import DynamicsQueryError, build_dynamics_series, parse_downsampling_params
 
 # --- ViewSet'ы для CRUD операций (без изменений) ---
 
-class PatientViewSet(viewsets.ModelViewSet):
+class FastListMixin:
+    """
+    list() через .values() и план полей из core/fast_serializers.py вместо ModelSerializer.
+    Ответ тот же; ?fields=a,b,c оставляет только перечисленные поля.
+    """
+    fast_plan = None
+
+    def get_fast_fields(self, request):
+        return self.fast_plan.parse_fields(request.query_params.get(FIELDS_QUERY_PARAM))
+
+    def list(self, request, *args, **kwargs):
+        try:
+            names = self.get_fast_fields(request)
+        except FieldsQueryError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        # Поля сортировки нужны пагинатору для курсора, даже если их нет в ?fields=
+        ordering = [name.lstrip('-') for name in getattr(self.paginator, 'ordering', ())]
+        rows = self.filter_queryset(self.get_queryset()).values(*self.fast_plan.columns(names, extra=ordering))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.fast_plan.serialize(page, names, request))
+        return Response(self.fast_plan.serialize(rows, names, request))
+
+
+class PatientViewSet(InstrumentedViewMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Patient.objects.all().select_related('primary_diagnosis_mkb').order_by('last_name', 'first_name')
     serializer_class = PatientSerializer
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['last_name', 'first_name', 'middle_name', 'clinic_id']
+    pagination_class = PatientPagination
+    fast_plan = PATIENT_PLAN
+    filter_backends = [PatientSearchFilter] # Ранжированный поиск по clinic_id и ФИО (core/search.py)
 
     @action(detail=True, methods=['get'], url_path='dynamics')
     def get_patient_dynamics(self, request, pk=None):
         patient = self.get_object()
         parameter_codes = request.query_params.getlist('param')
         if not parameter_codes: return Response({"error": "Query parameter 'param' is required."}, status=status.HTTP_400_BAD_REQUEST)
-        observations_qs = Observation.objects.filter(patient=patient, parameter__code__in=parameter_codes, parameter__is_numeric=True).select_related('parameter').order_by('timestamp')
-        serializer = ObservationSerializer(observations_qs, many=True, context={'request': request})
-        return Response(serializer.data)
+        # Прореживание (?max_points= и/или ?bucket=) - компактный колоночный ответ для графика
+        try:
+            max_points, bucket = parse_downsampling_params(request.query_params)
+        except DynamicsQueryError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if max_points or bucket:
+            return Response(build_dynamics_series(patient.id, parameter_codes, max_points=max_points, bucket=bucket))
+        try:
+            names = OBSERVATION_PLAN.parse_fields(request.query_params.get(FIELDS_QUERY_PARAM))
+        except FieldsQueryError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        observations_qs = Observation.objects.filter(patient=patient, parameter__code__in=parameter_codes, parameter__is_numeric=True).order_by('timestamp')
+        return Response(OBSERVATION_PLAN.serialize(observations_qs.values(*OBSERVATION_PLAN.columns(names)), names, request))
 
     @action(detail=True, methods=['get'], url_path='tests')
     def get_patient_tests(self, request, pk=None):
         patient = self.get_object()
-        tests = MedicalTest.objects.filter(patient=patient).select_related('uploaded_by').order_by('-test_date')
-        serializer = MedicalTestSerializer(tests, many=True, context={'request': request})
-        return Response(serializer.data)
+        try:
+            names = MEDICAL_TEST_PLAN.parse_fields(request.query_params.get(FIELDS_QUERY_PARAM))
+        except FieldsQueryError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        tests = MedicalTest.objects.filter(patient=patient).order_by('-test_date')
+        return Response(MEDICAL_TEST_PLAN.serialize(tests.values(*MEDICAL_TEST_PLAN.columns(names)), names, request))
 
     @action(detail=True, methods=['get'], url_path='episodes')
     def get_patient_episodes(self, request, pk=None):
         patient = self.get_object()
-        episodes = HospitalizationEpisode.objects.filter(patient=patient).order_by('-start_date')
+        episodes = HospitalizationEpisode.objects.filter(patient=patient).select_related('patient').order_by('-start_date')
         serializer = HospitalizationEpisodeSerializer(episodes, many=True, context={'request': request})
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'], url_path='summary')
+    def get_patient_summary(self, request, pk=None):
+        # Сводка по всем показателям пациента из PatientParameterSummary (без сканирования Observation)
+        patient = self.get_object()
+        summaries = PatientParameterSummary.objects.filter(patient=patient).select_related('parameter').order_by('parameter_id')
+        param_codes = request.query_params.getlist('param')
+        if param_codes: summaries = summaries.filter(parameter_id__in=param_codes)
+        serializer = PatientParameterSummarySerializer(summaries, many=True, context={'request': request})
+        return Response(serializer.data)
+
 
-class ObservationViewSet(viewsets.ModelViewSet):
+class ObservationViewSet(InstrumentedViewMixin, FastListMixin, viewsets.ModelViewSet):
     serializer_class = ObservationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ObservationPagination
+    fast_plan = OBSERVATION_PLAN
     def get_queryset(self):
-        queryset = Observation.objects.all().select_related('patient', 'parameter', 'recorded_by', 'episode')
+        # episode__patient: episode_display вызывает HospitalizationEpisode.__str__, который читает пациента
+        queryset = Observation.objects.all().select_related('patient', 'parameter', 'recorded_by', 'episode__patient')
         patient_id = self.request.query_params.get('patient_id')
         parameter_code = self.request.query_params.get('parameter_code')
         episode_id = self.request.query_params.get('episode_id')
@@ -81,10 +165,34 @@ class ObservationViewSet(viewsets.ModelViewSet):
         return queryset.order_by('-timestamp')
     def perform_create(self, serializer): serializer.save(recorded_by=self.request.user)
 
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[ORJSONParser, MultiPartParser, FormParser])
+    def bulk_ingest(self, request):
+        """
+        Пакетная загрузка: JSON-массив объектов или CSV-файл в поле 'file'
+        (колонки patient, parameter, value, timestamp, episode).
+        ?batch_size= - размер пакета bulk_create, ?atomic=1 - все или ничего.
+        Возвращает отчет с ошибками по строкам.
+        """
+        try:
+            batch_size = get_batch_size(request.query_params.get('batch_size'))
+            report = ingest_observations(
+                iter_bulk_rows(request),
+                recorded_by=request.user,
+                batch_size=batch_size,
+                all_or_nothing=request.query_params.get('atomic', '').lower() in ('1', 'true', 'yes'),
+            )
+        except BulkIngestError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        except UnicodeDecodeError:
+            return Response({"error": "CSV file must be UTF-8 encoded."}, status=status.HTTP_400_BAD_REQUEST)
+        response_status = status.HTTP_201_CREATED if report['created'] else status.HTTP_400_BAD_REQUEST
+        return Response(report, status=response_status)
+
 
-class HospitalizationEpisodeViewSet(viewsets.ModelViewSet):
+class HospitalizationEpisodeViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     serializer_class = HospitalizationEpisodeSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = EpisodePagination
     def get_queryset(self):
         queryset = HospitalizationEpisode.objects.all().select_related('patient')
         patient_id = self.request.query_params.get('patient_id')
@@ -92,118 +200,350 @@ class HospitalizationEpisodeViewSet(viewsets.ModelViewSet):
         return queryset.order_by('-start_date')
 
 
-class MedicalTestViewSet(viewsets.ModelViewSet):
+class MedicalTestViewSet(InstrumentedViewMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = MedicalTest.objects.all().select_related('patient', 'uploaded_by').order_by('-test_date')
     serializer_class = MedicalTestSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MedicalTestPagination
+    fast_plan = MEDICAL_TEST_PLAN
     parser_classes = (MultiPartParser, FormParser)
     def perform_create(self, serializer): serializer.save(uploaded_by=self.request.user)
+
+    @action(detail=True, methods=['post'], url_path='uploads', parser_classes=[ORJSONParser, FormParser])
+    def create_upload(self, request, pk=None):
+        """Начало докачиваемой загрузки файла частями (core/uploads.py) - для больших сканов и PDF."""
+        try:
+            upload = initiate_upload(self.get_object(), request.data, request.user)
+        except UploadError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(MedicalTestUploadSerializer(upload, context={'request': request}).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'], url_path='download', url_name='download')
+    def download(self, request, pk=None):
+        """Файл теста после проверки прав: X-Accel-Redirect на nginx или FileResponse с Range (core/downloads.py)."""
+        return protected_file_response(request, self.get_object().uploaded_file, as_attachment='inline' not in request.query_params)
+
+    @action(detail=True, methods=['get', 'post'], url_path='extraction', parser_classes=[ORJSONParser, FormParser])
+    def extraction(self, request, pk=None):
+        """
+        GET - последнее задание разбора файла (core/extraction.py): статус, число ответов, извлеченный итог.
+        POST - разобрать текущий файл заново (после исправления файла или установки openpyxl/ijson).
+        """
+        medical_test = self.get_object()
+        if request.method == 'POST':
+            with transaction.atomic():
+                extraction = schedule_extraction(medical_test)
+            if extraction is None:
+                return Response({"error": "The test has no file in a supported format (CSV, XLSX, JSON)."}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(MedicalTestExtractionSerializer(extraction).data, status=status.HTTP_202_ACCEPTED)
+        extraction = medical_test.extractions.order_by('-created_at', '-pk').first()
+        if extraction is None:
+            return Response({"error": "The test file has not been queued for extraction."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(MedicalTestExtractionSerializer(extraction).data)
+
+    @action(detail=True, methods=['get'], url_path='answers')
+    def answers(self, request, pk=None):
+        """Ответы на пункты, извлеченные из файла теста, по порядку."""
+        return Response(MedicalTestAnswerSerializer(self.get_object().answers.order_by('position'), many=True).data)
+
     def get_serializer_context(self): context = super().get_serializer_context(); context.update({"request": self.request}); return context
     def get_queryset(self): queryset = super().get_queryset(); patient_id = self.request.query_params.get('patient_id'); return queryset.filter(patient_id=patient_id) if patient_id else queryset
 
 
 # --- Views для Справочников (без изменений) ---
-class ParameterCodeListView(generics.ListAPIView):
+class PatientParameterSummaryListView(InstrumentedViewMixin, generics.ListAPIView):
+    """
+    Сводки по показателям для когорты одним запросом.
+    Фильтры: ?patient_id= (можно несколько), ?param_codes= (можно несколько), ?diagnosis_mkb=.
+    """
+    serializer_class = PatientParameterSummarySerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = SummaryPagination
+
+    def get_queryset(self):
+        queryset = PatientParameterSummary.objects.select_related('parameter')
+        patient_ids = self.request.query_params.getlist('patient_id')
+        param_codes = self.request.query_params.getlist('param_codes')
+        diagnosis_mkb = self.request.query_params.get('diagnosis_mkb')
+        if patient_ids:
+            try:
+                queryset = queryset.filter(patient_id__in=[int(pid) for pid in patient_ids])
+            except ValueError:
+                raise ValidationError({"error": "Query parameter 'patient_id' must be an integer."})
+        if param_codes: queryset = queryset.filter(parameter_id__in=param_codes)
+        if diagnosis_mkb: queryset = queryset.filter(patient__primary_diagnosis_mkb__code__iexact=diagnosis_mkb)
+        return queryset
+
+
+class CachedReferenceListMixin:
+    """
+    list() справочника из версионируемого кэша (core/cache.py) с ETag/Last-Modified:
+    повторный запрос с If-None-Match / If-Modified-Since получает 304 без тела.
+    """
+    reference_name = None
+
+    def get_reference_variant(self, request):
+        # Разные параметры запроса (?search=...) - разные записи кэша
+        return variant_key(request.query_params.urlencode()) if request.query_params else ''
+
+    def get_reference_data(self):
+        return [dict(item) for item in self.get_serializer(self.filter_queryset(self.get_queryset()), many=True).data]
+
+    def list(self, request, *args, **kwargs):
+        variant = self.get_reference_variant(request)
+        version, data = get_cached(self.reference_name, self.get_reference_data, variant=variant)
+        headers = conditional_headers(self.reference_name, version, variant)
+        if is_not_modified(request, headers):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(data, headers=headers)
+
+
+class ParameterCodeListView(InstrumentedViewMixin, CachedReferenceListMixin, generics.ListAPIView):
+    reference_name = PARAMETER_CODES
     queryset = ParameterCode.objects.all().order_by('name')
     serializer_class = ParameterCodeSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = None # Небольшой справочник - фронтенд получает его целиком
 
-class MKBCodeSearchView(generics.ListAPIView):
+class MKBCodeSearchView(InstrumentedViewMixin, CachedReferenceListMixin, generics.ListAPIView):
+    reference_name = MKB_CODES
     queryset = MKBCode.objects.all().order_by('code')
     serializer_class = MKBCodeSerializer
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['code', 'name']
+    pagination_class = None # Автодополнение ожидает простой список
+
+    def list(self, request, *args, **kwargs):
+        # ?search= - ранжированный top-N (?limit=) через core/search.py вместо icontains по всей таблице
+        try:
+            self.search_limit = parse_limit(request.query_params.get('limit'))
+        except SearchQueryError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return super().list(request, *args, **kwargs)
+
+    def get_reference_data(self):
+        term = self.request.query_params.get('search', '').strip()
+        if not term:
+            return super().get_reference_data()
+        return [{'code': code, 'name': name} for code, name in search_mkb(term, self.search_limit)]
 
 
-# --- ИЗМЕНЕННЫЙ ResearchQueryView с использованием CSVRenderer ---
-class ResearchQueryView(APIView):
+# --- ResearchQueryView: обычный ответ через рендереры DRF или потоковая выгрузка ---
+class ResearchQueryView(InstrumentedViewMixin, APIView):
     """
     Формирует выборку пациентов и их наблюдений по заданным критериям.
     Использует стандартные рендереры DRF (включая CSVRenderer)
     для вывода в JSON или CSV в зависимости от Accept хедера или ?format=csv.
+    Потоковый режим (?stream=1 или ?format=ndjson) отдает строки через
+    StreamingHttpResponse прямо из курсора БД, не собирая выборку в памяти.
+    ?format=parquet / ?format=arrow - типизированные колонки (core/columnar.py, нужен pyarrow),
+    ?layout=wide - колонка на каждый код параметра.
     """
     permission_classes = [permissions.IsAuthenticated]
     # Указываем поддерживаемые рендереры. Если CSVRenderer добавлен в DEFAULT_RENDERER_CLASSES,
     # эту строку можно убрать. Но явное указание надежнее.
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [CSVRenderer, NDJSONRenderer, ParquetRenderer, ArrowRenderer]
+
+    def get(self, request, *args, **kwargs):
+        # 1. Разбор параметров и фильтры выборки (общие для обоих режимов); ?cohort_id= - состав сохраненной когорты
+        try:
+            patient_qs, criteria = resolve_research_query(request.query_params)
+        except ResearchQueryError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        observation_filter = criteria.observation_filter()
+
+        # 2. Потоковый режим: Parquet/Arrow и NDJSON всегда потоковые, CSV/JSON - по ?stream=1
+        export_format = request.accepted_renderer.format
+        if export_format in COLUMNAR_WRITERS:
+            try:
+                layout = parse_layout(request.query_params.get(LAYOUT_QUERY_PARAM))
+                return columnar_streaming_response(patient_qs, observation_filter, export_format, layout, criteria.param_codes)
+            except ColumnarExportError as exc:
+                return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if export_format == 'ndjson' or request.query_params.get('stream', '').lower() in ('1', 'true', 'yes'):
+            return research_streaming_response(patient_qs, observation_filter, export_format)
+
+        # 3. Обычный режим: плоский список словарей, DRF сам выберет рендерер (JSON или CSV)
+        # на основе Accept хедера или параметра ?format=csv.
+        # Пациент без наблюдений дает строку только с полями пациента.
+        return Response(list(iter_research_rows(patient_qs, observation_filter)))
+
+
+# --- Матрица когорты: агрегаты value_numeric по интервалам вместо длинных строк ---
+class ResearchMatrixView(InstrumentedViewMixin, APIView):
+    """
+    Те же фильтры, что и у ResearchQueryView (включая ?cohort_id=), плюс ?bucket=day|week|episode и ?agg=last|mean|min|max.
+    Ответ - плотный массив values[пациент][показатель][интервал] с осями patients, parameters, buckets
+    (см. core/matrix.py).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            patient_qs, criteria = resolve_research_query(request.query_params)
+            bucket, agg = parse_matrix_params(request.query_params)
+            return Response(build_matrix(patient_qs, criteria.observation_filter(), criteria.param_codes, bucket, agg))
+        except (ResearchQueryError, MatrixQueryError) as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+# --- Ответы на пункты тестов из разобранных файлов (core/extraction.py) ---
+class ResearchTestAnswersView(InstrumentedViewMixin, APIView):
+    """
+    Плоский список ответов на пункты тестов: ?test_name=, ?items= (можно несколько),
+    критерии пациентов (diagnosis_mkb, age_min, age_max) или ?cohort_id=, start_date/end_date
+    по дате теста. JSON или CSV (?format=csv).
+    """
+    permission_classes = [permissions.IsAuthenticated]
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [CSVRenderer]
 
+    def get_renderer_context(self):
+        # Колонки CSV в порядке TEST_ANSWER_COLUMNS, а не по алфавиту
+        return {**super().get_renderer_context(), 'header': TEST_ANSWER_COLUMNS}
+
     def get(self, request, *args, **kwargs):
-        # 1. Получение и валидация параметров (как было, БЕЗ format)
-        diagnosis_mkb = request.query_params.get('diagnosis_mkb', None)
-        age_min_str = request.query_params.get('age_min', None)
-        age_max_str = request.query_params.get('age_max', None)
-        param_codes = request.query_params.getlist('param_codes')
-        start_date_str = request.query_params.get('start_date', None)
-        end_date_str = request.query_params.get('end_date', None)
-
-        if not param_codes:
-            return Response({"error": "Query parameter 'param_codes' is required."}, status=status.HTTP_400_BAD_REQUEST)
-
-        # 2. Фильтрация Пациентов (как было)
-        patient_qs = Patient.objects.all().select_related('primary_diagnosis_mkb')
-        if diagnosis_mkb: patient_qs = patient_qs.filter(primary_diagnosis_mkb__code__iexact=diagnosis_mkb)
-        today = timezone.now().date()
         try:
-            if age_min_str: patient_qs = patient_qs.filter(date_of_birth__lte=today - timedelta(days=int(age_min_str) * 365.25))
-            if age_max_str: patient_qs = patient_qs.filter(date_of_birth__gte=today - timedelta(days=(int(age_max_str) + 1) * 365.25) + timedelta(days=1))
-        except (ValueError, TypeError): return Response({"error": "Age parameters must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+            answers = test_answer_queryset(request.query_params)
+        except ResearchQueryError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(list(answers.iterator()))
+
+
+# --- Фоновые выгрузки: задание вместо долгого запроса (core/jobs.py) ---
+class ResearchExportJobViewSet(InstrumentedViewMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    POST /api/research/jobs/ с теми же параметрами, что и /api/research/query/
+    (+ export_format: csv, ndjson или json) ставит выгрузку в очередь и сразу отвечает.
+    Клиент опрашивает GET /api/research/jobs/{id}/ и скачивает файл по download_url.
+    Повторный такой же запрос возвращает существующее задание (200 вместо 202).
+    """
+    serializer_class = ResearchExportJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = ResearchExportJob.objects.select_related('created_by')
+        # В списке - свои задания; по id доступно любое (задания общие благодаря дедупликации)
+        if self.action == 'list': queryset = queryset.filter(created_by=self.request.user)
+        return queryset
 
-        # 3. Подготовка фильтра для Наблюдений (как было)
-        observation_filter = Q(parameter__code__in=param_codes)
+    def create(self, request, *args, **kwargs):
+        export_format = request.data.get('export_format') or request.data.get('format') or 'csv'
         try:
-            if start_date_str: observation_filter &= Q(timestamp__date__gte=datetime.strptime(start_date_str, '%Y-%m-%d').date())
-            if end_date_str: observation_filter &= Q(timestamp__date__lte=datetime.strptime(end_date_str, '%Y-%m-%d').date())
-        except ValueError: return Response({"error": "Invalid date format (use YYYY-MM-DD)."}, status=status.HTTP_400_BAD_REQUEST)
-
-        # 4. Выполнение запроса с Prefetch (как было)
-        patients_with_observations = patient_qs.prefetch_related(
-            Prefetch(
-                'observations',
-                queryset=Observation.objects.filter(observation_filter).order_by('timestamp').select_related('parameter', 'episode'),
-                to_attr='filtered_observations'
+            job, created = create_or_reuse_job(request.data, export_format, user=request.user)
+        except (ResearchJobError, ResearchQueryError) as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(job)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], url_path='download', url_name='download')
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != ResearchExportJob.STATUS_DONE:
+            return Response({"error": f"Export is not ready (status: {job.status})."}, status=status.HTTP_409_CONFLICT)
+        return protected_file_response(request, job.result_file)
+
+
+# --- Сохраненные когорты: критерии + материализованный состав (core/cohorts.py) ---
+class CohortViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
+    """
+    CRUD когорт. Состав считается при создании и смене критериев, дальше поддерживается сам.
+    /api/cohorts/{id}/patients/ - пациенты когорты, /api/cohorts/{id}/refresh/ - полный пересчет.
+    В /api/research/query/, /matrix/ и /jobs/ когорта задается через cohort_id.
+    """
+    serializer_class = CohortSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Cohort.objects.select_related('created_by').annotate(member_count=Count('memberships')).order_by('name', 'id')
+
+    def perform_create(self, serializer):
+        refresh_cohort(serializer.save(created_by=self.request.user))
+
+    def perform_update(self, serializer):
+        cohort = serializer.save()
+        if 'criteria' in serializer.validated_data:
+            refresh_cohort(cohort)
+            cohort.__dict__.pop('member_count', None)  # Аннотация устарела - пересчитает сериализатор
+
+    @action(detail=True, methods=['post'], url_path='refresh')
+    def refresh(self, request, pk=None):
+        cohort = refresh_cohort(self.get_object())
+        cohort.__dict__.pop('member_count', None)
+        return Response(self.get_serializer(cohort).data)
+
+    @action(detail=True, methods=['get'], url_path='patients')
+    def get_cohort_patients(self, request, pk=None):
+        cohort = ensure_current(self.get_object())
+        try:
+            names = PATIENT_PLAN.parse_fields(request.query_params.get(FIELDS_QUERY_PARAM))
+        except FieldsQueryError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        paginator = PatientPagination()
+        ordering = [name.lstrip('-') for name in paginator.ordering]
+        rows = Patient.objects.filter(cohort_memberships__cohort=cohort).values(*PATIENT_PLAN.columns(names, extra=ordering))
+        page = paginator.paginate_queryset(rows, request, view=self)
+        return paginator.get_paginated_response(PATIENT_PLAN.serialize(page, names, request))
+
+
+# --- Докачиваемая загрузка файлов тестов частями (core/uploads.py) ---
+class MedicalTestUploadViewSet(InstrumentedViewMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    GET/HEAD - сколько принято (заголовок Upload-Offset), PUT - часть файла с Upload-Offset,
+    POST .../finalize/ - проверка SHA-256 и прикрепление к тесту, DELETE - отмена.
+    """
+    serializer_class = MedicalTestUploadSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = MedicalTestUpload.objects.all()
+        # Загрузку продолжает только ее автор
+        return queryset if self.request.user.is_staff else queryset.filter(created_by=self.request.user)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        upload = getattr(self, '_upload', None)
+        if upload is not None:
+            response['Upload-Offset'] = str(upload.received_bytes)
+            response['Upload-Length'] = str(upload.size)
+            response['Cache-Control'] = 'no-store'
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        self._upload = self.get_object()
+        return Response(self.get_serializer(self._upload).data)
+
+    def update(self, request, pk=None):
+        upload = self.get_object()
+        raw_offset = request.headers.get('Upload-Offset', request.query_params.get('offset'))
+        raw_length = request.META.get('CONTENT_LENGTH')
+        try:
+            offset = parse_offset(raw_offset)
+            # Тело читается из потока запроса кусками (request.data не трогаем - без парсинга и буферизации)
+            self._upload = write_chunk(
+                upload, offset, request.stream or io.BytesIO(), int(raw_length) if raw_length else None,
+                request.headers.get('X-Chunk-Sha256'),
             )
-        ).order_by('last_name', 'first_name')
-
-        # 5. Подготовка данных для рендерера (Преобразование в плоский список)
-        results_list = []
-        # Определяем заголовки динамически на основе первого пациента/наблюдения или статически
-        # (CSVRenderer использует ключи первого словаря по умолчанию)
-        for patient in patients_with_observations:
-            patient_info = { # Используем ResearchPatientSerializer для получения нужных полей пациента
-                'patient_id': patient.id,
-                'last_name': patient.last_name,
-                'first_name': patient.first_name,
-                'middle_name': patient.middle_name,
-                'date_of_birth': patient.date_of_birth.strftime('%Y-%m-%d') if patient.date_of_birth else '',
-                'clinic_id': patient.clinic_id,
-                'primary_diagnosis_code': patient.primary_diagnosis_mkb.code if patient.primary_diagnosis_mkb else '',
-            }
-            if not hasattr(patient, 'filtered_observations') or not patient.filtered_observations:
-                 # Если нет наблюдений, добавляем только инфо о пациенте
-                 results_list.append(patient_info)
-            else:
-                for obs in patient.filtered_observations:
-                    # Используем SimpleObservationSerializer для получения нужных полей наблюдения
-                    obs_info = {
-                        'observation_timestamp': obs.timestamp.isoformat() if obs.timestamp else '',
-                        'parameter_code': obs.parameter.code if obs.parameter else '',
-                        'parameter_name': obs.parameter.name if obs.parameter else '',
-                        'unit': obs.parameter.unit if obs.parameter and obs.parameter.unit else '',
-                        'value': obs.value,
-                        'value_numeric': obs.value_numeric,
-                        'episode_id': obs.episode.id if obs.episode else '',
-                    }
-                    # Объединяем инфо о пациенте и наблюдении
-                    results_list.append({**patient_info, **obs_info})
-
-        # 6. Возвращаем данные. DRF сам выберет рендерер (JSON или CSV)
-        # на основе Accept хедера или параметра ?format=csv
-        # CSVRenderer ожидает список словарей.
-        # JSONRenderer по умолчанию обработает список словарей.
-        # Если бы мы хотели сохранить вложенную структуру для JSON,
-        # нужно было бы использовать ResearchPatientSerializer:
-        # serializer = ResearchPatientSerializer(patients_with_observations, many=True, context={'request': request})
-        # return Response(serializer.data)
-        # Но для совместимости с CSVRenderer возвращаем плоский список:
-        return Response(results_list)
+        except UploadConflict as exc:
+            self._upload = MedicalTestUpload.objects.get(pk=upload.pk)
+            return Response({"error": str(exc)}, status=status.HTTP_409_CONFLICT)
+        except UploadError as exc:
+            self._upload = MedicalTestUpload.objects.get(pk=upload.pk)
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(self._upload).data)
+
+    @action(detail=True, methods=['post'], url_path='finalize')
+    def finalize(self, request, pk=None):
+        upload = self.get_object()
+        try:
+            medical_test = finalize_upload(upload, request.data.get('sha256'))
+        except UploadConflict as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_409_CONFLICT)
+        except UploadError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(MedicalTestSerializer(medical_test, context={'request': request}).data)
+
+    def destroy(self, request, pk=None):
+        upload = self.get_object()
+        if upload.status == MedicalTestUpload.STATUS_COMPLETE:
+            return Response({"error": "Upload is already finalized."}, status=status.HTTP_409_CONFLICT)
+        upload.delete()  # Временный файл удаляет сигнал post_delete
+        return Response(status=status.HTTP_204_NO_CONTENT)
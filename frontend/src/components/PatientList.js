@@ -1,7 +1,7 @@
 // frontend/src/components/PatientList.js
 import React, { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom'; // Импортируем Link для создания ссылок
-import apiClient from '../services/api'; // Наш настроенный axios клиент
+import { getPatients } from '../services/api'; // Запросы к API через настроенный axios клиент
 
 // Опционально: Определяем интерфейс для лучшей типизации (если используете TS)
 // interface Patient {
@@ -17,6 +17,10 @@ function PatientList() {
   const [patients, setPatients] = useState([]); // Состояние для хранения списка
   const [loading, setLoading] = useState(true); // Состояние загрузки
   const [error, setError] = useState(null);     // Состояние для ошибок
+  // Keyset-пагинация: pageUrl - ссылка next/previous из ответа (null - первая страница)
+  const [pageUrl, setPageUrl] = useState(null);
+  const [nextUrl, setNextUrl] = useState(null);
+  const [previousUrl, setPreviousUrl] = useState(null);
 
   useEffect(() => {
     // Функция для загрузки данных
@@ -24,9 +28,11 @@ function PatientList() {
       setLoading(true); // Начинаем загрузку
       setError(null);
       try {
-        // Делаем GET запрос к эндпоинту списка пациентов
-        const response = await apiClient.get('/patients/');
-        setPatients(response.data); // Сохраняем полученные данные в состояние
+        // Делаем GET запрос к эндпоинту списка пациентов (одна страница)
+        const page = await getPatients('', pageUrl);
+        setPatients(page.results);
+        setNextUrl(page.next);
+        setPreviousUrl(page.previous);
       } catch (err) {
         console.error("Ошибка при загрузке пациентов:", err);
         // Возможно, стоит проверять err.message или err.response.data для более детальной ошибки
@@ -36,8 +42,8 @@ function PatientList() {
       }
     };
 
-    fetchPatients(); // Вызываем функцию загрузки при монтировании компонента
-  }, []); // Пустой массив зависимостей - выполнится один раз при монтировании
+    fetchPatients(); // Вызываем функцию загрузки при монтировании и при смене страницы
+  }, [pageUrl]);
 
   // Отображение состояний загрузки и ошибки
   if (loading) {
@@ -47,6 +53,14 @@ function PatientList() {
     return <div style={{ color: 'red' }}>{error}</div>;
   }
 
+  // Переход по страницам; кнопки неактивны, если ссылки нет
+  const pager = (
+    <div style={{ display: 'flex', gap: '8px', marginTop: '10px' }}>
+      <button onClick={() => setPageUrl(previousUrl)} disabled={!previousUrl}>← Назад</button>
+      <button onClick={() => setPageUrl(nextUrl)} disabled={!nextUrl}>Вперед →</button>
+    </div>
+  );
+
   // Отображение списка пациентов (убрали дублирующийся заголовок H2)
   // Используем таблицу для лучшего представления
   return (
@@ -84,6 +98,7 @@ function PatientList() {
           </tbody>
         </table>
       )}
+      {(nextUrl || previousUrl) && pager}
     </div>
   );
 }
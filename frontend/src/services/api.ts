@@ -7,10 +7,14 @@ import {
     ObservationData,
     MedicalTestData,
     DiagnosisMKB,
-    ResearchPatientData // Убедитесь, что этот тип импортирован из types/data.ts
+    ResearchPatientData, // Убедитесь, что этот тип импортирован из types/data.ts
+    DynamicsSeriesMap,
+    Paginated
 } from '../types/data';
 
 const API_BASE_URL = 'http://localhost:8000/api/';
+// Верхняя граница page_size на бэкенде (API_MAX_PAGE_SIZE)
+const MAX_PAGE_SIZE = 500;
 
 const apiClient = axios.create({
   baseURL: API_BASE_URL,
@@ -85,10 +89,27 @@ apiClient.interceptors.response.use(
 // --- ФУНКЦИИ API С ИНДИВИДУАЛЬНЫМИ ЭКСПОРТАМИ ---
 // ========================================================
 
+// Все страницы keyset-пагинации: идем по ссылкам next, пока она не станет null.
+// next - абсолютный URL, baseURL axios к нему не применяется.
+const getAllPages = async <T>(url: string, params: Record<string, any>): Promise<T[]> => {
+  let response = await apiClient.get<Paginated<T>>(url, { params: { ...params, page_size: MAX_PAGE_SIZE } });
+  const results = [...response.data.results];
+  while (response.data.next) {
+    response = await apiClient.get<Paginated<T>>(response.data.next);
+    results.push(...response.data.results);
+  }
+  return results;
+};
+
 // --- Пациенты (Patient) ---
-export const getPatients = async (searchTerm: string = ''): Promise<PatientDetails[]> => {
+// Одна страница списка: pageUrl - ссылка next/previous предыдущего ответа (уже содержит search и cursor)
+export const getPatients = async (searchTerm: string = '', pageUrl: string | null = null): Promise<Paginated<PatientDetails>> => {
+  if (pageUrl) {
+    const response = await apiClient.get<Paginated<PatientDetails>>(pageUrl);
+    return response.data;
+  }
   const params = searchTerm ? { search: searchTerm } : {};
-  const response = await apiClient.get<PatientDetails[]>('/patients/', { params });
+  const response = await apiClient.get<Paginated<PatientDetails>>('/patients/', { params });
   return response.data;
 };
 export const getPatientById = async (patientId: number | string): Promise<PatientDetails> => {
@@ -112,12 +133,24 @@ export const updatePatient = async (patientId: number | string, patientData: Par
      const response = await apiClient.get<ObservationData[]>(`/patients/${patientId}/dynamics/`, { params });
      return response.data;
  };
+ // Прореженные ряды для графика: maxPoints - LTTB, bucket - агрегация по интервалам
+ export const getPatientDynamicsSeries = async (
+     patientId: number | string,
+     parameterCodes: string[],
+     options: { maxPoints?: number; bucket?: 'hour' | 'day' | 'week' } = {}
+ ): Promise<DynamicsSeriesMap> => {
+     const params = new URLSearchParams();
+     parameterCodes.forEach(code => params.append('param', code));
+     if (options.maxPoints) params.append('max_points', String(options.maxPoints));
+     if (options.bucket) params.append('bucket', options.bucket);
+     const response = await apiClient.get<DynamicsSeriesMap>(`/patients/${patientId}/dynamics/`, { params });
+     return response.data;
+ };
 
 // --- Эпизоды Госпитализации (HospitalizationEpisode) ---
 type AddEpisodePayload = Omit<HospitalizationEpisode, 'id' | 'patient_display' | 'created_at' | 'updated_at'>; // Убрали еще updated_at
 export const getPatientEpisodes = async (patientId: number | string): Promise<HospitalizationEpisode[]> => {
-  const response = await apiClient.get<HospitalizationEpisode[]>('/episodes/', { params: { patient_id: patientId } });
-  return response.data;
+  return getAllPages<HospitalizationEpisode>('/episodes/', { patient_id: patientId });
 };
 export const addPatientEpisode = async (episodeData: AddEpisodePayload): Promise<HospitalizationEpisode> => {
   const response = await apiClient.post<HospitalizationEpisode>('/episodes/', episodeData);
@@ -130,8 +163,7 @@ export const getPatientObservations = async (patientId: number | string, paramet
   const params: Record<string, any> = { patient_id: patientId };
   if (parameterCode) params.parameter_code = parameterCode;
   if (episodeId) params.episode_id = episodeId;
-  const response = await apiClient.get<ObservationData[]>('/observations/', { params });
-  return response.data;
+  return getAllPages<ObservationData>('/observations/', params);
 };
 export const addPatientObservation = async (observationData: AddObservationPayload): Promise<ObservationData> => {
   const response = await apiClient.post<ObservationData>('/observations/', observationData);
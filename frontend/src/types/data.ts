@@ -7,6 +7,13 @@ export interface DiagnosisMKB {
   // Добавьте другие поля, если ваш API их возвращает для диагноза
 }
 
+// Страница списка с keyset-пагинацией (?cursor=...&page_size=...)
+export interface Paginated<T> {
+  next: string | null; // URL следующей страницы
+  previous: string | null; // URL предыдущей страницы
+  results: T[];
+}
+
 // Интерфейс для данных пациента, получаемых из API
 export interface PatientDetails {
   id: number;
@@ -65,6 +72,17 @@ export interface ChartDataPoint {
   [parameterCode: string]: number | undefined | null;
 }
 
+// Колоночный ответ /api/patients/<id>/dynamics/?max_points=...|bucket=...
+// t - время в миллисекундах (Unix timestamp), v - значение (в режиме bucket - среднее)
+export interface DynamicsSeries {
+  t: number[];
+  v: number[];
+  min?: number[]; // Только в режиме bucket
+  max?: number[];
+  n?: number[];
+}
+export type DynamicsSeriesMap = Record<string, DynamicsSeries>;
+
 // Интерфейс для данных медицинского теста (из API /api/medical-tests/ или /api/patients/.../tests/)
 export interface MedicalTestData {
   id: number;